@@ -0,0 +1,43 @@
+"""
+API de la campaña de recuperación de carritos abandonados por WhatsApp
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, status
+from datetime import datetime
+import logging
+
+from services.whatsapp_templates import template_manager
+from services.wordpress_db_service import wordpress_db_service
+from services.admin_auth import get_current_admin
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/cart-recovery", tags=["Admin Cart Recovery"])
+
+@router.post("/run")
+async def run_cart_recovery(
+    dry_run: bool = False,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Lanzar ahora la campaña sobre los carritos abandonados nuevos (dry_run no envía ni los consume)"""
+    if not wordpress_db_service.pool:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Base de datos de WordPress no configurada"
+        )
+
+    try:
+        results = await template_manager.process_cart_recovery_batch(dry_run=dry_run)
+        logger.info(f"🛒 Campaña de recuperación lanzada por {current_admin.get('username')}: {results}")
+        return {
+            "dry_run": dry_run,
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        logger.error(f"Error en la campaña de recuperación de carritos: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al ejecutar la campaña de recuperación"
+        )
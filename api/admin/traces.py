@@ -0,0 +1,90 @@
+"""
+API de trazas de latencia por etapa para el panel de administración
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, status
+from typing import Optional
+from datetime import datetime
+import logging
+
+from services.tracing_service import tracer
+from services.admin_auth import get_current_admin
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/traces", tags=["Admin Traces"])
+
+@router.get("/")
+async def get_recent_traces(
+    limit: int = 20,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Obtener las últimas trazas con el desglose de tiempo por etapa"""
+    try:
+        return {
+            "enabled": tracer.enabled,
+            "traces": tracer.get_recent_traces(limit=limit),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        logger.error(f"Error obteniendo trazas: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al obtener trazas"
+        )
+
+@router.get("/summary")
+async def get_stage_summary(current_admin: dict = Depends(get_current_admin)):
+    """Obtener estadísticas agregadas (avg, p50, p95, max) por etapa"""
+    try:
+        return {
+            "stages": tracer.get_stage_summary(),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        logger.error(f"Error obteniendo resumen de trazas: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al obtener resumen de trazas"
+        )
+
+@router.get("/spans")
+async def get_recent_spans(
+    limit: int = 100,
+    name_prefix: Optional[str] = None,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Obtener los últimos spans, opcionalmente filtrados por prefijo (p.ej. 'sql.', 'llm.')"""
+    try:
+        return {
+            "spans": tracer.get_recent_spans(limit=limit, name_prefix=name_prefix),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        logger.error(f"Error obteniendo spans: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al obtener spans"
+        )
+
+@router.get("/{trace_id}")
+async def get_trace(
+    trace_id: str,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Obtener todos los spans de una traza"""
+    spans = tracer.get_trace(trace_id)
+    if not spans:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Traza no encontrada"
+        )
+
+    return {
+        "trace_id": trace_id,
+        "spans": spans,
+        "timestamp": datetime.now().isoformat()
+    }
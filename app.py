@@ -15,23 +15,33 @@ from typing import Dict, Any, Optional
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
-import json
-from json import JSONEncoder
 
 # Importar servicios
 from services.database import db_service
 from services.embedding_service import embedding_service
 from services.woocommerce_sync import wc_sync_service
 from services.webhook_handler import webhook_handler
+from services.webhook_queue import webhook_queue
+from services.whatsapp_inbound_queue import whatsapp_inbound_queue
+from services.product_neighbors import product_neighbors_service
 from services.conversation_logger import conversation_logger
 from services.whatsapp_webhook_handler import whatsapp_webhook_handler
+from services.whatsapp_session_resolver import whatsapp_session_resolver
+from services.whatsapp_outbound_dispatcher import whatsapp_outbound_dispatcher
 from services.whatsapp_360dialog_service import whatsapp_service
+from services.wordpress_db_service import wordpress_db_service
+from services.whatsapp_templates import template_manager
+from services.dashboard_snapshot import dashboard_snapshot_service
+from services.runtime_metrics import runtime_metrics
+from services.cpu_offload import cpu_offload
+from services import json_codec
+from services.json_codec import CodecJSONResponse
 from services.knowledge_base import knowledge_service
 from services.conversation_memory import memory_service
 from config.settings import settings
@@ -50,6 +60,8 @@ from services.metrics_service import MetricsService
 from api.admin import auth as admin_auth_router
 from api.admin import settings as admin_settings_router
 from api.admin import knowledge as admin_knowledge_router
+from api.admin import traces as admin_traces_router
+from api.admin import cart_recovery as admin_cart_recovery_router
 
 # Configurar logging
 logging.basicConfig(
@@ -58,12 +70,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Custom JSON encoder para manejar datetime objects
-class DateTimeEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+def _log_webhook_body(label: str, body: Any):
+    """Volcar el body de un webhook solo con DEBUG: serializarlo indentado en cada petición bloquea el event loop"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{label}: {json_codec.dumps(body)}")
 
 # Crear aplicación FastAPI
 app = FastAPI(
@@ -72,7 +82,7 @@ app = FastAPI(
     version="2.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    default_response_class=JSONResponse
+    default_response_class=CodecJSONResponse  # Serialización con el codec (orjson)
 )
 
 # Configurar CORS
@@ -95,6 +105,8 @@ if os.path.exists("static"):
 app.include_router(admin_auth_router.router)
 app.include_router(admin_settings_router.router)
 app.include_router(admin_knowledge_router.router)
+app.include_router(admin_traces_router.router)
+app.include_router(admin_cart_recovery_router.router)
 
 # FASE 3: Instancia global del sistema multi-agente inteligente
 intelligent_agent: Optional[EvaGPT5Agent] = None
@@ -160,6 +172,22 @@ async def startup_event():
         await db_service.initialize()
         logger.info("✅ Base de datos inicializada")
         
+        # Cola persistente de webhooks de WooCommerce (worker con debounce por producto)
+        await webhook_queue.initialize()
+        
+        # Cola persistente de mensajes entrantes de WhatsApp (orden por número, sin duplicados)
+        await whatsapp_inbound_queue.initialize()
+        whatsapp_inbound_queue.set_handler(_process_whatsapp_message)
+        
+        # Sesiones de WhatsApp compartidas entre workers (número → sesión y proceso dueño)
+        await whatsapp_session_resolver.initialize()
+        
+        # Registro y estado de entrega de las plantillas de WhatsApp enviadas
+        await whatsapp_outbound_dispatcher.initialize()
+        
+        # Base de datos de WordPress para detectar carritos abandonados (opcional)
+        await wordpress_db_service.initialize()
+        
         # Inicializar servicio de embeddings
         await embedding_service.initialize()
         logger.info("✅ Servicio de embeddings inicializado")
@@ -181,6 +209,11 @@ async def startup_event():
         await intelligent_agent.initialize()
         logger.info("✅ Sistema Multi-Agente Inteligente con GPT-5 inicializado")
         
+        # Al expirar una sesión de WhatsApp se libera su estado en el agente y se cierra en métricas
+        whatsapp_session_resolver.add_expiry_listener(_on_whatsapp_session_expired)
+        # Si otro worker se queda con el número, este proceso solo suelta su estado en el agente
+        whatsapp_session_resolver.add_release_listener(_on_whatsapp_session_released)
+        
         # Inicializar servicios de administración
         await admin_auth_service.initialize()
         logger.info("✅ Servicio de autenticación admin inicializado")
@@ -193,6 +226,47 @@ async def startup_event():
         await metrics_service.initialize()
         logger.info("✅ Servicio de métricas inicializado")
         
+        # Estadísticas del dashboard: snapshot compartido entre workers, calculado bajo demanda
+        dashboard_snapshot_service.set_metrics_service(metrics_service)
+        await dashboard_snapshot_service.initialize()
+        dashboard_snapshot_service.start_worker()
+        logger.info("✅ Worker de snapshot del dashboard iniciado")
+        
+        # Métricas de runtime: pools, colas y retraso del event loop (/metrics, /health/ready)
+        runtime_metrics.register_pool("main", lambda: db_service.pool)
+        runtime_metrics.register_pool("agent", lambda: intelligent_agent.db_service.pool if intelligent_agent else None)
+        runtime_metrics.register_pool("metrics", lambda: metrics_service.pool if metrics_service else None)
+        runtime_metrics.register_pool("conversation_logger", lambda: conversation_logger.pool)
+        runtime_metrics.register_queue("webhooks", webhook_queue.get_depth)
+        runtime_metrics.register_queue("whatsapp_inbound", whatsapp_inbound_queue.get_depth)
+        runtime_metrics.register_gauge(
+            "eva_whatsapp_active_sessions", "Sesiones de WhatsApp activas",
+            lambda: len(whatsapp_session_resolver.sessions)
+        )
+        runtime_metrics.register_gauge(
+            "eva_websocket_connections", "Conexiones WebSocket de chat abiertas",
+            lambda: len(manager.active_connections)
+        )
+        runtime_metrics.start_worker()
+        logger.info("✅ Métricas de runtime iniciadas")
+        
+        # Procesar webhooks encolados ahora que embeddings y base de datos están listos
+        webhook_queue.start_worker()
+        logger.info("✅ Worker de cola de webhooks iniciado")
+        
+        # Atender mensajes de WhatsApp encolados ahora que el agente está listo
+        whatsapp_inbound_queue.start_worker()
+        whatsapp_session_resolver.start_worker()
+        logger.info("✅ Worker de mensajes de WhatsApp iniciado")
+        
+        # Refresco incremental de productos similares precalculados
+        product_neighbors_service.start_worker()
+        logger.info("✅ Worker de vecinos de productos iniciado")
+        
+        # Campaña periódica de recuperación de carritos abandonados
+        template_manager.start_worker()
+        logger.info("✅ Worker de recuperación de carritos iniciado")
+        
         # Iniciar scheduler de limpieza automática en segundo plano
         asyncio.create_task(metrics_service.start_cleanup_scheduler())
         logger.info("✅ Scheduler de limpieza de métricas iniciado")
@@ -209,6 +283,17 @@ async def shutdown_event():
     logger.info("🛑 Cerrando aplicación...")
     
     try:
+        await webhook_queue.stop_worker()
+        await whatsapp_inbound_queue.stop_worker()
+        await whatsapp_session_resolver.stop_worker()
+        await template_manager.stop_worker()
+        await whatsapp_service.close()
+        await wordpress_db_service.close()
+        await product_neighbors_service.stop_worker()
+        await dashboard_snapshot_service.stop_worker()
+        await runtime_metrics.stop_worker()
+        cpu_offload.shutdown()
+        
         await db_service.close()
         logger.info("✅ Base de datos cerrada")
         
@@ -224,10 +309,11 @@ async def shutdown_event():
 async def dashboard(request: Request):
     """Dashboard principal del sistema"""
     try:
-        # Obtener estadísticas
-        db_stats = await db_service.get_statistics()
-        sync_status = await wc_sync_service.get_sync_status()
-        webhook_stats = await webhook_handler.get_webhook_stats()
+        # Estadísticas del último snapshot (calculado en segundo plano)
+        snapshot = await dashboard_snapshot_service.get_snapshot()
+        db_stats = snapshot.section("database")
+        sync_status = snapshot.section("sync")
+        webhook_stats = snapshot.section("webhooks")
         
         # FASE 3: Estadísticas del agente
         agent_stats = None
@@ -247,10 +333,7 @@ async def dashboard(request: Request):
                 return [serialize_dates(item) for item in obj]
             return obj
         
-        # Serializar todas las fechas en los objetos antes de pasarlos al template
-        db_stats = serialize_dates(db_stats) if db_stats else {}
-        sync_status = serialize_dates(sync_status) if sync_status else {}
-        webhook_stats = serialize_dates(webhook_stats) if webhook_stats else {}
+        # El snapshot ya viene serializado; solo las estadísticas del agente son en vivo
         agent_stats = serialize_dates(agent_stats) if agent_stats else {}
         
         return templates.TemplateResponse("dashboard.html", {
@@ -260,7 +343,8 @@ async def dashboard(request: Request):
             "webhook_stats": webhook_stats,
             "agent_stats": agent_stats,
             "active_connections": len(manager.active_connections),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "snapshot_at": snapshot.generated_at
         })
         
     except Exception as e:
@@ -354,6 +438,55 @@ async def health_check():
             content={"status": "error", "error": str(e)}
         )
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: el proceso responde (no consulta dependencias)"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: servicios inicializados y sin saturación de esta instancia (pools, event loop,
+    turnos en curso). Responde 503 al superar un umbral READINESS_* para que el balanceador
+    deje de enviar tráfico. La profundidad de las colas es compartida por todas las réplicas:
+    se publica en /metrics (eva_queue_depth) pero no cuenta para readiness
+    """
+    readiness = runtime_metrics.check_readiness()
+    failures = list(readiness["failures"])
+    if not db_service.initialized:
+        failures.append("base de datos no inicializada")
+    if not embedding_service.initialized:
+        failures.append("servicio de embeddings no inicializado")
+    if not intelligent_agent:
+        failures.append("agente no inicializado")
+    
+    return JSONResponse(
+        status_code=200 if not failures else 503,
+        content={
+            "status": "ready" if not failures else "not_ready",
+            "failures": failures,
+            "checks": readiness["checks"],
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Métricas de runtime de este worker (etiqueta worker) en formato de texto de Prometheus"""
+    return PlainTextResponse(
+        runtime_metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/api/runtime/stats")
+async def runtime_stats():
+    """Resumen JSON de las métricas de runtime y perfil del trabajo de CPU descargado"""
+    return {
+        **runtime_metrics.get_stats(),
+        "cpu_offload": cpu_offload.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # Endpoints de búsqueda híbrida
 @app.post("/api/search")
 async def hybrid_search(request: SearchRequest):
@@ -388,6 +521,9 @@ async def hybrid_search(request: SearchRequest):
         else:
             raise HTTPException(status_code=400, detail="Tipo de búsqueda no válido")
         
+        # La búsqueda devuelve la proyección card: la API entrega el contenido completo
+        results = await db_service.hydrate_content(results)
+        
         return {
             "query": request.query,
             "search_type": request.search_type,
@@ -412,28 +548,20 @@ async def find_similar(external_id: str, limit: int = 5):
         if not original:
             raise HTTPException(status_code=404, detail="Elemento no encontrado")
         
-        # Buscar similares usando el embedding del elemento original
-        if original.get('embedding'):
-            results = await db_service.vector_search(
-                query_embedding=original['embedding'],
-                limit=limit + 1  # +1 porque el original aparecerá en resultados
-            )
-            
-            # Filtrar el elemento original de los resultados
-            filtered_results = [
-                r for r in results 
-                if r.get('external_id') != external_id
-            ][:limit]
-            
-            return {
-                "original_id": external_id,
-                "original_title": original.get('title', ''),
-                "similar_count": len(filtered_results),
-                "similar_items": filtered_results,
-                "timestamp": datetime.now().isoformat()
-            }
+        # Productos: listas de vecinos precalculadas; resto: búsqueda vectorial en vivo
+        if original.get('content_type') == 'product':
+            filtered_results = await product_neighbors_service.get_similar_products(external_id, limit)
         else:
-            raise HTTPException(status_code=400, detail="Elemento sin embedding disponible")
+            filtered_results = await db_service.find_similar_by_external_id(external_id, limit)
+        filtered_results = await db_service.hydrate_content(filtered_results)
+        
+        return {
+            "original_id": external_id,
+            "original_title": original.get('title', ''),
+            "similar_count": len(filtered_results),
+            "similar_items": filtered_results,
+            "timestamp": datetime.now().isoformat()
+        }
             
     except HTTPException:
         raise
@@ -499,6 +627,9 @@ async def woocommerce_webhook(request: Request):
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException:
+        # Firma ausente o inválida: WooCommerce debe ver el 401
+        raise
     except Exception as e:
         logger.error(f"Error procesando webhook: {e}")
         return JSONResponse(
@@ -515,6 +646,9 @@ async def get_webhook_stats():
     """Obtener estadísticas de webhooks"""
     try:
         stats = await webhook_handler.get_webhook_stats()
+        stats["whatsapp_queue"] = await whatsapp_inbound_queue.get_queue_stats()
+        stats["whatsapp_sessions"] = whatsapp_session_resolver.get_stats()
+        stats["whatsapp_outbound"] = await whatsapp_outbound_dispatcher.get_stats()
         return stats
         
     except Exception as e:
@@ -556,25 +690,40 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
         # Obtener body del request
         body = await request.json()
         
-        # Log para debugging
-        logger.info(f"WhatsApp webhook recibido: {json.dumps(body, indent=2, cls=DateTimeEncoder)}")
-        
-        # Procesar webhook en segundo plano para responder rápido
-        background_tasks.add_task(_process_whatsapp_webhook, body)
-        
-        # Responder inmediatamente a 360Dialog
-        return JSONResponse(
-            status_code=200,
-            content={"status": "received"}
-        )
+        # Log para debugging (el volcado completo solo con DEBUG)
+        entries = body.get('entry', []) if isinstance(body, dict) else []
+        logger.info(f"WhatsApp webhook recibido: {len(entries)} entradas")
+        _log_webhook_body("WhatsApp webhook", body)
         
     except Exception as e:
         logger.error(f"Error procesando webhook de WhatsApp: {e}")
-        # Siempre devolver 200 para evitar reintentos
+        # Un body que no se puede leer no mejora al reintentarlo: 200 para evitar reintentos
         return JSONResponse(
             status_code=200,
             content={"status": "error", "message": str(e)}
         )
+    
+    # Guardar los mensajes en la cola persistente antes de responder: las reentregas
+    # de 360Dialog se ignoran y los mensajes sobreviven a un reinicio
+    if whatsapp_inbound_queue.initialized:
+        try:
+            await whatsapp_inbound_queue.enqueue_webhook(body)
+        except Exception as e:
+            # Sin persistir no se confirma: con un 5xx 360Dialog reentrega el webhook
+            logger.error(f"❌ No se pudo guardar el webhook de WhatsApp en la cola: {e}")
+            return JSONResponse(
+                status_code=503,
+                content={"status": "error", "message": "Cola de mensajes no disponible"}
+            )
+    
+    # Estados, errores y confirmaciones de lectura en segundo plano para responder rápido
+    background_tasks.add_task(_process_whatsapp_webhook, body)
+    
+    # Responder inmediatamente a 360Dialog
+    return JSONResponse(
+        status_code=200,
+        content={"status": "received"}
+    )
 
 @app.post("/webhook/cart-abandoned")
 async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundTasks):
@@ -594,7 +743,7 @@ async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundT
         if "application/json" in content_type:
             # Es JSON
             body = await request.json()
-            logger.info(f"JSON Body: {json.dumps(body, indent=2, cls=DateTimeEncoder)}")
+            _log_webhook_body("JSON Body", body)
             
         elif "application/x-www-form-urlencoded" in content_type or "multipart/form-data" in content_type:
             # Es form data
@@ -606,7 +755,7 @@ async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundT
             for key, value in body.items():
                 if isinstance(value, str) and (value.startswith('{') or value.startswith('[')):
                     try:
-                        body[key] = json.loads(value)
+                        body[key] = json_codec.loads(value)
                     except:
                         pass
         else:
@@ -616,7 +765,7 @@ async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundT
             
             # Intentar parsear como JSON de todos modos
             try:
-                body = json.loads(raw_body)
+                body = json_codec.loads(raw_body)
             except:
                 # Si no es JSON, intentar parsear como query string
                 from urllib.parse import parse_qs
@@ -631,7 +780,7 @@ async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundT
             )
         
         # Log completo para debugging
-        logger.info(f"Datos procesados del webhook: {json.dumps(body, indent=2, cls=DateTimeEncoder)}")
+        _log_webhook_body("Datos procesados del webhook", body)
         
         # Procesar en segundo plano para responder rápido al webhook
         background_tasks.add_task(_process_cart_abandoned, body)
@@ -653,29 +802,25 @@ async def cart_abandoned_webhook(request: Request, background_tasks: BackgroundT
 # Endpoints de estadísticas
 @app.get("/api/stats")
 async def get_system_stats():
-    """Obtener estadísticas generales del sistema"""
+    """Obtener estadísticas generales del sistema (último snapshot del dashboard)"""
     try:
-        db_stats = await db_service.get_statistics()
-        sync_status = await wc_sync_service.get_sync_status()
-        webhook_stats = await webhook_handler.get_webhook_stats()
-        
-        # Obtener métricas del dashboard si el servicio está disponible
-        metrics_stats = {}
-        if metrics_service:
-            metrics_stats = await metrics_service.get_dashboard_stats()
-        
-        return {
-            "database": db_stats,
-            "sync": sync_status,
-            "webhooks": webhook_stats,
-            "metrics": metrics_stats,
-            "timestamp": datetime.now().isoformat()
-        }
+        snapshot = await dashboard_snapshot_service.get_snapshot()
+        # Ya serializado al publicarse: se sirve tal cual
+        return Response(content=snapshot.json, media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/stats/stream")
+async def stream_system_stats():
+    """Stream SSE con cada nuevo snapshot de estadísticas (para el panel de administración)"""
+    return StreamingResponse(
+        dashboard_snapshot_service.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/knowledge/{external_id}")
 async def get_knowledge_item(external_id: str):
     """Obtener un elemento específico de la base de conocimiento"""
@@ -810,7 +955,7 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
         }
         
         await manager.send_personal_message(
-            json.dumps(welcome_data, cls=DateTimeEncoder), 
+            json_codec.dumps(welcome_data), 
             client_id
         )
         
@@ -821,10 +966,12 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
         while True:
             # Recibir mensaje del cliente
             data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = json_codec.loads(data)
             
             user_message = message_data.get("message", "")
             platform = message_data.get("platform", "wordpress")
+            # Streaming opcional: el cliente recibe frames "delta" antes del final
+            stream_enabled = bool(message_data.get("stream", False))
             
             if not user_message:
                 continue
@@ -858,12 +1005,33 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
                     # IMPORTANTE: Incluir session_id para mantener contexto
                     session_id = f"{platform}_{client_id}_{conversation_id or 'default'}"
                     
-                    response = await intelligent_agent.process_message(
-                        message=user_message,
-                        user_id=client_id,
-                        platform=platform,
-                        session_id=session_id
-                    )
+                    if stream_enabled:
+                        response = ""
+                        async for event in intelligent_agent.process_message_stream(
+                            message=user_message,
+                            user_id=client_id,
+                            platform=platform,
+                            session_id=session_id
+                        ):
+                            if event["type"] == "delta":
+                                delta_data = {
+                                    "type": "delta",
+                                    "content": event["content"],
+                                    "client_id": client_id
+                                }
+                                await manager.send_personal_message(
+                                    json_codec.dumps(delta_data),
+                                    client_id
+                                )
+                            elif event["type"] == "final":
+                                response = event["content"]
+                    else:
+                        response = await intelligent_agent.process_message(
+                            message=user_message,
+                            user_id=client_id,
+                            platform=platform,
+                            session_id=session_id
+                        )
                     
                     # Debug log para verificar formato HTML
                     logger.info(f"Response preview (first 500 chars): {response[:500]}")
@@ -890,7 +1058,7 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
                     }
                     
                     await manager.send_personal_message(
-                        json.dumps(response_data, cls=DateTimeEncoder), 
+                        json_codec.dumps(response_data), 
                         client_id
                     )
                     
@@ -902,7 +1070,7 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
                         "timestamp": datetime.now().isoformat()
                     }
                     await manager.send_personal_message(
-                        json.dumps(error_response, cls=DateTimeEncoder), 
+                        json_codec.dumps(error_response), 
                         client_id
                     )
             else:
@@ -913,7 +1081,7 @@ async def websocket_chat(websocket: WebSocket, client_id: str):
                     "timestamp": datetime.now().isoformat()
                 }
                 await manager.send_personal_message(
-                    json.dumps(fallback_response, cls=DateTimeEncoder), 
+                    json_codec.dumps(fallback_response), 
                     client_id
                 )
                 
@@ -930,10 +1098,9 @@ async def get_chat_stats():
         
         stats = intelligent_agent.get_conversation_stats()
         
-        # Agregar métricas si están disponibles
-        metrics_data = {}
-        if metrics_service:
-            metrics_data = await metrics_service.get_dashboard_stats()
+        # Métricas del último snapshot del dashboard
+        snapshot = await dashboard_snapshot_service.get_snapshot()
+        metrics_data = snapshot.section("metrics")
         
         return {
             "agent_stats": stats,
@@ -1002,15 +1169,19 @@ async def get_conversations(
 async def get_metrics_summary():
     """Obtener resumen de métricas para el dashboard de admin"""
     try:
-        # Usar el singleton para obtener el servicio
-        from services.metrics_singleton import get_metrics_service
-        ms = await get_metrics_service()
+        snapshot = await dashboard_snapshot_service.get_snapshot()
+        metrics = snapshot.section("metrics")
         
-        metrics = await ms.get_dashboard_stats()
+        if not metrics:
+            # Sin servicio de métricas en el snapshot: usar el singleton
+            from services.metrics_singleton import get_metrics_service
+            ms = await get_metrics_service()
+            metrics = await ms.get_dashboard_stats()
         
         return {
             "metrics": metrics,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "snapshot_at": snapshot.generated_at
         }
         
     except Exception as e:
@@ -1184,9 +1355,6 @@ async def _process_cart_abandoned(webhook_data: Dict[str, Any]):
     try:
         logger.info("🛒 Procesando carrito abandonado en segundo plano")
         
-        # Importar servicios necesarios
-        from services.whatsapp_templates import template_manager
-        
         # Extraer datos del webhook
         # El formato puede variar según el plugin, vamos a loggear primero
         email = webhook_data.get('email') or webhook_data.get('customer_email')
@@ -1367,8 +1535,8 @@ async def _process_whatsapp_webhook(webhook_data: Dict[str, Any]):
         # Procesar el webhook
         result = await whatsapp_webhook_handler.process_webhook(webhook_data)
         
-        # Si hay mensajes entrantes, procesarlos con el agente
-        if "entry" in webhook_data:
+        # Si hay mensajes entrantes y no hay cola persistente, procesarlos con el agente
+        if "entry" in webhook_data and not whatsapp_inbound_queue.initialized:
             for entry in webhook_data.get("entry", []):
                 for change in entry.get("changes", []):
                     value = change.get("value", {})
@@ -1376,7 +1544,10 @@ async def _process_whatsapp_webhook(webhook_data: Dict[str, Any]):
                     # Procesar mensajes entrantes
                     if "messages" in value:
                         for message in value["messages"]:
-                            await _process_whatsapp_message(message, value)
+                            try:
+                                await _process_whatsapp_message(message, value)
+                            except Exception:
+                                pass  # Ya registrado; sin cola no hay reintento
         
         logger.info(f"✅ Webhook de WhatsApp procesado: {result}")
         
@@ -1384,11 +1555,13 @@ async def _process_whatsapp_webhook(webhook_data: Dict[str, Any]):
         logger.error(f"❌ Error procesando webhook de WhatsApp: {e}")
 
 async def _process_whatsapp_message(message_data: Dict[str, Any], value_data: Dict[str, Any]):
-    """Procesar mensaje individual de WhatsApp con el agente"""
+    """
+    Procesar mensaje individual de WhatsApp con el agente
+    Lanza la excepción si no se pudo responder para que la cola lo reintente
+    """
     try:
         if not intelligent_agent:
-            logger.error("Agente no inicializado para procesar mensaje de WhatsApp")
-            return
+            raise RuntimeError("Agente no inicializado para procesar mensaje de WhatsApp")
         
         # Extraer información del mensaje
         from_number = message_data.get("from", "")
@@ -1398,20 +1571,26 @@ async def _process_whatsapp_message(message_data: Dict[str, Any], value_data: Di
         if message_type == "text":
             text_content = message_data.get("text", {}).get("body", "")
             
-            # Iniciar tracking de conversación si hay servicio de métricas
+            # Sesión estable por número: los mensajes seguidos comparten el estado del agente
+            session = await whatsapp_session_resolver.resolve(from_number)
+            
+            # Tracking de conversación con el mismo timeout de inactividad que la sesión
             conversation_id = None
             start_time = datetime.now()
             
             if metrics_service:
-                conversation_id = await metrics_service.start_conversation(
+                conversation_id = await metrics_service.find_or_create_conversation(
                     user_id=from_number,
                     platform="whatsapp",
                     channel_details={
                         "source": "360dialog",
                         "message_id": message_data.get("id"),
-                        "phone": from_number
-                    }
+                        "phone": from_number,
+                        "session_id": session["session_id"]
+                    },
+                    timeout_minutes=whatsapp_session_resolver.timeout_minutes
                 )
+                await whatsapp_session_resolver.set_conversation(session, conversation_id)
                 
                 # Registrar mensaje del usuario
                 await metrics_service.track_message(
@@ -1424,7 +1603,8 @@ async def _process_whatsapp_message(message_data: Dict[str, Any], value_data: Di
             response = await intelligent_agent.process_message(
                 message=text_content,
                 user_id=from_number,
-                platform="whatsapp"
+                platform="whatsapp",
+                session_id=session["session_id"]
             )
             
             # Enviar respuesta
@@ -1434,38 +1614,62 @@ async def _process_whatsapp_message(message_data: Dict[str, Any], value_data: Di
                 reply_to=message_data.get("id")
             )
             
-            # Registrar respuesta del bot si hay métricas
-            if metrics_service and conversation_id:
-                response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-                
-                await metrics_service.track_message(
-                    conversation_id=conversation_id,
-                    sender_type="bot",
-                    content=response,
-                    response_time_ms=response_time_ms
-                )
-                
-                # Detectar intención básica
-                intent = "general"
-                if "producto" in text_content.lower() or "precio" in text_content.lower():
-                    intent = "product_inquiry"
-                elif "pedido" in text_content.lower() or "orden" in text_content.lower():
-                    intent = "order_inquiry"
-                elif "envío" in text_content.lower():
-                    intent = "shipping_inquiry"
-                
-                await metrics_service.track_topic(
-                    topic=intent,
-                    category="whatsapp",
-                    query=text_content[:200],
-                    resolution_time_minutes=(datetime.now() - start_time).total_seconds() / 60,
-                    success=True
-                )
+            # Respuesta ya enviada: un fallo de métricas no debe provocar un reintento
+            try:
+                await _track_whatsapp_response(conversation_id, text_content, response, start_time)
+            except Exception as e:
+                logger.error(f"Error registrando métricas de WhatsApp: {e}")
             
             logger.info(f"✅ Mensaje de WhatsApp procesado y respondido: {from_number}")
         
     except Exception as e:
         logger.error(f"Error procesando mensaje de WhatsApp: {e}")
+        raise
+
+async def _on_whatsapp_session_expired(session: Dict[str, Any]):
+    """Liberar el estado de conversación del agente y cerrar la conversación de métricas"""
+    if intelligent_agent:
+        intelligent_agent.release_session(session["session_id"])
+    
+    if metrics_service and session.get("conversation_id"):
+        await metrics_service.end_conversation(session["conversation_id"], status="ended")
+
+def _on_whatsapp_session_released(session: Dict[str, Any]):
+    """Liberar el estado de conversación de una sesión que ahora atiende otro worker"""
+    if intelligent_agent:
+        intelligent_agent.release_session(session["session_id"])
+
+async def _track_whatsapp_response(conversation_id: Optional[str], text_content: str, response: str,
+                                   start_time: datetime):
+    """Registrar en métricas la respuesta del bot a un mensaje de WhatsApp"""
+    if not metrics_service or not conversation_id:
+        return
+    
+    response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+    
+    await metrics_service.track_message(
+        conversation_id=conversation_id,
+        sender_type="bot",
+        content=response,
+        response_time_ms=response_time_ms
+    )
+    
+    # Detectar intención básica
+    intent = "general"
+    if "producto" in text_content.lower() or "precio" in text_content.lower():
+        intent = "product_inquiry"
+    elif "pedido" in text_content.lower() or "orden" in text_content.lower():
+        intent = "order_inquiry"
+    elif "envío" in text_content.lower():
+        intent = "shipping_inquiry"
+    
+    await metrics_service.track_topic(
+        topic=intent,
+        category="whatsapp",
+        query=text_content[:200],
+        resolution_time_minutes=(datetime.now() - start_time).total_seconds() / 60,
+        success=True
+    )
 
 # Manejadores de errores globales
 @app.exception_handler(Exception)
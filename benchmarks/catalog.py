@@ -0,0 +1,258 @@
+"""
+Generador de catálogo sintético de material eléctrico para benchmarks
+Produce productos con la forma de la API REST de WooCommerce (títulos
+realistas en español, SKU, precios, stock, categorías y atributos)
+de forma determinista a partir de una semilla.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Iterator
+
+BRANDS = [
+    "Schneider Electric", "Hager", "ABB", "Legrand", "Siemens", "Chint",
+    "Simon", "Jung", "Niessen", "Gewiss", "Orbis", "Cirprotec", "Mersen",
+    "Salicru", "Soler & Palau", "Dinuy", "B.E.G.", "Normalux", "Tekox", "Cellpack"
+]
+
+CATEGORIES = [
+    {"id": 10, "name": "Magnetotérmicos", "slug": "magnetotermicos"},
+    {"id": 11, "name": "Diferenciales", "slug": "diferenciales"},
+    {"id": 12, "name": "Cables", "slug": "cables"},
+    {"id": 13, "name": "Iluminación LED", "slug": "iluminacion-led"},
+    {"id": 14, "name": "Mecanismos", "slug": "mecanismos"},
+    {"id": 15, "name": "Ventilación", "slug": "ventilacion"},
+    {"id": 16, "name": "Contactores", "slug": "contactores"},
+    {"id": 17, "name": "Fusibles", "slug": "fusibles"},
+    {"id": 18, "name": "Cajas y envolventes", "slug": "cajas-envolventes"},
+    {"id": 19, "name": "Protección contra sobretensiones", "slug": "sobretensiones"},
+]
+
+_CATEGORY_BY_SLUG = {c["slug"]: c for c in CATEGORIES}
+
+
+def _magnetotermico(rng: random.Random) -> Dict[str, Any]:
+    amps = rng.choice([6, 10, 16, 20, 25, 32, 40, 50, 63])
+    poles = rng.choice(["1P", "1P+N", "2P", "3P", "4P"])
+    curve = rng.choice(["B", "C", "D"])
+    ka = rng.choice(["4,5kA", "6kA", "10kA"])
+    return {
+        "title": f"Interruptor magnetotérmico {poles} {amps}A curva {curve} {ka}",
+        "category": "magnetotermicos",
+        "attributes": {"Amperaje": f"{amps}A", "Polos": poles, "Curva": curve, "Poder de corte": ka},
+        "price": (8 + amps * 0.4) * (1 + 0.35 * (len(poles) - 2)),
+    }
+
+
+def _diferencial(rng: random.Random) -> Dict[str, Any]:
+    amps = rng.choice([25, 40, 63, 80])
+    poles = rng.choice(["2P", "4P"])
+    sens = rng.choice(["10mA", "30mA", "300mA"])
+    tipo = rng.choice(["AC", "A", "A-SI", "B"])
+    return {
+        "title": f"Interruptor diferencial {poles} {amps}A {sens} clase {tipo}",
+        "category": "diferenciales",
+        "attributes": {"Amperaje": f"{amps}A", "Polos": poles, "Sensibilidad": sens, "Tipo": tipo},
+        "price": 30 + amps * 0.8 + (120 if tipo == "B" else 0),
+    }
+
+
+def _cable(rng: random.Random) -> Dict[str, Any]:
+    section = rng.choice(["1,5", "2,5", "4", "6", "10", "16"])
+    kind = rng.choice(["H07V-K unipolar", "RZ1-K manguera 3G", "RV-K manguera 5G", "H05VV-F manguera 3G"])
+    color = rng.choice(["negro", "azul", "marrón", "gris", "amarillo-verde"])
+    length = rng.choice([25, 50, 100])
+    return {
+        "title": f"Cable {kind}{section}mm² {color} rollo {length}m",
+        "category": "cables",
+        "attributes": {"Sección": f"{section}mm²", "Color": color, "Longitud": f"{length}m"},
+        "price": length * float(section.replace(",", ".")) * 0.12,
+    }
+
+
+def _iluminacion(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.choice(["Campana industrial LED", "Proyector LED", "Panel LED 60x60", "Downlight LED", "Bombilla LED", "Regleta LED estanca"])
+    watts = rng.choice([6, 9, 12, 18, 24, 36, 50, 100, 150, 200])
+    temp = rng.choice(["3000K", "4000K", "6500K"])
+    ip = rng.choice(["IP20", "IP44", "IP65", "IP66"])
+    return {
+        "title": f"{kind} {watts}W {temp} {ip}",
+        "category": "iluminacion-led",
+        "attributes": {"Potencia": f"{watts}W", "Temperatura de color": temp, "Grado de protección": ip},
+        "price": 4 + watts * 0.45,
+    }
+
+
+def _mecanismo(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.choice(["Base enchufe schuko", "Interruptor conmutador", "Pulsador timbre", "Toma RJ45 Cat6", "Regulador de intensidad LED"])
+    serie = rng.choice(["serie 82", "serie LS990", "serie Zenit", "serie Valena", "serie 27"])
+    color = rng.choice(["blanco", "antracita", "aluminio", "negro mate"])
+    return {
+        "title": f"{kind} {serie} {color}",
+        "category": "mecanismos",
+        "attributes": {"Serie": serie, "Color": color},
+        "price": rng.uniform(3, 45),
+    }
+
+
+def _ventilacion(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.choice(["Extractor helicoidal mural", "Ventilador de techo", "Extractor de baño", "Ventilador industrial de pie", "Ventilador con filtro VF"])
+    diameter = rng.choice([100, 120, 150, 250, 350, 450])
+    return {
+        "title": f"{kind} {diameter}mm",
+        "category": "ventilacion",
+        "attributes": {"Diámetro": f"{diameter}mm"},
+        "price": 25 + diameter * 0.6,
+    }
+
+
+def _contactor(rng: random.Random) -> Dict[str, Any]:
+    amps = rng.choice([9, 12, 18, 25, 32, 40, 65])
+    coil = rng.choice(["24V AC", "230V AC", "24V DC"])
+    return {
+        "title": f"Contactor tripolar {amps}A bobina {coil} 1NA+1NC",
+        "category": "contactores",
+        "attributes": {"Amperaje": f"{amps}A", "Bobina": coil, "Polos": "3P"},
+        "price": 15 + amps * 1.1,
+    }
+
+
+def _fusible(rng: random.Random) -> Dict[str, Any]:
+    amps = rng.choice([2, 4, 6, 10, 16, 20, 25, 32, 63, 100])
+    size = rng.choice(["10x38", "14x51", "22x58", "NH00", "NH1"])
+    kind = rng.choice(["gG", "aM", "gPV"])
+    return {
+        "title": f"Fusible cilíndrico {size} {amps}A {kind}",
+        "category": "fusibles",
+        "attributes": {"Amperaje": f"{amps}A", "Tamaño": size, "Clase": kind},
+        "price": 1.5 + amps * 0.05,
+    }
+
+
+def _caja(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.choice(["Caja estanca de derivación", "Cuadro de superficie", "Caja de empotrar universal", "Armario metálico"])
+    modules = rng.choice([4, 8, 12, 24, 36, 48])
+    ip = rng.choice(["IP40", "IP55", "IP65"])
+    return {
+        "title": f"{kind} {modules} módulos {ip}",
+        "category": "cajas-envolventes",
+        "attributes": {"Módulos": str(modules), "Grado de protección": ip},
+        "price": 3 + modules * 1.8,
+    }
+
+
+def _sobretensiones(rng: random.Random) -> Dict[str, Any]:
+    kind = rng.choice(["Protector sobretensiones transitorias", "Protector sobretensiones permanentes", "Protector combinado transitorias y permanentes"])
+    poles = rng.choice(["1P+N", "3P+N"])
+    ka = rng.choice(["15kA", "20kA", "40kA"])
+    return {
+        "title": f"{kind} {poles} {ka}",
+        "category": "sobretensiones",
+        "attributes": {"Polos": poles, "Corriente máxima": ka},
+        "price": rng.uniform(45, 260),
+    }
+
+
+_GENERATORS = [
+    (_magnetotermico, 22), (_diferencial, 12), (_cable, 14), (_iluminacion, 16),
+    (_mecanismo, 10), (_ventilacion, 6), (_contactor, 6), (_fusible, 6),
+    (_caja, 5), (_sobretensiones, 3),
+]
+
+
+def generate_products(count: int, seed: int = 42, start_id: int = 1000) -> Iterator[Dict[str, Any]]:
+    """
+    Genera productos con la forma de la API REST de WooCommerce
+
+    Args:
+        count: Número de productos
+        seed: Semilla para que el catálogo sea reproducible
+        start_id: Primer ID de producto
+
+    Yields:
+        Diccionarios de producto tipo WooCommerce
+    """
+    rng = random.Random(seed)
+    generators = [g for g, _ in _GENERATORS]
+    weights = [w for _, w in _GENERATORS]
+    base_date = datetime(2025, 1, 1)
+
+    for i in range(count):
+        spec = rng.choices(generators, weights=weights)[0](rng)
+        brand = rng.choice(BRANDS)
+        product_id = start_id + i
+        sku = f"{brand[:3].upper().replace(' ', '')}-{product_id:07d}"
+        price = round(max(spec["price"], 0.5) * rng.uniform(0.85, 1.2), 2)
+        on_sale = rng.random() < 0.15
+        sale_price = round(price * 0.85, 2) if on_sale else None
+        stock_status = rng.choices(["instock", "outofstock", "onbackorder"], weights=[80, 15, 5])[0]
+        category = _CATEGORY_BY_SLUG[spec["category"]]
+        title = f"{spec['title']} {brand}"
+        modified = base_date + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+
+        attributes = [{"name": "Marca", "options": [brand]}]
+        attributes.extend({"name": k, "options": [v]} for k, v in spec["attributes"].items())
+
+        yield {
+            "id": product_id,
+            "name": title,
+            "slug": f"producto-{product_id}",
+            "permalink": f"https://elcorteelectrico.example/producto/producto-{product_id}/",
+            "status": "publish",
+            "sku": sku,
+            "price": f"{sale_price if on_sale else price:.2f}",
+            "regular_price": f"{price:.2f}",
+            "sale_price": f"{sale_price:.2f}" if on_sale else "",
+            "stock_status": stock_status,
+            "stock_quantity": rng.randint(1, 500) if stock_status == "instock" else 0,
+            "short_description": f"<p>{title}. Marca {brand}.</p>",
+            "description": (
+                f"<p>{title}.</p><ul>"
+                + "".join(f"<li><strong>{k}:</strong> {v}</li>" for k, v in spec["attributes"].items())
+                + f"</ul><p>Producto de {category['name'].lower()} de la marca {brand}, "
+                  f"apto para instalaciones domésticas e industriales según normativa vigente.</p>"
+            ),
+            "categories": [{"id": category["id"], "name": category["name"], "slug": category["slug"]}],
+            "attributes": attributes,
+            "images": [{"src": f"https://elcorteelectrico.example/wp-content/uploads/{product_id}.jpg"}],
+            "date_created": (modified - timedelta(days=30)).isoformat(),
+            "date_modified": modified.isoformat(),
+        }
+
+
+def generate_categories(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Categorías tipo WooCommerce con el recuento de productos del catálogo"""
+    counts: Dict[int, int] = {}
+    for product in products:
+        for cat in product.get("categories", []):
+            counts[cat["id"]] = counts.get(cat["id"], 0) + 1
+
+    return [
+        {
+            "id": c["id"],
+            "name": c["name"],
+            "slug": c["slug"],
+            "parent": 0,
+            "description": f"<p>{c['name']} para instalaciones eléctricas.</p>",
+            "count": counts.get(c["id"], 0),
+            "link": f"https://elcorteelectrico.example/categoria/{c['slug']}/",
+        }
+        for c in CATEGORIES
+    ]
+
+
+# Consultas típicas de clientes para los escenarios de carga
+SAMPLE_QUERIES = [
+    "busco un magnetotérmico 2P 16A curva C",
+    "necesito diferencial 40A 30mA",
+    "quiero cable 2,5mm² azul",
+    "campana industrial LED 150W",
+    "hola",
+    "qué es un diferencial superinmunizado",
+    "cuál es el teléfono de la tienda",
+    "busco contactor 25A bobina 230V",
+    "fusible 10x38 16A",
+    "ventilador de techo",
+    "proyector LED IP65 Schneider",
+    "caja estanca de derivación IP65",
+]
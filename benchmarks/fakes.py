@@ -0,0 +1,410 @@
+"""
+Servicios falsos locales para benchmarks sin dependencias externas
+- OpenAI: Responses API (con y sin streaming SSE) y embeddings deterministas
+- WooCommerce: API REST v3 respaldada por un catálogo sintético
+- 360Dialog: sumidero de mensajes salientes de WhatsApp
+
+Todos permiten configurar una latencia artificial para simular la red real.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import time
+import uuid
+from functools import lru_cache
+from typing import Dict, Any, List
+
+from aiohttp import web
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+# ----------------------------------------------------------------------
+# Embeddings deterministas
+# ----------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"[a-záéíóúñü0-9,\.]+", re.IGNORECASE)
+
+
+@lru_cache(maxsize=20000)
+def _token_vector(token: str, dims: int) -> tuple:
+    seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    return tuple(rng.gauss(0.0, 1.0) for _ in range(dims))
+
+
+def fake_embedding(text: str, dims: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """
+    Embedding determinista tipo "bolsa de palabras con hashing"
+    Textos que comparten palabras quedan cerca en el espacio vectorial,
+    de modo que la búsqueda semántica devuelve resultados plausibles.
+    """
+    tokens = _TOKEN_RE.findall(text.lower())[:64] or ["vacio"]
+    vector = [0.0] * dims
+    for token in tokens:
+        for i, value in enumerate(_token_vector(token, dims)):
+            vector[i] += value
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class LatencyProfile:
+    """Latencia artificial con jitter para un servicio falso"""
+
+    def __init__(self, mean_ms: float = 0.0, jitter: float = 0.2, seed: int = 7):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    async def wait(self, scale: float = 1.0):
+        if self.mean_ms <= 0:
+            return
+        delay = self.mean_ms * scale * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+        await asyncio.sleep(delay / 1000)
+
+
+# ----------------------------------------------------------------------
+# OpenAI
+# ----------------------------------------------------------------------
+
+class FakeOpenAI:
+    """
+    Imita /v1/responses y /v1/embeddings
+    Las respuestas de la Responses API se eligen según la firma del prompt de
+    cada agente (clasificador, analizador, generador de queries, validador...)
+    para que el flujo completo del agente se ejecute con JSON válido.
+    """
+
+    def __init__(self, llm_latency_ms: float = 300.0, embedding_latency_ms: float = 40.0,
+                 stream_chunk_delay_ms: float = 15.0):
+        self.llm_latency = LatencyProfile(llm_latency_ms)
+        self.embedding_latency = LatencyProfile(embedding_latency_ms)
+        self.stream_chunk_delay_ms = stream_chunk_delay_ms
+        self.calls: Dict[str, int] = {"responses": 0, "responses_stream": 0, "embeddings": 0, "embedding_inputs": 0}
+
+    def register(self, app: web.Application):
+        app.router.add_post("/v1/responses", self.handle_responses)
+        app.router.add_post("/v1/embeddings", self.handle_embeddings)
+
+    # -- Responses API --------------------------------------------------
+
+    async def handle_responses(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        prompt = payload.get("input", "")
+        if isinstance(prompt, list):
+            prompt = "\n".join(str(item.get("content", "")) for item in prompt if isinstance(item, dict))
+        model = payload.get("model", "gpt-5")
+        text = self._answer_for(prompt)
+
+        if payload.get("stream"):
+            self.calls["responses_stream"] += 1
+            return await self._stream(request, model, text)
+
+        self.calls["responses"] += 1
+        await self.llm_latency.wait()
+        return web.json_response(self._response_object(model, prompt, text))
+
+    async def _stream(self, request: web.Request, model: str, text: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        # La primera parte de la latencia es "tiempo hasta el primer token"
+        await self.llm_latency.wait(scale=0.4)
+
+        async def send(event_type: str, data: Dict[str, Any]):
+            data["type"] = event_type
+            await response.write(f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        response_id = f"resp_{uuid.uuid4().hex}"
+        await send("response.created", {"response": {"id": response_id, "model": model, "status": "in_progress"}})
+
+        words = re.findall(r"\S+\s*", text)
+        for i in range(0, len(words), 3):
+            await send("response.output_text.delta", {"delta": "".join(words[i:i + 3]), "output_index": 0, "content_index": 0})
+            if self.stream_chunk_delay_ms:
+                await asyncio.sleep(self.stream_chunk_delay_ms / 1000)
+
+        final = self._response_object(model, "", text)
+        final["id"] = response_id
+        await send("response.completed", {"response": final})
+        await response.write_eof()
+        return response
+
+    def _response_object(self, model: str, prompt: str, text: str) -> Dict[str, Any]:
+        input_tokens = max(1, len(prompt) // 4)
+        output_tokens = max(1, len(text) // 4)
+        return {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": model,
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}]
+            }],
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens}
+        }
+
+    def _answer_for(self, prompt: str) -> str:
+        """Respuesta plausible según el agente que hace la llamada"""
+        if "clasificador de intención" in prompt:
+            match = re.search(r'Mensaje actual: "(.*)"', prompt)
+            return json.dumps(self._classify(match.group(1) if match else prompt))
+
+        if "Extrae información de pedido" in prompt:
+            number = re.search(r"#?(\d{3,})", prompt)
+            return json.dumps({"order_number": number.group(1) if number else None,
+                               "email": None, "has_order_reference": bool(number)})
+
+        if "CONSULTA DEL CLIENTE:" in prompt:
+            match = re.search(r'CONSULTA DEL CLIENTE: "(.*?)"', prompt)
+            query = match.group(1) if match else ""
+            return json.dumps({
+                "has_enough_info": True, "missing_info": [],
+                "extracted_specs": {"raw_specs": [], "normalized_specs": {}},
+                "product_type": _strip_stop_words(query) or "producto",
+                "brand": None, "technical_specs": {},
+                "clarification_needed": None, "confidence": 0.85
+            })
+
+        if "Query simplificada:" in prompt:
+            match = re.search(r'Query simplificada: "(.*?)"', prompt)
+            query = match.group(1) if match else "producto"
+            words = query.split()
+            return json.dumps({
+                "primary_query": query,
+                "alternative_queries": [" ".join(words[:2]) or query, words[0] if words else query],
+                "synonym_queries": [], "broad_query": words[0] if words else query,
+                "narrow_queries": [], "strategy": "benchmark"
+            })
+
+        if '"best_matches"' in prompt:
+            return json.dumps({
+                "is_valid": True, "relevance_score": 0.9, "result_quality": "good",
+                "issues": [], "suggestions": [], "best_matches": [0, 1, 2, 3, 4],
+                "needs_refinement": False, "refinement_reason": ""
+            })
+
+        if '"refined_queries"' in prompt:
+            return json.dumps({"new_approach": "ampliar", "refined_queries": ["producto"],
+                               "avoid_terms": [], "focus_terms": [], "reasoning": "benchmark",
+                               "confidence": 0.6})
+
+        if "BROADEN/NARROW/SYNONYMS/RETHINK" in prompt:
+            return json.dumps({"strategy": "BROADEN", "specific_action": "ampliar",
+                               "avoid": [], "include": []})
+
+        if "Responde SOLO con la pregunta" in prompt:
+            return "¿Qué amperaje y número de polos necesitas?"
+
+        return (
+            "Claro. Un interruptor diferencial protege a las personas frente a contactos "
+            "indirectos detectando fugas de corriente a tierra, mientras que el magnetotérmico "
+            "protege la instalación frente a sobrecargas y cortocircuitos. Para vivienda se "
+            "recomienda un diferencial de 30mA clase A y magnetotérmicos curva C dimensionados "
+            "según la sección del cable de cada circuito. Si necesitas ayuda para elegir, "
+            "indícame el tipo de instalación y te recomiendo los productos adecuados."
+        )
+
+    def _classify(self, message: str) -> Dict[str, Any]:
+        lower = message.lower()
+        if any(w in lower for w in ["pedido", "orden", "envío #"]):
+            intent = "ORDER_INQUIRY"
+        elif lower.strip() in ("hola", "buenas", "buenos días") or lower.startswith("hola"):
+            intent = "GREETING"
+        elif any(w in lower for w in ["busco", "quiero", "necesito", "precio"]) or re.search(r"\d+\s*(a|w|mm)", lower):
+            intent = "PRODUCT_SEARCH"
+        elif any(w in lower for w in ["qué es", "cómo funciona", "diferencia", "para qué"]):
+            intent = "TECHNICAL_INFO"
+        else:
+            intent = "GENERAL_QUESTION"
+        return {"intent": intent, "confidence": 0.9, "reasoning": "benchmark",
+                "entities": {}, "needs_clarification": False, "clarification_prompt": None}
+
+    # -- Embeddings -----------------------------------------------------
+
+    async def handle_embeddings(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        inputs = payload.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dims = int(payload.get("dimensions") or EMBEDDING_DIMENSIONS)
+        as_base64 = payload.get("encoding_format") == "base64"
+
+        self.calls["embeddings"] += 1
+        self.calls["embedding_inputs"] += len(inputs)
+        await self.embedding_latency.wait(scale=1 + len(inputs) / 50)
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(str(text), dims)
+            if as_base64:
+                encoded = base64.b64encode(struct.pack(f"<{dims}f", *vector)).decode("ascii")
+                data.append({"object": "embedding", "index": index, "embedding": encoded})
+            else:
+                data.append({"object": "embedding", "index": index, "embedding": vector})
+
+        tokens = sum(max(1, len(str(t)) // 4) for t in inputs)
+        return web.json_response({
+            "object": "list", "data": data, "model": payload.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+
+def _strip_stop_words(query: str) -> str:
+    stop = {"busco", "quiero", "necesito", "un", "una", "de", "el", "la", "para", "hola"}
+    return " ".join(w for w in query.split() if w.lower() not in stop)
+
+
+# ----------------------------------------------------------------------
+# WooCommerce
+# ----------------------------------------------------------------------
+
+class FakeWooCommerce:
+    """API REST de WooCommerce (wc/v3) sobre un catálogo en memoria"""
+
+    def __init__(self, products: List[Dict[str, Any]], categories: List[Dict[str, Any]],
+                 latency_ms: float = 80.0):
+        self.products = products
+        self.by_id = {p["id"]: p for p in products}
+        self.categories = categories
+        self.latency = LatencyProfile(latency_ms)
+        self.calls: Dict[str, int] = {}
+
+    def register(self, app: web.Application, prefix: str = "/wp-json/wc/v3"):
+        app.router.add_get(f"{prefix}/products", self.list_products)
+        app.router.add_get(f"{prefix}/products/categories", self.list_categories)
+        app.router.add_get(f"{prefix}/products/{{product_id:\\d+}}", self.get_product)
+        app.router.add_get(f"{prefix}/orders", self.list_orders)
+        app.router.add_get(f"{prefix}/orders/{{order_id:\\d+}}", self.get_order)
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    @staticmethod
+    def _paginate(request: web.Request, items: List[Dict[str, Any]]) -> web.Response:
+        per_page = max(1, min(int(request.query.get("per_page", 10)), 100))
+        page = max(1, int(request.query.get("page", 1)))
+        total = len(items)
+        total_pages = max(1, math.ceil(total / per_page))
+        chunk = items[(page - 1) * per_page:page * per_page]
+        return web.json_response(chunk, headers={"X-WP-Total": str(total), "X-WP-TotalPages": str(total_pages)})
+
+    async def list_products(self, request: web.Request) -> web.Response:
+        self._count("products")
+        await self.latency.wait()
+        items = self.products
+
+        if "sku" in request.query:
+            sku = request.query["sku"].upper()
+            items = [p for p in items if p["sku"].upper() == sku]
+        if "search" in request.query:
+            words = request.query["search"].lower().split()
+            items = [p for p in items if all(w in p["name"].lower() for w in words)]
+        if "category" in request.query:
+            category_id = int(request.query["category"])
+            items = [p for p in items if any(c["id"] == category_id for c in p["categories"])]
+        if "modified_after" in request.query:
+            after = request.query["modified_after"]
+            items = [p for p in items if p["date_modified"] > after]
+        if "include" in request.query:
+            ids = {int(i) for i in request.query["include"].split(",") if i}
+            items = [p for p in items if p["id"] in ids]
+
+        return self._paginate(request, items)
+
+    async def get_product(self, request: web.Request) -> web.Response:
+        self._count("product")
+        await self.latency.wait()
+        product = self.by_id.get(int(request.match_info["product_id"]))
+        if not product:
+            return web.json_response({"code": "woocommerce_rest_product_invalid_id"}, status=404)
+        return web.json_response(product)
+
+    async def list_categories(self, request: web.Request) -> web.Response:
+        self._count("categories")
+        await self.latency.wait()
+        items = self.categories
+        if "search" in request.query:
+            term = request.query["search"].lower()
+            items = [c for c in items if term in c["name"].lower()]
+        return self._paginate(request, items)
+
+    async def list_orders(self, request: web.Request) -> web.Response:
+        self._count("orders")
+        await self.latency.wait()
+        return self._paginate(request, [])
+
+    async def get_order(self, request: web.Request) -> web.Response:
+        self._count("order")
+        await self.latency.wait()
+        return web.json_response({"code": "woocommerce_rest_shop_order_invalid_id"}, status=404)
+
+
+# ----------------------------------------------------------------------
+# 360Dialog
+# ----------------------------------------------------------------------
+
+class Fake360Dialog:
+    """
+    Sumidero de mensajes salientes de WhatsApp
+    Permite esperar la respuesta enviada a un número para medir la latencia
+    extremo a extremo del webhook de WhatsApp.
+    """
+
+    def __init__(self, latency_ms: float = 60.0):
+        self.latency = LatencyProfile(latency_ms)
+        self.sent: List[Dict[str, Any]] = []
+        self.read_receipts = 0
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    def register(self, app: web.Application):
+        app.router.add_post("/messages", self.handle_message)
+        app.router.add_post("/v1/messages", self.handle_message)
+
+    async def handle_message(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await self.latency.wait()
+
+        if payload.get("status") == "read":
+            self.read_receipts += 1
+            return web.json_response({"success": True})
+
+        recipient = str(payload.get("to", ""))
+        self.sent.append({"to": recipient, "type": payload.get("type"), "received_at": time.perf_counter()})
+        for future in self._waiters.pop(recipient, []):
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+        return web.json_response({
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": recipient, "wa_id": recipient}],
+            "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]
+        })
+
+    def wait_for_reply(self, recipient: str) -> asyncio.Future:
+        """Futuro que se resuelve (con perf_counter) cuando se envía un mensaje a ese número"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(recipient, []).append(future)
+        return future
+
+
+async def start_fake_server(host: str, port: int, *services) -> web.AppRunner:
+    """Arranca un servidor aiohttp con los servicios falsos indicados"""
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    for service in services:
+        service.register(app)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga extremo a extremo sin servicios externos
+
+Arranca servicios falsos locales (OpenAI, WooCommerce, 360Dialog), lanza la
+aplicación (app.py) apuntando a ellos y genera carga concurrente contra
+/api/chat, /ws/chat y /api/webhooks/whatsapp. Informa de latencias
+p50/p95/p99, throughput, consultas a PostgreSQL y memoria del proceso.
+
+Requiere un PostgreSQL local con pgvector (DATABASE_URL).
+
+Uso:
+    python -m benchmarks.run_benchmark --products 2000 --concurrency 20 --requests 300 --sync
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+import aiohttp
+import asyncpg
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.catalog import generate_products, generate_categories, SAMPLE_QUERIES
+from benchmarks.fakes import FakeOpenAI, FakeWooCommerce, Fake360Dialog, start_fake_server
+
+
+# ----------------------------------------------------------------------
+# Estadísticas
+# ----------------------------------------------------------------------
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por interpolación lineal"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+class ScenarioResult:
+    """Resultados de un escenario de carga"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies_ms: List[float] = []
+        self.first_frame_ms: List[float] = []
+        self.errors = 0
+        self.elapsed_s = 0.0
+        self.db: Dict[str, int] = {}
+
+    def summary(self) -> Dict[str, Any]:
+        ok = len(self.latencies_ms)
+        result = {
+            "scenario": self.name,
+            "requests": ok + self.errors,
+            "errors": self.errors,
+            "throughput_rps": round(ok / self.elapsed_s, 2) if self.elapsed_s else 0.0,
+            "p50_ms": round(percentile(self.latencies_ms, 50), 1),
+            "p95_ms": round(percentile(self.latencies_ms, 95), 1),
+            "p99_ms": round(percentile(self.latencies_ms, 99), 1),
+            "max_ms": round(max(self.latencies_ms), 1) if ok else 0.0,
+            "db": self.db,
+        }
+        if self.first_frame_ms:
+            result["ttff_p50_ms"] = round(percentile(self.first_frame_ms, 50), 1)
+            result["ttff_p95_ms"] = round(percentile(self.first_frame_ms, 95), 1)
+        return result
+
+
+# ----------------------------------------------------------------------
+# Métricas de PostgreSQL y memoria
+# ----------------------------------------------------------------------
+
+class DatabaseCounters:
+    """
+    Contadores de consultas de PostgreSQL
+    Usa pg_stat_statements si está disponible; si no, pg_stat_database.
+    """
+
+    def __init__(self, database_url: str):
+        self.database_url = database_url
+        self.has_statements = False
+
+    async def snapshot(self) -> Dict[str, int]:
+        conn = await asyncpg.connect(self.database_url)
+        try:
+            self.has_statements = bool(await conn.fetchval(
+                "SELECT COUNT(*) FROM pg_extension WHERE extname = 'pg_stat_statements'"
+            ))
+            row = await conn.fetchrow("""
+                SELECT xact_commit + xact_rollback AS transactions,
+                       tup_returned, tup_fetched, blks_read, blks_hit
+                FROM pg_stat_database WHERE datname = current_database()
+            """)
+            counters = {k: int(v) for k, v in dict(row).items()}
+            if self.has_statements:
+                counters["queries"] = int(await conn.fetchval(
+                    "SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements "
+                    "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())"
+                ))
+            return counters
+        finally:
+            await conn.close()
+
+    @staticmethod
+    def delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+        return {k: after[k] - before.get(k, 0) for k in after}
+
+
+class MemorySampler:
+    """Muestrea el RSS de un proceso (Linux /proc) y guarda el pico"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def read_rss_kb(self) -> Optional[int]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+    async def _run(self):
+        while True:
+            rss = self.read_rss_kb()
+            if rss:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.samples:
+            return {"available": False}
+        return {
+            "available": True,
+            "rss_start_mb": round(self.samples[0] / 1024, 1),
+            "rss_peak_mb": round(max(self.samples) / 1024, 1),
+            "rss_end_mb": round(self.samples[-1] / 1024, 1),
+        }
+
+
+# ----------------------------------------------------------------------
+# Escenarios
+# ----------------------------------------------------------------------
+
+async def run_load(name: str, total: int, concurrency: int,
+                   one_request: Callable[[int, ScenarioResult], Awaitable[None]],
+                   db_counters: Optional[DatabaseCounters]) -> ScenarioResult:
+    """Ejecuta `total` peticiones con un máximo de `concurrency` simultáneas"""
+    result = ScenarioResult(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(i: int):
+        async with semaphore:
+            try:
+                await one_request(i, result)
+            except Exception as e:
+                result.errors += 1
+                if result.errors <= 3:
+                    print(f"   ⚠️ {name}: {type(e).__name__}: {e}")
+
+    before = await db_counters.snapshot() if db_counters else None
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(total)))
+    result.elapsed_s = time.perf_counter() - start
+    if db_counters:
+        result.db = DatabaseCounters.delta(before, await db_counters.snapshot())
+    return result
+
+
+def chat_scenario(session: aiohttp.ClientSession, base_url: str, users: int):
+    async def one(i: int, result: ScenarioResult):
+        payload = {
+            "message": SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)],
+            "user_id": f"bench_user_{i % users}",
+            "platform": "wordpress",
+        }
+        start = time.perf_counter()
+        async with session.post(f"{base_url}/api/chat", json=payload) as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+        result.latencies_ms.append((time.perf_counter() - start) * 1000)
+    return one
+
+
+def websocket_scenario(session: aiohttp.ClientSession, base_url: str, stream: bool):
+    ws_url = base_url.replace("http://", "ws://")
+
+    async def one(i: int, result: ScenarioResult):
+        client_id = f"bench_ws_{uuid.uuid4().hex[:8]}"
+        async with session.ws_connect(f"{ws_url}/ws/chat/{client_id}") as ws:
+            welcome = await ws.receive_json(timeout=30)
+            if welcome.get("type") != "welcome":
+                raise RuntimeError(f"Frame inesperado: {welcome.get('type')}")
+
+            start = time.perf_counter()
+            await ws.send_json({
+                "message": SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)],
+                "platform": "wordpress",
+                "stream": stream,
+            })
+            first_frame = None
+            while True:
+                frame = await ws.receive_json(timeout=120)
+                if first_frame is None:
+                    first_frame = time.perf_counter()
+                if frame.get("type") in ("agent_response", "error", "fallback"):
+                    break
+            end = time.perf_counter()
+            if frame.get("type") != "agent_response":
+                raise RuntimeError(f"Respuesta {frame.get('type')}")
+
+        result.latencies_ms.append((end - start) * 1000)
+        result.first_frame_ms.append((first_frame - start) * 1000)
+    return one
+
+
+def whatsapp_scenario(session: aiohttp.ClientSession, base_url: str, sink: Fake360Dialog):
+    async def one(i: int, result: ScenarioResult):
+        phone = f"3460{random.randint(0, 9999999):07d}"
+        body = {
+            "object": "whatsapp_business_account",
+            "entry": [{
+                "id": "bench",
+                "changes": [{
+                    "field": "messages",
+                    "value": {
+                        "messaging_product": "whatsapp",
+                        "metadata": {"display_phone_number": "34600000000", "phone_number_id": "bench"},
+                        "contacts": [{"profile": {"name": "Benchmark"}, "wa_id": phone}],
+                        "messages": [{
+                            "from": phone,
+                            "id": f"wamid.{uuid.uuid4().hex}",
+                            "timestamp": str(int(time.time())),
+                            "type": "text",
+                            "text": {"body": SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]},
+                        }],
+                    },
+                }],
+            }],
+        }
+        reply = sink.wait_for_reply(phone)
+        start = time.perf_counter()
+        async with session.post(f"{base_url}/api/webhooks/whatsapp", json=body) as response:
+            await response.read()
+            ack = time.perf_counter()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+        # Latencia extremo a extremo: hasta que la respuesta llega al sumidero de 360Dialog
+        replied_at = await asyncio.wait_for(reply, timeout=180)
+        result.first_frame_ms.append((ack - start) * 1000)
+        result.latencies_ms.append((replied_at - start) * 1000)
+    return one
+
+
+# ----------------------------------------------------------------------
+# Orquestación
+# ----------------------------------------------------------------------
+
+def launch_app(port: int, fakes_url: str, database_url: Optional[str], log_path: str) -> subprocess.Popen:
+    """Arranca la aplicación con las URLs de servicios externos apuntando a los fakes"""
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "development",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{fakes_url}/v1",
+        "WOOCOMMERCE_API_URL": f"{fakes_url}/wp-json/wc/v3",
+        "WOOCOMMERCE_CONSUMER_KEY": "ck_benchmark",
+        "WOOCOMMERCE_CONSUMER_SECRET": "cs_benchmark",
+        "WHATSAPP_360DIALOG_API_URL": fakes_url,
+        "WHATSAPP_360DIALOG_API_KEY": "benchmark",
+        "WHATSAPP_PHONE_NUMBER": "34600000000",
+    })
+    if database_url:
+        env["DATABASE_URL"] = database_url
+
+    log_file = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_for_health(session: aiohttp.ClientSession, base_url: str, timeout: float = 180.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/health") as response:
+                if response.status == 200 and (await response.json()).get("status") == "healthy":
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(1)
+    raise TimeoutError("La aplicación no respondió healthy a tiempo")
+
+
+async def sync_catalog(session: aiohttp.ClientSession, base_url: str, expected: int, timeout: float = 1800.0) -> float:
+    """Lanza la sincronización completa y espera a que el catálogo esté cargado"""
+    start = time.perf_counter()
+    async with session.post(f"{base_url}/api/sync/products", json={"force_update": True}) as response:
+        response.raise_for_status()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(2)
+        async with session.get(f"{base_url}/api/sync/status") as response:
+            status = await response.json()
+        if status.get("active_products", 0) >= expected:
+            return time.perf_counter() - start
+    raise TimeoutError("La sincronización no terminó a tiempo")
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n" + "=" * 96)
+    print("📊 RESULTADOS DEL BENCHMARK")
+    print("=" * 96)
+    header = f"{'Escenario':<18}{'Req':>6}{'Err':>5}{'RPS':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'TTFF p50':>10}{'DB tx':>9}{'DB q':>9}"
+    print(header)
+    print("-" * len(header))
+    for s in report["scenarios"]:
+        print(
+            f"{s['scenario']:<18}{s['requests']:>6}{s['errors']:>5}{s['throughput_rps']:>8}"
+            f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s.get('ttff_p50_ms', '-'):>10}"
+            f"{s['db'].get('transactions', '-'):>9}{s['db'].get('queries', '-'):>9}"
+        )
+    memory = report.get("memory", {})
+    if memory.get("available"):
+        print(f"\n💾 Memoria (RSS): inicio {memory['rss_start_mb']} MB | pico {memory['rss_peak_mb']} MB | final {memory['rss_end_mb']} MB")
+    if report.get("sync_seconds") is not None:
+        print(f"🔄 Sincronización completa: {report['sync_seconds']:.1f}s")
+    print(f"🤖 Llamadas OpenAI falsas: {report['fakes']['openai']}")
+    print(f"🛒 Llamadas WooCommerce falsas: {report['fakes']['woocommerce']}")
+
+
+async def main_async(args) -> Dict[str, Any]:
+    products = list(generate_products(args.products, seed=args.seed))
+    categories = generate_categories(products)
+
+    openai_fake = FakeOpenAI(llm_latency_ms=args.llm_latency_ms, embedding_latency_ms=args.embedding_latency_ms)
+    wc_fake = FakeWooCommerce(products, categories, latency_ms=args.wc_latency_ms)
+    whatsapp_fake = Fake360Dialog(latency_ms=args.whatsapp_latency_ms)
+
+    runner = await start_fake_server("127.0.0.1", args.fakes_port, openai_fake, wc_fake, whatsapp_fake)
+    fakes_url = f"http://127.0.0.1:{args.fakes_port}"
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    print(f"🧪 Servicios falsos en {fakes_url} ({len(products)} productos)")
+
+    database_url = args.database_url or os.getenv("DATABASE_URL")
+    app_process = launch_app(args.app_port, fakes_url, database_url, args.app_log)
+    memory = MemorySampler(app_process.pid)
+    db_counters = DatabaseCounters(database_url) if database_url else None
+
+    report: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args),
+        "scenarios": [],
+        "sync_seconds": None,
+    }
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency * 2, 100))
+    try:
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            print("⏳ Esperando a que la aplicación esté lista...")
+            await wait_for_health(session, base_url)
+            memory.start()
+
+            if args.sync:
+                print("🔄 Sincronizando catálogo desde el WooCommerce falso...")
+                report["sync_seconds"] = await sync_catalog(session, base_url, len(products))
+
+            scenarios = {
+                "chat": lambda: chat_scenario(session, base_url, args.users),
+                "ws": lambda: websocket_scenario(session, base_url, stream=False),
+                "ws_stream": lambda: websocket_scenario(session, base_url, stream=True),
+                "whatsapp": lambda: whatsapp_scenario(session, base_url, whatsapp_fake),
+            }
+
+            for name in args.scenarios.split(","):
+                name = name.strip()
+                if name not in scenarios:
+                    print(f"⚠️ Escenario desconocido: {name}")
+                    continue
+                print(f"🚀 Escenario '{name}': {args.requests} peticiones, concurrencia {args.concurrency}")
+                result = await run_load(name, args.requests, args.concurrency, scenarios[name](), db_counters)
+                report["scenarios"].append(result.summary())
+
+            await memory.stop()
+    finally:
+        app_process.send_signal(signal.SIGINT)
+        try:
+            app_process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            app_process.kill()
+        await runner.cleanup()
+
+    report["memory"] = memory.summary()
+    report["fakes"] = {
+        "openai": openai_fake.calls,
+        "woocommerce": wc_fake.calls,
+        "whatsapp_sent": len(whatsapp_fake.sent),
+    }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga con servicios externos falsos")
+    parser.add_argument("--products", type=int, default=1000, help="Productos del catálogo sintético")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", default="chat,ws,ws_stream,whatsapp",
+                        help="Lista separada por comas: chat, ws, ws_stream, whatsapp")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50, help="Usuarios distintos en /api/chat")
+    parser.add_argument("--sync", action="store_true", help="Sincronizar el catálogo antes de la carga")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=40.0)
+    parser.add_argument("--wc-latency-ms", type=float, default=80.0)
+    parser.add_argument("--whatsapp-latency-ms", type=float, default=60.0)
+    parser.add_argument("--app-port", type=int, default=18080)
+    parser.add_argument("--fakes-port", type=int, default=18900)
+    parser.add_argument("--database-url", default=None, help="Por defecto DATABASE_URL del entorno")
+    parser.add_argument("--app-log", default="benchmark_app.log")
+    parser.add_argument("--output", default=None, help="Guardar el informe en JSON")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n📄 Informe guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,9 @@ class Settings(BaseSettings):
     WOOCOMMERCE_CONSUMER_KEY: Optional[str] = "demo_key" if IS_DEVELOPMENT else None
     WOOCOMMERCE_CONSUMER_SECRET: Optional[str] = "demo_secret" if IS_DEVELOPMENT else None
     WOOCOMMERCE_WEBHOOK_SECRET: Optional[str] = None
+    WEBHOOK_DEBOUNCE_SECONDS: float = 5.0  # Espera sin nuevos eventos antes de procesar un producto
+    WEBHOOK_MAX_WAIT_SECONDS: float = 60.0  # Espera máxima aunque sigan llegando eventos del mismo producto
+    WEBHOOK_BATCH_SIZE: int = 50  # Productos procesados por lote
     
     # Configuración de PostgreSQL (reemplaza MongoDB)
     POSTGRES_HOST: str = "localhost"
@@ -62,6 +65,17 @@ class Settings(BaseSettings):
     # Configuración de monitoreo (opcional)
     SENTRY_DSN: Optional[str] = None
     ENABLE_METRICS: bool = False
+    DASHBOARD_SNAPSHOT_INTERVAL: int = 30  # Segundos entre recálculos de las estadísticas del dashboard
+    
+    # Configuración de trazas por etapa (latencia del agente)
+    TRACING_ENABLED: bool = True
+    TRACING_BUFFER_SIZE: int = 5000  # Spans en el buffer circular en memoria
+    TRACING_EXPORT_FILE: Optional[str] = None  # Ruta para exportar trazas OTLP-JSON (una línea por traza)
+    
+    # Umbrales de saturación del probe de readiness (/health/ready responde 503 al superarlos)
+    READINESS_MAX_LOOP_LAG_MS: int = 500  # Retraso máximo del event loop
+    READINESS_MAX_POOL_WAIT_MS: int = 1000  # Espera máxima para obtener conexión de un pool
+    READINESS_MAX_INFLIGHT_TURNS: int = 50  # Turnos del agente en curso a la vez
     
     # Configuración de WhatsApp 360Dialog
     WHATSAPP_360DIALOG_API_KEY: Optional[str] = None
@@ -69,11 +83,22 @@ class Settings(BaseSettings):
     WHATSAPP_PHONE_NUMBER: Optional[str] = None
     WHATSAPP_WEBHOOK_VERIFY_TOKEN: Optional[str] = None
     WHATSAPP_BUSINESS_ACCOUNT_ID: Optional[str] = None
+    WHATSAPP_INBOUND_CONCURRENCY: int = 8  # Conversaciones (números) atendidas en paralelo
+    WHATSAPP_INBOUND_MAX_ATTEMPTS: int = 3  # Intentos por mensaje entrante antes de darlo por fallido
+    WHATSAPP_INBOUND_MAX_AGE_MINUTES: int = 30  # No responder mensajes más antiguos que esto
+    WHATSAPP_SESSION_TIMEOUT_MINUTES: int = 30  # Inactividad tras la que un número empieza conversación nueva
+    WHATSAPP_OUTBOUND_RATE_PER_SECOND: float = 20.0  # Envíos por segundo (la API admite ~80/s por número)
+    WHATSAPP_OUTBOUND_BURST: int = 20  # Ráfaga máxima del cubo de tokens
+    WHATSAPP_OUTBOUND_CONCURRENCY: int = 10  # Envíos simultáneos en campañas
+    WHATSAPP_OUTBOUND_MAX_ATTEMPTS: int = 3  # Intentos por envío si la API aplica límite de ritmo
     
     # Configuración de plantillas de WhatsApp
     WHATSAPP_CART_RECOVERY_TEMPLATE: str = "carrito_recuperacion_descuento"
     WHATSAPP_ORDER_CONFIRMATION_TEMPLATE: str = "order_confirmation"
     WHATSAPP_WELCOME_TEMPLATE: str = "welcome_message"
+    # Las sesiones de WooCommerce no guardan consentimiento para WhatsApp (CartFlows sí)
+    WHATSAPP_CART_RECOVERY_WC_SESSIONS_OPTIN: bool = False
+    WHATSAPP_CART_RECOVERY_INTERVAL_MINUTES: int = 60  # Cada cuánto se lanza la campaña (0 = solo manual)
     
     @field_validator('WOOCOMMERCE_API_URL', mode='before')
     @classmethod
@@ -166,7 +191,79 @@ HYBRID_SEARCH_CONFIG = {
     "semantic_match_weight": 0.3,  # Peso para WooCommerce en búsquedas semánticas
     "wc_results_limit": 20,       # Límite de resultados de WooCommerce
     "stock_boost_factor": 1.2,    # Factor de boost para productos en stock
-    "popularity_boost_factor": 1.1  # Factor de boost por popularidad
+    "popularity_boost_factor": 1.1,  # Factor de boost por popularidad
+    # Proyección "card": los candidatos traen solo un extracto de `content`; el texto
+    # completo se hidrata para los pocos resultados que llegan a un prompt o a la API
+    "content_preview_chars": 300,
+    # Detección de categorías por centroide (media de embeddings de sus productos)
+    "category_centroid_min_similarity": 0.5
+}
+
+# Configuración del índice vectorial HNSW (pgvector)
+VECTOR_INDEX_CONFIG = {
+    "m": 16,                 # Conexiones por nodo del grafo
+    "ef_construction": 64,   # Candidatos durante la construcción
+    # Perfiles de recall/latencia por consulta (hnsw.ef_search)
+    "default_profile": "balanced",
+    "profiles": {
+        "fast": {"ef_search": 40},
+        "balanced": {"ef_search": 100},
+        "exact": {"ef_search": None}  # Sin índice: recorrido secuencial con distancia exacta
+    },
+    # Escaneo iterativo (pgvector >= 0.8): sigue recorriendo el grafo hasta completar
+    # el LIMIT cuando los filtros (is_active, content_type, min_similarity) descartan filas
+    "iterative_scan": "relaxed_order",  # off | relaxed_order | strict_order
+    "max_scan_tuples": 20000,
+    # Índices HNSW parciales por tipo de contenido (nombre -> predicado). Solo tipos
+    # concretos: el planificador únicamente usa el índice si la consulta implica el
+    # predicado, y ninguna búsqueda filtra con "NOT IN" (la de conocimiento usa el general)
+    "partial_indexes": {
+        "product": "content_type = 'product'",
+        "category": "content_type = 'category'"
+    },
+    # Índices parciales de versiones anteriores que ya no se usan (se eliminan al arrancar)
+    "dropped_partial_indexes": ["knowledge"]
+}
+
+# Paginación concurrente de la API de WooCommerce con limitador adaptativo (token bucket)
+WOOCOMMERCE_PAGINATION_CONFIG = {
+    "concurrency": 4,          # Páginas en vuelo a la vez
+    "initial_rate": 4.0,       # Peticiones por segundo al arrancar
+    "min_rate": 0.5,
+    "max_rate": 20.0,
+    "burst": 4,                # Capacidad del cubo de tokens
+    "rate_increase": 0.5,      # Incremento aditivo por respuesta rápida
+    "backoff_factor": 0.5,     # Reducción multiplicativa ante 429/5xx
+    "target_latency": 2.0,     # Segundos; por encima se reduce el ritmo
+    "max_retries": 3           # Reintentos por página
+}
+
+# Vecinos más cercanos precalculados por producto ("productos similares")
+PRODUCT_NEIGHBORS_CONFIG = {
+    "top_k": 20,               # Vecinos guardados por producto
+    "min_similarity": 0.3,     # Similitud coseno mínima para guardar un vecino
+    "batch_size": 512,         # Filas por multiplicación de matrices
+    "refresh_interval": 900    # Segundos entre refrescos incrementales en segundo plano
+}
+
+# Cache de fragmentos renderizados de tarjetas de producto (WordPress/WhatsApp)
+PRODUCT_CARD_CACHE_CONFIG = {
+    "max_entries": 5000        # Fragmentos (producto, plataforma) en memoria, desalojo LRU
+}
+
+# Métricas de runtime (formato Prometheus en /metrics)
+RUNTIME_METRICS_CONFIG = {
+    "lag_interval": 0.5,       # Segundos entre muestras del retraso del event loop
+    "probe_interval": 5,       # Segundos entre sondeos de pools y profundidad de colas
+    "probe_timeout": 5.0,      # Espera máxima del sondeo de un pool (se registra como saturado)
+    "latency_window": 300,     # Segundos de la ventana móvil para percentiles
+    "latency_buckets": (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+}
+
+# Trabajo de CPU (formateo/parseo) fuera del event loop
+CPU_OFFLOAD_CONFIG = {
+    "max_workers": None,       # Hilos del pool; None = min(4, núcleos)
+    "inline_threshold": 20000  # Tamaño estimado (caracteres) por debajo del cual se ejecuta en línea
 }
 
 # Configuración de embeddings
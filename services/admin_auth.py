@@ -3,7 +3,6 @@ Servicio de autenticación para el panel de administración
 """
 
 import os
-import json
 import logging
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
@@ -273,9 +272,9 @@ class AdminAuthService:
                 await conn.execute("""
                     INSERT INTO admin_activity_logs 
                     (admin_id, action, entity_type, entity_id, details, ip_address, user_agent)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    VALUES ($1, $2, $3, $4, $5::jsonb, $6, $7)
                 """, admin_id, action, entity_type, entity_id, 
-                    json.dumps(details) if details else None,
+                    details or None,
                     ip_address, user_agent)
                     
         except Exception as e:
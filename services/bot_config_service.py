@@ -2,12 +2,12 @@
 Servicio para gestionar configuraciones del bot
 """
 
-import json
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
 from services.database import db_service
+from services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -44,12 +44,13 @@ class BotConfigService:
                 return default
                 
             async with pool.acquire() as conn:
+                # Como texto: los valores pueden ser cadenas JSON y el codec JSONB ya las devolvería decodificadas
                 result = await conn.fetchrow("""
-                    SELECT value FROM bot_settings WHERE key = $1
+                    SELECT value::text AS value FROM bot_settings WHERE key = $1
                 """, key)
                 
                 if result:
-                    value = json.loads(result['value'])
+                    value = json_codec.loads(result['value'])
                     self.cache[key] = value
                     return value
                     
@@ -68,20 +69,17 @@ class BotConfigService:
                 return False
                 
             async with pool.acquire() as conn:
-                # Convertir valor a JSON
-                json_value = json.dumps(value)
-                
                 # Upsert la configuración
                 await conn.execute("""
                     INSERT INTO bot_settings (key, value, category, description, updated_by, updated_at)
-                    VALUES ($1, $2, $3, $4, $5, NOW())
+                    VALUES ($1, $2::jsonb, $3, $4, $5, NOW())
                     ON CONFLICT (key) DO UPDATE SET
                         value = EXCLUDED.value,
                         category = EXCLUDED.category,
                         description = COALESCE(EXCLUDED.description, bot_settings.description),
                         updated_by = EXCLUDED.updated_by,
                         updated_at = NOW()
-                """, key, json_value, category, description, admin_id)
+                """, key, value, category, description, admin_id)
                 
                 # Actualizar cache
                 self.cache[key] = value
@@ -102,7 +100,7 @@ class BotConfigService:
                 
             async with pool.acquire() as conn:
                 results = await conn.fetch("""
-                    SELECT key, value, description 
+                    SELECT key, value::text AS value, description 
                     FROM bot_settings 
                     WHERE category = $1
                     ORDER BY key
@@ -111,7 +109,7 @@ class BotConfigService:
                 settings = {}
                 for row in results:
                     settings[row['key']] = {
-                        'value': json.loads(row['value']),
+                        'value': json_codec.loads(row['value']),
                         'description': row['description']
                     }
                     
@@ -130,7 +128,7 @@ class BotConfigService:
                 
             async with pool.acquire() as conn:
                 results = await conn.fetch("""
-                    SELECT key, value, category, description, updated_at
+                    SELECT key, value::text AS value, category, description, updated_at
                     FROM bot_settings
                     ORDER BY category, key
                 """)
@@ -142,7 +140,7 @@ class BotConfigService:
                         settings[category] = {}
                     
                     settings[category][row['key']] = {
-                        'value': json.loads(row['value']),
+                        'value': json_codec.loads(row['value']),
                         'description': row['description'],
                         'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None
                     }
@@ -162,12 +160,12 @@ class BotConfigService:
                 
             async with pool.acquire() as conn:
                 results = await conn.fetch("""
-                    SELECT key, value FROM bot_settings
+                    SELECT key, value::text AS value FROM bot_settings
                 """)
                 
                 self.cache = {}
                 for row in results:
-                    self.cache[row['key']] = json.loads(row['value'])
+                    self.cache[row['key']] = json_codec.loads(row['value'])
                 
                 self.cache_timestamp = datetime.now()
                 logger.info(f"✅ {len(self.cache)} configuraciones cargadas en cache")
@@ -5,11 +5,11 @@ Reemplaza el sistema anterior de MongoDB
 
 import asyncio
 import asyncpg
-import json
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from config.settings import settings
 import logging
+from services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +31,8 @@ class PostgreSQLConversationLogger:
                 settings.DATABASE_URL,
                 min_size=2,
                 max_size=10,
-                command_timeout=60
+                command_timeout=60,
+                init=json_codec.register_json_codecs
             )
             
             await self._create_tables()
@@ -102,7 +103,7 @@ class PostgreSQLConversationLogger:
                     ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
                 """, 
                 session_id, user_id, message_type, content, 
-                json.dumps(metadata or {}), response_time_ms, 
+                metadata or {}, response_time_ms, 
                 strategy, tools_used or [], satisfaction_score
                 )
                 
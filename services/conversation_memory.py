@@ -4,7 +4,6 @@ Extiende el conversation_logger para mantener contexto entre sesiones
 """
 
 import asyncio
-import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import logging
@@ -12,6 +11,7 @@ import logging
 from services.conversation_logger import conversation_logger
 from services.embedding_service import embedding_service
 from config.settings import settings
+from services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -158,7 +158,7 @@ class ConversationMemoryService:
                 """, user_id)
                 
                 if prefs_row:
-                    context["preferences"] = json.loads(prefs_row["preferences"])
+                    context["preferences"] = json_codec.from_db(prefs_row["preferences"], {})
                     context["interaction_count"] = prefs_row["interaction_count"]
                 
                 # Si hay una consulta actual, buscar conversaciones relevantes
@@ -223,7 +223,7 @@ class ConversationMemoryService:
                 """, user_id)
                 
                 if current:
-                    existing_prefs = json.loads(current["preferences"])
+                    existing_prefs = json_codec.from_db(current["preferences"], {})
                     # Mezclar con nuevas preferencias
                     existing_prefs.update(new_preferences)
                     final_prefs = existing_prefs
@@ -237,7 +237,7 @@ class ConversationMemoryService:
                     ON CONFLICT (user_id) DO UPDATE SET
                         preferences = $2,
                         updated_at = NOW()
-                """, user_id, json.dumps(final_prefs))
+                """, user_id, final_prefs)
                 
             return True
             
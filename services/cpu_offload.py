@@ -0,0 +1,111 @@
+"""
+Descarga de trabajo de CPU fuera del event loop
+Formateo y parseo síncronos (limpieza de HTML de productos, decodificación de metadatos
+de resultados, PHP unserialize de carritos, conversión de respuestas a HTML) se ejecutan
+en un pool de hilos propio, separado del executor por defecto que usan las llamadas
+bloqueantes de E/S. Las cargas pequeñas se ejecutan en línea: enviar al pool cuesta más
+que el trabajo en sí. Cada tarea se perfila (en línea o en el pool, espera en cola y
+duración) en runtime_metrics, junto al retraso del event loop, para comparar el p99
+antes y después.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from config.settings import CPU_OFFLOAD_CONFIG
+from services.runtime_metrics import runtime_metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CpuOffloadService:
+    """Pool de hilos para trabajo de CPU con umbral de ejecución en línea"""
+
+    def __init__(self):
+        # Con el GIL más hilos no aceleran el trabajo Python puro; el objetivo es que el
+        # event loop siga recibiendo turnos mientras otro hilo formatea
+        self.max_workers = CPU_OFFLOAD_CONFIG["max_workers"] or min(4, os.cpu_count() or 1)
+        self.inline_threshold = CPU_OFFLOAD_CONFIG["inline_threshold"]
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._profile: Dict[str, Dict[str, Any]] = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="eva-cpu")
+        return self._executor
+
+    async def run(self, name: str, fn: Callable[..., T], *args: Any, size: Optional[int] = None) -> T:
+        """
+        Ejecutar `fn(*args)` fuera del event loop
+        `size` estima la carga (p.ej. caracteres a procesar); por debajo de
+        inline_threshold la función se ejecuta directamente en el loop
+        """
+        if size is not None and size < self.inline_threshold:
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(name, "inline", 0.0, time.perf_counter() - started)
+
+        submitted = time.perf_counter()
+        timings = {}
+
+        def task():
+            timings["started"] = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timings["finished"] = time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), task)
+        finally:
+            if "started" in timings:
+                self._record(name, "thread", timings["started"] - submitted,
+                             timings["finished"] - timings["started"])
+
+    def _record(self, name: str, mode: str, wait: float, duration: float):
+        profile = self._profile.setdefault(name, {
+            "inline": 0, "thread": 0, "total_seconds": 0.0, "max_seconds": 0.0, "wait_seconds": 0.0
+        })
+        profile[mode] += 1
+        profile["total_seconds"] += duration
+        profile["max_seconds"] = max(profile["max_seconds"], duration)
+        profile["wait_seconds"] += wait
+
+        runtime_metrics.observe("eva_offload_run_seconds", duration, task=name, mode=mode)
+        if mode == "thread":
+            runtime_metrics.observe("eva_offload_wait_seconds", wait, task=name)
+
+    def shutdown(self):
+        """Cerrar el pool (al apagar la aplicación)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Perfil por tarea: ejecuciones en línea/en el pool, tiempo total y máximo, espera en cola"""
+        return {
+            "max_workers": self.max_workers,
+            "inline_threshold": self.inline_threshold,
+            "tasks": {
+                name: {
+                    **profile,
+                    "total_seconds": round(profile["total_seconds"], 4),
+                    "max_seconds": round(profile["max_seconds"], 4),
+                    "wait_seconds": round(profile["wait_seconds"], 4)
+                }
+                for name, profile in self._profile.items()
+            }
+        }
+
+
+# Instancia global
+cpu_offload = CpuOffloadService()
@@ -0,0 +1,335 @@
+"""
+Snapshot de estadísticas del dashboard
+Las estadísticas de la base de conocimiento, la sincronización, los webhooks y las
+métricas de conversación se calculan en paralelo y se publican como un snapshot
+inmutable con una vida de DASHBOARD_SNAPSHOT_INTERVAL segundos. Solo se recalculan
+al leerlas (páginas, endpoints) o mientras hay paneles conectados por SSE, y el
+snapshot se comparte entre workers en la tabla dashboard_snapshot: un único proceso
+lo recalcula (pg_try_advisory_xact_lock) y los demás adoptan el resultado. Así tener
+el dashboard abierto no genera agregados sobre la base de datos del chat, y nadie
+mirándolo no genera ninguno.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, replace
+from datetime import date, datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Dict, Mapping, Optional
+
+from config.settings import settings
+from services import json_codec
+from services.database import db_service
+from services.webhook_handler import webhook_handler
+from services.woocommerce_sync import wc_sync_service
+
+logger = logging.getLogger(__name__)
+
+
+def _to_json_ready(obj: Any) -> Any:
+    """Fechas y decimales a tipos serializables, recursivamente"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, dict):
+        return {k: _to_json_ready(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_json_ready(item) for item in obj]
+    return obj
+
+
+def _freeze(obj: Any) -> Any:
+    """Vista de solo lectura de un dict/lista anidados"""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(item) for item in obj)
+    return obj
+
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    """Estadísticas del dashboard en un instante; nunca se modifica tras publicarse"""
+    version: int
+    generated_at: str
+    duration_ms: int
+    data: Mapping[str, Any]  # database, sync, webhooks, metrics (solo lectura)
+    json: str  # Serialización lista para servir o emitir por SSE
+
+    def section(self, name: str) -> Dict[str, Any]:
+        """Copia mutable de una sección (para plantillas y respuestas)"""
+        return _thaw(self.data.get(name, {}))
+
+
+def _thaw(obj: Any) -> Any:
+    if isinstance(obj, Mapping):
+        return {k: _thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [_thaw(item) for item in obj]
+    return obj
+
+
+class DashboardSnapshotService:
+    """Cálculo bajo demanda y publicación del snapshot del dashboard, compartido entre workers"""
+
+    def __init__(self, interval: Optional[int] = None):
+        self.interval = interval or settings.DASHBOARD_SNAPSHOT_INTERVAL
+        self.keepalive_seconds = 15  # Comentario SSE para que los proxies no corten el stream
+        self.lock_name = "dashboard_snapshot"  # Clave del advisory lock del recálculo
+
+        self.initialized = False
+        self._metrics_service = None
+        self._snapshot: Optional[DashboardSnapshot] = None
+        self._refresh_lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
+        self._subscribers = 0
+
+    async def initialize(self):
+        """Crear la tabla del snapshot compartido"""
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS dashboard_snapshot (
+                        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                        version INTEGER NOT NULL,
+                        generated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                        duration_ms INTEGER NOT NULL,
+                        json TEXT NOT NULL
+                    );
+                """)
+
+            self.initialized = True
+            logger.info("✅ Snapshot del dashboard compartido entre workers")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando el snapshot del dashboard: {e}")
+            self.initialized = False
+
+    def set_metrics_service(self, metrics_service):
+        """Servicio de métricas creado en el arranque de la aplicación"""
+        self._metrics_service = metrics_service
+
+    async def refresh(self) -> DashboardSnapshot:
+        """Recalcular todas las estadísticas en paralelo y publicar un snapshot nuevo"""
+        async with self._refresh_lock:
+            snapshot = await self._build()
+            if self.initialized:
+                try:
+                    async with db_service.pool.acquire() as conn:
+                        snapshot = await self._store(conn, snapshot)
+                except Exception as e:
+                    logger.error(f"❌ Error guardando el snapshot del dashboard: {e}")
+            return self._publish(snapshot)
+
+    async def _build(self) -> DashboardSnapshot:
+        """Calcular el snapshot (con _refresh_lock adquirido); no lo publica"""
+        started = time.monotonic()
+
+        async def metrics_stats():
+            if not self._metrics_service:
+                return {}
+            return await self._metrics_service.get_dashboard_stats()
+
+        db_stats, last_sync, webhook_stats, metrics = await asyncio.gather(
+            db_service.get_statistics(),
+            db_service.get_last_sync_time(),
+            webhook_handler.get_webhook_stats(),
+            metrics_stats(),
+            return_exceptions=True
+        )
+
+        for name, result in (("database", db_stats), ("last_sync", last_sync),
+                             ("webhooks", webhook_stats), ("metrics", metrics)):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Error calculando '{name}' para el dashboard: {result}")
+
+        # La sincronización se deriva de las mismas estadísticas: sin segunda consulta
+        if isinstance(db_stats, Exception):
+            sync_status = {"error": str(db_stats)}
+        else:
+            sync_status = wc_sync_service.build_sync_status(
+                db_stats or {}, None if isinstance(last_sync, Exception) else last_sync
+            )
+
+        data = _to_json_ready({
+            "database": {} if isinstance(db_stats, Exception) else (db_stats or {}),
+            "sync": sync_status,
+            "webhooks": {"error": str(webhook_stats)} if isinstance(webhook_stats, Exception) else webhook_stats,
+            "metrics": {} if isinstance(metrics, Exception) else (metrics or {})
+        })
+
+        previous = self._snapshot
+        generated_at = datetime.now().isoformat()
+        return DashboardSnapshot(
+            version=(previous.version + 1) if previous else 1,
+            generated_at=generated_at,
+            duration_ms=int((time.monotonic() - started) * 1000),
+            data=_freeze(data),
+            json=json_codec.dumps({**data, "timestamp": generated_at, "snapshot_at": generated_at})
+        )
+
+    def _publish(self, snapshot: DashboardSnapshot) -> DashboardSnapshot:
+        """Publicar un snapshot en este proceso y despertar a los streams SSE"""
+        current = self._snapshot
+        if current is not None and (
+            snapshot is current
+            or datetime.fromisoformat(snapshot.generated_at) < datetime.fromisoformat(current.generated_at)
+        ):
+            return current
+
+        self._snapshot = snapshot
+
+        # Despertar a los streams SSE con un evento nuevo para la siguiente espera
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+        return snapshot
+
+    async def _store(self, conn, snapshot: DashboardSnapshot) -> DashboardSnapshot:
+        """Guardar el snapshot como el compartido; la versión la asigna la base de datos"""
+        version = await conn.fetchval("""
+            INSERT INTO dashboard_snapshot (id, version, generated_at, duration_ms, json)
+            VALUES (1, 1, $1, $2, $3)
+            ON CONFLICT (id) DO UPDATE
+            SET version = dashboard_snapshot.version + 1,
+                generated_at = EXCLUDED.generated_at,
+                duration_ms = EXCLUDED.duration_ms,
+                json = EXCLUDED.json
+            RETURNING version
+        """, datetime.fromisoformat(snapshot.generated_at).astimezone(), snapshot.duration_ms, snapshot.json)
+        return replace(snapshot, version=version)
+
+    def _from_row(self, row) -> DashboardSnapshot:
+        """Snapshot publicado por otro worker"""
+        payload = json_codec.loads(row["json"])
+        data = {key: value for key, value in payload.items() if key not in ("timestamp", "snapshot_at")}
+        return DashboardSnapshot(
+            version=row["version"],
+            generated_at=payload.get("snapshot_at") or row["generated_at"].isoformat(),
+            duration_ms=row["duration_ms"],
+            data=_freeze(data),
+            json=row["json"]
+        )
+
+    def _is_fresh(self, snapshot: Optional[DashboardSnapshot]) -> bool:
+        if snapshot is None:
+            return False
+        age = (datetime.now() - datetime.fromisoformat(snapshot.generated_at)).total_seconds()
+        return age <= self.interval
+
+    async def get_snapshot(self) -> DashboardSnapshot:
+        """
+        Snapshot vigente; si el de este proceso caducó se adopta el compartido o,
+        si también caducó, lo recalcula un único worker
+        """
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        return await self._refresh_once()
+
+    async def _refresh_once(self) -> DashboardSnapshot:
+        """Refrescar evitando que peticiones concurrentes o varios workers repitan el cálculo"""
+        async with self._refresh_lock:
+            if self._is_fresh(self._snapshot):
+                return self._snapshot
+
+            if not self.initialized:
+                return self._publish(await self._build())
+
+            try:
+                return await self._refresh_shared()
+            except Exception as e:
+                logger.error(f"❌ Error con el snapshot compartido del dashboard: {e}")
+                return self._publish(await self._build())
+
+    async def _refresh_shared(self) -> DashboardSnapshot:
+        """Adoptar el snapshot compartido o recalcularlo con el advisory lock (con _refresh_lock)"""
+        async with db_service.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow("SELECT * FROM dashboard_snapshot WHERE id = 1")
+                shared = self._from_row(row) if row else None
+                if self._is_fresh(shared):
+                    return self._publish(shared)
+
+                locked = await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext($1))", self.lock_name)
+                if locked:
+                    snapshot = await self._build()
+                    return self._publish(await self._store(conn, snapshot))
+
+        # Otro worker lo está recalculando: servir el último conocido mientras tanto
+        if self._snapshot is not None or shared is not None:
+            return self._publish(shared) if shared else self._snapshot
+        return self._publish(await self._build())
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Eventos SSE: el snapshot actual y cada uno nuevo; comentarios de keepalive entre medias"""
+        self._subscribers += 1
+        try:
+            snapshot = await self.get_snapshot()
+            yield f"event: snapshot\nid: {snapshot.version}\ndata: {snapshot.json}\n\n"
+
+            while True:
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                snapshot = self._snapshot
+                yield f"event: snapshot\nid: {snapshot.version}\ndata: {snapshot.json}\n\n"
+        finally:
+            self._subscribers -= 1
+
+    def start_worker(self):
+        """Arrancar el refresco periódico para los paneles conectados por SSE"""
+        if self._running:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop_worker(self):
+        """Detener el refresco periódico"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+    async def _worker_loop(self):
+        # Sin suscriptores SSE no se calcula nada: las lecturas refrescan bajo demanda
+        while self._running:
+            await asyncio.sleep(self.interval)
+            if not self._subscribers:
+                continue
+            try:
+                snapshot = await self.get_snapshot()
+                logger.debug(f"📊 Snapshot del dashboard v{snapshot.version} ({snapshot.duration_ms} ms)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error calculando el snapshot del dashboard: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado del snapshot publicado"""
+        snapshot = self._snapshot
+        return {
+            "running": self._running,
+            "interval": self.interval,
+            "version": snapshot.version if snapshot else 0,
+            "generated_at": snapshot.generated_at if snapshot else None,
+            "duration_ms": snapshot.duration_ms if snapshot else None,
+            "subscribers": self._subscribers
+        }
+
+
+# Instancia global
+dashboard_snapshot_service = DashboardSnapshotService()
@@ -5,15 +5,52 @@ Maneja la base de conocimiento con vectores y búsqueda de texto completo
 
 import asyncio
 import asyncpg
-import json
 import numpy as np
-from typing import Dict, List, Optional, Any, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
 from datetime import datetime
-from config.settings import settings, HYBRID_SEARCH_CONFIG
+from config.settings import settings, HYBRID_SEARCH_CONFIG, VECTOR_INDEX_CONFIG
+from services.tracing_service import tracer
+from services.search_filters import ProductSearchFilters
+from services.cpu_offload import cpu_offload
+from services import json_codec
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _rows_to_dicts(rows) -> List[Dict[str, Any]]:
+    """Convertir filas de asyncpg a dicts decodificando el JSON de `metadata`"""
+    results = []
+    for row in rows:
+        result = dict(row)
+        if result.get('metadata') and isinstance(result['metadata'], str):
+            result['metadata'] = json_codec.loads(result['metadata'])
+        results.append(result)
+    return results
+
+
+def _card_columns(alias: str = "") -> str:
+    """
+    Columnas de la proyección "card" de un resultado de búsqueda
+    Lo que usan el ranking y las tarjetas (título, tipo y metadatos con SKU y permalink;
+    precio y stock se unen después) más un extracto de `content` para los filtros por
+    palabra. El texto completo se pide con hydrate_content solo para los resultados finales
+    """
+    p = f"{alias}." if alias else ""
+    chars = HYBRID_SEARCH_CONFIG["content_preview_chars"]
+    return f"{p}id, {p}title, LEFT({p}content, {chars}) AS content, {p}content_type, {p}metadata, {p}external_id"
+
+
+def _decode_vectors(values: List[bytes]) -> np.ndarray:
+    """
+    Vectores de pgvector en formato binario (vector_send) a una matriz float32
+    Cada valor es: dimensión (int16), reservado (int16) y los componentes en float32 big-endian
+    """
+    dim = int.from_bytes(values[0][:2], "big")
+    data = np.frombuffer(b"".join(value[4:] for value in values), dtype=">f4")
+    return data.reshape(len(values), dim).astype(np.float32)
+
+
 class HybridDatabaseService:
     """Servicio de base de datos para búsqueda híbrida semántica + texto"""
     
@@ -22,6 +59,8 @@ class HybridDatabaseService:
         self.initialized = False
         self._search_cache = {}  # Cache para búsquedas frecuentes
         self._cache_max_size = 500  # Máximo de búsquedas en cache
+        self.pgvector_version = None
+        self.supports_iterative_scan = False  # hnsw.iterative_scan (pgvector >= 0.8)
     
     async def initialize(self):
         """Inicializar el pool de conexiones y crear esquema"""
@@ -32,7 +71,8 @@ class HybridDatabaseService:
                 max_size=10,
                 command_timeout=60,
                 max_cached_statement_lifetime=0,  # Desactiva cache de statements
-                statement_cache_size=0  # Sin cache para evitar conflictos
+                statement_cache_size=0,  # Sin cache para evitar conflictos
+                init=json_codec.register_json_codecs  # JSON/JSONB llegan como dicts
             )
             
             await self._create_schema()
@@ -69,12 +109,32 @@ class HybridDatabaseService:
             """)
             
             # Índices para búsqueda vectorial (HNSW para alta performance)
-            await conn.execute("""
+            hnsw_params = f"m = {VECTOR_INDEX_CONFIG['m']}, ef_construction = {VECTOR_INDEX_CONFIG['ef_construction']}"
+            await conn.execute(f"""
                 CREATE INDEX IF NOT EXISTS idx_knowledge_embedding_hnsw 
                 ON knowledge_base USING hnsw (embedding vector_cosine_ops)
-                WITH (m = 16, ef_construction = 64);
+                WITH ({hnsw_params});
             """)
             
+            # Índices HNSW parciales por tipo de contenido: una búsqueda filtrada por
+            # content_type recorre un grafo que solo contiene filas que cumplen el filtro
+            for index_name, predicate in VECTOR_INDEX_CONFIG["partial_indexes"].items():
+                await conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_knowledge_embedding_hnsw_{index_name}
+                    ON knowledge_base USING hnsw (embedding vector_cosine_ops)
+                    WITH ({hnsw_params})
+                    WHERE is_active = true AND {predicate};
+                """)
+            for index_name in VECTOR_INDEX_CONFIG.get("dropped_partial_indexes", []):
+                await conn.execute(f"DROP INDEX IF EXISTS idx_knowledge_embedding_hnsw_{index_name};")
+            
+            # Detectar capacidades de pgvector
+            self.pgvector_version = await conn.fetchval(
+                "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+            )
+            self.supports_iterative_scan = self._version_at_least(self.pgvector_version, (0, 8, 0))
+            logger.info(f"✅ pgvector {self.pgvector_version} (escaneo iterativo: {'sí' if self.supports_iterative_scan else 'no'})")
+            
             # Índices para búsqueda de texto completo (GIN)
             await conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_knowledge_search_vector 
@@ -97,6 +157,131 @@ class HybridDatabaseService:
                 ON knowledge_base(is_active) WHERE is_active = true;
             """)
             
+            # Chunks de documentos de conocimiento agrupados por documento de origen
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_knowledge_original_doc
+                ON knowledge_base ((metadata->>'original_doc_id'));
+            """)
+            
+            # Estado comercial en caliente (precio/stock) fuera de knowledge_base: los cambios
+            # de inventario reescriben esta fila estrecha y no la fila ancha con embedding,
+            # así no generan tuplas muertas en los índices HNSW y GIN
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS product_live_state (
+                    external_id VARCHAR(255) PRIMARY KEY,
+                    price DOUBLE PRECISION DEFAULT 0,
+                    regular_price DOUBLE PRECISION DEFAULT 0,
+                    sale_price DOUBLE PRECISION DEFAULT 0,
+                    stock_status VARCHAR(20),
+                    stock_qty INTEGER DEFAULT 0,
+                    commercial_hash VARCHAR(64),
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                ) WITH (fillfactor = 80);
+            """)
+            
+            # Filtros de precio en búsqueda (el stock no se indexa para no impedir
+            # las actualizaciones HOT de stock_status/stock_qty)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_product_live_state_price
+                ON product_live_state(price);
+            """)
+            
+            # Poblar desde los metadatos de productos ya sincronizados (solo filas ausentes)
+            try:
+                await conn.execute("""
+                    INSERT INTO product_live_state
+                        (external_id, price, regular_price, sale_price, stock_status, stock_qty)
+                    SELECT external_id,
+                           COALESCE((metadata->>'price')::float8, 0),
+                           COALESCE((metadata->>'regular_price')::float8, 0),
+                           COALESCE((metadata->>'sale_price')::float8, 0),
+                           metadata->>'stock_status',
+                           COALESCE((metadata->>'stock_quantity')::float8::int, 0)
+                    FROM knowledge_base
+                    WHERE content_type = 'product'
+                    AND external_id IS NOT NULL
+                    AND metadata ? 'price'
+                    ON CONFLICT (external_id) DO NOTHING;
+                """)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo poblar product_live_state desde knowledge_base: {e}")
+            
+            # Facetas normalizadas por producto (marca, tipo, amperaje, polos...) extraídas
+            # en la sincronización para refinar búsquedas con un solo GROUP BY
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS product_facets (
+                    external_id VARCHAR(255) NOT NULL,
+                    facet VARCHAR(50) NOT NULL,
+                    value VARCHAR(100) NOT NULL,
+                    PRIMARY KEY (external_id, facet, value)
+                );
+            """)
+            
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_product_facets_facet_value
+                ON product_facets(facet, value);
+            """)
+            
+            # Pertenencia producto -> categoría (IDs de WooCommerce) mantenida en la sincronización
+            # y centroide de embeddings por categoría, para navegar categorías sin embeddings
+            # ni búsquedas híbridas adicionales
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS category_products (
+                    category_id INTEGER NOT NULL,
+                    external_id VARCHAR(255) NOT NULL,
+                    PRIMARY KEY (category_id, external_id)
+                );
+            """)
+            
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_category_products_external_id
+                ON category_products(external_id);
+            """)
+            
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS category_centroids (
+                    category_id INTEGER PRIMARY KEY,
+                    centroid vector(1536),
+                    product_count INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            
+            # Vecinos más cercanos precalculados por producto (listas compactas top-K);
+            # source_hash es el text_hash del producto cuando se calcularon
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS product_neighbors (
+                    external_id VARCHAR(255) PRIMARY KEY,
+                    neighbor_ids TEXT[] NOT NULL,
+                    scores REAL[] NOT NULL,
+                    source_hash VARCHAR(64),
+                    computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            
+            # Primera vez: poblar la pertenencia por nombre de categoría desde los metadatos
+            # (las sincronizaciones posteriores la mantienen con los IDs de WooCommerce)
+            try:
+                populated = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM category_products)")
+                if not populated:
+                    await conn.execute("""
+                        INSERT INTO category_products (category_id, external_id)
+                        SELECT DISTINCT (c.metadata->>'wc_id')::int, p.external_id
+                        FROM knowledge_base p
+                        CROSS JOIN LATERAL jsonb_array_elements_text(p.metadata->'categories') AS cat(name)
+                        JOIN knowledge_base c
+                          ON c.content_type = 'category'
+                         AND c.title = 'Categoría: ' || cat.name
+                         AND c.metadata ? 'wc_id'
+                        WHERE p.content_type = 'product'
+                        AND p.external_id IS NOT NULL
+                        AND jsonb_typeof(p.metadata->'categories') = 'array'
+                        ON CONFLICT DO NOTHING;
+                    """)
+                    await self.refresh_category_centroids(conn=conn)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo poblar category_products desde knowledge_base: {e}")
+            
             # NO USAMOS TRIGGERS - Actualización manual del search_vector
             
             logger.info("✅ Esquema de base de datos creado exitosamente")
@@ -130,7 +315,7 @@ class HybridDatabaseService:
                 ) VALUES ($1, $2, $3, $4, $5, $6, to_tsvector('spanish', $2 || ' ' || $3))
                 RETURNING id
             """, content_type, title, content, embedding_str, external_id, 
-                json.dumps(metadata or {}))
+                metadata or {})
             
             return row['id']
     
@@ -167,7 +352,7 @@ class HybridDatabaseService:
         
         if metadata is not None:
             updates.append(f"metadata = ${param_count}")
-            values.append(json.dumps(metadata))
+            values.append(metadata)
             param_count += 1
         
         if not updates:
@@ -195,22 +380,29 @@ class HybridDatabaseService:
         content_types: List[str] = None,
         limit: int = None,
         wc_service = None,
-        search_analysis: Dict[str, Any] = None
+        search_analysis: Dict[str, Any] = None,
+        profile: str = None,
+        filters: Optional[ProductSearchFilters] = None
     ) -> List[Dict[str, Any]]:
         """
         Búsqueda inteligente que combina WooCommerce y búsqueda híbrida
         Prioriza WooCommerce para búsquedas exactas y usa híbrida para semánticas
+        `profile` selecciona el perfil HNSW (fast, balanced, exact) de VECTOR_INDEX_CONFIG
+        `filters` restringe todas las fuentes a los productos que cumplen los filtros exactos
         """
         if not self.initialized:
             raise Exception("Base de datos no inicializada")
         
         limit = limit or HYBRID_SEARCH_CONFIG["final_limit"]
+        if filters is not None and filters.is_empty():
+            filters = None
         
         # Verificar cache para búsquedas idénticas
-        cache_key = f"{query_text.lower().strip()}_{limit}"
+        cache_key = f"{query_text.lower().strip()}_{limit}_{profile or ''}_{filters.cache_key() if filters else ''}"
         if cache_key in self._search_cache:
             logger.info(f"🔍 Usando resultado en cache para: '{query_text}'")
-            return self._search_cache[cache_key]
+            # El precio/stock no se cachea: se vuelve a unir el estado vigente
+            return await self._merge_live_state(self._search_cache[cache_key])
         
         logger.info(f"🔍 Búsqueda inteligente para: '{query_text}'")
         
@@ -254,11 +446,16 @@ class HybridDatabaseService:
                 if external_id and external_id not in all_results:
                     all_results[external_id] = result
         
+        # SKU exacto y WooCommerce no pasan por SQL: quedarse solo con los que cumplen los filtros
+        if filters and all_results:
+            matching_ids = await self.filter_external_ids(list(all_results.keys()), filters)
+            all_results = {eid: r for eid, r in all_results.items() if eid in matching_ids}
+        
         # PASO 2: Búsqueda híbrida en knowledge base (complementaria)
         remaining_limit = max(1, limit - len(all_results))
         if remaining_limit > 0:
             hybrid_results = await self._hybrid_knowledge_search(
-                query_text, query_embedding, content_types, remaining_limit * 2
+                query_text, query_embedding, content_types, remaining_limit * 2, profile, filters
             )
             
             # Agregar resultados híbridos si no están ya incluidos
@@ -294,9 +491,35 @@ class HybridDatabaseService:
         query_text: str,
         query_embedding: List[float],
         content_types: List[str] = None,
-        limit: int = None
+        limit: int = None,
+        profile: str = None,
+        filters: Optional[ProductSearchFilters] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda híbrida tradicional (mantenida para compatibilidad)
+        `profile` selecciona el perfil HNSW (fast, balanced, exact) de VECTOR_INDEX_CONFIG
+        `filters` (ProductSearchFilters) se compila a predicados SQL que se aplican en cada
+        paso antes de ordenar, no sobre los candidatos ya recuperados
+        Los resultados usan la proyección card (extracto de `content`); ver hydrate_content
+        """
+        # Span de la búsqueda completa: los pasos (marca, términos, RRF) cuelgan de él
+        with tracer.span("sql.hybrid_search", profile=profile or "default") as span:
+            results = await self._hybrid_search(
+                query_text, query_embedding, content_types, limit, profile, filters
+            )
+            span.set_attribute("results", len(results))
+            return results
+
+    async def _hybrid_search(
+        self,
+        query_text: str,
+        query_embedding: List[float],
+        content_types: List[str] = None,
+        limit: int = None,
+        profile: str = None,
+        filters: Optional[ProductSearchFilters] = None
     ) -> List[Dict[str, Any]]:
-        """Búsqueda híbrida tradicional (mantenida para compatibilidad)"""
+        """Implementación de hybrid_search dentro de su span"""
         if not self.initialized:
             raise Exception("Base de datos no inicializada")
         
@@ -314,6 +537,10 @@ class HybridDatabaseService:
         
         # Log para debugging
         logger.info(f"🔍 Búsqueda: '{query_text}' - Términos técnicos: {technical_terms}, Marcas: {brand_terms}")
+        if filters is not None and filters.is_empty():
+            filters = None
+        if filters:
+            logger.info(f"   🧩 Filtros: {filters.cache_key()}")
         
         async with self.pool.acquire() as conn:
             all_results = {}
@@ -327,10 +554,13 @@ class HybridDatabaseService:
                     type_filter = ""
                     if content_types:
                         type_filter = f"AND content_type = ANY(ARRAY{content_types}::text[])"
+                    brand_params = [brand]
+                    if filters:
+                        type_filter += " " + filters.to_sql(brand_params)
                     
                     # Búsqueda de productos con la marca en el título
                     brand_query = f"""
-                        SELECT id, title, content, content_type, metadata, external_id
+                        SELECT {_card_columns()}
                         FROM knowledge_base 
                         WHERE is_active = true 
                         AND LOWER(title) LIKE '%' || LOWER($1) || '%'
@@ -345,14 +575,12 @@ class HybridDatabaseService:
                         LIMIT 50
                     """
                     
-                    rows = await conn.fetch(brand_query, brand)
+                    with tracer.span("sql.hybrid_search.brand", brand=brand) as span:
+                        rows = await conn.fetch(brand_query, *brand_params)
+                        span.set_attribute("rows", len(rows))
                     logger.info(f"   ✅ Encontrados {len(rows)} productos de marca '{brand}'")
                     
-                    for row in rows:
-                        result = dict(row)
-                        if result['metadata']:
-                            result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                        
+                    for result in await self._decode_rows(rows):
                         # Score alto para marcas, mayor si coincide con el resto de la consulta
                         base_score = 800.0
                         # Verificar si el producto también coincide con otros términos de la consulta
@@ -381,10 +609,13 @@ class HybridDatabaseService:
                     type_filter = ""
                     if content_types:
                         type_filter = f"AND content_type = ANY(ARRAY{content_types}::text[])"
+                    term_params = [term]
+                    if filters:
+                        type_filter += " " + filters.to_sql(term_params)
                     
                     # Búsqueda DIRECTA de productos con el término en el título
                     exact_title_query = f"""
-                        SELECT id, title, content, content_type, metadata, external_id
+                        SELECT {_card_columns()}
                         FROM knowledge_base 
                         WHERE is_active = true 
                         AND (UPPER(unaccent(title)) LIKE '%' || UPPER(unaccent($1)) || '%'
@@ -394,14 +625,12 @@ class HybridDatabaseService:
                         LIMIT 30
                     """
                     
-                    rows = await conn.fetch(exact_title_query, term)
+                    with tracer.span("sql.hybrid_search.technical_term", term=term) as span:
+                        rows = await conn.fetch(exact_title_query, *term_params)
+                        span.set_attribute("rows", len(rows))
                     logger.info(f"   ✅ Encontrados {len(rows)} productos con '{term}' en título")
                     
-                    for row in rows:
-                        result = dict(row)
-                        if result['metadata']:
-                            result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                        
+                    for result in await self._decode_rows(rows):
                         # Calcular score basado en relevancia real
                         title_lower = result['title'].lower()
                         query_lower = query_text.lower()
@@ -459,12 +688,10 @@ class HybridDatabaseService:
                     logger.info(f"   🔧 Usando términos técnicos para búsqueda: '{search_text}'")
                 
                 # Construir filtros
-                type_filter = ""
                 params = [str(query_embedding), search_text, max_results]
-                
-                if content_types:
-                    type_filter = f"AND content_type = ANY(${len(params) + 1})"
-                    params.append(content_types)
+                type_filter = self._content_type_filter(content_types, params)
+                if filters:
+                    type_filter += " " + filters.to_sql(params)
                 
                 # Excluir IDs ya encontrados
                 if all_results:
@@ -474,7 +701,7 @@ class HybridDatabaseService:
                 # Búsqueda híbrida NORMAL (vector + texto)
                 query = f"""
                 WITH vector_search AS (
-                    SELECT id, title, content, content_type, metadata, external_id,
+                    SELECT {_card_columns()},
                            (1 - (embedding <=> $1)) as vector_similarity,
                            ROW_NUMBER() OVER (ORDER BY embedding <=> $1) as vector_rank
                     FROM knowledge_base 
@@ -485,7 +712,7 @@ class HybridDatabaseService:
                     LIMIT $3
                 ),
                 text_search AS (
-                    SELECT id, title, content, content_type, metadata, external_id,
+                    SELECT {_card_columns()},
                            ts_rank_cd(search_vector, plainto_tsquery('spanish', $2)) as text_score,
                            ROW_NUMBER() OVER (ORDER BY ts_rank_cd(search_vector, plainto_tsquery('spanish', $2)) DESC) as text_rank
                     FROM knowledge_base 
@@ -520,15 +747,14 @@ class HybridDatabaseService:
                 LIMIT {max_results}
             """
             
-                rows = await conn.fetch(query, *params)
+                with tracer.span("sql.hybrid_search.rrf", excluded=len(all_results)) as span:
+                    async with conn.transaction():
+                        applied_profile = await self.apply_vector_search_profile(conn, profile, max_results)
+                        rows = await conn.fetch(query, *params)
+                    span.set_attributes(rows=len(rows), profile=applied_profile)
                 
                 # Agregar resultados de búsqueda híbrida a los resultados existentes
-                for row in rows:
-                    result = dict(row)
-                    # Parsear metadata JSON
-                    if result['metadata']:
-                        result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                    
+                for result in await self._decode_rows(rows):
                     # Convertir scores a float (score bajo para búsqueda normal)
                     result['rrf_score'] = float(result.get('rrf_score', 0))
                     result['match_type'] = 'hybrid'
@@ -553,31 +779,31 @@ class HybridDatabaseService:
                     for i, r in enumerate(final_results[:3]):
                         logger.info(f"     {i+1}. {r.get('title', 'Sin título')} (Score: {r.get('rrf_score', 0):.1f}, Tipo: {r.get('match_type', 'unknown')})")
             
-            return final_results[:limit]
+            return await self._merge_live_state(final_results[:limit], conn)
     
     async def vector_search(
         self,
         query_embedding: List[float],
         content_types: List[str] = None,
         limit: int = 10,
-        min_similarity: float = None
+        min_similarity: float = None,
+        profile: str = None
     ) -> List[Dict[str, Any]]:
-        """Búsqueda puramente vectorial"""
+        """
+        Búsqueda puramente vectorial
+        `profile` selecciona el perfil HNSW (fast, balanced, exact) de VECTOR_INDEX_CONFIG
+        """
         if not self.initialized:
             raise Exception("Base de datos no inicializada")
         
         min_sim = min_similarity or HYBRID_SEARCH_CONFIG["min_similarity"]
         
         async with self.pool.acquire() as conn:
-            type_filter = ""
             params = [str(query_embedding), limit]
-            
-            if content_types:
-                type_filter = f"AND content_type = ANY(${len(params) + 1})"
-                params.append(content_types)
+            type_filter = self._content_type_filter(content_types, params)
             
             query = f"""
-                SELECT id, title, content, content_type, metadata, external_id,
+                SELECT {_card_columns()},
                        (1 - (embedding <=> $1)) as similarity
                 FROM knowledge_base 
                 WHERE is_active = true 
@@ -587,16 +813,18 @@ class HybridDatabaseService:
                 LIMIT $2
             """
             
-            rows = await conn.fetch(query, *params)
+            with tracer.span("sql.vector_search") as span:
+                async with conn.transaction():
+                    applied_profile = await self.apply_vector_search_profile(conn, profile, limit)
+                    rows = await conn.fetch(query, *params)
+                span.set_attributes(rows=len(rows), profile=applied_profile)
             
-            results = []
-            for row in rows:
-                result = dict(row)
-                if result['metadata']:
-                    result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                results.append(result)
+            results = await self._decode_rows(rows)
             
-            return results
+            # El escaneo iterativo relaxed_order puede devolver filas ligeramente desordenadas
+            results.sort(key=lambda r: float(r['similarity']), reverse=True)
+            
+            return await self._merge_live_state(results, conn)
     
     async def text_search(
         self,
@@ -665,7 +893,7 @@ class HybridDatabaseService:
             score_calc = " + ".join(score_parts)
             
             query = f"""
-                SELECT id, title, content, content_type, metadata, external_id,
+                SELECT {_card_columns()},
                        ({score_calc}) as score
                 FROM knowledge_base 
                 WHERE is_active = true 
@@ -677,16 +905,13 @@ class HybridDatabaseService:
             
             params.append(limit)
             
-            rows = await conn.fetch(query, *params)
+            with tracer.span("sql.text_search") as span:
+                rows = await conn.fetch(query, *params)
+                span.set_attribute("rows", len(rows))
             
-            results = []
-            for row in rows:
-                result = dict(row)
-                if result['metadata']:
-                    result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                results.append(result)
+            results = await self._decode_rows(rows)
             
-            return results
+            return await self._merge_live_state(results, conn)
     
     async def refined_product_search(
         self,
@@ -716,7 +941,8 @@ class HybridDatabaseService:
             if row:
                 result = dict(row)
                 if result['metadata']:
-                    result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
+                    result['metadata'] = json_codec.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
+                await self._merge_live_state([result], conn)
                 return result
             
             return None
@@ -797,11 +1023,637 @@ class HybridDatabaseService:
             if row:
                 result = dict(row)
                 if result['metadata']:
-                    result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
+                    result['metadata'] = json_codec.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
+                await self._merge_live_state([result], conn)
                 return result
             
             return None
-    
+
+    async def find_similar_by_external_id(
+        self,
+        external_id: str,
+        limit: int = 5,
+        content_types: List[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda vectorial en vivo de elementos similares a uno existente
+        El embedding se toma en la propia consulta, sin traerlo a Python
+        """
+        if not self.initialized:
+            return []
+
+        params = [external_id, limit]
+        type_filter = self._content_type_filter(content_types, params)
+
+        async with self.pool.acquire() as conn:
+            base = await conn.fetchval(
+                "SELECT embedding::text FROM knowledge_base WHERE external_id = $1 AND embedding IS NOT NULL",
+                external_id
+            )
+            if base is None:
+                return []
+            params[0] = base
+            params.append(external_id)
+
+            with tracer.span("sql.find_similar", external_id=external_id) as span:
+                async with conn.transaction():
+                    await self.apply_vector_search_profile(conn, None, limit)
+                    rows = await conn.fetch(f"""
+                        SELECT {_card_columns()},
+                               (1 - (embedding <=> $1::vector)) as similarity
+                        FROM knowledge_base
+                        WHERE is_active = true
+                        AND external_id IS DISTINCT FROM ${len(params)}
+                        {type_filter}
+                        ORDER BY embedding <=> $1::vector
+                        LIMIT $2
+                    """, *params)
+                span.set_attribute("rows", len(rows))
+
+            results = await self._decode_rows(rows)
+            return await self._merge_live_state(results, conn)
+
+    async def get_product_neighbors(self, external_id: str, limit: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """
+        Productos similares precalculados (una lectura por clave primaria)
+        Returns: lista ordenada por similitud, o None si el producto aún no tiene vecinos calculados
+        """
+        if not self.initialized:
+            return None
+
+        async with self.pool.acquire() as conn:
+            with tracer.span("sql.product_neighbors", external_id=external_id) as span:
+                computed = await conn.fetchval(
+                    "SELECT TRUE FROM product_neighbors WHERE external_id = $1", external_id
+                )
+                if not computed:
+                    span.set_attribute("rows", 0)
+                    return None
+
+                # Los vecinos desactivados después del cálculo se descartan al leer
+                rows = await conn.fetch(f"""
+                    SELECT {_card_columns("kb")},
+                           n.score AS similarity
+                    FROM product_neighbors pn
+                    CROSS JOIN LATERAL unnest(pn.neighbor_ids, pn.scores) WITH ORDINALITY AS n(external_id, score, pos)
+                    JOIN knowledge_base kb ON kb.external_id = n.external_id AND kb.is_active = true
+                    WHERE pn.external_id = $1
+                    ORDER BY n.pos
+                    LIMIT $2
+                """, external_id, limit)
+                span.set_attribute("rows", len(rows))
+
+            results = []
+            for result in await self._decode_rows(rows):
+                result['similarity'] = float(result['similarity'])
+                results.append(result)
+            return await self._merge_live_state(results, conn)
+
+    async def count_neighbor_changes(self) -> Tuple[int, int]:
+        """
+        Cambios pendientes para los vecinos sin transferir embeddings:
+        (productos activos sin lista o con texto cambiado, listas de productos ya no activos)
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    (SELECT COUNT(*)
+                     FROM knowledge_base kb
+                     LEFT JOIN product_neighbors pn ON pn.external_id = kb.external_id
+                     WHERE kb.content_type = 'product' AND kb.is_active = true
+                     AND kb.external_id IS NOT NULL AND kb.embedding IS NOT NULL
+                     AND (pn.external_id IS NULL
+                          OR (kb.metadata->>'text_hash' IS NOT NULL
+                              AND pn.source_hash IS DISTINCT FROM kb.metadata->>'text_hash'))
+                    ) AS changed,
+                    (SELECT COUNT(*)
+                     FROM product_neighbors pn
+                     WHERE NOT EXISTS (
+                         SELECT 1 FROM knowledge_base kb
+                         WHERE kb.external_id = pn.external_id AND kb.content_type = 'product'
+                         AND kb.is_active = true AND kb.embedding IS NOT NULL
+                     )
+                    ) AS removed
+            """)
+
+        return row['changed'], row['removed']
+
+    async def get_neighbor_catalog(self) -> Tuple[List[Tuple[str, Optional[str]]], Dict[str, Dict[str, Any]]]:
+        """
+        Estado para recalcular vecinos, sin transferir embeddings:
+        - productos activos con embedding: (external_id, text_hash)
+        - listas guardadas: {external_id: {"source_hash", "neighbor_ids", "scores"}}
+        """
+        async with self.pool.acquire() as conn:
+            products = await conn.fetch("""
+                SELECT external_id, metadata->>'text_hash' AS text_hash
+                FROM knowledge_base
+                WHERE content_type = 'product' AND is_active = true
+                AND external_id IS NOT NULL AND embedding IS NOT NULL
+                ORDER BY external_id
+            """)
+            stored = await conn.fetch(
+                "SELECT external_id, source_hash, neighbor_ids, scores FROM product_neighbors"
+            )
+
+        return (
+            [(row['external_id'], row['text_hash']) for row in products],
+            {row['external_id']: dict(row) for row in stored}
+        )
+
+    async def iter_neighbor_embeddings(
+        self,
+        external_ids: Optional[List[str]] = None,
+        batch_size: int = 512
+    ) -> AsyncIterator[Tuple[List[str], np.ndarray]]:
+        """
+        Embeddings de productos activos por lotes: (external_ids, matriz float32)
+        Se leen en el formato binario de pgvector con un cursor de servidor, así que en
+        memoria solo hay un lote y nunca listas de floats de Python. Con external_ids se
+        limita a esos productos. Usar contextlib.aclosing si el consumidor puede salir antes
+        """
+        query = """
+            SELECT external_id, vector_send(embedding) AS embedding
+            FROM knowledge_base
+            WHERE content_type = 'product' AND is_active = true
+            AND external_id IS NOT NULL AND embedding IS NOT NULL
+        """
+        args = []
+        if external_ids is not None:
+            if not external_ids:
+                return
+            query += " AND external_id = ANY($1::text[])"
+            args.append(external_ids)
+
+        async with self.pool.acquire() as conn, conn.transaction(readonly=True):
+            cursor = await conn.cursor(query, *args)
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                yield [row['external_id'] for row in rows], _decode_vectors([row['embedding'] for row in rows])
+
+    async def upsert_product_neighbors(
+        self,
+        neighbors: List[Tuple[str, Optional[str], List[str], List[float]]],
+        remove_ids: List[str] = None
+    ) -> int:
+        """
+        Guardar listas de vecinos (external_id, source_hash, neighbor_ids, scores) y
+        borrar las de productos que ya no están activos
+        """
+        if not self.initialized:
+            return 0
+
+        async with self.pool.acquire() as conn, conn.transaction():
+            if remove_ids:
+                await conn.execute(
+                    "DELETE FROM product_neighbors WHERE external_id = ANY($1::text[])", remove_ids
+                )
+            if neighbors:
+                await conn.executemany("""
+                    INSERT INTO product_neighbors (external_id, source_hash, neighbor_ids, scores, computed_at)
+                    VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+                    ON CONFLICT (external_id) DO UPDATE SET
+                        source_hash = EXCLUDED.source_hash,
+                        neighbor_ids = EXCLUDED.neighbor_ids,
+                        scores = EXCLUDED.scores,
+                        computed_at = EXCLUDED.computed_at
+                """, neighbors)
+
+        return len(neighbors)
+
+    async def get_product_sync_state(self, external_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtener en una sola consulta el estado de sincronización de varias entradas:
+        última modificación, is_active, huellas de texto/catálogo guardadas en metadata
+        y huella comercial de product_live_state
+        """
+        if not self.initialized or not external_ids:
+            return {}
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT kb.external_id,
+                       GREATEST(kb.updated_at, ls.updated_at) AS updated_at,
+                       kb.is_active,
+                       kb.metadata->>'text_hash' AS text_hash,
+                       kb.metadata->>'catalog_hash' AS catalog_hash,
+                       ls.commercial_hash
+                FROM knowledge_base kb
+                LEFT JOIN product_live_state ls ON ls.external_id = kb.external_id
+                WHERE kb.external_id = ANY($1::text[])
+            """, list(external_ids))
+
+            return {row['external_id']: dict(row) for row in rows}
+
+    async def upsert_product_live_state(self, states: List[Dict[str, Any]]) -> int:
+        """
+        Insertar o actualizar precio/stock en product_live_state en una sola sentencia
+        Las filas cuya huella comercial no cambió no se reescriben
+        Returns: número de filas insertadas o modificadas
+        """
+        if not self.initialized or not states:
+            return 0
+
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("""
+                INSERT INTO product_live_state
+                    (external_id, price, regular_price, sale_price, stock_status, stock_qty,
+                     commercial_hash, updated_at)
+                SELECT *, CURRENT_TIMESTAMP
+                FROM unnest($1::text[], $2::float8[], $3::float8[], $4::float8[],
+                            $5::text[], $6::int[], $7::text[])
+                ON CONFLICT (external_id) DO UPDATE SET
+                    price = EXCLUDED.price,
+                    regular_price = EXCLUDED.regular_price,
+                    sale_price = EXCLUDED.sale_price,
+                    stock_status = EXCLUDED.stock_status,
+                    stock_qty = EXCLUDED.stock_qty,
+                    commercial_hash = EXCLUDED.commercial_hash,
+                    updated_at = EXCLUDED.updated_at
+                WHERE product_live_state.commercial_hash IS DISTINCT FROM EXCLUDED.commercial_hash
+            """,
+                [s["external_id"] for s in states],
+                [float(s.get("price") or 0) for s in states],
+                [float(s.get("regular_price") or 0) for s in states],
+                [float(s.get("sale_price") or 0) for s in states],
+                [s.get("stock_status") for s in states],
+                [int(s.get("stock_qty") or 0) for s in states],
+                [s.get("commercial_hash") for s in states]
+            )
+
+            # Formato "INSERT 0 n"
+            return int(result.split()[-1]) if result and result.split() else 0
+
+    async def filter_external_ids(self, external_ids: List[str], filters: ProductSearchFilters) -> set:
+        """Subconjunto de external_ids activos que cumplen los filtros exactos"""
+        if not external_ids or not self.initialized:
+            return set()
+
+        params = [list(external_ids)]
+        filter_sql = filters.to_sql(params)
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(f"""
+                    SELECT external_id FROM knowledge_base
+                    WHERE external_id = ANY($1) AND is_active = true
+                    {filter_sql}
+                """, *params)
+            return {row['external_id'] for row in rows}
+        except Exception as e:
+            logger.error(f"❌ Error aplicando filtros a resultados: {e}")
+            return set(external_ids)
+
+    async def get_product_live_state(self, external_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Obtener precio/stock vigente de varios productos por ID externo"""
+        if not self.initialized or not external_ids:
+            return {}
+
+        async with self.pool.acquire() as conn:
+            return await self._fetch_live_state(conn, external_ids)
+
+    async def get_product_labels(self, external_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Nombre y SKU de varios productos por ID externo, en una sola consulta"""
+        if not self.initialized or not external_ids:
+            return {}
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT external_id, title AS name, metadata->>'sku' AS sku
+                FROM knowledge_base
+                WHERE external_id = ANY($1::text[])
+            """, list(external_ids))
+
+        return {row['external_id']: dict(row) for row in rows}
+
+    async def _fetch_live_state(self, conn, external_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Consultar product_live_state con una conexión ya adquirida"""
+        rows = await conn.fetch("""
+            SELECT external_id, price, regular_price, sale_price, stock_status, stock_qty
+            FROM product_live_state
+            WHERE external_id = ANY($1::text[])
+        """, list(external_ids))
+
+        return {row['external_id']: dict(row) for row in rows}
+
+    async def _decode_rows(self, rows) -> List[Dict[str, Any]]:
+        """
+        Filas a dicts con `metadata` decodificado
+        Los lotes grandes se decodifican fuera del event loop (cpu_offload)
+        """
+        size = sum(len(row['metadata']) for row in rows if isinstance(row.get('metadata'), str))
+        return await cpu_offload.run("sql.decode_rows", _rows_to_dicts, rows, size=size)
+
+    async def _merge_live_state(self, results: List[Dict[str, Any]], conn=None) -> List[Dict[str, Any]]:
+        """
+        Unir en lectura el precio/stock de product_live_state a los metadatos de los resultados
+        Los consumidores (boost comercial, tarjetas, formateadores) siguen leyendo `metadata`
+        Acepta la conexión de la consulta de búsqueda para no adquirir una segunda
+        """
+        external_ids = list({
+            r['external_id'] for r in results
+            if r.get('external_id') and r.get('content_type', 'product') == 'product'
+        })
+        if not external_ids:
+            return results
+
+        try:
+            with tracer.span("sql.live_state", products=len(external_ids)):
+                if conn is not None:
+                    live_states = await self._fetch_live_state(conn, external_ids)
+                else:
+                    live_states = await self.get_product_live_state(external_ids)
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo estado comercial de productos: {e}")
+            return results
+
+        for result in results:
+            state = live_states.get(result.get('external_id'))
+            if not state:
+                continue
+            metadata = result.get('metadata')
+            if not isinstance(metadata, dict):
+                metadata = {}
+                result['metadata'] = metadata
+            metadata.update({
+                "price": state['price'] or 0,
+                "regular_price": state['regular_price'] or 0,
+                "sale_price": state['sale_price'] or 0,
+                "stock_status": state['stock_status'],
+                "stock_quantity": state['stock_qty'] or 0
+            })
+
+        return results
+
+    async def hydrate_content(self, results: List[Dict[str, Any]], limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Sustituir el extracto de `content` (proyección card) por el texto completo en los
+        primeros `limit` resultados: los que se pasan a un prompt o se devuelven por la API
+        Una lectura por clave primaria; los resultados de WooCommerce ya traen el texto
+        """
+        preview_chars = HYBRID_SEARCH_CONFIG["content_preview_chars"]
+        candidates = results if limit is None else results[:limit]
+        targets = [
+            r for r in candidates
+            if isinstance(r, dict) and isinstance(r.get('id'), int)
+            and len(r.get('content') or '') >= preview_chars
+        ]
+        if not targets or not self.initialized:
+            return results
+
+        try:
+            async with self.pool.acquire() as conn:
+                with tracer.span("sql.hydrate_content", rows=len(targets)):
+                    rows = await conn.fetch(
+                        "SELECT id, content FROM knowledge_base WHERE id = ANY($1::int[])",
+                        [r['id'] for r in targets]
+                    )
+        except Exception as e:
+            logger.error(f"❌ Error hidratando contenido de resultados: {e}")
+            return results
+
+        contents = {row['id']: row['content'] for row in rows}
+        for result in targets:
+            if result['id'] in contents:
+                result['content'] = contents[result['id']]
+
+        return results
+
+    async def update_knowledge_metadata_batch(self, updates: List[Tuple[str, Dict]]) -> int:
+        """
+        Actualizar solo los metadatos de varias entradas (external_id, metadata)
+        Vía rápida cuando el texto no cambió: no toca embedding, contenido ni search_vector
+        """
+        if not self.initialized or not updates:
+            return 0
+
+        async with self.pool.acquire() as conn:
+            await conn.executemany("""
+                UPDATE knowledge_base
+                SET metadata = $2, is_active = true, updated_at = CURRENT_TIMESTAMP
+                WHERE external_id = $1
+            """, [(external_id, metadata or {}) for external_id, metadata in updates])
+
+        return len(updates)
+
+    async def replace_product_facets(self, facets_by_id: Dict[str, Dict[str, List[str]]]) -> int:
+        """
+        Reemplazar las facetas de varios productos {external_id: {faceta: [valores]}}
+        Returns: número de filas de facetas insertadas
+        """
+        if not self.initialized or not facets_by_id:
+            return 0
+
+        rows = [
+            (external_id, facet, str(value)[:100])
+            for external_id, facets in facets_by_id.items()
+            for facet, values in facets.items()
+            for value in values
+            if value
+        ]
+
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(
+                "DELETE FROM product_facets WHERE external_id = ANY($1::text[])",
+                list(facets_by_id.keys())
+            )
+            if rows:
+                await conn.execute("""
+                    INSERT INTO product_facets (external_id, facet, value)
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::text[])
+                    ON CONFLICT DO NOTHING
+                """, [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+        return len(rows)
+
+    async def replace_category_membership(self, members: Dict[str, List[int]]) -> int:
+        """
+        Reemplazar las categorías de varios productos {external_id: [category_id]} y
+        recalcular los centroides de las categorías afectadas (antiguas y nuevas)
+        Returns: número de categorías cuyo centroide se recalculó
+        """
+        if not self.initialized or not members:
+            return 0
+
+        rows = [
+            (int(category_id), external_id)
+            for external_id, category_ids in members.items()
+            for category_id in set(category_ids or [])
+        ]
+
+        async with self.pool.acquire() as conn, conn.transaction():
+            removed = await conn.fetch(
+                "DELETE FROM category_products WHERE external_id = ANY($1::text[]) RETURNING category_id",
+                list(members.keys())
+            )
+            if rows:
+                await conn.execute("""
+                    INSERT INTO category_products (category_id, external_id)
+                    SELECT * FROM unnest($1::int[], $2::text[])
+                    ON CONFLICT DO NOTHING
+                """, [r[0] for r in rows], [r[1] for r in rows])
+
+            affected = {row['category_id'] for row in removed} | {r[0] for r in rows}
+            return await self.refresh_category_centroids(list(affected), conn=conn)
+
+    async def refresh_category_centroids(self, category_ids: List[int] = None, conn=None) -> int:
+        """
+        Recalcular el centroide (media de embeddings de productos activos) por categoría
+        Sin category_ids recalcula todas. Returns: número de centroides escritos
+        """
+        if conn is None:
+            async with self.pool.acquire() as conn, conn.transaction():
+                return await self.refresh_category_centroids(category_ids, conn)
+
+        if category_ids is not None and not category_ids:
+            return 0
+
+        if category_ids is None:
+            await conn.execute("DELETE FROM category_centroids")
+            scope, params = "", []
+        else:
+            await conn.execute("DELETE FROM category_centroids WHERE category_id = ANY($1::int[])", category_ids)
+            scope, params = "AND cp.category_id = ANY($1::int[])", [category_ids]
+
+        result = await conn.execute(f"""
+            INSERT INTO category_centroids (category_id, centroid, product_count, updated_at)
+            SELECT cp.category_id, AVG(kb.embedding), COUNT(*), CURRENT_TIMESTAMP
+            FROM category_products cp
+            JOIN knowledge_base kb ON kb.external_id = cp.external_id
+            WHERE kb.is_active = true AND kb.embedding IS NOT NULL
+            {scope}
+            GROUP BY cp.category_id
+        """, *params)
+        return int(result.split()[-1]) if result and result.split() else 0
+
+    async def find_category(self, name: str) -> Optional[Dict[str, Any]]:
+        """Categoría sincronizada por nombre o slug (la de más productos si hay varias)"""
+        if not self.initialized or not name:
+            return None
+
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT (kb.metadata->>'wc_id')::int AS category_id, kb.title, kb.metadata,
+                       COALESCE(cc.product_count, 0) AS product_count
+                FROM knowledge_base kb
+                LEFT JOIN category_centroids cc ON cc.category_id = (kb.metadata->>'wc_id')::int
+                WHERE kb.content_type = 'category'
+                AND kb.is_active = true
+                AND kb.metadata ? 'wc_id'
+                AND (unaccent(kb.title) ILIKE '%' || unaccent($1) || '%' OR kb.metadata->>'slug' = LOWER($1))
+                ORDER BY (LOWER(kb.title) = LOWER('Categoría: ' || $1)) DESC, product_count DESC
+                LIMIT 1
+            """, name.strip())
+
+        if not row:
+            return None
+        result = dict(row)
+        if isinstance(result['metadata'], str):
+            result['metadata'] = json_codec.loads(result['metadata'])
+        return result
+
+    async def get_category_products(self, category_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Productos activos de una categoría con una búsqueda por índice en category_products,
+        ordenados por cercanía al centroide (los más representativos primero)
+        """
+        if not self.initialized:
+            return []
+
+        async with self.pool.acquire() as conn:
+            with tracer.span("sql.category_products", category_id=category_id) as span:
+                rows = await conn.fetch(f"""
+                    SELECT {_card_columns("kb")},
+                           (1 - (kb.embedding <=> cc.centroid)) AS centroid_similarity
+                    FROM category_products cp
+                    JOIN knowledge_base kb ON kb.external_id = cp.external_id
+                    LEFT JOIN category_centroids cc ON cc.category_id = cp.category_id
+                    WHERE cp.category_id = $1 AND kb.is_active = true
+                    ORDER BY kb.embedding <=> cc.centroid NULLS LAST, kb.title
+                    LIMIT $2
+                """, category_id, limit)
+                span.set_attribute("rows", len(rows))
+
+            results = []
+            for result in await self._decode_rows(rows):
+                result['rrf_score'] = float(result['centroid_similarity'] or 0)
+                result['match_type'] = 'category'
+                results.append(result)
+
+            return await self._merge_live_state(results, conn)
+
+    async def search_categories_by_centroid(
+        self,
+        query_embedding: List[float],
+        limit: int = 5,
+        min_similarity: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Categorías más cercanas a una consulta comparando con el centroide de sus productos
+        (recorrido exacto: hay pocas categorías, no necesita índice). Detecta la categoría
+        aunque su nombre no aparezca en la consulta ('magneto' -> Magnetotérmicos)
+        """
+        if not self.initialized:
+            return []
+
+        if min_similarity is None:
+            min_similarity = HYBRID_SEARCH_CONFIG.get("category_centroid_min_similarity", 0.5)
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT cc.category_id, cc.product_count, kb.title, kb.metadata,
+                       (1 - (cc.centroid <=> $1)) AS similarity
+                FROM category_centroids cc
+                JOIN knowledge_base kb
+                  ON kb.content_type = 'category'
+                 AND kb.external_id = 'category_' || cc.category_id
+                WHERE kb.is_active = true AND cc.centroid IS NOT NULL
+                AND (1 - (cc.centroid <=> $1)) >= $3
+                ORDER BY cc.centroid <=> $1
+                LIMIT $2
+            """, str(query_embedding), limit, float(min_similarity))
+
+        return await self._decode_rows(rows)
+
+    async def get_facet_distribution(self, external_ids: List[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Distribución de facetas en una sola consulta (GROUPING SETS)
+        Sin external_ids cubre todo el catálogo activo
+        Returns: {faceta: {"products": productos con la faceta, "values": {valor: productos}}}
+        """
+        if not self.initialized:
+            return {}
+
+        if external_ids is not None:
+            if not external_ids:
+                return {}
+            source = "product_facets f WHERE f.external_id = ANY($1::text[])"
+            params = [list(external_ids)]
+        else:
+            source = """product_facets f
+                JOIN knowledge_base kb ON kb.external_id = f.external_id AND kb.is_active = true"""
+            params = []
+
+        async with self.pool.acquire() as conn:
+            with tracer.span("sql.facet_distribution", products=len(external_ids or [])) as span:
+                rows = await conn.fetch(f"""
+                    SELECT f.facet, f.value, COUNT(DISTINCT f.external_id) AS products
+                    FROM {source}
+                    GROUP BY GROUPING SETS ((f.facet, f.value), (f.facet))
+                """, *params)
+                span.set_attribute("rows", len(rows))
+
+        distribution: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            entry = distribution.setdefault(row['facet'], {"products": 0, "values": {}})
+            if row['value'] is None:
+                entry["products"] = row['products']
+            else:
+                entry["values"][row['value']] = row['products']
+
+        return distribution
+
     async def upsert_knowledge(self, content_type: str, title: str, content: str, 
                              embedding: List[float], external_id: str = None, 
                              metadata: Dict = None) -> int:
@@ -826,7 +1678,7 @@ class HybridDatabaseService:
                 
                 result = await conn.fetchrow(
                     update_query, external_id, title, content, 
-                    embedding_str, json.dumps(metadata or {})
+                    embedding_str, metadata or {}
                 )
                 
                 if result:
@@ -842,7 +1694,7 @@ class HybridDatabaseService:
             
             result = await conn.fetchrow(
                 insert_query, content_type, title, content, 
-                embedding_str, external_id, json.dumps(metadata or {})
+                embedding_str, external_id, metadata or {}
             )
             
             return result['id'] if result else None
@@ -870,6 +1722,22 @@ class HybridDatabaseService:
             affected_rows = int(result.split()[-1]) if result and result.split() else 0
             return affected_rows
     
+    async def deactivate_products(self, external_ids: List[str]) -> int:
+        """Marcar como inactivos productos concretos por ID externo"""
+        if not self.initialized or not external_ids:
+            return 0
+        
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE knowledge_base 
+                SET is_active = false, updated_at = CURRENT_TIMESTAMP
+                WHERE content_type = 'product' 
+                AND is_active = true 
+                AND external_id = ANY($1::text[])
+            """, list(external_ids))
+            
+            return int(result.split()[-1]) if result and result.split() else 0
+    
     async def get_last_sync_time(self) -> Optional[datetime]:
         """Obtener la fecha de la última sincronización de productos"""
         if not self.initialized:
@@ -884,6 +1752,63 @@ class HybridDatabaseService:
             
             return result['last_sync'] if result and result['last_sync'] else None
     
+    @staticmethod
+    def _version_at_least(version: Optional[str], minimum: Tuple[int, ...]) -> bool:
+        """Comparar una versión 'x.y.z' de extensión con un mínimo"""
+        if not version:
+            return False
+        try:
+            parts = tuple(int(p) for p in version.split(".")[:len(minimum)])
+        except ValueError:
+            return False
+        return parts >= minimum
+
+    def _content_type_filter(self, content_types: Optional[List[str]], params: List[Any]) -> str:
+        """
+        Filtro SQL por content_type que añade su parámetro a `params`
+        Con un solo tipo usa igualdad para que el planificador pueda elegir el índice HNSW parcial
+        """
+        if not content_types:
+            return ""
+        if len(content_types) == 1:
+            params.append(content_types[0])
+            return f"AND content_type = ${len(params)}"
+        params.append(list(content_types))
+        return f"AND content_type = ANY(${len(params)})"
+
+    async def apply_vector_search_profile(self, conn, profile: Optional[str] = None, limit: int = 0) -> str:
+        """
+        Ajustar la búsqueda HNSW de la transacción actual según el perfil
+        - fast / balanced: hnsw.ef_search y, si pgvector lo soporta, escaneo iterativo
+        - exact: desactiva los índices para ordenar por distancia exacta
+
+        Usa SET LOCAL, por lo que debe llamarse dentro de una transacción.
+
+        Returns:
+            Nombre del perfil aplicado
+        """
+        profile = profile or VECTOR_INDEX_CONFIG["default_profile"]
+        profile_config = VECTOR_INDEX_CONFIG["profiles"].get(profile)
+        if profile_config is None:
+            logger.warning(f"⚠️ Perfil de búsqueda vectorial desconocido '{profile}', usando el perfil por defecto")
+            profile = VECTOR_INDEX_CONFIG["default_profile"]
+            profile_config = VECTOR_INDEX_CONFIG["profiles"][profile]
+
+        ef_search = profile_config.get("ef_search")
+        if ef_search is None:
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            return profile
+
+        # ef_search nunca por debajo del LIMIT (máximo admitido por pgvector: 1000)
+        await conn.execute(f"SET LOCAL hnsw.ef_search = {min(max(int(ef_search), limit), 1000)}")
+
+        iterative_scan = VECTOR_INDEX_CONFIG["iterative_scan"]
+        if self.supports_iterative_scan and iterative_scan != "off":
+            await conn.execute(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}")
+            await conn.execute(f"SET LOCAL hnsw.max_scan_tuples = {int(VECTOR_INDEX_CONFIG['max_scan_tuples'])}")
+
+        return profile
+
     def _detect_brand_terms(self, query_text: str) -> List[str]:
         """Detectar marcas conocidas en la consulta"""
         # Marcas comunes en material eléctrico
@@ -1271,8 +2196,8 @@ class HybridDatabaseService:
         try:
             async with self.pool.acquire() as conn:
                 # Búsqueda exacta por SKU en el campo metadata
-                query = """
-                SELECT id, title, content, content_type, metadata, external_id
+                query = f"""
+                SELECT {_card_columns()}
                 FROM knowledge_base 
                 WHERE is_active = true 
                 AND content_type = 'product'
@@ -1280,16 +2205,13 @@ class HybridDatabaseService:
                 LIMIT 5
                 """
                 
-                rows = await conn.fetch(query, sku)
+                with tracer.span("sql.exact_sku") as span:
+                    rows = await conn.fetch(query, sku)
+                    span.set_attribute("rows", len(rows))
                 
-                results = []
-                for row in rows:
-                    result = dict(row)
-                    if result['metadata']:
-                        result['metadata'] = json.loads(result['metadata']) if isinstance(result['metadata'], str) else result['metadata']
-                    results.append(result)
+                results = await self._decode_rows(rows)
                 
-                return results
+                return await self._merge_live_state(results, conn)
                 
         except Exception as e:
             logger.error(f"Error buscando SKU exacto: {e}")
@@ -1351,7 +2273,9 @@ class HybridDatabaseService:
         query_text: str, 
         query_embedding: List[float], 
         content_types: List[str], 
-        limit: int
+        limit: int,
+        profile: str = None,
+        filters: Optional[ProductSearchFilters] = None
     ) -> List[Dict[str, Any]]:
         """Realizar búsqueda híbrida en la knowledge base"""
         try:
@@ -1360,7 +2284,9 @@ class HybridDatabaseService:
                 query_text=query_text,
                 query_embedding=query_embedding,
                 content_types=content_types,
-                limit=limit
+                limit=limit,
+                profile=profile,
+                filters=filters
             )
         except Exception as e:
             logger.error(f"❌ Error en búsqueda híbrida: {e}")
@@ -7,6 +7,7 @@ import asyncio
 import openai
 from typing import List, Dict, Any, Optional
 from config.settings import settings, EMBEDDING_CONFIG
+from services.tracing_service import tracer
 import logging
 import time
 
@@ -54,10 +55,13 @@ class EmbeddingService:
             # Limpiar y preparar texto
             clean_text = self._prepare_text(text)
             
-            response = await self.client.embeddings.create(
-                model=self.model,
-                input=clean_text
-            )
+            with tracer.span("embedding.generate", model=self.model, chars=len(clean_text)) as span:
+                response = await self.client.embeddings.create(
+                    model=self.model,
+                    input=clean_text
+                )
+                if getattr(response, "usage", None):
+                    span.set_attribute("tokens", response.usage.total_tokens)
             
             return response.data[0].embedding
             
@@ -75,10 +79,11 @@ class EmbeddingService:
             batch_clean = [self._prepare_text(text) for text in batch]
             
             try:
-                response = await self.client.embeddings.create(
-                    model=self.model,
-                    input=batch_clean
-                )
+                with tracer.span("embedding.generate_batch", model=self.model, batch_size=len(batch_clean)):
+                    response = await self.client.embeddings.create(
+                        model=self.model,
+                        input=batch_clean
+                    )
                 
                 batch_embeddings = [data.embedding for data in response.data]
                 embeddings.extend(batch_embeddings)
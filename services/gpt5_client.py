@@ -6,13 +6,16 @@ Implementación completa según documentación oficial de OpenAI
 
 import os
 import json
+import time
 import logging
 import aiohttp
-from typing import Dict, Any, Optional, List, Literal, Union
+from typing import Dict, Any, Optional, List, Literal, Union, AsyncIterator
 from dataclasses import dataclass
 from enum import Enum
 from dotenv import load_dotenv
 
+from services.tracing_service import tracer
+
 # Cargar variables de entorno
 load_dotenv("env.agent")
 
@@ -55,7 +58,9 @@ class GPT5Client:
             raise ValueError("OPENAI_API_KEY no configurada")
         
         # USAR ENDPOINT DE RESPONSES API, NO CHAT COMPLETIONS
-        self.base_url = "https://api.openai.com/v1/responses"
+        # OPENAI_BASE_URL permite apuntar a un proxy o a los fakes de benchmarks/
+        api_base = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+        self.base_url = f"{api_base}/responses"
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -81,7 +86,183 @@ class GPT5Client:
         Crea una respuesta usando la API de Responses de GPT-5
         """
         
-        # Construir el payload según la documentación de Responses API
+        payload = self._build_payload(
+            input_text=input_text,
+            model=model,
+            reasoning_effort=reasoning_effort,
+            verbosity=verbosity,
+            tools=tools,
+            tool_choice=tool_choice,
+            store=store,
+            previous_response_id=previous_response_id,
+            instructions=instructions
+        )
+        
+        try:
+            with tracer.span("llm.create_response", model=model, streaming=False) as span:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        self.base_url,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=120)
+                    ) as response:
+                        span.set_attribute("http.status", response.status)
+                        if response.status != 200:
+                            error_text = await response.text()
+                            logger.error(f"Error en GPT-5 API: {response.status} - {error_text}")
+                            raise Exception(f"API Error: {response.status} - {error_text}")
+                        
+                        result = await response.json()
+                        parsed = self._parse_result(result, model)
+                        self._set_usage_attributes(span, parsed.usage)
+                        return parsed
+                    
+        except Exception as e:
+            logger.error(f"Error llamando a GPT-5 API: {e}")
+            raise
+    
+    async def stream_response(
+        self,
+        input_text: Union[str, List[Dict[str, str]]],
+        model: str = "gpt-5",
+        reasoning_effort: ReasoningEffort = ReasoningEffort.LOW,
+        verbosity: Verbosity = Verbosity.MEDIUM,
+        max_completion_tokens: Optional[int] = None,
+        tools: Optional[List[Dict]] = None,
+        tool_choice: Optional[Union[str, Dict]] = None,
+        store: bool = True,
+        previous_response_id: Optional[str] = None,
+        instructions: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Crea una respuesta en modo streaming consumiendo los server-sent events
+        de la Responses API.
+        
+        Emite eventos ``{"type": "delta", "text": ...}`` a medida que llegan
+        fragmentos de texto y termina con ``{"type": "completed", "response": GPT5Response}``.
+        """
+        
+        payload = self._build_payload(
+            input_text=input_text,
+            model=model,
+            reasoning_effort=reasoning_effort,
+            verbosity=verbosity,
+            tools=tools,
+            tool_choice=tool_choice,
+            store=store,
+            previous_response_id=previous_response_id,
+            instructions=instructions
+        )
+        payload["stream"] = True
+        
+        headers = dict(self.headers)
+        headers["Accept"] = "text/event-stream"
+        
+        accumulated: List[str] = []
+        final_result: Optional[Dict[str, Any]] = None
+        
+        # En un generador asíncrono no se puede activar el span en el contexto
+        # (se reanuda desde el contexto del consumidor), se gestiona manualmente
+        span = tracer.start_span("llm.stream_response", model=model, streaming=True)
+        first_token_ns = None
+        
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    self.base_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=120, sock_read=60)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"Error en GPT-5 API (stream): {response.status} - {error_text}")
+                        raise Exception(f"API Error: {response.status} - {error_text}")
+                    
+                    # Cada evento SSE llega como líneas "event: ..." / "data: {...}"
+                    # separadas por una línea en blanco. Solo necesitamos "data".
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        
+                        data = line[5:].strip()
+                        if not data or data == "[DONE]":
+                            continue
+                        
+                        try:
+                            event = json.loads(data)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Evento SSE no válido: {data[:200]}")
+                            continue
+                        
+                        event_type = event.get("type", "")
+                        
+                        if event_type == "response.output_text.delta":
+                            delta = event.get("delta", "")
+                            if delta:
+                                if first_token_ns is None:
+                                    first_token_ns = time.time_ns()
+                                    span.set_attribute("ttft_ms", round((first_token_ns - span.start_ns) / 1_000_000, 2))
+                                accumulated.append(delta)
+                                yield {"type": "delta", "text": delta}
+                        
+                        elif event_type == "response.completed":
+                            final_result = event.get("response") or {}
+                            self._set_usage_attributes(span, final_result.get("usage"))
+                        
+                        elif event_type in ("response.failed", "error"):
+                            error_info = event.get("error") or (event.get("response") or {}).get("error")
+                            logger.error(f"Error en streaming GPT-5: {error_info}")
+                            raise Exception(f"Stream Error: {error_info}")
+            
+        except Exception as e:
+            span.status = "error"
+            span.error = str(e)
+            logger.error(f"Error en streaming de GPT-5 API: {e}")
+            raise
+        finally:
+            tracer.end_span(span)
+        
+        streamed_text = "".join(accumulated)
+        if final_result:
+            final_response = self._parse_result(final_result, model)
+            if not final_response.content:
+                final_response.content = streamed_text
+                final_response.output_text = streamed_text
+        else:
+            final_response = GPT5Response(
+                content=streamed_text,
+                model=model,
+                output_text=streamed_text
+            )
+        
+        yield {"type": "completed", "response": final_response}
+    
+    def _set_usage_attributes(self, span, usage: Optional[Dict[str, Any]]):
+        """Añade el consumo de tokens de la respuesta al span"""
+        if not usage:
+            return
+        span.set_attributes(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0)
+        )
+    
+    def _build_payload(
+        self,
+        input_text: Union[str, List[Dict[str, str]]],
+        model: str,
+        reasoning_effort: ReasoningEffort,
+        verbosity: Verbosity,
+        tools: Optional[List[Dict]],
+        tool_choice: Optional[Union[str, Dict]],
+        store: bool,
+        previous_response_id: Optional[str],
+        instructions: Optional[str]
+    ) -> Dict[str, Any]:
+        """Construye el payload según la documentación de Responses API"""
         payload = {
             "model": model,  # gpt-5, gpt-5-mini, gpt-5-nano
             "input": input_text,
@@ -110,65 +291,49 @@ class GPT5Client:
         if instructions:
             payload["instructions"] = instructions
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=120)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Error en GPT-5 API: {response.status} - {error_text}")
-                        raise Exception(f"API Error: {response.status} - {error_text}")
-                    
-                    result = await response.json()
-                    
-                    # Extraer contenido según estructura de Responses API
-                    output_text = ""
-                    content = ""
-                    reasoning_summary = ""
-                    
-                    # La respuesta tiene un array 'output' con items
-                    if "output" in result and isinstance(result["output"], list):
-                        for item in result["output"]:
-                            if item.get("type") == "message":
-                                # Extraer texto del mensaje
-                                if "content" in item and isinstance(item["content"], list):
-                                    for content_item in item["content"]:
-                                        if content_item.get("type") == "output_text":
-                                            output_text = content_item.get("text", "")
-                                            content = output_text
-                            elif item.get("type") == "reasoning":
-                                # Capturar resumen de razonamiento
-                                if "summary" in item:
-                                    reasoning_summary = " ".join(item["summary"])
-                    
-                    # Si hay output_text directo en la respuesta
-                    if "output_text" in result:
-                        output_text = result["output_text"]
-                        content = output_text
-                    
-                    # Debug log para entender la estructura
-                    if not content:
-                        logger.warning(f"GPT-5 response sin content. Raw response keys: {list(result.keys())}")
-                        if "output" in result:
-                            logger.warning(f"Output structure: {result['output'][:200] if isinstance(result['output'], str) else 'not a string'}")
-                    
-                    return GPT5Response(
-                        content=content,
-                        reasoning_summary=reasoning_summary,
-                        model=result.get("model", model),
-                        usage=result.get("usage"),
-                        response_id=result.get("id", ""),
-                        raw_response=result,
-                        output_text=output_text
-                    )
-                    
-        except Exception as e:
-            logger.error(f"Error llamando a GPT-5 API: {e}")
-            raise
+        return payload
+    
+    def _parse_result(self, result: Dict[str, Any], model: str) -> GPT5Response:
+        """Extrae contenido según estructura de Responses API"""
+        output_text = ""
+        content = ""
+        reasoning_summary = ""
+        
+        # La respuesta tiene un array 'output' con items
+        if "output" in result and isinstance(result["output"], list):
+            for item in result["output"]:
+                if item.get("type") == "message":
+                    # Extraer texto del mensaje
+                    if "content" in item and isinstance(item["content"], list):
+                        for content_item in item["content"]:
+                            if content_item.get("type") == "output_text":
+                                output_text = content_item.get("text", "")
+                                content = output_text
+                elif item.get("type") == "reasoning":
+                    # Capturar resumen de razonamiento
+                    if "summary" in item:
+                        reasoning_summary = " ".join(item["summary"])
+        
+        # Si hay output_text directo en la respuesta
+        if "output_text" in result:
+            output_text = result["output_text"]
+            content = output_text
+        
+        # Debug log para entender la estructura
+        if not content:
+            logger.warning(f"GPT-5 response sin content. Raw response keys: {list(result.keys())}")
+            if "output" in result:
+                logger.warning(f"Output structure: {result['output'][:200] if isinstance(result['output'], str) else 'not a string'}")
+        
+        return GPT5Response(
+            content=content,
+            reasoning_summary=reasoning_summary,
+            model=result.get("model", model),
+            usage=result.get("usage"),
+            response_id=result.get("id", ""),
+            raw_response=result,
+            output_text=output_text
+        )
     
     async def create_conversational_response(
         self,
@@ -7,12 +7,10 @@ import asyncio
 import logging
 from typing import List, Dict, Any, Optional, Set
 from datetime import datetime, timezone
-import json
-import hashlib
+from contextlib import aclosing
 
 from services.woocommerce import WooCommerceService
 from services.database import db_service
-from services.embedding_service import embedding_service
 from services.woocommerce_sync import WooCommerceSyncService
 from config.settings import settings
 
@@ -173,138 +171,43 @@ class IncrementalSyncService:
     async def _get_modified_products(self, modified_after: datetime) -> List[Dict[str, Any]]:
         """Obtener productos modificados después de una fecha"""
         modified_products = []
-        page = 1
         
-        while True:
-            # WooCommerce espera formato ISO 8601
-            modified_after_str = modified_after.strftime("%Y-%m-%dT%H:%M:%S")
-            
-            products = await self.wc_service.get_products(
-                page=page,
-                per_page=50,
-                modified_after=modified_after_str,
-                orderby='modified',
-                order='asc'
-            )
-            
-            if not products:
-                break
-                
-            modified_products.extend(products)
-            
-            if len(products) < 50:
-                break
-                
-            page += 1
-            await asyncio.sleep(0.5)  # Rate limiting
+        # WooCommerce espera formato ISO 8601
+        modified_after_str = modified_after.strftime("%Y-%m-%dT%H:%M:%S")
+        
+        # El paginador respeta el ritmo de la API sin pausas fijas entre páginas
+        pages = self.wc_service.iter_pages(
+            "products",
+            {"modified_after": modified_after_str, "orderby": "modified", "order": "asc"},
+            per_page=50
+        )
+        # aclosing: si una página falla se cancelan las descargas que siguen en vuelo
+        async with aclosing(pages):
+            async for page, products in pages:
+                if products is None:
+                    # Sin la lista completa no se debe avanzar la fecha de última sincronización
+                    raise Exception(f"No se pudo obtener la página {page} de productos modificados")
+                modified_products.extend(products)
         
         return modified_products
     
     async def _process_single_product(self, product: Dict[str, Any]) -> str:
-        """Procesar un único producto actualizado"""
-        pool = await db_service.get_pool()
-        
-        # Calcular hash del producto para detectar cambios reales
-        product_hash = self._calculate_product_hash(product)
-        
-        async with pool.acquire() as conn:
-            # Verificar si el producto existe
-            existing = await conn.fetchrow("""
-                SELECT id, data_hash FROM products 
-                WHERE woo_id = $1
-            """, product['id'])
-            
-            if existing:
-                # Comparar hash para ver si realmente cambió
-                if existing['data_hash'] == product_hash:
-                    logger.debug(f"Producto {product['id']} sin cambios reales")
-                    return "unchanged"
-                
-                # Actualizar producto existente
-                return await self._update_product(product, product_hash)
-            else:
-                # Nuevo producto
-                return await self._insert_product(product, product_hash)
-    
-    def _calculate_product_hash(self, product: Dict[str, Any]) -> str:
-        """Calcular hash de los datos importantes del producto"""
-        # Campos relevantes para detectar cambios
-        relevant_data = {
-            'name': product.get('name'),
-            'description': product.get('description'),
-            'short_description': product.get('short_description'),
-            'price': product.get('price'),
-            'regular_price': product.get('regular_price'),
-            'sale_price': product.get('sale_price'),
-            'stock_status': product.get('stock_status'),
-            'stock_quantity': product.get('stock_quantity'),
-            'categories': [c['id'] for c in product.get('categories', [])],
-            'images': [img['src'] for img in product.get('images', [])]
-        }
+        """
+        Procesar un único producto actualizado
+        Las huellas de texto y comerciales del sync_service deciden si hace falta
+        un nuevo embedding o basta con actualizar precio/stock en los metadatos
+        """
+        page_stats = await self.sync_service._process_product_page([product], force_update=True)
         
-        # Crear string determinístico y calcular hash
-        data_string = json.dumps(relevant_data, sort_keys=True)
-        return hashlib.md5(data_string.encode()).hexdigest()
-    
-    async def _update_product(self, product: Dict[str, Any], product_hash: str) -> str:
-        """Actualizar producto existente"""
-        # Usar el método existente del sync_service
-        pool = await db_service.get_pool()
-        
-        # Preparar texto para embedding
-        text_for_embedding = self.sync_service._prepare_product_text(product)
-        
-        # Generar nuevo embedding solo si el contenido cambió significativamente
-        embedding = await embedding_service.generate_embedding(text_for_embedding)
-        
-        if embedding:
-            async with pool.acquire() as conn:
-                await conn.execute("""
-                    UPDATE products SET
-                        name = $2,
-                        description = $3,
-                        short_description = $4,
-                        price = $5,
-                        categories = $6,
-                        embedding = $7,
-                        metadata = $8,
-                        data_hash = $9,
-                        updated_at = NOW()
-                    WHERE woo_id = $1
-                """, 
-                product['id'],
-                product.get('name'),
-                product.get('description'),
-                product.get('short_description'),
-                float(product.get('price', 0) or 0),
-                [cat['name'] for cat in product.get('categories', [])],
-                embedding,
-                json.dumps(self.sync_service._extract_metadata(product)),
-                product_hash
-                )
-                
-            logger.info(f"✅ Actualizado producto: {product.get('name')}")
-            return "updated"
-        
-        return "error"
-    
-    async def _insert_product(self, product: Dict[str, Any], product_hash: str) -> str:
-        """Insertar nuevo producto"""
-        # Reutilizar lógica del sync_service
-        batch_stats = await self.sync_service._process_product_batch([product], force_update=False)
-        
-        if batch_stats["new"] > 0:
-            # Actualizar hash
-            pool = await db_service.get_pool()
-            async with pool.acquire() as conn:
-                await conn.execute("""
-                    UPDATE products SET data_hash = $2 
-                    WHERE woo_id = $1
-                """, product['id'], product_hash)
-            
+        if page_stats["errors"]:
+            return "error"
+        if page_stats["new"]:
             return "added"
+        if page_stats["updated"] or page_stats["commercial"]:
+            return "updated"
         
-        return "error"
+        logger.debug(f"Producto {product.get('id')} sin cambios reales")
+        return "unchanged"
     
     async def register_webhook_change(
         self, 
@@ -325,7 +228,7 @@ class IncrementalSyncService:
                     DO UPDATE SET 
                         webhook_data = $4,
                         created_at = NOW()
-                """, resource_type, resource_id, action, json.dumps(webhook_data))
+                """, resource_type, resource_id, action, webhook_data)
                 
             logger.info(f"📌 Registrado cambio webhook: {resource_type} {resource_id} - {action}")
             return True
@@ -402,7 +305,7 @@ class IncrementalSyncService:
             datetime.now(timezone.utc), 
             stats.get("products_updated", 0) + stats.get("products_added", 0),
             status,
-            json.dumps(details)
+            details
             )
     
     async def start_continuous_sync(self, interval: int = 300):
@@ -0,0 +1,101 @@
+"""
+Codec JSON centralizado
+Una sola implementación (orjson si está instalado, json estándar si no) para las
+respuestas de la API, los frames del WebSocket, los parámetros y columnas JSON/JSONB
+de PostgreSQL y los volcados de logs. orjson serializa datetime, date, UUID y
+dataclasses de forma nativa; Decimal y set se convierten en `_default`.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Tipos que ni orjson ni json serializan por sí solos"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (datetime, date)):  # Solo llega aquí con el json estándar
+        return obj.isoformat()
+    if hasattr(obj, "tolist"):  # Arrays de numpy (embeddings)
+        return obj.tolist()
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serializar a bytes UTF-8 (cuerpos HTTP)"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        """Serializar a str (frames de WebSocket, parámetros JSONB, logs)"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode("utf-8")
+
+    def loads(data: Any) -> Any:
+        """Deserializar str o bytes"""
+        return orjson.loads(data)
+
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serializar a bytes UTF-8 (cuerpos HTTP)"""
+        return dumps(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        """Serializar a str (frames de WebSocket, parámetros JSONB, logs)"""
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: Any) -> Any:
+        """Deserializar str o bytes"""
+        return json.loads(data)
+
+
+def from_db(value: Any, default: Any = None) -> Any:
+    """
+    Valor de una columna JSON/JSONB con objetos o listas
+    Con los codecs registrados ya llega decodificado; si la consulta lo devuelve como texto
+    se decodifica aquí. No usar para columnas que guardan escalares (p.ej. cadenas JSON)
+    """
+    if value is None:
+        return default
+    if isinstance(value, (str, bytes)):
+        return loads(value) if value else default
+    return value
+
+
+def _encode_db(value: Any) -> str:
+    # Los parámetros son siempre objetos Python: una cadena se guarda como cadena JSON
+    return dumps(value)
+
+
+async def register_json_codecs(conn):
+    """
+    Codecs JSON/JSONB de asyncpg (init= de create_pool): las columnas llegan como
+    dicts/listas sin json.loads manual y los parámetros aceptan objetos Python
+    """
+    for type_name in ("jsonb", "json"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=_encode_db,
+            decoder=loads,
+            schema="pg_catalog",
+            format="text"
+        )
+
+
+class CodecJSONResponse(JSONResponse):
+    """Respuesta JSON serializada con el codec (clase por defecto de la aplicación)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -10,11 +10,11 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import hashlib
-import json
 
 from services.database import db_service
 from services.embedding_service import embedding_service
 from config.settings import settings
+from services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +26,7 @@ class KnowledgeBaseService:
         self.db_service = db_service
         self.embedding_service = embedding_service
         self.enabled = True
+        self.max_parallel_files = 4  # Documentos procesándose a la vez en load_all_documents
         
     async def initialize(self):
         """Inicializar el servicio y crear tabla si es necesario"""
@@ -103,97 +104,150 @@ class KnowledgeBaseService:
         
         return final_chunks
     
+    def _split_sections(self, content: str) -> List[str]:
+        """
+        Dividir el documento por secciones de nivel 2 (## ...)
+        Los chunks nunca cruzan una sección: editar una pregunta de FAQ solo
+        desplaza los límites de los chunks de su propia sección
+        """
+        sections = []
+        current = []
+        has_body = False  # La sección actual ya tiene texto además de encabezados
+        for line in content.split('\n'):
+            # Un encabezado sin texto debajo (p. ej. el título #) se une a la sección siguiente
+            if line.startswith('## ') and has_body:
+                sections.append('\n'.join(current))
+                current = []
+                has_body = False
+            current.append(line)
+            if line.strip() and not line.startswith('#'):
+                has_body = True
+        if current:
+            sections.append('\n'.join(current))
+        
+        return [section for section in sections if section.strip()]
+    
+    def _build_chunks(self, content: str) -> List[str]:
+        """Chunks del documento: secciones subdivididas por párrafos y oraciones"""
+        chunks = []
+        for section in self._split_sections(content):
+            chunks.extend(chunk for chunk in self._split_content(section) if chunk)
+        return chunks
+    
     async def load_markdown_file(self, file_path: Path, doc_type: str = "general") -> bool:
-        """Cargar un archivo markdown en la base de conocimientos"""
+        """
+        Cargar un archivo markdown en la base de conocimientos a nivel de chunk
+        Cada chunk guarda el hash de su texto de embedding: los chunks sin cambios se
+        conservan, solo los nuevos o modificados se embeben (en una única llamada por lotes)
+        y los que ya no existen se eliminan, todo en una transacción
+        """
         try:
             # Leer contenido del archivo
             content = file_path.read_text(encoding='utf-8')
             title = self._extract_title(content)
             doc_id = f"{doc_type}_{file_path.stem}"
             
-            # Calcular hash para detectar cambios
-            content_hash = self._calculate_hash(content)
-            
-            # Verificar si ya existe y si cambió
             pool = self.db_service.pool
             if not pool:
                 logger.error("No hay pool de conexiones disponible")
                 return False
-            async with pool.acquire() as conn:
-                # Buscar si ya existe por external_id
-                existing = await conn.fetchrow(
-                    "SELECT id, metadata FROM knowledge_base WHERE external_id = $1 AND content_type = $2",
-                    doc_id, doc_type
-                )
-                
-                if existing and existing['metadata'] and existing['metadata'].get('hash') == content_hash:
-                    logger.info(f"ℹ️ Documento {doc_id} sin cambios, omitiendo")
-                    return True
-                
-                # Si cambió o es nuevo, eliminar versión anterior
-                if existing:
-                    await conn.execute(
-                        "DELETE FROM knowledge_base WHERE external_id = $1",
-                        doc_id
-                    )
-                    logger.info(f"🔄 Actualizando documento {doc_id}")
             
-            # Dividir en chunks si es muy largo
-            chunks = self._split_content(content)
+            # Chunks deseados, identificados por el hash de su texto de embedding
+            chunks = []
+            seen_hashes = set()
+            for chunk_content in self._build_chunks(content):
+                chunk_hash = self._calculate_hash(f"{title}\n\n{chunk_content}")
+                if chunk_hash in seen_hashes:
+                    continue  # Bloques repetidos dentro del mismo documento
+                seen_hashes.add(chunk_hash)
+                chunks.append((chunk_hash, chunk_content))
             total_chunks = len(chunks)
             
-            # Procesar cada chunk
-            for idx, chunk_content in enumerate(chunks):
-                chunk_doc_id = f"{doc_id}_chunk_{idx}" if total_chunks > 1 else doc_id
-                
-                # Generar embedding
+            async with pool.acquire() as conn:
+                # Chunks actuales del documento (incluye filas de versiones anteriores sin chunk_hash)
+                rows = await conn.fetch("""
+                    SELECT id, metadata->>'chunk_hash' AS chunk_hash,
+                           (metadata->>'chunk_index')::int AS chunk_index,
+                           (metadata->>'total_chunks')::int AS total_chunks
+                    FROM knowledge_base
+                    WHERE metadata->>'original_doc_id' = $1
+                """, doc_id)
+            
+            existing = {}
+            stale_ids = []
+            for row in rows:
+                if row['chunk_hash'] and row['chunk_hash'] not in existing:
+                    existing[row['chunk_hash']] = row
+                else:
+                    stale_ids.append(row['id'])
+            
+            to_embed = []
+            to_reindex = []
+            for idx, (chunk_hash, chunk_content) in enumerate(chunks):
+                row = existing.pop(chunk_hash, None)
+                if row is None:
+                    to_embed.append((idx, chunk_hash, chunk_content))
+                elif row['chunk_index'] != idx or row['total_chunks'] != total_chunks:
+                    to_reindex.append((row['id'], idx))
+            stale_ids.extend(row['id'] for row in existing.values())
+            
+            if not to_embed and not to_reindex and not stale_ids:
+                logger.info(f"ℹ️ Documento {doc_id} sin cambios, omitiendo")
+                return True
+            
+            # Embeddings solo de los chunks nuevos o modificados, en una sola llamada
+            embeddings = []
+            if to_embed:
                 if not self.embedding_service.initialized:
                     await self.embedding_service.initialize()
-                
-                embedding = await self.embedding_service.generate_embedding(
-                    f"{title}\n\n{chunk_content}"
+                embeddings = await self.embedding_service.generate_embeddings_batch(
+                    [f"{title}\n\n{chunk_content}" for _, _, chunk_content in to_embed]
                 )
+            
+            inserts = []
+            for (idx, chunk_hash, chunk_content), embedding in zip(to_embed, embeddings):
+                # generate_embeddings_batch devuelve un vector de ceros si la API falla
+                if not embedding or not any(embedding):
+                    logger.error(f"Error generando embedding para chunk {idx} de {doc_id}")
+                    return False
                 
-                if not embedding:
-                    logger.error(f"Error generando embedding para {chunk_doc_id}")
-                    continue
-                
-                # Preparar metadata
                 metadata = {
                     "file_name": file_path.name,
                     "doc_type": doc_type,
                     "chunk_index": idx,
                     "total_chunks": total_chunks,
                     "original_doc_id": doc_id,
-                    "hash": content_hash
+                    "chunk_hash": chunk_hash
                 }
+                inserts.append((
+                    doc_type, title, chunk_content, f"{doc_id}#{chunk_hash[:16]}",
+                    f"[{','.join(map(str, embedding))}]", metadata
+                ))
+            
+            async with pool.acquire() as conn, conn.transaction():
+                if stale_ids:
+                    await conn.execute("DELETE FROM knowledge_base WHERE id = ANY($1::int[])", stale_ids)
                 
-                # Insertar en base de datos usando estructura existente
-                async with pool.acquire() as conn:
-                    # Convertir embedding a formato pgvector
-                    embedding_str = f"[{','.join(map(str, embedding))}]"
-                    
-                    # Verificar si ya existe y eliminar
-                    existing = await conn.fetchrow(
-                        "SELECT id FROM knowledge_base WHERE external_id = $1",
-                        chunk_doc_id
-                    )
-                    if existing:
-                        await conn.execute(
-                            "DELETE FROM knowledge_base WHERE external_id = $1",
-                            chunk_doc_id
-                        )
-                    
-                    # Insertar nuevo documento
-                    await conn.execute("""
+                if to_reindex:
+                    # Solo cambia la posición: metadatos, sin embedding ni search_vector
+                    await conn.executemany("""
+                        UPDATE knowledge_base
+                        SET metadata = metadata || jsonb_build_object('chunk_index', $2::int, 'total_chunks', $3::int),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = $1
+                    """, [(row_id, idx, total_chunks) for row_id, idx in to_reindex])
+                
+                if inserts:
+                    await conn.executemany("""
                         INSERT INTO knowledge_base 
                         (content_type, title, content, external_id, 
-                         embedding, metadata, is_active)
-                        VALUES ($1, $2, $3, $4, $5::vector, $6, true)
-                    """, doc_type, title, chunk_content, chunk_doc_id,
-                        embedding_str, json.dumps(metadata))
+                         embedding, metadata, search_vector, is_active)
+                        VALUES ($1, $2, $3, $4, $5::vector, $6,
+                                to_tsvector('spanish', $2 || ' ' || $3), true)
+                    """, inserts)
             
-            logger.info(f"✅ Documento {doc_id} cargado exitosamente ({total_chunks} chunks)")
+            logger.info(f"✅ Documento {doc_id} cargado ({total_chunks} chunks: {len(inserts)} embebidos, "
+                       f"{total_chunks - len(inserts)} reutilizados, {len(stale_ids)} eliminados)")
             return True
             
         except Exception as e:
@@ -223,7 +277,8 @@ class KnowledgeBaseService:
             ".": "general"  # Archivos en raíz
         }
         
-        # Procesar archivos markdown
+        # Recopilar archivos markdown con su tipo de documento
+        files_to_load = []
         for root, dirs, files in os.walk(self.knowledge_dir):
             root_path = Path(root)
             relative_path = root_path.relative_to(self.knowledge_dir)
@@ -235,15 +290,22 @@ class KnowledgeBaseService:
                     doc_type = dtype
                     break
             
-            # Procesar archivos .md
             for file in files:
                 if file.endswith('.md'):
-                    file_path = root_path / file
-                    success = await self.load_markdown_file(file_path, doc_type)
-                    if success:
-                        results["success"] += 1
-                    else:
-                        results["failed"] += 1
+                    files_to_load.append((root_path / file, doc_type))
+        
+        # Procesar documentos en paralelo (cada uno hace su propio lote de embeddings)
+        semaphore = asyncio.Semaphore(self.max_parallel_files)
+        
+        async def load_with_semaphore(file_path: Path, doc_type: str) -> bool:
+            async with semaphore:
+                return await self.load_markdown_file(file_path, doc_type)
+        
+        outcomes = await asyncio.gather(
+            *(load_with_semaphore(file_path, doc_type) for file_path, doc_type in files_to_load)
+        )
+        results["success"] = sum(1 for ok in outcomes if ok)
+        results["failed"] = len(outcomes) - results["success"]
         
         logger.info(f"📚 Carga completa: {results['success']} exitosos, {results['failed']} fallidos")
         return results
@@ -277,7 +339,9 @@ class KnowledgeBaseService:
                 params.extend(doc_types)
             
             # Búsqueda híbrida: vector + texto
-            async with pool.acquire() as conn:
+            async with pool.acquire() as conn, conn.transaction():
+                # Perfil HNSW por defecto (ef_search + escaneo iterativo si está disponible)
+                await self.db_service.apply_vector_search_profile(conn, limit=limit * 2)
                 results = await conn.fetch(f"""
                     WITH vector_search AS (
                         SELECT 
@@ -328,7 +392,7 @@ class KnowledgeBaseService:
                         "title": row["title"],
                         "content": row["content"],
                         "doc_type": row["doc_type"],
-                        "metadata": json.loads(row["metadata"]) if row["metadata"] else {},
+                        "metadata": json_codec.from_db(row["metadata"], {}),
                         "score": float(row["combined_score"])
                     })
                 
@@ -358,7 +422,7 @@ class KnowledgeBaseService:
                         "doc_id": row["doc_id"],
                         "title": row["title"],
                         "content": row["content"],
-                        "metadata": json.loads(row["metadata"]) if row["metadata"] else {}
+                        "metadata": json_codec.from_db(row["metadata"], {})
                     }
                     for row in results
                 ]
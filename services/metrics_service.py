@@ -5,11 +5,11 @@ Servicio de métricas y análisis para el chatbot
 import asyncio
 import asyncpg
 import uuid
-import json
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, List, Optional
 from collections import defaultdict
 import logging
+from services import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +28,8 @@ class MetricsService:
             self.pool = await asyncpg.create_pool(
                 self.database_url,
                 min_size=1,
-                max_size=10
+                max_size=10,
+                init=json_codec.register_json_codecs
             )
             logger.info("MetricsService inicializado correctamente")
         except Exception as e:
@@ -113,11 +114,11 @@ class MetricsService:
                     INSERT INTO conversations (
                         conversation_id, user_id, platform, 
                         channel_details, started_at, status, created_at, updated_at
-                    ) VALUES ($1, $2, $3, $4, NOW(), 'active', NOW(), NOW())
+                    ) VALUES ($1, $2, $3, $4::jsonb, NOW(), 'active', NOW(), NOW())
                     ON CONFLICT (conversation_id) DO UPDATE
                     SET status = 'active', updated_at = NOW()
                 """, conversation_id, user_id, platform, 
-                    json.dumps(channel_details or {}))
+                    channel_details or {})
                 
                 # Guardar en cache
                 self.active_conversations[conversation_id] = {
@@ -155,10 +156,10 @@ class MetricsService:
                     INSERT INTO conversation_messages (
                         conversation_id, message_id, sender_type, content,
                         intent, entities, confidence, response_time_ms, tools_used
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    ) VALUES ($1, $2, $3, $4, $5, $6::jsonb, $7, $8, $9::jsonb)
                 """, conversation_id, message_id, sender_type, content[:1000],  # Limitar contenido
-                    intent, json.dumps(entities or []), confidence,
-                    response_time_ms, json.dumps(tools_used or []))
+                    intent, entities or [], confidence,
+                    response_time_ms, tools_used or [])
                 
                 # Actualizar contadores en la conversación
                 if sender_type == 'user':
@@ -234,7 +235,7 @@ class MetricsService:
                         date, tool_name, total_calls,
                         successful_calls, failed_calls,
                         avg_execution_time_ms, error_messages
-                    ) VALUES ($1, $2, 1, $3, $4, $5, $6)
+                    ) VALUES ($1, $2, 1, $3, $4, $5, $6::jsonb)
                     ON CONFLICT (date, tool_name) DO UPDATE
                     SET total_calls = tool_metrics.total_calls + 1,
                         successful_calls = tool_metrics.successful_calls + $3,
@@ -252,7 +253,7 @@ class MetricsService:
                     1 if success else 0,
                     0 if success else 1,
                     execution_time_ms,
-                    json.dumps([error_message]) if error_message else None)
+                    [error_message] if error_message else None)
                 
             except Exception as e:
                 logger.error(f"Error tracking herramienta: {e}")
@@ -274,7 +275,7 @@ class MetricsService:
                     INSERT INTO popular_topics (
                         date, topic, category, count,
                         sample_queries, avg_resolution_time_minutes, success_rate
-                    ) VALUES ($1, $2, $3, 1, $4, $5, $6)
+                    ) VALUES ($1, $2, $3, 1, $4::jsonb, $5, $6)
                     ON CONFLICT (date, topic) DO UPDATE
                     SET count = popular_topics.count + 1,
                         sample_queries = 
@@ -293,7 +294,7 @@ class MetricsService:
                             (COALESCE(popular_topics.success_rate, 0) * popular_topics.count + $6) / (popular_topics.count + 1),
                         updated_at = NOW()
                 """, today, topic, category,
-                    json.dumps([query[:200]]),  # Limitar longitud de query
+                    [query[:200]],  # Limitar longitud de query
                     resolution_time_minutes,
                     100.0 if success else 0.0)
                 
@@ -317,9 +318,9 @@ class MetricsService:
                     INSERT INTO metric_events (
                         event_type, severity, title, description,
                         platform, conversation_id, metadata
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ) VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
                 """, event_type, severity, title, description,
-                    platform, conversation_id, json.dumps(metadata or {}))
+                    platform, conversation_id, metadata or {})
                 
                 logger.info(f"Evento registrado: {event_type} - {title}")
                 
@@ -520,7 +521,7 @@ class MetricsService:
                         'bot_messages': row['bot_messages_count'],
                         'avg_response_time_ms': float(row['avg_response_time_ms']) if row['avg_response_time_ms'] else None,
                         'satisfaction': row['user_satisfaction'],
-                        'channel_details': json.loads(row['channel_details']) if row['channel_details'] else {}
+                        'channel_details': json_codec.from_db(row['channel_details'], {})
                     }
                     for row in rows
                 ]
@@ -604,8 +605,8 @@ class MetricsService:
                     'bot_messages': row['bot_messages_count'],
                     'avg_response_time_ms': float(row['avg_response_time_ms']) if row['avg_response_time_ms'] else None,
                     'satisfaction': row['user_satisfaction'],
-                    'channel_details': json.loads(row['channel_details']) if row['channel_details'] else {},
-                    'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+                    'channel_details': json_codec.from_db(row['channel_details'], {}),
+                    'metadata': json_codec.from_db(row['metadata'], {})
                 }
                 
             except Exception as e:
@@ -638,10 +639,10 @@ class MetricsService:
                         'sender_type': row['sender_type'],
                         'content': row['content'],
                         'intent': row['intent'],
-                        'entities': json.loads(row['entities']) if row['entities'] else [],
+                        'entities': json_codec.from_db(row['entities'], []),
                         'confidence': float(row['confidence']) if row['confidence'] else None,
                         'response_time_ms': row['response_time_ms'],
-                        'tools_used': json.loads(row['tools_used']) if row['tools_used'] else [],
+                        'tools_used': json_codec.from_db(row['tools_used'], []),
                         'timestamp': row['created_at'].isoformat() if row['created_at'] else None
                     }
                     for row in rows
@@ -759,7 +760,7 @@ class MetricsService:
                         'bot_messages': row['bot_messages_count'],
                         'avg_response_time_ms': float(row['avg_response_time_ms']) if row['avg_response_time_ms'] else None,
                         'satisfaction': row['user_satisfaction'],
-                        'channel_details': json.loads(row['channel_details']) if row['channel_details'] else {}
+                        'channel_details': json_codec.from_db(row['channel_details'], {})
                     }
                     for row in rows
                 ]
@@ -9,6 +9,7 @@ import logging
 from typing import Dict, List, Set, Optional, Any
 from collections import defaultdict
 import json
+import math
 import re
 
 logger = logging.getLogger(__name__)
@@ -23,20 +24,24 @@ class ProductAttributesService:
         self.last_update = None
         
         # Patrones regex para extraer atributos del título/descripción
+        # Los números no pueden ir pegados a otra palabra o número ('IP65 Aluminio' no es
+        # 65A) y la unidad tiene que terminar ahí; admiten coma decimal ('2,5mm2')
         self.patterns = {
-            'amperaje': re.compile(r'(\d+(?:\.\d+)?)\s*[Aa](?:mp)?(?:perios?)?'),
+            'amperaje': re.compile(r'(?<![\w.,])(\d+(?:[.,]\d+)?)\s*(?:A|[Aa]mp(?:erios?)?)\b'),
             'voltaje': re.compile(r'(\d+)\s*[Vv](?:oltios?)?'),
             'potencia': re.compile(r'(\d+(?:\.\d+)?)\s*[KkWw][Ww]?'),
-            'seccion': re.compile(r'(\d+(?:\.\d+)?)\s*mm2?'),
-            'sensibilidad': re.compile(r'(\d+)\s*m[Aa]'),
-            'curva': re.compile(r'[Cc]urva\s*([A-Z])'),
-            'polos': re.compile(r'(\d)[Pp](?:\+[Nn])?'),
+            'seccion': re.compile(r'(?<![\d.,])(\d+(?:[.,]\d+)?)\s*mm(?:2|²)(?!\d)'),
+            'sensibilidad': re.compile(r'(?<![\w.,])(\d+)\s*m[Aa]\b'),
+            'curva': re.compile(r'\b[Cc]urva\s*([BCDK])\b'),
+            'polos': re.compile(r'(?<![\w.,])(\d)\s*[Pp](?:\s*\+\s*[Nn])?\b'),
             'fase': re.compile(r'(monof[aá]sico|trif[aá]sico|bif[aá]sico)'),
-            'ip': re.compile(r'IP\s*(\d{2})'),
+            'ip': re.compile(r'\bIP\s*(\d{2})\b'),
             'temperatura': re.compile(r'(\d+)\s*°[CcFf]'),
             'frecuencia': re.compile(r'(\d+)\s*[Hh]z'),
             'longitud': re.compile(r'(\d+(?:\.\d+)?)\s*(?:m|metros?|cm|mm)')
         }
+        # Códigos de protección IP/IK: se quitan del texto antes de buscar el resto de atributos
+        self.protection_code_pattern = re.compile(r'\b(?:IP|IK)\s*\d{2}\b', re.IGNORECASE)
         
         # Marcas conocidas de material eléctrico
         self.known_brands = {
@@ -49,6 +54,17 @@ class ProductAttributesService:
             'Jung', 'Gira', 'Busch-Jaeger', 'Berker', 'Merten'
         }
         
+        # Facetas normalizadas que se guardan en product_facets durante la sincronización
+        # (faceta -> atributo técnico del que sale y nombres de atributo de WooCommerce)
+        self.facet_sources = {
+            'amperaje': ('amperaje', ['amper', 'intensidad']),
+            'polos': ('polos', ['polo']),
+            'curva': ('curva', ['curva']),
+            'sensibilidad': ('sensibilidad', ['sensibilidad']),
+            'ip': ('ip', ['ip', 'protección', 'proteccion']),
+            'seccion': ('seccion', ['sección', 'seccion'])
+        }
+        
         # Tipos de productos y sus atributos típicos
         self.product_type_attributes = {
             'automático': ['amperaje', 'curva', 'polos', 'poder_corte', 'marca'],
@@ -133,9 +149,10 @@ class ProductAttributesService:
         """Extrae la marca del título o metadata"""
         title_lower = title.lower()
         
-        # Buscar en marcas conocidas
-        for brand in self.known_brands:
-            if brand.lower() in title_lower:
+        # Buscar en marcas conocidas, como palabra completa ('genérico' no es GE) y la
+        # más larga primero ('Schneider Electric' antes que 'Schneider')
+        for brand in sorted(self.known_brands, key=lambda b: (-len(b), b)):
+            if re.search(rf'\b{re.escape(brand.lower())}\b', title_lower):
                 return brand
         
         # Buscar en metadata
@@ -153,19 +170,20 @@ class ProductAttributesService:
     def _extract_technical_attributes(self, text: str) -> Dict[str, Set[str]]:
         """Extrae atributos técnicos del texto usando regex"""
         attributes = defaultdict(set)
+        without_codes = self.protection_code_pattern.sub(' ', text)
         
         for attr_type, pattern in self.patterns.items():
-            matches = pattern.findall(text)
+            matches = pattern.findall(text if attr_type == 'ip' else without_codes)
             if matches:
                 # Formatear según el tipo
                 if attr_type == 'amperaje':
-                    attributes[attr_type].update([f"{m}A" for m in matches])
+                    attributes[attr_type].update([f"{m.replace(',', '.')}A" for m in matches])
                 elif attr_type == 'voltaje':
                     attributes[attr_type].update([f"{m}V" for m in matches])
                 elif attr_type == 'potencia':
                     attributes[attr_type].update([f"{m}W" if 'w' in m.lower() else f"{m}kW" for m in matches])
                 elif attr_type == 'seccion':
-                    attributes[attr_type].update([f"{m}mm²" for m in matches])
+                    attributes[attr_type].update([f"{m.replace(',', '.')}mm²" for m in matches])
                 elif attr_type == 'sensibilidad':
                     attributes[attr_type].update([f"{m}mA" for m in matches])
                 elif attr_type == 'polos':
@@ -206,6 +224,107 @@ class ProductAttributesService:
         
         return None
     
+    def extract_facets(self, title: str, metadata: Dict) -> Dict[str, List[str]]:
+        """
+        Extraer facetas normalizadas de un producto (una vez, en la sincronización)
+        Returns: {'marca': ['ABB'], 'tipo': ['diferencial'], 'amperaje': ['40A'], ...}
+        """
+        metadata = metadata or {}
+        facets: Dict[str, Set[str]] = defaultdict(set)
+        
+        brand = self._extract_brand(title, metadata)
+        if brand:
+            facets['marca'].add(brand)
+        
+        categories = metadata.get('categories', [])
+        product_type = self._identify_product_type(title, categories if isinstance(categories, list) else [])
+        if product_type:
+            facets['tipo'].add(product_type)
+        
+        technical = self._extract_technical_attributes(title)
+        wc_attributes = metadata.get('attributes', {})
+        if not isinstance(wc_attributes, dict):
+            wc_attributes = {}
+        
+        for facet, (technical_key, wc_names) in self.facet_sources.items():
+            facets[facet].update(technical.get(technical_key, set()))
+            for attr_name, attr_values in wc_attributes.items():
+                # Al inicio de palabra: 'Tipo' no es el atributo 'ip'
+                if (any(re.search(rf'\b{re.escape(name)}', attr_name.lower()) for name in wc_names)
+                        and isinstance(attr_values, list)):
+                    facets[facet].update(self.normalize_facet_value(facet, v) for v in attr_values)
+        
+        # Normalizar formato (p. ej. 'IP' + '65', curvas en mayúscula)
+        if facets.get('ip'):
+            facets['ip'] = {v if v.upper().startswith('IP') else f"IP{v}" for v in facets['ip']}
+        
+        return {facet: sorted(v for v in values if v) for facet, values in facets.items() if values}
+    
+    def normalize_facet_value(self, facet: str, value: Any) -> str:
+        """Normalizar un valor de atributo de WooCommerce al formato de la faceta"""
+        text = str(value).strip()
+        compact = text.replace(' ', '')
+        if facet == 'amperaje' and re.fullmatch(r'\d+(?:[.,]\d+)?[Aa]?', compact):
+            return compact.rstrip('Aa').replace(',', '.') + 'A'
+        if facet == 'polos' and re.fullmatch(r'\d[Pp]?(?:\+[Nn])?', compact):
+            return compact.upper() if 'p' in compact.lower() else f"{compact}P"
+        if facet == 'sensibilidad' and re.fullmatch(r'\d+(?:m[Aa])?', compact):
+            return compact.lower().replace('ma', '') + 'mA'
+        if facet == 'curva':
+            return compact.upper().replace('CURVA', '')
+        if facet == 'ip':
+            return compact.upper()
+        return text
+    
+    def choose_split_facet(
+        self,
+        distribution: Dict[str, Dict[str, Any]],
+        total_results: int,
+        exclude: Optional[Set[str]] = None,
+        max_options: int = 8
+    ) -> Optional[str]:
+        """
+        Elegir la faceta que mejor divide un conjunto de resultados
+        Puntuación = cobertura (fracción de resultados con la faceta) x entropía de sus
+        valores en bits (limitada a log2(max_options) para no premiar listas enormes)
+        """
+        exclude = exclude or set()
+        best_facet, best_score = None, 0.0
+        
+        for facet, entry in distribution.items():
+            values = entry.get("values", {})
+            if facet in exclude or len(values) < 2 or not total_results:
+                continue
+            
+            counted = sum(values.values())
+            entropy = -sum((c / counted) * math.log2(c / counted) for c in values.values() if c)
+            coverage = min(1.0, entry.get("products", counted) / total_results)
+            score = coverage * min(entropy, math.log2(max_options))
+            
+            if score > best_score:
+                best_facet, best_score = facet, score
+        
+        return best_facet
+    
+    def build_facet_question(
+        self,
+        facet: str,
+        distribution: Dict[str, Dict[str, Any]],
+        max_options: int = 10
+    ) -> Dict[str, Any]:
+        """Pregunta de refinamiento para una faceta con las opciones más frecuentes primero"""
+        values = distribution.get(facet, {}).get("values", {})
+        options = sorted(values, key=lambda v: (-values[v], v))[:max_options]
+        return self._format_attribute_question(facet, options)
+    
+    async def get_result_facets(self, db_service, external_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Distribución de facetas de un conjunto de resultados (una consulta GROUP BY)"""
+        try:
+            return await db_service.get_facet_distribution(external_ids)
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo facetas de resultados: {e}")
+            return {}
+    
     def suggest_next_filter(
         self, 
         current_attributes: Dict[str, Any],
@@ -282,42 +401,83 @@ class ProductAttributesService:
         }
     
     async def update_cache_from_database(self, db_service):
-        """Actualiza la caché de atributos desde la base de datos"""
+        """
+        Actualiza la caché de atributos desde la tabla de facetas (catálogo completo)
+        Si la tabla aún está vacía, la rellena una vez a partir de los productos activos
+        """
         try:
+            distribution = await db_service.get_facet_distribution()
+            if not distribution:
+                await self.rebuild_facets(db_service)
+                distribution = await db_service.get_facet_distribution()
+            
             async with db_service.pool.acquire() as conn:
-                # Obtener muestra de productos para análisis
-                products = await conn.fetch("""
-                    SELECT title, metadata, content_type
-                    FROM knowledge_base
-                    WHERE content_type = 'product'
-                    AND is_active = true
-                    LIMIT 1000
+                price_row = await conn.fetchrow("""
+                    SELECT MIN(price) FILTER (WHERE price > 0) AS min_price, MAX(price) AS max_price
+                    FROM product_live_state
                 """)
-                
-                # Procesar productos
-                products_list = []
-                for row in products:
-                    metadata = json.loads(row['metadata']) if isinstance(row['metadata'], str) else row['metadata']
-                    products_list.append({
-                        'title': row['title'],
-                        'metadata': metadata or {}
-                    })
-                
-                # Extraer atributos
-                attributes = await self.extract_attributes_from_products(products_list)
-                
-                # Actualizar caché
-                self.attributes_cache = attributes
-                self.brands_cache = set(attributes.get('brands', []))
-                
-                logger.info(f"✅ Caché de atributos actualizada: {len(self.brands_cache)} marcas, {len(attributes.get('technical', {}))} tipos de atributos")
-                
-                return True
+                total_products = await conn.fetchval("""
+                    SELECT COUNT(*) FROM knowledge_base
+                    WHERE content_type = 'product' AND is_active = true
+                """)
+            
+            def values_of(facet: str) -> List[str]:
+                return sorted(distribution.get(facet, {}).get("values", {}).keys())
+            
+            attributes = {
+                'brands': values_of('marca'),
+                'technical': {
+                    facet: values_of(facet)
+                    for facet in distribution if facet not in ('marca', 'tipo')
+                },
+                'categories': [],
+                'product_types': values_of('tipo'),
+                'price_range': {
+                    'min': (price_row['min_price'] if price_row else None) or 0,
+                    'max': (price_row['max_price'] if price_row else None) or 0
+                },
+                'total_products': total_products or 0
+            }
+            
+            # Actualizar caché
+            self.attributes_cache = attributes
+            self.brands_cache = set(attributes['brands'])
+            
+            logger.info(f"✅ Caché de atributos actualizada: {len(self.brands_cache)} marcas, {len(attributes['technical'])} tipos de atributos")
+            
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Error actualizando caché de atributos: {e}")
             return False
     
+    async def rebuild_facets(self, db_service, batch_size: int = 500) -> int:
+        """Recalcular las facetas de todos los productos activos (relleno inicial)"""
+        total = 0
+        last_id = 0
+        while True:
+            async with db_service.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, external_id, title, metadata
+                    FROM knowledge_base
+                    WHERE content_type = 'product' AND is_active = true
+                    AND external_id IS NOT NULL AND id > $1
+                    ORDER BY id
+                    LIMIT $2
+                """, last_id, batch_size)
+            if not rows:
+                break
+            
+            facets_by_id = {}
+            for row in rows:
+                metadata = json.loads(row['metadata']) if isinstance(row['metadata'], str) else row['metadata']
+                facets_by_id[row['external_id']] = self.extract_facets(row['title'], metadata or {})
+            total += await db_service.replace_product_facets(facets_by_id)
+            last_id = rows[-1]['id']
+        
+        logger.info(f"✅ Facetas recalculadas: {total} valores")
+        return total
+    
     def get_brand_suggestions(self, partial_brand: str = None) -> List[str]:
         """Obtiene sugerencias de marcas basadas en entrada parcial"""
         if not partial_brand:
@@ -0,0 +1,87 @@
+"""
+Cache LRU de fragmentos renderizados de tarjetas de producto
+Los formateadores de WordPress y WhatsApp guardan aquí el HTML/texto de cada tarjeta
+por (external_id, plataforma) junto con la versión de los datos con que se generó
+(precio, oferta, stock, título...). Una versión distinta vuelve a renderizar y
+sustituye el fragmento; la sincronización invalida los productos que cambian.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from config.settings import PRODUCT_CARD_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class ProductCardCache:
+    """Fragmentos de tarjeta por producto y plataforma con desalojo LRU"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or PRODUCT_CARD_CACHE_CONFIG["max_entries"]
+        # (external_id, plataforma) -> (versión, fragmento)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, str]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get_or_render(self, external_id: Optional[str], platform: str, version: str,
+                      render: Callable[[], str]) -> str:
+        """
+        Devolver el fragmento cacheado si la versión coincide; si no, renderizarlo y guardarlo
+        Sin external_id no hay clave estable y se renderiza siempre
+        """
+        if not external_id:
+            return render()
+
+        key = (external_id, platform)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+        self._stats["misses"] += 1
+        fragment = render()
+        self._entries[key] = (version, fragment)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+        return fragment
+
+    def invalidate(self, external_ids: Iterable[str]) -> int:
+        """
+        Eliminar los fragmentos de los productos indicados (todas las plataformas)
+        Returns: número de fragmentos eliminados
+        """
+        ids = set(external_ids)
+        if not ids or not self._entries:
+            return 0
+
+        keys = [key for key in self._entries if key[0] in ids]
+        for key in keys:
+            del self._entries[key]
+
+        self._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        """Vaciar la cache (p. ej. tras desactivar productos sin conocer sus IDs)"""
+        self._stats["invalidations"] += len(self._entries)
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Aciertos, fallos y ocupación"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0
+        }
+
+
+# Instancia global
+product_card_cache = ProductCardCache()
@@ -0,0 +1,368 @@
+"""
+Vecinos más cercanos precalculados por producto
+Un job en segundo plano calcula el top-K de productos similares (coseno sobre los
+embeddings, NumPy float32 por lotes) y lo guarda en product_neighbors. Los refrescos
+son incrementales: solo se recalculan los productos cuyo texto cambió, los que
+apuntaban a productos cambiados o retirados y los que ahora tendrían uno de los
+cambiados entre sus vecinos. "Productos similares" pasa a ser una lectura por clave.
+Antes de cargar los embeddings se comparan huellas de texto y productos activos en
+la base de datos (sin cambios no se transfiere nada), y un advisory lock hace que
+solo un worker refresque a la vez. Los embeddings se leen en binario como float32 y
+por lotes: un refresco incremental solo mantiene en memoria las filas cambiadas y las
+que hay que recalcular, y recorre el resto del catálogo en streaming.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config.settings import PRODUCT_NEIGHBORS_CONFIG
+from services.database import HybridDatabaseService, db_service
+from services.tracing_service import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ProductNeighborsService:
+    """Cálculo y mantenimiento de las listas de productos similares"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        config = config or PRODUCT_NEIGHBORS_CONFIG
+        self.top_k = config["top_k"]
+        self.min_similarity = config["min_similarity"]
+        self.batch_size = config["batch_size"]
+        self.refresh_interval = config["refresh_interval"]
+        self.lock_name = "product_neighbors"  # Clave del advisory lock entre workers
+
+        self._lock = asyncio.Lock()
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
+        self._stats = {
+            "refreshes": 0,
+            "last_refresh": None,
+            "last_duration": 0.0,
+            "last_recomputed": 0,
+            "products": 0
+        }
+
+    async def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Recalcular las listas de vecinos pendientes (todas si full=True)
+        Returns: resumen del refresco
+        """
+        async with self._lock, db_service.pool.acquire() as lock_conn:
+            locked = await lock_conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", self.lock_name)
+            if not locked:
+                logger.debug("🧭 Otro worker está refrescando los vecinos de productos")
+                return {"products": self._stats["products"], "recomputed": 0, "removed": 0, "skipped": True}
+            try:
+                return await self._refresh_locked(full)
+            finally:
+                await lock_conn.execute("SELECT pg_advisory_unlock(hashtext($1))", self.lock_name)
+
+    async def _refresh_locked(self, full: bool) -> Dict[str, Any]:
+        """Refresco con el advisory lock adquirido"""
+        if not full:
+            changed, removed = await db_service.count_neighbor_changes()
+            if not changed and not removed:
+                return {"products": self._stats["products"], "recomputed": 0, "removed": 0}
+
+        started = time.monotonic()
+        with tracer.span("neighbors.refresh", full=full) as span:
+            products, stored = await db_service.get_neighbor_catalog()
+            ids = [external_id for external_id, _ in products]
+            hashes = [text_hash for _, text_hash in products]
+            index = {external_id: row for row, external_id in enumerate(ids)}
+            remove_ids = [external_id for external_id in stored if external_id not in index]
+
+            if len(ids) < 2:
+                await db_service.upsert_product_neighbors([], remove_ids)
+                return {"products": len(ids), "recomputed": 0, "removed": len(remove_ids)}
+
+            if full:
+                computed = await self._compute_all(index)
+            else:
+                computed = await self._compute_incremental(ids, hashes, index, stored)
+
+            rows = [
+                (ids[row], hashes[row], [ids[i] for i in neighbors], scores)
+                for row, (neighbors, scores) in computed.items()
+            ]
+            await db_service.upsert_product_neighbors(rows, remove_ids)
+            span.set_attributes(products=len(ids), recomputed=len(rows), removed=len(remove_ids))
+
+        duration = time.monotonic() - started
+        self._stats.update({
+            "refreshes": self._stats["refreshes"] + 1,
+            "last_refresh": time.time(),
+            "last_duration": round(duration, 2),
+            "last_recomputed": len(rows),
+            "products": len(ids)
+        })
+        if rows or remove_ids:
+            logger.info(f"🧭 Vecinos de productos: {len(rows)} recalculados, {len(remove_ids)} eliminados "
+                        f"({len(ids)} productos, {duration:.1f}s)")
+        return {"products": len(ids), "recomputed": len(rows), "removed": len(remove_ids)}
+
+    async def _stream(self, index: Dict[str, int], external_ids: Optional[List[str]] = None):
+        """
+        Embeddings por lotes como (filas del catálogo, matriz float32 normalizada)
+        Los productos que aparecieron después de leer el catálogo se ignoran
+        """
+        batches = db_service.iter_neighbor_embeddings(external_ids, batch_size=self.batch_size)
+        async with aclosing(batches):
+            async for batch_ids, vectors in batches:
+                rows = np.asarray([index.get(external_id, -1) for external_id in batch_ids])
+                keep = rows >= 0
+                if keep.any():
+                    yield rows[keep], self._normalize(vectors[keep])
+
+    async def _load_rows(self, index: Dict[str, int], ids: List[str], rows: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Solo los embeddings de las filas indicadas: (filas cargadas, matriz)"""
+        loaded_rows, parts = [], []
+        async for batch_rows, vectors in self._stream(index, [ids[row] for row in rows]):
+            loaded_rows.append(batch_rows)
+            parts.append(vectors)
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(loaded_rows), np.concatenate(parts)
+
+    async def _compute_all(self, index: Dict[str, int]) -> Dict[int, Tuple[List[int], List[float]]]:
+        """Refresco completo: una matriz float32 con todo el catálogo y top-K de todas las filas"""
+        matrix = None
+        loaded = np.zeros(len(index), dtype=bool)
+        async for rows, vectors in self._stream(index):
+            if matrix is None:
+                matrix = np.zeros((len(index), vectors.shape[1]), dtype=np.float32)
+            matrix[rows] = vectors
+            loaded[rows] = True
+
+        present = np.nonzero(loaded)[0]
+        if len(present) < 2:
+            return {}
+        if len(present) < len(index):
+            matrix = matrix[present]  # Productos desactivados mientras se leía el catálogo
+
+        computed = await asyncio.to_thread(self._compute_top_k, matrix, list(range(len(present))))
+        return {
+            int(present[row]): ([int(present[i]) for i in neighbors], scores)
+            for row, (neighbors, scores) in computed.items()
+        }
+
+    async def _compute_incremental(
+        self,
+        ids: List[str],
+        hashes: List[Optional[str]],
+        index: Dict[str, int],
+        stored: Dict[str, Dict[str, Any]]
+    ) -> Dict[int, Tuple[List[int], List[float]]]:
+        """
+        Refresco incremental sin tener el catálogo entero en memoria: se cargan solo los
+        embeddings de las filas cambiadas y de las filas a recalcular, y el resto se recorre
+        por lotes (una pasada para detectar filas afectadas y otra para su top-K)
+        """
+        changed, dirty = self._find_dirty(ids, hashes, stored)
+        if len(changed) * 2 > len(ids):
+            return await self._compute_all(index)
+
+        if changed:
+            # Filas para las que un producto cambiado supera ahora a su último vecino
+            thresholds = self._entry_thresholds(ids, stored)
+            changed_rows, changed_matrix = await self._load_rows(index, ids, changed)
+            best = np.full(len(ids), -1.0, dtype=np.float32)
+            if len(changed_rows):
+                async for rows, vectors in self._stream(index):
+                    sims = await asyncio.to_thread(np.matmul, changed_matrix, vectors.T)
+                    best[rows] = np.maximum(best[rows], sims.max(axis=0))
+            dirty.update(int(row) for row in np.nonzero(best > thresholds)[0])
+
+        if not dirty:
+            return {}
+        if len(dirty) * 2 > len(ids):
+            return await self._compute_all(index)
+
+        dirty_rows, dirty_matrix = await self._load_rows(index, ids, sorted(dirty))
+        if not len(dirty_rows):
+            return {}
+
+        k = min(self.top_k, len(ids) - 1)
+        top_scores = np.full((len(dirty_rows), k), -np.inf, dtype=np.float32)
+        top_rows = np.full((len(dirty_rows), k), -1, dtype=np.int64)
+        async for rows, vectors in self._stream(index):
+            await asyncio.to_thread(self._merge_top_k, dirty_rows, dirty_matrix, rows, vectors, top_scores, top_rows)
+
+        return self._finish_top_k(dirty_rows, top_rows, top_scores)
+
+    def _find_dirty(
+        self,
+        ids: List[str],
+        hashes: List[Optional[str]],
+        stored: Dict[str, Dict[str, Any]]
+    ) -> Tuple[List[int], Set[int]]:
+        """
+        Filas cambiadas y filas a recalcular que se deducen sin embeddings:
+        - productos sin lista o cuyo texto (y por tanto embedding) cambió
+        - listas que contienen productos cambiados o ya no activos
+        """
+        changed = [
+            row for row, external_id in enumerate(ids)
+            if external_id not in stored
+            or (hashes[row] is not None and stored[external_id]["source_hash"] != hashes[row])
+        ]
+        changed_ids = {ids[row] for row in changed}
+        active = set(ids)
+        dirty = set(changed)
+
+        for row, external_id in enumerate(ids):
+            entry = stored.get(external_id)
+            if entry and any(n not in active or n in changed_ids for n in entry["neighbor_ids"]):
+                dirty.add(row)
+
+        return changed, dirty
+
+    def _entry_thresholds(self, ids: List[str], stored: Dict[str, Dict[str, Any]]) -> np.ndarray:
+        """Umbral de entrada por fila: la última similitud guardada si la lista está llena"""
+        thresholds = np.full(len(ids), self.min_similarity, dtype=np.float32)
+        for row, external_id in enumerate(ids):
+            entry = stored.get(external_id)
+            if entry and len(entry["scores"]) >= self.top_k:
+                thresholds[row] = max(self.min_similarity, entry["scores"][-1])
+        return thresholds
+
+    def _merge_top_k(
+        self,
+        query_rows: np.ndarray,
+        queries: np.ndarray,
+        rows: np.ndarray,
+        vectors: np.ndarray,
+        top_scores: np.ndarray,
+        top_rows: np.ndarray
+    ):
+        """Fusionar un lote del catálogo con el top-K acumulado de cada fila consultada"""
+        k = top_scores.shape[1]
+        for start in range(0, len(query_rows), self.batch_size):
+            end = start + self.batch_size
+            sims = queries[start:end] @ vectors.T
+            sims[query_rows[start:end, None] == rows[None, :]] = -np.inf  # excluirse a sí mismo
+
+            scores = np.concatenate([top_scores[start:end], sims], axis=1)
+            candidates = np.concatenate(
+                [top_rows[start:end], np.broadcast_to(rows, sims.shape)], axis=1
+            )
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores[start:end] = np.take_along_axis(scores, best, axis=1)
+            top_rows[start:end] = np.take_along_axis(candidates, best, axis=1)
+
+    def _finish_top_k(
+        self,
+        query_rows: np.ndarray,
+        top_rows: np.ndarray,
+        top_scores: np.ndarray
+    ) -> Dict[int, Tuple[List[int], List[float]]]:
+        """Ordenar el top-K acumulado y aplicar la similitud mínima"""
+        order = np.argsort(-top_scores, axis=1)
+        top_rows = np.take_along_axis(top_rows, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        result = {}
+        for row, neighbors, scores in zip(query_rows, top_rows, top_scores):
+            keep = scores >= self.min_similarity
+            result[int(row)] = (
+                [int(i) for i in neighbors[keep]],
+                [round(float(s), 4) for s in scores[keep]]
+            )
+        return result
+
+    def _normalize(self, matrix: np.ndarray) -> np.ndarray:
+        """Filas normalizadas (producto escalar = similitud coseno)"""
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _compute_top_k(self, matrix: np.ndarray, rows: List[int]) -> Dict[int, Tuple[List[int], List[float]]]:
+        """Top-K por fila mediante multiplicación por lotes y argpartition"""
+        k = min(self.top_k, matrix.shape[0] - 1)
+        result = {}
+
+        for start in range(0, len(rows), self.batch_size):
+            chunk = np.asarray(rows[start:start + self.batch_size])
+            sims = matrix[chunk] @ matrix.T
+            sims[np.arange(len(chunk)), chunk] = -np.inf  # excluirse a sí mismo
+
+            candidates = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            candidate_scores = np.take_along_axis(sims, candidates, axis=1)
+            order = np.argsort(-candidate_scores, axis=1)
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+            for row, neighbors, scores in zip(chunk, candidates, candidate_scores):
+                keep = scores >= self.min_similarity
+                result[int(row)] = (
+                    [int(i) for i in neighbors[keep]],
+                    [round(float(s), 4) for s in scores[keep]]
+                )
+
+        return result
+
+    async def get_similar_products(
+        self,
+        external_id: str,
+        limit: int = 5,
+        db: Optional[HybridDatabaseService] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Productos similares desde las listas precalculadas
+        Si el producto aún no tiene lista se hace una búsqueda vectorial en vivo
+        Args:
+            db: servicio de base de datos a usar (por defecto el global; las herramientas MCP
+                pasan el suyo porque en ese proceso el global no se inicializa)
+        """
+        db = db or db_service
+        limit = min(limit, self.top_k)
+        neighbors = await db.get_product_neighbors(external_id, limit)
+        if neighbors is not None:
+            return neighbors
+
+        logger.info(f"⚠️ Sin vecinos precalculados para {external_id}, búsqueda vectorial en vivo")
+        return await db.find_similar_by_external_id(external_id, limit, content_types=["product"])
+
+    def start_worker(self):
+        """Arrancar el refresco periódico en segundo plano"""
+        if self._running:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop_worker(self):
+        """Detener el refresco periódico"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+    async def _worker_loop(self):
+        while self._running:
+            try:
+                if db_service.initialized:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error refrescando vecinos de productos: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado del último refresco"""
+        return {**self._stats, "running": self._running, "top_k": self.top_k}
+
+
+# Instancia global
+product_neighbors_service = ProductNeighborsService()
@@ -0,0 +1,399 @@
+"""
+Métricas de runtime en formato Prometheus
+Reúne lo que el /health booleano no ve: ocupación y espera de cada pool de conexiones,
+retraso del event loop, turnos del agente en curso, profundidad de las colas e
+histogramas de latencia de OpenAI, WooCommerce, 360Dialog y cada modo de búsqueda.
+Las latencias salen de los spans del trazador (tracer.add_listener), así que cualquier
+etapa ya instrumentada con tracer.span queda medida sin tocar su código.
+Un worker muestrea el event loop y sondea pools y colas en segundo plano; /metrics y
+/health/ready solo leen los últimos valores.
+Cada proceso de uvicorn expone solo sus propias métricas: todas las series llevan la
+etiqueta worker (pid) para que Prometheus no mezcle los contadores de varios procesos;
+las consultas agregan con sum o max sin esa etiqueta.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import settings, RUNTIME_METRICS_CONFIG
+from services.tracing_service import Span, tracer
+
+logger = logging.getLogger(__name__)
+
+# Modo de búsqueda de cada span SQL de primer nivel
+SEARCH_SPANS = {
+    "sql.hybrid_search": "hybrid",
+    "sql.vector_search": "vector",
+    "sql.text_search": "text",
+    "sql.exact_sku": "exact_sku"
+}
+
+# Servicio externo según el prefijo del span
+UPSTREAM_PREFIXES = (
+    ("llm.", "openai"),
+    ("embedding.", "openai"),
+    ("woocommerce.", "woocommerce"),
+    ("whatsapp.", "360dialog")
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class LatencyHistogram:
+    """Histograma acumulado (para Prometheus) más una ventana móvil para percentiles"""
+
+    def __init__(self, buckets: Tuple[float, ...], window_seconds: float):
+        self.buckets = buckets
+        self.window_seconds = window_seconds
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self._recent: deque = deque(maxlen=5000)  # (monotonic, segundos)
+
+    def observe(self, seconds: float, error: bool = False):
+        index = bisect_left(self.buckets, seconds)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+        self._recent.append((time.monotonic(), seconds))
+
+    def recent(self) -> List[float]:
+        """Observaciones dentro de la ventana móvil"""
+        cutoff = time.monotonic() - self.window_seconds
+        return [value for ts, value in self._recent if ts >= cutoff]
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Percentil `q` de las observaciones dentro de la ventana móvil"""
+        values = sorted(self.recent())
+        if not values:
+            return None
+        return values[int(q * (len(values) - 1))]
+
+
+class RuntimeMetrics:
+    """Registro de métricas del proceso y muestreo en segundo plano"""
+
+    def __init__(self):
+        self.buckets = tuple(RUNTIME_METRICS_CONFIG["latency_buckets"])
+        self.window_seconds = RUNTIME_METRICS_CONFIG["latency_window"]
+        self.lag_interval = RUNTIME_METRICS_CONFIG["lag_interval"]
+        self.probe_interval = RUNTIME_METRICS_CONFIG["probe_interval"]
+        self.probe_timeout = RUNTIME_METRICS_CONFIG["probe_timeout"]
+        self.worker = str(os.getpid())
+
+        # (métrica, etiquetas) -> histograma
+        self._histograms: Dict[Tuple[str, Labels], LatencyHistogram] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._pools: Dict[str, Callable[[], Any]] = {}
+        self._queues: Dict[str, Callable[[], Awaitable[int]]] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+        # Últimas muestras del worker
+        self._loop_lag = 0.0
+        self._loop_lag_recent: deque = deque(maxlen=max(1, int(60 / self.lag_interval)))
+        self._pool_wait: Dict[str, float] = {}
+        self._queue_depth: Dict[str, int] = {}
+
+        self._running = False
+        self._tasks: List[asyncio.Task] = []
+
+        tracer.add_listener(self.observe_span)
+
+    # ------------------------------------------------------------------
+    # Registro
+    # ------------------------------------------------------------------
+
+    def register_pool(self, name: str, getter: Callable[[], Any]):
+        """Pool asyncpg devuelto por `getter`; puede ser None si aún no existe"""
+        self._pools[name] = getter
+
+    def register_queue(self, name: str, depth: Callable[[], Awaitable[int]]):
+        """Cola persistida cuya profundidad se consulta en cada sondeo"""
+        self._queues[name] = depth
+
+    def register_gauge(self, name: str, help_text: str, value: Callable[[], float]):
+        """Valor instantáneo leído al servir /metrics (debe ser barato y síncrono)"""
+        self._gauges[name] = (help_text, value)
+
+    @contextmanager
+    def in_flight(self, name: str) -> Iterator[None]:
+        """Contar un bloque en curso (p.ej. turnos del agente)"""
+        self._in_flight[name] = self._in_flight.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            self._in_flight[name] -= 1
+
+    # ------------------------------------------------------------------
+    # Latencias
+    # ------------------------------------------------------------------
+
+    def observe(self, metric: str, seconds: float, error: bool = False, **labels: str):
+        """Registrar una duración en el histograma (métrica, etiquetas)"""
+        key = (metric, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = LatencyHistogram(self.buckets, self.window_seconds)
+        histogram.observe(seconds, error)
+
+    def observe_span(self, span: Span):
+        """Listener del trazador: clasifica el span como búsqueda, servicio externo o turno"""
+        seconds = span.duration_ms / 1000
+        error = span.status == "error"
+
+        mode = SEARCH_SPANS.get(span.name)
+        if mode:
+            self.observe("eva_search_latency_seconds", seconds, error, mode=mode)
+            return
+
+        if span.name == "agent.turn":
+            self.observe("eva_agent_turn_latency_seconds", seconds, error)
+            return
+
+        for prefix, upstream in UPSTREAM_PREFIXES:
+            if span.name.startswith(prefix):
+                self.observe("eva_upstream_latency_seconds", seconds, error,
+                             upstream=upstream, operation=span.name)
+                return
+
+    # ------------------------------------------------------------------
+    # Muestreo en segundo plano
+    # ------------------------------------------------------------------
+
+    def start_worker(self):
+        """Arrancar el muestreo del event loop y el sondeo de pools y colas"""
+        if self._running:
+            return
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._lag_loop()),
+            asyncio.create_task(self._probe_loop())
+        ]
+
+    async def stop_worker(self):
+        """Detener el muestreo"""
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _lag_loop(self):
+        """Retraso del event loop: cuánto tarda en despertar un sleep respecto a lo pedido"""
+        while self._running:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.monotonic() - started - self.lag_interval)
+            self._loop_lag = lag
+            self._loop_lag_recent.append(lag)
+            self.observe("eva_event_loop_lag_seconds", lag)
+
+    async def _probe_loop(self):
+        while self._running:
+            try:
+                await asyncio.gather(
+                    *(self._probe_pool(name, getter) for name, getter in self._pools.items()),
+                    *(self._probe_queue(name, depth) for name, depth in self._queues.items())
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error sondeando métricas de runtime: {e}")
+            await asyncio.sleep(self.probe_interval)
+
+    async def _probe_pool(self, name: str, getter: Callable[[], Any]):
+        """Tiempo que tarda en obtenerse una conexión del pool (lo que esperaría una petición nueva)"""
+        pool = getter()
+        if pool is None:
+            return
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._acquire_release(pool), timeout=self.probe_timeout)
+            self._pool_wait[name] = time.monotonic() - started
+        except asyncio.TimeoutError:
+            self._pool_wait[name] = self.probe_timeout
+            logger.warning(f"⚠️ Pool '{name}' sin conexiones libres tras {self.probe_timeout}s")
+        except Exception as e:
+            logger.error(f"❌ Error sondeando pool '{name}': {e}")
+
+    @staticmethod
+    async def _acquire_release(pool):
+        async with pool.acquire():
+            pass
+
+    async def _probe_queue(self, name: str, depth: Callable[[], Awaitable[int]]):
+        try:
+            self._queue_depth[name] = int(await depth())
+        except Exception as e:
+            logger.error(f"❌ Error consultando profundidad de la cola '{name}': {e}")
+
+    @staticmethod
+    def _pool_usage(pool) -> Dict[str, int]:
+        """Tamaño, conexiones en uso y máximo de un pool asyncpg"""
+        size = pool.get_size()
+        return {"size": size, "in_use": size - pool.get_idle_size(), "max": pool.get_max_size()}
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def get_pools(self) -> Dict[str, Dict[str, Any]]:
+        pools = {}
+        for name, getter in self._pools.items():
+            pool = getter()
+            if pool is None:
+                continue
+            try:
+                usage = self._pool_usage(pool)
+            except Exception as e:
+                logger.error(f"❌ Error leyendo el pool '{name}': {e}")
+                continue
+            usage["wait_seconds"] = round(self._pool_wait.get(name, 0.0), 4)
+            pools[name] = usage
+        return pools
+
+    def check_readiness(self) -> Dict[str, Any]:
+        """
+        Comparar las últimas muestras con los umbrales READINESS_*
+        Returns: {"ready": bool, "failures": [...], "checks": {...}}
+        """
+        failures = []
+
+        lag_ms = self._loop_lag * 1000
+        lag_histogram = self._histograms.get(("eva_event_loop_lag_seconds", ()))
+        lag_p99 = lag_histogram.quantile(0.99) if lag_histogram else None
+        if lag_ms > settings.READINESS_MAX_LOOP_LAG_MS:
+            failures.append(f"event loop lag {lag_ms:.0f}ms > {settings.READINESS_MAX_LOOP_LAG_MS}ms")
+
+        pools = self.get_pools()
+        for name, usage in pools.items():
+            wait_ms = usage["wait_seconds"] * 1000
+            if wait_ms > settings.READINESS_MAX_POOL_WAIT_MS:
+                failures.append(f"pool {name}: espera {wait_ms:.0f}ms > {settings.READINESS_MAX_POOL_WAIT_MS}ms")
+
+        turns = self._in_flight.get("agent_turns", 0)
+        if turns > settings.READINESS_MAX_INFLIGHT_TURNS:
+            failures.append(f"turnos en curso {turns} > {settings.READINESS_MAX_INFLIGHT_TURNS}")
+
+        return {
+            "ready": not failures,
+            "failures": failures,
+            "checks": {
+                "worker_running": self._running,
+                "event_loop_lag_ms": round(lag_ms, 1),
+                "event_loop_lag_p99_ms": round(lag_p99 * 1000, 1) if lag_p99 is not None else None,
+                "pools": pools,
+                "in_flight": dict(self._in_flight),
+                "queue_depth": dict(self._queue_depth)
+            }
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Resumen JSON: muestras actuales y p50/p95 de cada serie de latencia"""
+        latencies = {}
+        for (name, labels), histogram in self._histograms.items():
+            series = name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+            latencies[series] = {"count": histogram.count, "errors": histogram.errors}
+            for label, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                value = histogram.quantile(q)
+                latencies[series][label] = round(value * 1000, 1) if value is not None else None
+
+        return {
+            **self.check_readiness()["checks"],
+            "event_loop_lag_max_ms": round(max(self._loop_lag_recent, default=0.0) * 1000, 1),
+            "latency": latencies
+        }
+
+    def render_prometheus(self) -> str:
+        """Exposición en formato de texto de Prometheus (versión 0.0.4)"""
+        lines: List[str] = []
+        worker: Labels = (("worker", self.worker),)
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        pools = self.get_pools()
+        for name, field, help_text in (
+            ("eva_db_pool_size", "size", "Conexiones abiertas en el pool"),
+            ("eva_db_pool_in_use", "in_use", "Conexiones del pool en uso"),
+            ("eva_db_pool_max_size", "max", "Tamaño máximo del pool"),
+            ("eva_db_pool_acquire_wait_seconds", "wait_seconds", "Espera del último sondeo para obtener una conexión")
+        ):
+            metric(name, "gauge", help_text)
+            for pool_name, usage in pools.items():
+                lines.append(f"{name}{_labels(worker + (('pool', pool_name),))} {usage[field]}")
+
+        metric("eva_event_loop_lag_max_seconds", "gauge", "Retraso máximo del event loop en el último minuto")
+        lines.append(f"eva_event_loop_lag_max_seconds{_labels(worker)} {max(self._loop_lag_recent, default=0.0):.6f}")
+
+        metric("eva_in_flight", "gauge", "Operaciones en curso")
+        for name, value in self._in_flight.items():
+            lines.append(f"eva_in_flight{_labels(worker + (('operation', name),))} {value}")
+
+        metric("eva_queue_depth", "gauge", "Elementos pendientes en cada cola persistida")
+        for name, depth in self._queue_depth.items():
+            lines.append(f"eva_queue_depth{_labels(worker + (('queue', name),))} {depth}")
+
+        for name, (help_text, value) in self._gauges.items():
+            try:
+                current = float(value())
+            except Exception as e:
+                logger.error(f"❌ Error leyendo la métrica '{name}': {e}")
+                continue
+            metric(name, "gauge", help_text)
+            lines.append(f"{name}{_labels(worker)} {current:g}")
+
+        by_metric: Dict[str, List[Tuple[Labels, LatencyHistogram]]] = {}
+        for (name, labels), histogram in self._histograms.items():
+            by_metric.setdefault(name, []).append((labels, histogram))
+
+        for name, series in sorted(by_metric.items()):
+            metric(name, "histogram", "Duración en segundos")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(worker + labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(worker + labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(worker + labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(worker + labels)} {histogram.count}")
+
+            if not name.endswith("_latency_seconds"):
+                continue
+            errors_name = name.replace("_latency_seconds", "_errors_total")
+            metric(errors_name, "counter", "Operaciones terminadas con error")
+            for labels, histogram in series:
+                lines.append(f"{errors_name}{_labels(worker + labels)} {histogram.errors}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Labels) -> str:
+    """Etiquetas en la sintaxis de Prometheus, con los valores escapados"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Instancia global
+runtime_metrics = RuntimeMetrics()
@@ -0,0 +1,203 @@
+"""
+Filtros tipados para la búsqueda de productos
+Convierte las restricciones exactas de una consulta (marca, amperaje, polos, precio,
+stock...) en predicados SQL sobre product_facets y product_live_state que se aplican
+antes del ranking vectorial/textual, en lugar de filtrar candidatos después
+"""
+
+import re
+import logging
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.product_attributes_service import product_attributes_service
+
+logger = logging.getLogger(__name__)
+
+# Expresiones para extraer filtros del texto de la consulta
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+_CURRENCY = r'\s*(?:€|eur(?:os?)?\b)'
+FILTER_PATTERNS = {
+    'amperaje': re.compile(rf'\b{_NUMBER}(?:a|\s*amp(?:erios?)?)\b', re.IGNORECASE),
+    'sensibilidad': re.compile(r'\b(\d+)\s*(?:ma|miliamperios?)\b', re.IGNORECASE),
+    'polos': re.compile(r'\b(\d)(?:p|\s*polos?)\b(\s*\+\s*n\b)?', re.IGNORECASE),
+    'curva': re.compile(r'\bcurva\s*([bcdk])\b', re.IGNORECASE),
+    'ip': re.compile(r'\bip\s*(\d{2})\b', re.IGNORECASE),
+    'seccion': re.compile(rf'\b{_NUMBER}\s*mm(?:2|²)', re.IGNORECASE),
+    'price_range': re.compile(rf'\bentre\s+{_NUMBER}\s*(?:€|eur(?:os?)?)?\s+y\s+{_NUMBER}{_CURRENCY}', re.IGNORECASE),
+    'max_price': re.compile(
+        rf'\b(?:por\s+)?(?:menos\s+de|hasta|m[aá]ximo|por\s+debajo\s+de|inferior\s+a)\s+{_NUMBER}{_CURRENCY}',
+        re.IGNORECASE
+    ),
+    'min_price': re.compile(
+        rf'\b(?:m[aá]s\s+de|desde|m[ií]nimo|por\s+encima\s+de|superior\s+a)\s+{_NUMBER}{_CURRENCY}',
+        re.IGNORECASE
+    ),
+    'in_stock': re.compile(r'\b(?:en|con)\s+(?:stock|existencias?)\b', re.IGNORECASE)
+}
+
+
+@dataclass
+class ProductSearchFilters:
+    """
+    Restricciones exactas de una búsqueda de productos
+    Los valores de faceta usan el formato normalizado de product_facets
+    ('40A', '2P', '30mA', 'C', 'IP65'); el precio se compara con product_live_state
+    """
+    brands: List[str] = field(default_factory=list)
+    product_type: Optional[str] = None
+    amperaje: List[str] = field(default_factory=list)
+    polos: List[str] = field(default_factory=list)
+    sensibilidad: List[str] = field(default_factory=list)
+    curva: List[str] = field(default_factory=list)
+    ip: List[str] = field(default_factory=list)
+    seccion: List[str] = field(default_factory=list)
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: bool = False
+
+    FACET_FIELDS = ('amperaje', 'polos', 'sensibilidad', 'curva', 'ip', 'seccion')
+
+    def is_empty(self) -> bool:
+        """True si no hay ninguna restricción"""
+        return not (
+            self.brands or self.product_type or self.in_stock
+            or self.min_price is not None or self.max_price is not None
+            or any(getattr(self, facet) for facet in self.FACET_FIELDS)
+        )
+
+    def facet_constraints(self) -> Dict[str, List[str]]:
+        """Valores exigidos por faceta (sin marca), normalizados como en product_facets"""
+        constraints = {}
+        for facet in self.FACET_FIELDS:
+            values = getattr(self, facet)
+            if values:
+                constraints[facet] = sorted({
+                    product_attributes_service.normalize_facet_value(facet, v) for v in values
+                })
+        if self.product_type:
+            constraints['tipo'] = [self.product_type]
+        return constraints
+
+    def cache_key(self) -> str:
+        """Representación estable para claves de cache"""
+        if self.is_empty():
+            return ""
+        parts = []
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value in (None, False, [], ""):
+                continue
+            if isinstance(value, list):
+                value = ",".join(sorted(str(v).lower() for v in value))
+            parts.append(f"{f.name}={value}")
+        return "|".join(parts)
+
+    def to_sql(self, params: List[Any], id_column: str = "external_id") -> str:
+        """
+        Compilar los filtros a predicados SQL que añaden sus parámetros a `params`
+        Cada faceta es una semijoin contra idx_product_facets_facet_value y el precio/stock
+        una contra product_live_state, así el planificador puede empezar por el filtro
+        cuando es muy selectivo o recorrer el índice HNSW con escaneo iterativo si no lo es
+        """
+        predicates = []
+
+        if self.brands:
+            # La marca se guarda con su nombre completo ('Schneider Electric'): prefijo sin mayúsculas
+            params.append('marca')
+            params.append([f"{brand.strip()}%" for brand in self.brands])
+            predicates.append(
+                f"AND {id_column} IN (SELECT f.external_id FROM product_facets f "
+                f"WHERE f.facet = ${len(params) - 1} AND f.value ILIKE ANY(${len(params)}))"
+            )
+
+        for facet, values in self.facet_constraints().items():
+            params.append(facet)
+            params.append(values)
+            predicates.append(
+                f"AND {id_column} IN (SELECT f.external_id FROM product_facets f "
+                f"WHERE f.facet = ${len(params) - 1} AND f.value = ANY(${len(params)}))"
+            )
+
+        live_conditions = []
+        if self.min_price is not None:
+            params.append(float(self.min_price))
+            live_conditions.append(f"ls.price >= ${len(params)}")
+        if self.max_price is not None:
+            params.append(float(self.max_price))
+            live_conditions.append(f"ls.price <= ${len(params)}")
+        if self.in_stock:
+            live_conditions.append("ls.stock_status = 'instock'")
+        if live_conditions:
+            predicates.append(
+                f"AND {id_column} IN (SELECT ls.external_id FROM product_live_state ls "
+                f"WHERE {' AND '.join(live_conditions)})"
+            )
+
+        return " ".join(predicates)
+
+    @classmethod
+    def from_query(cls, query_text: str) -> Tuple["ProductSearchFilters", str]:
+        """
+        Extraer filtros exactos del texto de una consulta
+        Returns: (filtros, consulta sin las expresiones de precio/stock)
+        Las especificaciones técnicas y la marca se mantienen en el texto porque
+        también ayudan al ranking; precio y stock solo añaden ruido al embedding
+        """
+        filters = cls()
+        text = query_text or ""
+
+        for facet in cls.FACET_FIELDS:
+            for match in FILTER_PATTERNS[facet].finditer(text):
+                if facet == 'polos' and match.group(2):
+                    # Los títulos se indexan como '4P' aunque sean 4P+N: aceptar ambos
+                    filters.polos.extend(v for v in (f"{match.group(1)}P+N", f"{match.group(1)}P")
+                                         if v not in filters.polos)
+                    continue
+                if facet == 'polos':
+                    value = f"{match.group(1)}P"
+                elif facet == 'seccion':
+                    value = f"{match.group(1).replace(',', '.')}mm²"
+                elif facet == 'ip':
+                    value = f"IP{match.group(1)}"
+                else:
+                    value = match.group(1)
+                normalized = product_attributes_service.normalize_facet_value(facet, value)
+                if normalized not in getattr(filters, facet):
+                    getattr(filters, facet).append(normalized)
+
+        text_lower = text.lower()
+        brands = set(product_attributes_service.known_brands) | set(product_attributes_service.brands_cache)
+        for brand in sorted(brands, key=len, reverse=True):
+            if re.search(rf'\b{re.escape(brand.lower())}\b', text_lower):
+                # 'Schneider Electric' ya cubre 'Schneider' por prefijo
+                if not any(b.lower().startswith(brand.lower()) for b in filters.brands):
+                    filters.brands.append(brand)
+
+        def to_float(value: str) -> float:
+            return float(value.replace(',', '.'))
+
+        match = FILTER_PATTERNS['price_range'].search(text)
+        if match:
+            low, high = sorted((to_float(match.group(1)), to_float(match.group(2))))
+            filters.min_price, filters.max_price = low, high
+            text = text.replace(match.group(0), ' ')
+        else:
+            match = FILTER_PATTERNS['max_price'].search(text)
+            if match:
+                filters.max_price = to_float(match.group(1))
+                text = text.replace(match.group(0), ' ')
+            match = FILTER_PATTERNS['min_price'].search(text)
+            if match:
+                filters.min_price = to_float(match.group(1))
+                text = text.replace(match.group(0), ' ')
+
+        match = FILTER_PATTERNS['in_stock'].search(text)
+        if match:
+            filters.in_stock = True
+            text = text.replace(match.group(0), ' ')
+
+        cleaned = re.sub(r'\s+', ' ', text).strip() or (query_text or "").strip()
+        if not filters.is_empty():
+            logger.info(f"🧩 Filtros detectados en '{query_text}': {filters.cache_key()}")
+        return filters, cleaned
@@ -0,0 +1,338 @@
+"""
+Servicio de trazas ligeras para medir la latencia por etapa del agente
+Registra spans (clasificación de intención, llamadas LLM, embeddings, SQL,
+WooCommerce, formateo) en un buffer circular en memoria y, opcionalmente,
+los exporta como JSON compatible con OTLP a un fichero.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, Optional, List, Iterator
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Span activo en el contexto actual (se propaga a las tareas hijas de asyncio)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("eva_current_span", default=None)
+
+
+@dataclass
+class Span:
+    """Una etapa medida dentro de una traza"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        """Duración del span en milisegundos"""
+        if not self.end_ns:
+            return 0.0
+        return (self.end_ns - self.start_ns) / 1_000_000
+
+    def set_attribute(self, key: str, value: Any):
+        """Añade un atributo al span"""
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        """Añade varios atributos al span"""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación serializable del span"""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_ns / 1_000_000_000,
+            "duration_ms": round(self.duration_ms, 2),
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error
+        }
+
+
+class TracingService:
+    """
+    Trazador en memoria con exportación opcional a fichero OTLP-JSON
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        buffer_size: int = 2000,
+        export_file: Optional[str] = None,
+        service_name: str = "eva-agent"
+    ):
+        self.enabled = enabled
+        self.export_file = export_file
+        self.service_name = service_name
+
+        # Buffer circular de spans finalizados
+        self._spans: deque = deque(maxlen=buffer_size)
+        # Spans de trazas cuyo span raíz aún no ha terminado (para exportar la traza completa)
+        self._open_traces: Dict[str, List[Span]] = {}
+        self._max_open_traces = 1000
+        self._write_lock = threading.Lock()
+        # Callbacks que reciben cada span finalizado (p.ej. histogramas de latencia)
+        self._listeners: List[Callable[[Span], None]] = []
+
+    def add_listener(self, listener: Callable[[Span], None]):
+        """Registrar un callback síncrono que recibe cada span finalizado, aunque las trazas estén desactivadas"""
+        self._listeners.append(listener)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Mide un bloque de código como span hijo del span activo
+
+        Uso:
+            with tracer.span("intent_classification", model="gpt-5-mini") as span:
+                ...
+                span.set_attribute("intent", "product_search")
+        """
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes) -> Span:
+        """
+        Crea un span sin activarlo en el contexto
+        Útil en generadores asíncronos, donde no se puede restaurar el contexto entre yields
+        """
+        parent = parent or _current_span.get()
+        return Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start_ns=time.time_ns(),
+            attributes=dict(attributes)
+        )
+
+    def end_span(self, span: Span):
+        """Finaliza un span y lo registra"""
+        if not span.end_ns:
+            span.end_ns = time.time_ns()
+        self._record(span)
+
+    def record_span(self, name: str, duration_ms: float, **attributes) -> Optional[Span]:
+        """
+        Registra un span ya medido externamente (p.ej. PipelineContext.add_processing_time)
+        """
+        if not self.enabled and not self._listeners:
+            return None
+
+        end_ns = time.time_ns()
+        span = self.start_span(name, **attributes)
+        span.start_ns = end_ns - int(duration_ms * 1_000_000)
+        span.end_ns = end_ns
+        self._record(span)
+        return span
+
+    def current_span(self) -> Optional[Span]:
+        """Span activo en el contexto actual"""
+        return _current_span.get()
+
+    def _record(self, span: Span):
+        for listener in self._listeners:
+            try:
+                listener(span)
+            except Exception as e:
+                logger.error(f"❌ Error en listener de spans: {e}")
+
+        if not self.enabled:
+            return
+
+        self._spans.append(span)
+
+        if not self.export_file:
+            return
+
+        # Acumular spans hasta que termine el span raíz y exportar la traza completa
+        if span.trace_id not in self._open_traces and len(self._open_traces) >= self._max_open_traces:
+            # Spans huérfanos (p.ej. tareas que terminan después de su raíz): descartar la más antigua
+            self._open_traces.pop(next(iter(self._open_traces)))
+        trace_spans = self._open_traces.setdefault(span.trace_id, [])
+        trace_spans.append(span)
+        if span.parent_id is None:
+            self._export(self._open_traces.pop(span.trace_id, []))
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def get_recent_spans(self, limit: int = 100, name_prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Últimos spans registrados (más recientes primero)"""
+        spans = list(self._spans)
+        if name_prefix:
+            spans = [s for s in spans if s.name.startswith(name_prefix)]
+        return [s.to_dict() for s in reversed(spans[-limit:])]
+
+    def get_trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        """Todos los spans de una traza ordenados por inicio"""
+        spans = [s for s in self._spans if s.trace_id == trace_id]
+        spans.sort(key=lambda s: s.start_ns)
+        return [s.to_dict() for s in spans]
+
+    def get_recent_traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Resumen de las últimas trazas: duración total y desglose por etapa
+        """
+        traces: Dict[str, Dict[str, Any]] = {}
+        for span in self._spans:
+            trace = traces.setdefault(span.trace_id, {
+                "trace_id": span.trace_id,
+                "root": None,
+                "duration_ms": 0.0,
+                "start_time": span.start_ns / 1_000_000_000,
+                "span_count": 0,
+                "breakdown_ms": {}
+            })
+            trace["span_count"] += 1
+            trace["start_time"] = min(trace["start_time"], span.start_ns / 1_000_000_000)
+            if span.parent_id is None:
+                trace["root"] = span.name
+                trace["duration_ms"] = round(span.duration_ms, 2)
+                trace["attributes"] = span.attributes
+            else:
+                breakdown = trace["breakdown_ms"]
+                breakdown[span.name] = round(breakdown.get(span.name, 0.0) + span.duration_ms, 2)
+
+        result = sorted(traces.values(), key=lambda t: t["start_time"], reverse=True)
+        return result[:limit]
+
+    def get_stage_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Estadísticas agregadas por nombre de span (count, avg, p50, p95, max)"""
+        durations: Dict[str, List[float]] = {}
+        errors: Dict[str, int] = {}
+        for span in self._spans:
+            durations.setdefault(span.name, []).append(span.duration_ms)
+            if span.status == "error":
+                errors[span.name] = errors.get(span.name, 0) + 1
+
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            count = len(values)
+            summary[name] = {
+                "count": count,
+                "avg_ms": round(sum(values) / count, 2),
+                "p50_ms": round(values[int(0.50 * (count - 1))], 2),
+                "p95_ms": round(values[int(0.95 * (count - 1))], 2),
+                "max_ms": round(values[-1], 2),
+                "errors": errors.get(name, 0)
+            }
+        return summary
+
+    def clear(self):
+        """Vacía el buffer de spans"""
+        self._spans.clear()
+        self._open_traces.clear()
+
+    # ------------------------------------------------------------------
+    # Exportación OTLP-JSON
+    # ------------------------------------------------------------------
+
+    def _export(self, spans: List[Span]):
+        """Escribe una traza como una línea OTLP-JSON sin bloquear el event loop"""
+        if not spans:
+            return
+
+        line = json.dumps(self._to_otlp(spans), ensure_ascii=False)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop:
+            loop.run_in_executor(None, self._write_line, line)
+        else:
+            self._write_line(line)
+
+    def _write_line(self, line: str):
+        try:
+            with self._write_lock:
+                directory = os.path.dirname(self.export_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.export_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"❌ Error exportando trazas a {self.export_file}: {e}")
+
+    def _to_otlp(self, spans: List[Span]) -> Dict[str, Any]:
+        """Convierte spans al formato JSON de OTLP (ExportTraceServiceRequest)"""
+        return {
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [_otlp_attribute("service.name", self.service_name)]
+                },
+                "scopeSpans": [{
+                    "scope": {"name": "eva.tracing"},
+                    "spans": [self._span_to_otlp(s) for s in spans]
+                }]
+            }]
+        }
+
+    def _span_to_otlp(self, span: Span) -> Dict[str, Any]:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1}
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    """Convierte un atributo al formato KeyValue de OTLP"""
+    if isinstance(value, bool):
+        otlp_value = {"boolValue": value}
+    elif isinstance(value, int):
+        otlp_value = {"intValue": str(value)}
+    elif isinstance(value, float):
+        otlp_value = {"doubleValue": value}
+    else:
+        otlp_value = {"stringValue": str(value)}
+    return {"key": key, "value": otlp_value}
+
+
+# Instancia global del trazador
+tracer = TracingService(
+    enabled=settings.TRACING_ENABLED,
+    buffer_size=settings.TRACING_BUFFER_SIZE,
+    export_file=settings.TRACING_EXPORT_FILE
+)
@@ -15,6 +15,7 @@ from fastapi import HTTPException
 from services.woocommerce_sync import wc_sync_service
 from services.database import db_service
 from services.embedding_service import embedding_service
+from services.webhook_queue import webhook_queue
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -59,6 +60,61 @@ class WooCommerceWebhookHandler:
             logger.error(f"❌ Error verificando firma webhook: {e}")
             return False
     
+    async def process_webhook(self, headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+        """
+        Recibir un webhook HTTP de WooCommerce y encolarlo
+        Solo verifica y persiste el evento para responder 200 de inmediato;
+        el worker de webhook_queue lo procesa después agrupando por producto.
+        Args:
+            headers: Cabeceras HTTP (en minúsculas)
+            body: Cuerpo crudo de la petición
+        Returns:
+            Resultado de la recepción
+        """
+        event = headers.get('x-wc-webhook-topic', '')
+        signature = headers.get('x-wc-webhook-signature')
+        delivery_id = headers.get('x-wc-webhook-delivery-id')
+        
+        # Al crear el webhook WooCommerce envía un ping sin topic (webhook_id=N)
+        if not event:
+            return {"status": "ignored", "reason": "ping"}
+        
+        # Con secreto configurado la firma es obligatoria. Sin secreto el evento se acepta,
+        # pero su payload no es de fiar: solo indica qué producto volver a pedir a la API
+        verified = False
+        if self.webhook_secret:
+            if not signature or not self.verify_webhook_signature(body, signature):
+                logger.warning(f"⚠️ Webhook {event} rechazado: firma ausente o inválida")
+                raise HTTPException(status_code=401, detail="Firma de webhook inválida")
+            verified = True
+        else:
+            logger.warning("⚠️ WOOCOMMERCE_WEBHOOK_SECRET no configurado - el producto se pedirá a la API")
+        
+        if event not in self.supported_events:
+            logger.warning(f"⚠️ Evento no soportado: {event}")
+            return {"status": "ignored", "reason": "evento no soportado"}
+        
+        try:
+            payload = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            return {"status": "error", "error": "Payload JSON inválido"}
+        
+        if not payload.get('id'):
+            return {"status": "error", "error": "ID no encontrado en el payload"}
+        
+        # Sin cola disponible (p.ej. base de datos no inicializada), procesar en línea
+        if not webhook_queue.initialized:
+            return await self.handle_webhook(event, payload)
+        
+        event_id = await webhook_queue.enqueue(event, payload, delivery_id, verified=verified)
+        logger.info(f"📨 Webhook encolado: {event} ({payload.get('id')})")
+        
+        return {
+            "status": "queued" if event_id else "duplicate",
+            "event": event,
+            "event_id": event_id
+        }
+    
     async def handle_webhook(self, event: str, payload: Dict[str, Any], 
                            signature: str = None, raw_payload: bytes = None) -> Dict[str, Any]:
         """
@@ -272,7 +328,8 @@ class WooCommerceWebhookHandler:
                 "supported_events": list(self.supported_events),
                 "webhook_secret_configured": bool(self.webhook_secret),
                 "last_processed": datetime.now().isoformat(),
-                "status": "active"
+                "status": "active",
+                "queue": await webhook_queue.get_queue_stats()
             }
             
         except Exception as e:
@@ -0,0 +1,466 @@
+"""
+Cola persistente de eventos de webhooks de WooCommerce
+El endpoint solo guarda el evento y responde 200; un worker en segundo plano
+agrupa los eventos de cada producto durante una ventana de espera (debounce)
+y los procesa por lotes usando directamente el payload del webhook cuando su
+firma está verificada (si no, vuelve a pedir el producto a WooCommerce).
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from config.settings import settings
+from services.database import db_service
+from services.woocommerce_sync import wc_sync_service
+from services.product_card_cache import product_card_cache
+
+logger = logging.getLogger(__name__)
+
+# Campos mínimos para usar el payload del webhook sin volver a pedir el producto
+_REQUIRED_PRODUCT_FIELDS = ("id", "name", "status", "price", "date_modified")
+
+
+class WebhookQueueService:
+    """Cola de eventos de webhooks con coalescencia por producto"""
+
+    def __init__(self):
+        self.initialized = False
+        self.debounce_seconds = settings.WEBHOOK_DEBOUNCE_SECONDS
+        self.max_wait_seconds = settings.WEBHOOK_MAX_WAIT_SECONDS
+        self.batch_size = settings.WEBHOOK_BATCH_SIZE
+        self.max_attempts = 5
+        self.poll_interval = 1.0  # Segundos entre comprobaciones de la cola
+        self.stale_lock_minutes = 10  # Eventos "processing" huérfanos tras una caída
+        self.retention_days = 7
+
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
+        self._stats = {
+            "events_received": 0,
+            "duplicates_ignored": 0,
+            "events_processed": 0,
+            "events_coalesced": 0,
+            "products_upserted": 0,
+            "commercial_updates": 0,
+            "products_deactivated": 0,
+            "products_refetched": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed": 0
+        }
+
+    async def initialize(self):
+        """Crear la tabla de eventos y recuperar eventos bloqueados"""
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS webhook_events (
+                        id BIGSERIAL PRIMARY KEY,
+                        topic VARCHAR(100) NOT NULL,
+                        resource VARCHAR(50) NOT NULL,
+                        resource_id BIGINT,
+                        delivery_id VARCHAR(100),
+                        payload JSONB NOT NULL DEFAULT '{}',
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        available_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        locked_at TIMESTAMP WITH TIME ZONE,
+                        processed_at TIMESTAMP WITH TIME ZONE
+                    );
+                """)
+
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+                    ON webhook_events(resource, resource_id, received_at) WHERE status = 'pending';
+                """)
+
+                # WooCommerce reintenta entregas con el mismo X-WC-Webhook-Delivery-ID
+                await conn.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_events_delivery
+                    ON webhook_events(delivery_id) WHERE delivery_id IS NOT NULL;
+                """)
+
+                # Solo el payload de entregas con firma verificada se usa directamente
+                await conn.execute("""
+                    ALTER TABLE webhook_events
+                    ADD COLUMN IF NOT EXISTS verified BOOLEAN NOT NULL DEFAULT false
+                """)
+
+            # Eventos que quedaron a medias por una caída del proceso
+            await self.recover_stale_events()
+
+            self.initialized = True
+            logger.info("✅ Cola de webhooks inicializada")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando cola de webhooks: {e}")
+            self.initialized = False
+
+    # ------------------------------------------------------------------
+    # Ingesta
+    # ------------------------------------------------------------------
+
+    async def enqueue(self, topic: str, payload: Dict[str, Any], delivery_id: str = None,
+                      verified: bool = False) -> Optional[int]:
+        """
+        Guardar un evento en la cola
+        `verified` indica que la firma HMAC se comprobó; si no, el worker vuelve a pedir
+        el producto a WooCommerce en lugar de usar el payload
+        Returns: ID del evento, o None si es una entrega duplicada
+        """
+        resource = topic.split('.', 1)[0]
+        try:
+            resource_id = int(payload.get('id')) if payload.get('id') is not None else None
+        except (TypeError, ValueError):
+            resource_id = None
+
+        async with db_service.pool.acquire() as conn:
+            event_id = await conn.fetchval("""
+                INSERT INTO webhook_events (topic, resource, resource_id, delivery_id, payload, verified)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (delivery_id) WHERE delivery_id IS NOT NULL DO NOTHING
+                RETURNING id
+            """, topic, resource, resource_id, delivery_id, payload, verified)
+
+        if event_id is None:
+            self._stats["duplicates_ignored"] += 1
+            logger.info(f"ℹ️ Entrega de webhook duplicada ignorada: {delivery_id}")
+        else:
+            self._stats["events_received"] += 1
+
+        return event_id
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def start_worker(self):
+        """Arrancar el worker en segundo plano"""
+        if not self.initialized or self._running:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop_worker(self):
+        """Detener el worker (los eventos pendientes siguen en la tabla)"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+    async def _worker_loop(self):
+        last_cleanup = 0.0
+        last_recovery = time.monotonic()
+
+        while self._running:
+            try:
+                # Lotes de procesos que murieron sin liberarlos: mientras siguen en
+                # "processing" no se reclama ningún evento más de esos productos
+                if time.monotonic() - last_recovery > 60:
+                    await self.recover_stale_events()
+                    last_recovery = time.monotonic()
+
+                processed = await self.process_due_events()
+
+                if time.monotonic() - last_cleanup > 3600:
+                    await self.cleanup_old_events()
+                    last_cleanup = time.monotonic()
+
+                # Si había trabajo, seguir vaciando la cola sin esperar
+                if processed:
+                    continue
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en worker de webhooks: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def recover_stale_events(self) -> int:
+        """Devolver a pendientes los eventos "processing" bloqueados más de stale_lock_minutes"""
+        async with db_service.pool.acquire() as conn:
+            recovered = await conn.execute("""
+                UPDATE webhook_events
+                SET status = 'pending', locked_at = NULL
+                WHERE status = 'processing'
+                AND locked_at < NOW() - make_interval(mins => $1)
+            """, self.stale_lock_minutes)
+
+        recovered_count = int(recovered.split()[-1])
+        if recovered_count:
+            logger.info(f"🔄 {recovered_count} eventos de webhook recuperados para reprocesar")
+        return recovered_count
+
+    async def process_due_events(self) -> int:
+        """
+        Procesar los eventos listos (productos fuera de la ventana de debounce y pedidos)
+        Returns: número de eventos procesados
+        """
+        processed = await self._process_order_events()
+
+        rows = await self._claim_product_events()
+        if not rows:
+            return processed
+
+        # Agrupar por producto: solo importa el último evento de cada uno
+        events_by_product: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            events_by_product.setdefault(row['resource_id'], []).append(row)
+
+        latest = {
+            product_id: max(events, key=lambda e: (e['received_at'], e['id']))
+            for product_id, events in events_by_product.items()
+        }
+
+        failed_products: Dict[int, str] = {}
+        try:
+            failed_products = await self._apply_product_events(latest)
+        except Exception as e:
+            logger.error(f"❌ Error procesando lote de webhooks de productos: {e}")
+            failed_products = {product_id: str(e) for product_id in latest}
+
+        done_ids = [
+            e['id'] for product_id, events in events_by_product.items()
+            if product_id not in failed_products for e in events
+        ]
+        await self._mark_done(done_ids)
+
+        for product_id, error in failed_products.items():
+            await self._mark_failed(events_by_product[product_id], error)
+
+        self._stats["batches"] += 1
+        self._stats["events_processed"] += len(done_ids)
+        self._stats["events_coalesced"] += len(rows) - len(latest)
+
+        logger.info(f"✅ Lote de webhooks: {len(rows)} eventos → {len(latest)} productos "
+                   f"({len(failed_products)} con error)")
+
+        return processed + len(rows)
+
+    async def _claim_product_events(self) -> List[Dict[str, Any]]:
+        """
+        Reclamar los eventos de los productos cuyo último evento es más antiguo que
+        la ventana de debounce (o cuyo primer evento supera la espera máxima)
+        Un producto con un lote en proceso en otro worker espera a que termine: si no,
+        el lote anterior podría aplicarse después y pisar datos más nuevos
+        """
+        async with db_service.pool.acquire() as conn, conn.transaction():
+            # Un reclamo a la vez entre workers, para que la consulta vea como "processing"
+            # los lotes que otro worker acaba de reclamar
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", "webhook_events_claim")
+            rows = await conn.fetch("""
+                WITH due AS (
+                    SELECT resource_id
+                    FROM webhook_events
+                    WHERE status = 'pending'
+                    AND resource = 'product'
+                    AND available_at <= NOW()
+                    AND NOT EXISTS (
+                        SELECT 1 FROM webhook_events p
+                        WHERE p.resource = 'product'
+                        AND p.resource_id = webhook_events.resource_id
+                        AND p.status = 'processing'
+                    )
+                    GROUP BY resource_id
+                    HAVING MAX(received_at) <= NOW() - make_interval(secs => $1)
+                        OR MIN(received_at) <= NOW() - make_interval(secs => $2)
+                    ORDER BY MIN(received_at)
+                    LIMIT $3
+                )
+                UPDATE webhook_events e
+                SET status = 'processing', attempts = e.attempts + 1, locked_at = NOW()
+                FROM due
+                WHERE e.resource = 'product'
+                AND e.resource_id = due.resource_id
+                AND e.status = 'pending'
+                RETURNING e.id, e.resource_id, e.topic, e.payload, e.verified, e.received_at, e.attempts
+            """, float(self.debounce_seconds), float(self.max_wait_seconds), self.batch_size)
+
+        return [dict(row) for row in rows]
+
+    async def _apply_product_events(self, latest: Dict[int, Dict[str, Any]]) -> Dict[int, str]:
+        """
+        Aplicar el último evento de cada producto
+        Returns: productos con error {product_id: motivo}
+        """
+        to_upsert: List[Dict[str, Any]] = []
+        to_deactivate: List[int] = []
+        to_fetch: List[int] = []
+        failed: Dict[int, str] = {}
+
+        for product_id, event in latest.items():
+            payload = event['payload'] or {}
+            if not event.get('verified'):
+                # Sin firma verificada el payload podría ser arbitrario (también un borrado)
+                to_fetch.append(product_id)
+            elif event['topic'] == 'product.deleted':
+                to_deactivate.append(product_id)
+            elif all(field in payload for field in _REQUIRED_PRODUCT_FIELDS):
+                if payload.get('status') == 'publish':
+                    to_upsert.append(payload)
+                else:
+                    # Borrador, privado o papelera: fuera del catálogo del agente
+                    to_deactivate.append(product_id)
+            else:
+                to_fetch.append(product_id)
+
+        # Payloads incompletos o sin firma verificada: pedir el producto a la API
+        if to_fetch:
+            semaphore = asyncio.Semaphore(5)
+
+            async def fetch(product_id: int):
+                async with semaphore:
+                    return await wc_sync_service.wc_service.get_product(product_id)
+
+            fetched = await asyncio.gather(*(fetch(pid) for pid in to_fetch), return_exceptions=True)
+            self._stats["products_refetched"] += len(to_fetch)
+            for product_id, product in zip(to_fetch, fetched):
+                if isinstance(product, Exception) or not product:
+                    failed[product_id] = "No se pudo obtener el producto de WooCommerce"
+                elif product.get('status') == 'publish':
+                    to_upsert.append(product)
+                else:
+                    to_deactivate.append(product_id)
+
+        if to_upsert:
+            # El webhook indica un cambio: no comparar fechas
+            page_stats = await wc_sync_service._process_product_page(to_upsert, force_update=True)
+            self._stats["products_upserted"] += page_stats["new"] + page_stats["updated"]
+            self._stats["commercial_updates"] += page_stats["commercial"]
+            for external_id in page_stats["failed_ids"]:
+                failed[int(external_id.split('_', 1)[1])] = "Error guardando producto"
+
+        if to_deactivate:
+            deactivated_ids = [f"product_{pid}" for pid in to_deactivate]
+            deactivated = await db_service.deactivate_products(deactivated_ids)
+            product_card_cache.invalidate(deactivated_ids)
+            self._stats["products_deactivated"] += deactivated
+
+        return failed
+
+    async def _process_order_events(self) -> int:
+        """Los eventos de pedidos no se agrupan: por ahora solo se registran"""
+        async with db_service.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                UPDATE webhook_events
+                SET status = 'done', attempts = attempts + 1, processed_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM webhook_events
+                    WHERE status = 'pending' AND resource = 'order'
+                    ORDER BY received_at
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING topic, resource_id
+            """, self.batch_size)
+
+        for row in rows:
+            logger.info(f"📦 Webhook de pedido {row['topic']}: {row['resource_id']}")
+
+        self._stats["events_processed"] += len(rows)
+        return len(rows)
+
+    async def _mark_done(self, event_ids: List[int]):
+        if not event_ids:
+            return
+        async with db_service.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE webhook_events
+                SET status = 'done', processed_at = NOW(), locked_at = NULL, last_error = NULL
+                WHERE id = ANY($1::bigint[])
+            """, event_ids)
+
+    async def _mark_failed(self, events: List[Dict[str, Any]], error: str):
+        """Reintentar con espera exponencial o dar el evento por fallido"""
+        attempts = max(e['attempts'] for e in events)
+        event_ids = [e['id'] for e in events]
+
+        async with db_service.pool.acquire() as conn:
+            if attempts >= self.max_attempts:
+                await conn.execute("""
+                    UPDATE webhook_events
+                    SET status = 'failed', last_error = $2, locked_at = NULL, processed_at = NOW()
+                    WHERE id = ANY($1::bigint[])
+                """, event_ids, error)
+                self._stats["failed"] += len(event_ids)
+                logger.error(f"❌ Webhook de producto {events[0]['resource_id']} descartado tras {attempts} intentos: {error}")
+            else:
+                await conn.execute("""
+                    UPDATE webhook_events
+                    SET status = 'pending', last_error = $2, locked_at = NULL,
+                        available_at = NOW() + make_interval(secs => $3)
+                    WHERE id = ANY($1::bigint[])
+                """, event_ids, error, float(2 ** attempts * 5))
+                self._stats["retries"] += len(event_ids)
+                logger.warning(f"⚠️ Webhook de producto {events[0]['resource_id']} se reintentará: {error}")
+
+    async def cleanup_old_events(self) -> int:
+        """Eliminar eventos procesados antiguos"""
+        async with db_service.pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM webhook_events
+                WHERE status = 'done'
+                AND processed_at < NOW() - make_interval(days => $1)
+            """, self.retention_days)
+
+        deleted = int(result.split()[-1])
+        if deleted:
+            logger.info(f"🗑️ {deleted} eventos de webhook antiguos eliminados")
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Estadísticas
+    # ------------------------------------------------------------------
+
+    async def get_depth(self) -> int:
+        """Elementos pendientes (consulta barata para el sondeo de métricas)"""
+        if not self.initialized:
+            return 0
+
+        async with db_service.pool.acquire() as conn:
+            return await conn.fetchval("SELECT COUNT(*) FROM webhook_events WHERE status = 'pending'")
+
+    async def get_queue_stats(self) -> Dict[str, Any]:
+        """Estado de la cola: eventos por estado, antigüedad del pendiente más viejo y contadores"""
+        if not self.initialized:
+            return {"enabled": False}
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                by_status = await conn.fetch("""
+                    SELECT status, COUNT(*) as count
+                    FROM webhook_events
+                    GROUP BY status
+                """)
+                oldest_pending = await conn.fetchval("""
+                    SELECT EXTRACT(EPOCH FROM NOW() - MIN(received_at))
+                    FROM webhook_events WHERE status = 'pending'
+                """)
+
+            return {
+                "enabled": True,
+                "worker_running": self._running,
+                "debounce_seconds": self.debounce_seconds,
+                "by_status": {row['status']: row['count'] for row in by_status},
+                "oldest_pending_seconds": round(float(oldest_pending), 1) if oldest_pending is not None else None,
+                "counters": dict(self._stats),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo estadísticas de la cola de webhooks: {e}")
+            return {"enabled": True, "error": str(e)}
+
+
+# Instancia global de la cola de webhooks
+webhook_queue = WebhookQueueService()
@@ -12,6 +12,7 @@ from dataclasses import dataclass
 from enum import Enum
 
 from config.settings import settings
+from services.tracing_service import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +38,18 @@ class MessageStatus(Enum):
     FAILED = "failed"
 
 
+class WhatsAppRateLimitError(Exception):
+    """La API rechazó el envío por límite de throughput"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Códigos de error de Meta/360Dialog que indican límite de envío
+RATE_LIMIT_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+
 @dataclass
 class WhatsAppMessage:
     """Estructura de mensaje de WhatsApp"""
@@ -68,11 +81,26 @@ class WhatsApp360DialogService:
         self._templates_cache = {}
         self._templates_cache_time = None
         
+        # Sesión HTTP compartida (reutiliza conexiones entre envíos)
+        self._session: Optional[aiohttp.ClientSession] = None
+        
         if self.api_key and self.phone_number:
             logger.info(f"WhatsApp 360Dialog Service initialized for number: {self.phone_number}")
         else:
             logger.warning("WhatsApp 360Dialog Service initialized without complete configuration")
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Sesión HTTP compartida, creada bajo demanda"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self._session
+    
+    async def close(self):
+        """Cerrar la sesión HTTP compartida"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
     async def send_message(self, message: WhatsAppMessage) -> Dict[str, Any]:
         """
         Envía un mensaje a través de WhatsApp
@@ -131,13 +159,23 @@ class WhatsApp360DialogService:
             logger.info(f"DEBUG - Full payload: {json.dumps(payload, indent=2, ensure_ascii=False)}")
         
         try:
-            async with aiohttp.ClientSession() as session:
+            with tracer.span("whatsapp.send_message", type=message.type.value) as span:
+                session = self._get_session()
                 async with session.post(endpoint, headers=self.headers, json=payload) as response:
-                    result = await response.json()
-                    
+                    result = await response.json(content_type=None) or {}
+                    span.set_attribute("http.status", response.status)
+                
                     if response.status == 200:
                         logger.info(f"Message sent successfully to {message.to}: {result.get('messages', [{}])[0].get('id')}")
                         return result
+                
+                    error = result.get('error', {}) if isinstance(result, dict) else {}
+                    if response.status == 429 or error.get('code') in RATE_LIMIT_ERROR_CODES:
+                        retry_after = response.headers.get('Retry-After')
+                        raise WhatsAppRateLimitError(
+                            f"WhatsApp API rate limit: {error.get('message', response.status)}",
+                            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+                        )
                     else:
                         logger.error(f"Failed to send message: {result}")
                         logger.error(f"DEBUG - Payload that failed: {json.dumps(payload, indent=2, ensure_ascii=False)}")
@@ -305,10 +343,11 @@ class WhatsApp360DialogService:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
+            with tracer.span("whatsapp.mark_as_read"):
+                session = self._get_session()
                 async with session.post(endpoint, headers=self.headers, json=payload) as response:
                     result = await response.json()
-                    
+                
                     if response.status == 200:
                         logger.info(f"Message {message_id} marked as read")
                         return result
@@ -333,15 +372,15 @@ class WhatsApp360DialogService:
         endpoint = f"{self.api_url}/media/{media_id}"
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(endpoint, headers=self.headers) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        return result.get("url", "")
-                    else:
-                        logger.error(f"Failed to get media URL: {result}")
-                        return ""
+            session = self._get_session()
+            async with session.get(endpoint, headers=self.headers) as response:
+                result = await response.json()
+                
+                if response.status == 200:
+                    return result.get("url", "")
+                else:
+                    logger.error(f"Failed to get media URL: {result}")
+                    return ""
         
         except Exception as e:
             logger.error(f"Error getting media URL: {str(e)}")
@@ -358,13 +397,13 @@ class WhatsApp360DialogService:
             Contenido del archivo en bytes
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(media_url, headers=self.headers) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        logger.error(f"Failed to download media: {response.status}")
-                        return b""
+            session = self._get_session()
+            async with session.get(media_url, headers=self.headers) as response:
+                if response.status == 200:
+                    return await response.read()
+                else:
+                    logger.error(f"Failed to download media: {response.status}")
+                    return b""
         
         except Exception as e:
             logger.error(f"Error downloading media: {str(e)}")
@@ -388,20 +427,20 @@ class WhatsApp360DialogService:
         endpoint = f"{self.api_url}/configs/templates"
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(endpoint, headers=self.headers) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        templates = result.get("waba_templates", [])
-                        # Actualizar cache
-                        self._templates_cache = templates
-                        self._templates_cache_time = datetime.now()
-                        logger.info(f"Retrieved {len(templates)} templates")
-                        return templates
-                    else:
-                        logger.error(f"Failed to get templates: {result}")
-                        return []
+            session = self._get_session()
+            async with session.get(endpoint, headers=self.headers) as response:
+                result = await response.json()
+                
+                if response.status == 200:
+                    templates = result.get("waba_templates", [])
+                    # Actualizar cache
+                    self._templates_cache = templates
+                    self._templates_cache_time = datetime.now()
+                    logger.info(f"Retrieved {len(templates)} templates")
+                    return templates
+                else:
+                    logger.error(f"Failed to get templates: {result}")
+                    return []
         
         except Exception as e:
             logger.error(f"Error getting templates: {str(e)}")
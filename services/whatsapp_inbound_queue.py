@@ -0,0 +1,393 @@
+"""
+Cola persistente de mensajes entrantes de WhatsApp
+El endpoint guarda cada mensaje (clave: ID de mensaje de WhatsApp, así las
+reentregas de 360Dialog se ignoran) y responde 200. Un worker en segundo plano
+atiende los mensajes de cada número en orden y de uno en uno, con varios números
+en paralelo bajo un límite global y reintentos con espera exponencial.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config.settings import settings
+from services.database import db_service
+from services.whatsapp_session_resolver import whatsapp_session_resolver
+
+logger = logging.getLogger(__name__)
+
+# Firma del procesador: (mensaje, value del webhook sin la lista de mensajes)
+MessageHandler = Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[None]]
+
+
+class WhatsAppInboundQueue:
+    """Cola de mensajes entrantes con orden por número e idempotencia por ID de mensaje"""
+
+    def __init__(self):
+        self.initialized = False
+        self.max_concurrency = settings.WHATSAPP_INBOUND_CONCURRENCY
+        self.max_attempts = settings.WHATSAPP_INBOUND_MAX_ATTEMPTS
+        self.max_age_minutes = settings.WHATSAPP_INBOUND_MAX_AGE_MINUTES
+        self.poll_interval = 1.0  # Segundos entre comprobaciones si no hay avisos
+        self.stale_lock_minutes = 5  # Mensajes "processing" huérfanos tras una caída
+        self.retention_days = 7
+
+        self._handler: Optional[MessageHandler] = None
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
+        self._in_flight: Dict[str, asyncio.Task] = {}  # Número -> mensaje en proceso
+        self._wakeup = asyncio.Event()
+        self._stats = {
+            "messages_received": 0,
+            "duplicates_ignored": 0,
+            "messages_processed": 0,
+            "retries": 0,
+            "failed": 0,
+            "expired": 0
+        }
+
+    async def initialize(self):
+        """Crear la tabla de mensajes y recuperar mensajes bloqueados"""
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS whatsapp_inbound_messages (
+                        id BIGSERIAL PRIMARY KEY,
+                        message_id VARCHAR(255) NOT NULL UNIQUE,
+                        phone VARCHAR(50) NOT NULL,
+                        message JSONB NOT NULL,
+                        value JSONB NOT NULL DEFAULT '{}',
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        available_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        locked_at TIMESTAMP WITH TIME ZONE,
+                        processed_at TIMESTAMP WITH TIME ZONE
+                    );
+                """)
+
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_whatsapp_inbound_active
+                    ON whatsapp_inbound_messages(phone, received_at, id)
+                    WHERE status IN ('pending', 'processing');
+                """)
+
+            self.initialized = True
+            await self.recover_stale_messages()
+            logger.info("✅ Cola de mensajes de WhatsApp inicializada")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando cola de mensajes de WhatsApp: {e}")
+            self.initialized = False
+
+    # ------------------------------------------------------------------
+    # Ingesta
+    # ------------------------------------------------------------------
+
+    async def enqueue_webhook(self, webhook_data: Dict[str, Any]) -> int:
+        """
+        Guardar los mensajes de un webhook de 360Dialog
+        Returns: número de mensajes nuevos (las reentregas no cuentan)
+        """
+        message_ids, phones, messages, values = [], [], [], []
+        for entry in webhook_data.get("entry", []):
+            for change in entry.get("changes", []):
+                value = change.get("value", {})
+                context_value = {k: v for k, v in value.items() if k not in ("messages", "statuses")}
+                for message in value.get("messages", []):
+                    if not message.get("id") or not message.get("from"):
+                        continue
+                    message_ids.append(message["id"])
+                    phones.append(message["from"])
+                    messages.append(message)
+                    values.append(context_value)
+
+        if not message_ids:
+            return 0
+
+        async with db_service.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                INSERT INTO whatsapp_inbound_messages (message_id, phone, message, value)
+                SELECT * FROM unnest($1::text[], $2::text[], $3::jsonb[], $4::jsonb[])
+                ON CONFLICT (message_id) DO NOTHING
+                RETURNING message_id
+            """, message_ids, phones, messages, values)
+
+        duplicates = len(message_ids) - len(rows)
+        self._stats["messages_received"] += len(rows)
+        self._stats["duplicates_ignored"] += duplicates
+        if duplicates:
+            logger.info(f"ℹ️ {duplicates} mensajes de WhatsApp reentregados ignorados")
+        if rows:
+            self._wakeup.set()
+        return len(rows)
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def set_handler(self, handler: MessageHandler):
+        """Registrar la función que atiende cada mensaje (debe lanzar excepción si falla)"""
+        self._handler = handler
+
+    def start_worker(self):
+        """Arrancar el worker en segundo plano"""
+        if not self.initialized or self._running or not self._handler:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop_worker(self):
+        """Detener el worker; los mensajes en curso se cancelan y vuelven a pendientes"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+        in_flight = list(self._in_flight.values())
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def _worker_loop(self):
+        last_cleanup = 0.0
+        last_recovery = time.monotonic()
+
+        while self._running:
+            try:
+                # Bloqueos de procesos que murieron sin liberar sus mensajes: mientras
+                # siguen en "processing" su número no recibe ninguna respuesta más
+                if time.monotonic() - last_recovery > 60:
+                    await self.recover_stale_messages()
+                    last_recovery = time.monotonic()
+
+                free_slots = self.max_concurrency - len(self._in_flight)
+                if free_slots > 0:
+                    for row in await self._claim_messages(free_slots):
+                        phone = row['phone']
+                        self._in_flight[phone] = asyncio.create_task(self._run_message(row))
+
+                if time.monotonic() - last_cleanup > 3600:
+                    await self.cleanup_old_messages()
+                    last_cleanup = time.monotonic()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en worker de mensajes de WhatsApp: {e}")
+
+            # Despertar al llegar un mensaje, al terminar uno o tras el intervalo
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def recover_stale_messages(self) -> int:
+        """Devolver a pendientes los mensajes "processing" bloqueados más de stale_lock_minutes"""
+        async with db_service.pool.acquire() as conn:
+            recovered = await conn.execute("""
+                UPDATE whatsapp_inbound_messages
+                SET status = 'pending', locked_at = NULL
+                WHERE status = 'processing'
+                AND locked_at < NOW() - make_interval(mins => $1)
+            """, self.stale_lock_minutes)
+
+        recovered_count = int(recovered.split()[-1])
+        if recovered_count:
+            logger.info(f"🔄 {recovered_count} mensajes de WhatsApp recuperados para reprocesar")
+        return recovered_count
+
+    async def _claim_messages(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Reclamar el mensaje más antiguo de cada número sin otro mensaje en proceso
+        Un mensaje en espera de reintento bloquea los posteriores de su número, y los
+        números con sesión viva en otro worker se dejan a ese worker (su estado de
+        conversación está en la memoria de ese proceso)
+        """
+        affinity_filter = ""
+        params: List[Any] = [limit, list(self._in_flight.keys())]
+        if whatsapp_session_resolver.initialized:
+            affinity_filter = """
+                    AND NOT EXISTS (
+                        SELECT 1 FROM whatsapp_sessions s
+                        WHERE s.phone = h.phone
+                        AND s.owner IS NOT NULL AND s.owner <> $3
+                        AND s.heartbeat_at > NOW() - make_interval(secs => $4)
+                        AND s.last_activity > NOW() - make_interval(mins => $5)
+                    )"""
+            params += [
+                whatsapp_session_resolver.owner,
+                float(whatsapp_session_resolver.owner_timeout_seconds),
+                whatsapp_session_resolver.timeout_minutes
+            ]
+
+        async with db_service.pool.acquire() as conn:
+            # Mensajes demasiado antiguos: responderlos ya no tiene sentido
+            expired = await conn.execute("""
+                UPDATE whatsapp_inbound_messages
+                SET status = 'expired', processed_at = NOW()
+                WHERE status = 'pending'
+                AND received_at < NOW() - make_interval(mins => $1)
+            """, self.max_age_minutes)
+            expired_count = int(expired.split()[-1])
+            if expired_count:
+                self._stats["expired"] += expired_count
+                logger.warning(f"⚠️ {expired_count} mensajes de WhatsApp caducados sin responder")
+
+            rows = await conn.fetch(f"""
+                WITH heads AS (
+                    SELECT DISTINCT ON (phone) id, phone, available_at, received_at
+                    FROM whatsapp_inbound_messages
+                    WHERE status IN ('pending', 'processing')
+                    ORDER BY phone, (status = 'processing') DESC, received_at, id
+                ),
+                due AS (
+                    SELECT h.id
+                    FROM heads h
+                    JOIN whatsapp_inbound_messages m ON m.id = h.id AND m.status = 'pending'
+                    WHERE h.available_at <= NOW()
+                    AND NOT (h.phone = ANY($2::text[])){affinity_filter}
+                    ORDER BY h.received_at
+                    LIMIT $1
+                )
+                UPDATE whatsapp_inbound_messages m
+                SET status = 'processing', attempts = m.attempts + 1, locked_at = NOW()
+                FROM due
+                WHERE m.id = due.id AND m.status = 'pending'
+                RETURNING m.id, m.message_id, m.phone, m.message, m.value, m.attempts
+            """, *params)
+
+        return [dict(row) for row in rows]
+
+    async def _run_message(self, row: Dict[str, Any]):
+        """Atender un mensaje y registrar el resultado"""
+        try:
+            await self._handler(row['message'], row['value'])
+            await self._mark_done(row['id'])
+            self._stats["messages_processed"] += 1
+        except asyncio.CancelledError:
+            # Parada del worker (p.ej. redespliegue): liberar el mensaje para que otro
+            # proceso lo atienda en lugar de dejar bloqueado su número
+            try:
+                await self._release_message(row['id'])
+            except Exception as release_error:
+                logger.error(f"❌ Error liberando mensaje de WhatsApp {row['message_id']}: {release_error}")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error atendiendo mensaje de WhatsApp {row['message_id']}: {e}")
+            try:
+                await self._mark_failed(row, str(e))
+            except Exception as mark_error:
+                logger.error(f"❌ Error registrando fallo del mensaje {row['message_id']}: {mark_error}")
+        finally:
+            self._in_flight.pop(row['phone'], None)
+            self._wakeup.set()
+
+    async def _mark_done(self, row_id: int):
+        async with db_service.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE whatsapp_inbound_messages
+                SET status = 'done', processed_at = NOW(), locked_at = NULL, last_error = NULL
+                WHERE id = $1
+            """, row_id)
+
+    async def _release_message(self, row_id: int):
+        """Volver a pendiente un mensaje interrumpido sin contarlo como intento"""
+        async with db_service.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE whatsapp_inbound_messages
+                SET status = 'pending', locked_at = NULL, attempts = GREATEST(attempts - 1, 0)
+                WHERE id = $1 AND status = 'processing'
+            """, row_id)
+
+    async def _mark_failed(self, row: Dict[str, Any], error: str):
+        """Reintentar con espera exponencial o dar el mensaje por fallido"""
+        async with db_service.pool.acquire() as conn:
+            if row['attempts'] >= self.max_attempts:
+                await conn.execute("""
+                    UPDATE whatsapp_inbound_messages
+                    SET status = 'failed', last_error = $2, locked_at = NULL, processed_at = NOW()
+                    WHERE id = $1
+                """, row['id'], error)
+                self._stats["failed"] += 1
+                logger.error(f"❌ Mensaje de WhatsApp {row['message_id']} descartado tras {row['attempts']} intentos")
+            else:
+                await conn.execute("""
+                    UPDATE whatsapp_inbound_messages
+                    SET status = 'pending', last_error = $2, locked_at = NULL,
+                        available_at = NOW() + make_interval(secs => $3)
+                    WHERE id = $1
+                """, row['id'], error, float(2 ** row['attempts'] * 2))
+                self._stats["retries"] += 1
+                logger.warning(f"⚠️ Mensaje de WhatsApp {row['message_id']} se reintentará")
+
+    async def cleanup_old_messages(self) -> int:
+        """Eliminar mensajes terminados antiguos"""
+        async with db_service.pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM whatsapp_inbound_messages
+                WHERE status IN ('done', 'expired', 'failed')
+                AND processed_at < NOW() - make_interval(days => $1)
+            """, self.retention_days)
+
+        deleted = int(result.split()[-1])
+        if deleted:
+            logger.info(f"🗑️ {deleted} mensajes de WhatsApp antiguos eliminados")
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Estadísticas
+    # ------------------------------------------------------------------
+
+    async def get_depth(self) -> int:
+        """Elementos pendientes (consulta barata para el sondeo de métricas)"""
+        if not self.initialized:
+            return 0
+
+        async with db_service.pool.acquire() as conn:
+            return await conn.fetchval("SELECT COUNT(*) FROM whatsapp_inbound_messages WHERE status = 'pending'")
+
+    async def get_queue_stats(self) -> Dict[str, Any]:
+        """Estado de la cola: mensajes por estado, antigüedad del pendiente más viejo y contadores"""
+        if not self.initialized:
+            return {"enabled": False}
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                by_status = await conn.fetch("""
+                    SELECT status, COUNT(*) as count
+                    FROM whatsapp_inbound_messages
+                    GROUP BY status
+                """)
+                oldest_pending = await conn.fetchval("""
+                    SELECT EXTRACT(EPOCH FROM NOW() - MIN(received_at))
+                    FROM whatsapp_inbound_messages WHERE status = 'pending'
+                """)
+
+            return {
+                "enabled": True,
+                "worker_running": self._running,
+                "in_flight": len(self._in_flight),
+                "max_concurrency": self.max_concurrency,
+                "by_status": {row['status']: row['count'] for row in by_status},
+                "oldest_pending_seconds": round(float(oldest_pending), 1) if oldest_pending is not None else None,
+                "counters": dict(self._stats),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo estadísticas de la cola de WhatsApp: {e}")
+            return {"enabled": True, "error": str(e)}
+
+
+# Instancia global de la cola de mensajes entrantes
+whatsapp_inbound_queue = WhatsAppInboundQueue()
@@ -0,0 +1,324 @@
+"""
+Despachador de mensajes salientes de WhatsApp
+Las campañas (p. ej. recuperación de carritos) se envían con un conjunto acotado de
+workers y un cubo de tokens ajustado al throughput de 360Dialog; si la API responde
+con límite de ritmo el cubo se pausa y el envío se reintenta, así la limitación queda
+en las estadísticas en lugar de aparecer como timeouts. Cada plantilla enviada se
+guarda en whatsapp_outbound_messages y su estado (sent/delivered/read/failed) se
+actualiza con los webhooks de estado.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from config.settings import settings
+from services.database import db_service
+from services.whatsapp_360dialog_service import WhatsAppRateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Orden de los estados de entrega: un webhook atrasado no puede hacer retroceder el estado
+STATUS_RANK_SQL = """
+    CASE {column}
+        WHEN 'sent' THEN 1
+        WHEN 'delivered' THEN 2
+        WHEN 'read' THEN 3
+        WHEN 'failed' THEN 4
+        ELSE 0
+    END
+"""
+
+
+class TokenBucket:
+    """Cubo de tokens: `rate` envíos por segundo con ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.throttled_seconds = 0.0
+
+    async def acquire(self) -> float:
+        """
+        Esperar hasta disponer de un token
+        Returns: segundos esperados por la limitación
+        """
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+        # Incluye la espera en cola detrás de otros workers
+        waited = time.monotonic() - started
+        self.throttled_seconds += waited
+        return waited
+
+    def pause(self, seconds: float):
+        """Detener la emisión de tokens (la API ha aplicado su límite de ritmo)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+
+@dataclass
+class OutboundJob:
+    """Un envío de una campaña"""
+    phone: str
+    template_type: str
+    send: Callable[[], Awaitable[Dict[str, Any]]]  # Realiza el envío (y registra el mensaje enviado)
+    reference: Optional[str] = None  # Identificador de negocio (ID del carrito, pedido...)
+
+
+class WhatsAppOutboundDispatcher:
+    """Envío limitado en ritmo y concurrencia con estado de entrega persistido"""
+
+    def __init__(self):
+        self.initialized = False
+        self.concurrency = settings.WHATSAPP_OUTBOUND_CONCURRENCY
+        self.max_attempts = settings.WHATSAPP_OUTBOUND_MAX_ATTEMPTS
+        self.bucket = TokenBucket(settings.WHATSAPP_OUTBOUND_RATE_PER_SECOND, settings.WHATSAPP_OUTBOUND_BURST)
+        self._stats = {
+            "messages_sent": 0,
+            "failed": 0,
+            "rate_limited": 0,
+            "status_updates": 0
+        }
+
+    async def initialize(self):
+        """Crear la tabla de mensajes salientes"""
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS whatsapp_outbound_messages (
+                        id BIGSERIAL PRIMARY KEY,
+                        message_id VARCHAR(255) UNIQUE,
+                        phone VARCHAR(50) NOT NULL,
+                        template_type VARCHAR(50) NOT NULL,
+                        template_name VARCHAR(255),
+                        reference VARCHAR(255),
+                        status VARCHAR(20) NOT NULL DEFAULT 'sent',
+                        last_error TEXT,
+                        data JSONB NOT NULL DEFAULT '{}',
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        delivered_at TIMESTAMP WITH TIME ZONE,
+                        read_at TIMESTAMP WITH TIME ZONE
+                    );
+                """)
+
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_whatsapp_outbound_recent
+                    ON whatsapp_outbound_messages(template_type, phone, created_at DESC);
+                """)
+
+            self.initialized = True
+            logger.info("✅ Despachador de mensajes salientes de WhatsApp inicializado")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando despachador de WhatsApp: {e}")
+            self.initialized = False
+
+    # ------------------------------------------------------------------
+    # Envío
+    # ------------------------------------------------------------------
+
+    async def dispatch(self, jobs: List[OutboundJob]) -> Dict[str, Any]:
+        """
+        Enviar una campaña con workers acotados y cubo de tokens
+        Returns: resumen con enviados, fallidos y tiempo de limitación
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        summary = {"sent": 0, "failed": 0, "rate_limited": 0, "throttled_seconds": 0.0}
+        started = time.monotonic()
+
+        async def worker():
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._run_job(job, summary)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(jobs)))]
+        await asyncio.gather(*workers)
+
+        summary["throttled_seconds"] = round(summary["throttled_seconds"], 2)
+        summary["duration_seconds"] = round(time.monotonic() - started, 2)
+        logger.info(f"📊 Campaña de WhatsApp: {summary['sent']} enviados, {summary['failed']} fallidos, "
+                    f"{summary['rate_limited']} límites de ritmo, {summary['throttled_seconds']}s en espera")
+        return summary
+
+    async def _run_job(self, job: OutboundJob, summary: Dict[str, Any]):
+        """Enviar un mensaje reintentando solo ante límites de ritmo"""
+        error: Optional[Exception] = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            summary["throttled_seconds"] += await self.bucket.acquire()
+            try:
+                await job.send()
+                summary["sent"] += 1
+                self._stats["messages_sent"] += 1
+                return
+            except WhatsAppRateLimitError as e:
+                error = e
+                summary["rate_limited"] += 1
+                self._stats["rate_limited"] += 1
+                pause = e.retry_after or 2 ** attempt
+                logger.warning(f"⚠️ Límite de ritmo de WhatsApp (intento {attempt}/{self.max_attempts}), "
+                               f"pausa de {pause}s")
+                self.bucket.pause(pause)
+            except Exception as e:
+                error = e
+                break
+
+        summary["failed"] += 1
+        self._stats["failed"] += 1
+        logger.error(f"❌ Envío a {job.phone} fallido ({job.reference or job.template_type}): {error}")
+        await self.record_failed(job.phone, job.template_type, str(error), reference=job.reference)
+
+    # ------------------------------------------------------------------
+    # Estado persistido
+    # ------------------------------------------------------------------
+
+    async def get_recently_sent(self, phones: List[str], template_type: str, hours: int = 48) -> Set[str]:
+        """Números que ya recibieron (sin fallo) esta plantilla en las últimas `hours` horas"""
+        if not self.initialized or not phones:
+            return set()
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT DISTINCT phone
+                    FROM whatsapp_outbound_messages
+                    WHERE template_type = $1
+                    AND phone = ANY($2::text[])
+                    AND status <> 'failed'
+                    AND created_at >= NOW() - make_interval(hours => $3)
+                """, template_type, list(set(phones)), hours)
+            return {row['phone'] for row in rows}
+
+        except Exception as e:
+            logger.error(f"❌ Error consultando envíos recientes de WhatsApp: {e}")
+            return set()
+
+    async def record_sent(self, phone: str, template_type: str, template_name: Optional[str],
+                          message_id: Optional[str], data: Dict[str, Any] = None,
+                          reference: Optional[str] = None):
+        """Registrar una plantilla aceptada por la API"""
+        if not self.initialized:
+            return
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO whatsapp_outbound_messages
+                        (message_id, phone, template_type, template_name, reference, status, data)
+                    VALUES ($1, $2, $3, $4, $5, 'sent', $6)
+                    ON CONFLICT (message_id) DO NOTHING
+                """, message_id, phone, template_type, template_name, reference,
+                    data or {})
+
+        except Exception as e:
+            logger.error(f"❌ Error registrando envío de WhatsApp a {phone}: {e}")
+
+    async def record_failed(self, phone: str, template_type: str, error: str,
+                            reference: Optional[str] = None):
+        """Registrar un envío que la API no aceptó"""
+        if not self.initialized:
+            return
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO whatsapp_outbound_messages
+                        (phone, template_type, reference, status, last_error)
+                    VALUES ($1, $2, $3, 'failed', $4)
+                """, phone, template_type, reference, error[:1000])
+
+        except Exception as e:
+            logger.error(f"❌ Error registrando fallo de WhatsApp a {phone}: {e}")
+
+    async def record_status(self, message_id: str, status: str, timestamp: Optional[float] = None,
+                            error: Optional[str] = None) -> bool:
+        """
+        Aplicar un webhook de estado (sent/delivered/read/failed) al mensaje enviado
+        Returns: True si el mensaje es nuestro y el estado avanzó
+        """
+        if not self.initialized or not message_id or not status:
+            return False
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                result = await conn.execute(f"""
+                    UPDATE whatsapp_outbound_messages
+                    SET status = $2,
+                        last_error = COALESCE($4, last_error),
+                        delivered_at = CASE WHEN $2 IN ('delivered', 'read')
+                            THEN COALESCE(delivered_at, to_timestamp($3)) ELSE delivered_at END,
+                        read_at = CASE WHEN $2 = 'read' THEN to_timestamp($3) ELSE read_at END,
+                        updated_at = NOW()
+                    WHERE message_id = $1
+                    AND {STATUS_RANK_SQL.format(column='status')} < {STATUS_RANK_SQL.format(column='$2::text')}
+                """, message_id, status, timestamp or time.time(), error)
+
+            updated = int(result.split()[-1]) > 0
+            if updated:
+                self._stats["status_updates"] += 1
+            return updated
+
+        except Exception as e:
+            logger.error(f"❌ Error actualizando estado del mensaje {message_id}: {e}")
+            return False
+
+    async def get_stats(self, hours: int = 24) -> Dict[str, Any]:
+        """Contadores del proceso y estados de entrega de las últimas `hours` horas"""
+        stats = {
+            **self._stats,
+            "throttled_seconds": round(self.bucket.throttled_seconds, 2),
+            "rate_per_second": self.bucket.rate,
+            "concurrency": self.concurrency
+        }
+        if not self.initialized:
+            return stats
+
+        try:
+            async with db_service.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT template_type, status, COUNT(*) AS count
+                    FROM whatsapp_outbound_messages
+                    WHERE created_at >= NOW() - make_interval(hours => $1)
+                    GROUP BY template_type, status
+                """, hours)
+
+            delivery: Dict[str, Dict[str, int]] = {}
+            for row in rows:
+                delivery.setdefault(row['template_type'], {})[row['status']] = row['count']
+            stats["delivery"] = delivery
+
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo estadísticas de envíos de WhatsApp: {e}")
+
+        return stats
+
+
+# Instancia global
+whatsapp_outbound_dispatcher = WhatsAppOutboundDispatcher()
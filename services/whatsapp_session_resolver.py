@@ -0,0 +1,356 @@
+"""
+Resolución de sesiones de WhatsApp
+Asocia cada número de teléfono con su sesión activa para que los mensajes sucesivos
+compartan el mismo session_id (y por tanto el mismo ConversationState del agente).
+La sesión expira tras el mismo tiempo de inactividad que usa
+metrics_service.find_or_create_conversation, de modo que sesión del agente y
+conversación de métricas empiezan y terminan juntas.
+
+El mapa número → sesión vive en PostgreSQL (tabla whatsapp_sessions) junto a la
+conversación de métricas, porque la app corre con varios workers de uvicorn. Cada
+sesión tiene un proceso dueño con latido periódico: la cola de mensajes entrantes
+solo entrega los mensajes de un número al proceso dueño de su sesión (el que tiene
+su ConversationState en memoria), y solo el dueño, o cualquiera si el dueño dejó de
+latir, expira la sesión. Cuando otro proceso se queda con un número, el que lo
+tenía lo detecta en su latido y libera su estado local (listeners de liberación).
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from config.settings import settings
+from services.database import db_service
+
+logger = logging.getLogger(__name__)
+
+ExpiryListener = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+ReleaseListener = ExpiryListener
+
+
+class WhatsAppSessionResolver:
+    """Mapa número de teléfono → sesión activa con timeout por inactividad y proceso dueño"""
+
+    def __init__(self, timeout_minutes: Optional[int] = None, cleanup_interval: int = 300):
+        self.timeout_minutes = timeout_minutes or settings.WHATSAPP_SESSION_TIMEOUT_MINUTES
+        self.cleanup_interval = cleanup_interval
+        self.heartbeat_seconds = 30  # Latido de las sesiones de este proceso
+        self.owner_timeout_seconds = 120  # Sin latido durante este tiempo el dueño se da por caído
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self.initialized = False
+        # Sesiones de las que este proceso es dueño (sin base de datos: todas las sesiones)
+        self.sessions: Dict[str, Dict[str, Any]] = {}  # Compartido con WhatsAppWebhookHandler.active_sessions
+
+        self._listeners: List[ExpiryListener] = []
+        self._release_listeners: List[ReleaseListener] = []
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
+
+    async def initialize(self):
+        """Crear la tabla de sesiones"""
+        try:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS whatsapp_sessions (
+                        phone VARCHAR(50) PRIMARY KEY,
+                        session_id VARCHAR(100) NOT NULL,
+                        conversation_id VARCHAR(100),
+                        started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        last_activity TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        owner VARCHAR(150),
+                        heartbeat_at TIMESTAMP WITH TIME ZONE
+                    );
+                """)
+
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_whatsapp_sessions_owner
+                    ON whatsapp_sessions(owner);
+                """)
+
+            self.initialized = True
+            logger.info(f"✅ Sesiones de WhatsApp en base de datos (proceso {self.owner})")
+
+        except Exception as e:
+            logger.error(f"❌ Error inicializando sesiones de WhatsApp: {e}")
+            self.initialized = False
+
+    def add_expiry_listener(self, listener: ExpiryListener):
+        """Registrar un callback (síncrono o async) que recibe cada sesión expirada"""
+        self._listeners.append(listener)
+
+    def add_release_listener(self, listener: ReleaseListener):
+        """
+        Registrar un callback (síncrono o async) que recibe cada sesión que este proceso
+        deja de atender sin que haya expirado aquí: otro worker se quedó con el número o la
+        sesión se sustituyó. Sirve para soltar el estado en memoria de este proceso
+        """
+        self._release_listeners.append(listener)
+
+    def _is_expired(self, session: Dict[str, Any], now: datetime) -> bool:
+        return (now - session["last_activity"]).total_seconds() > self.timeout_minutes * 60
+
+    async def resolve(self, phone_number: str) -> Dict[str, Any]:
+        """
+        Obtener la sesión activa del número o crear una nueva si no existe o expiró
+        Actualiza la última actividad de la sesión devuelta y toma su propiedad
+        """
+        if not self.initialized:
+            return await self._resolve_local(phone_number)
+
+        new_session_id = f"wa_{phone_number}_{int(time.time())}"
+        expired = None
+
+        async with db_service.pool.acquire() as conn:
+            async with conn.transaction():
+                current = await conn.fetchrow("""
+                    SELECT *, last_activity < NOW() - make_interval(mins => $2) AS expired
+                    FROM whatsapp_sessions
+                    WHERE phone = $1
+                    FOR UPDATE
+                """, phone_number, self.timeout_minutes)
+
+                if current is not None and not current['expired']:
+                    row = await conn.fetchrow("""
+                        UPDATE whatsapp_sessions
+                        SET last_activity = NOW(), owner = $2, heartbeat_at = NOW()
+                        WHERE phone = $1
+                        RETURNING *
+                    """, phone_number, self.owner)
+                else:
+                    if current is not None:
+                        expired = dict(current)
+                    row = await conn.fetchrow("""
+                        INSERT INTO whatsapp_sessions
+                            (phone, session_id, started_at, last_activity, owner, heartbeat_at)
+                        VALUES ($1, $2, NOW(), NOW(), $3, NOW())
+                        ON CONFLICT (phone) DO UPDATE
+                        SET session_id = EXCLUDED.session_id, conversation_id = NULL,
+                            started_at = NOW(), last_activity = NOW(),
+                            owner = EXCLUDED.owner, heartbeat_at = NOW()
+                        RETURNING *
+                    """, phone_number, new_session_id, self.owner)
+
+        if expired:
+            await self._notify_expired(self._to_session(expired))
+
+        session = self._to_session(row)
+        cached = self.sessions.get(phone_number)
+        if cached and cached["session_id"] == session["session_id"]:
+            session["context"] = cached["context"]
+        else:
+            logger.info(f"🔄 Sesión de WhatsApp {session['session_id']} para {phone_number} en {self.owner}")
+            if cached and (not expired or expired["session_id"] != cached["session_id"]):
+                # Sesión anterior de este proceso sustituida sin pasar por la expiración
+                await self._notify(self._release_listeners, cached)
+        self.sessions[phone_number] = session
+        return session
+
+    async def set_conversation(self, session: Dict[str, Any], conversation_id: Optional[str]):
+        """Guardar la conversación de métricas asociada a la sesión"""
+        session["conversation_id"] = conversation_id
+        if not self.initialized:
+            return
+
+        async with db_service.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE whatsapp_sessions
+                SET conversation_id = $3
+                WHERE phone = $1 AND session_id = $2
+            """, session["phone_number"], session["session_id"], conversation_id)
+
+    def _to_session(self, row) -> Dict[str, Any]:
+        return {
+            "phone_number": row["phone"],
+            "session_id": row["session_id"],
+            "conversation_id": row["conversation_id"],  # Conversación de métricas asociada
+            "started_at": row["started_at"],
+            "last_activity": row["last_activity"],
+            "platform": "whatsapp",
+            "context": {}
+        }
+
+    async def _resolve_local(self, phone_number: str) -> Dict[str, Any]:
+        """Sesión en memoria del proceso (sin base de datos disponible)"""
+        now = datetime.now()
+        session = self.sessions.get(phone_number)
+
+        if session and self._is_expired(session, now):
+            del self.sessions[phone_number]
+            await self._notify_expired(session)
+            session = None
+
+        if session is None:
+            session = {
+                "phone_number": phone_number,
+                "session_id": f"wa_{phone_number}_{int(now.timestamp())}",
+                "conversation_id": None,  # Conversación de métricas asociada
+                "started_at": now,
+                "last_activity": now,
+                "platform": "whatsapp",
+                "context": {}
+            }
+            self.sessions[phone_number] = session
+            logger.info(f"🔄 Nueva sesión de WhatsApp para {phone_number}: {session['session_id']}")
+        else:
+            session["last_activity"] = now
+
+        return session
+
+    async def _notify_expired(self, session: Dict[str, Any]):
+        """Avisar a los listeners de una sesión expirada"""
+        await self._notify(self._listeners, session)
+
+    async def _notify(self, listeners: List[ExpiryListener], session: Dict[str, Any]):
+        for listener in listeners:
+            try:
+                result = listener(session)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"❌ Error en listener de sesión {session['session_id']}: {e}")
+
+    async def cleanup_expired(self, timeout_minutes: Optional[int] = None) -> int:
+        """
+        Expirar las sesiones inactivas de este proceso (y las de procesos caídos)
+        Returns: número de sesiones eliminadas
+        """
+        timeout = timeout_minutes or self.timeout_minutes
+
+        if not self.initialized:
+            now = datetime.now()
+            expired = [
+                (phone, session) for phone, session in self.sessions.items()
+                if (now - session["last_activity"]).total_seconds() > timeout * 60
+            ]
+            for phone, session in expired:
+                del self.sessions[phone]
+                await self._notify_expired(session)
+        else:
+            # DELETE ... RETURNING: cada sesión la expira un único proceso
+            async with db_service.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    DELETE FROM whatsapp_sessions
+                    WHERE last_activity < NOW() - make_interval(mins => $1)
+                    AND (owner = $2 OR owner IS NULL
+                         OR heartbeat_at < NOW() - make_interval(secs => $3))
+                    RETURNING *
+                """, timeout, self.owner, float(self.owner_timeout_seconds))
+
+            expired = []
+            for row in rows:
+                session = self._to_session(row)
+                cached = self.sessions.get(session["phone_number"])
+                if cached and cached["session_id"] == session["session_id"]:
+                    del self.sessions[session["phone_number"]]
+                expired.append((session["phone_number"], session))
+                await self._notify_expired(session)
+
+        if expired:
+            logger.info(f"🧹 {len(expired)} sesiones de WhatsApp expiradas")
+        return len(expired)
+
+    async def heartbeat(self) -> int:
+        """
+        Renovar la propiedad de las sesiones de este proceso y liberar las que ya no lo son
+        (otro worker se quedó con el número o la sesión ya no existe)
+        Returns: número de sesiones liberadas
+        """
+        if not self.initialized:
+            return 0
+
+        # Las sesiones que resolve() crea o renueva mientras tanto no se comprueban aquí
+        known = dict(self.sessions)
+
+        async with db_service.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                UPDATE whatsapp_sessions
+                SET heartbeat_at = NOW()
+                WHERE owner = $1
+                RETURNING phone, session_id
+            """, self.owner)
+
+        owned = {(row["phone"], row["session_id"]) for row in rows}
+        lost = [
+            session for phone, session in known.items()
+            if (phone, session["session_id"]) not in owned and self.sessions.get(phone) is session
+        ]
+        for session in lost:
+            del self.sessions[session["phone_number"]]
+            await self._notify(self._release_listeners, session)
+
+        if lost:
+            logger.info(f"🔄 {len(lost)} sesiones de WhatsApp atendidas ahora por otro worker")
+        return len(lost)
+
+    async def release_ownership(self):
+        """Ceder las sesiones de este proceso (al apagar) para que otro worker las atienda ya"""
+        if not self.initialized:
+            return
+
+        async with db_service.pool.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE whatsapp_sessions
+                SET owner = NULL, heartbeat_at = NULL
+                WHERE owner = $1
+            """, self.owner)
+
+        released = int(result.split()[-1])
+        if released:
+            logger.info(f"🔄 {released} sesiones de WhatsApp cedidas a otros workers")
+
+    def start_worker(self):
+        """Arrancar el latido y la limpieza periódica de sesiones inactivas"""
+        if self._running:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop_worker(self):
+        """Detener el worker y ceder las sesiones de este proceso"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+        try:
+            await self.release_ownership()
+        except Exception as e:
+            logger.error(f"❌ Error cediendo sesiones de WhatsApp: {e}")
+
+    async def _worker_loop(self):
+        last_cleanup = time.monotonic()
+
+        while self._running:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.heartbeat()
+                if time.monotonic() - last_cleanup > self.cleanup_interval:
+                    await self.cleanup_expired()
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logger.error(f"❌ Error en el mantenimiento de sesiones de WhatsApp: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado actual de las sesiones de este proceso"""
+        return {
+            "active_sessions": len(self.sessions),
+            "timeout_minutes": self.timeout_minutes,
+            "shared": self.initialized,
+            "owner": self.owner,
+            "running": self._running
+        }
+
+
+# Instancia global
+whatsapp_session_resolver = WhatsAppSessionResolver()
@@ -2,15 +2,18 @@
 Sistema de plantillas para mensajes de WhatsApp
 """
 
+import asyncio
 import json
 import logging
+from functools import partial
 from typing import Dict, Any, List, Optional
-from datetime import datetime
 from enum import Enum
 
 from services.whatsapp_360dialog_service import whatsapp_service
 from services.woocommerce import WooCommerceService
 from services.database import db_service
+from services.whatsapp_outbound_dispatcher import whatsapp_outbound_dispatcher, OutboundJob
+from services.wordpress_db_service import wordpress_db_service
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -41,6 +44,9 @@ class WhatsAppTemplateManager:
             TemplateType.ORDER_CONFIRMATION: getattr(settings, 'WHATSAPP_ORDER_CONFIRMATION_TEMPLATE', 'order_confirmation'),
             TemplateType.WELCOME: getattr(settings, 'WHATSAPP_WELCOME_TEMPLATE', 'welcome_message')
         }
+        self.recovery_interval = settings.WHATSAPP_CART_RECOVERY_INTERVAL_MINUTES * 60
+        self._running = False
+        self._worker_task: Optional[asyncio.Task] = None
         logger.info("WhatsApp Template Manager initialized")
     
     async def send_cart_recovery_multimedia(self, phone_number: str, cart_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -75,7 +81,8 @@ class WhatsAppTemplateManager:
                 phone_number,
                 TemplateType.CART_RECOVERY,
                 cart_data,
-                result
+                result,
+                template_name=template_name
             )
             
             return result
@@ -116,7 +123,8 @@ class WhatsAppTemplateManager:
                 phone_number,
                 TemplateType.CART_RECOVERY,
                 cart_data,
-                result
+                result,
+                template_name=template_name
             )
             
             return result
@@ -153,7 +161,8 @@ class WhatsAppTemplateManager:
                 phone_number,
                 TemplateType.ORDER_CONFIRMATION,
                 order_data,
-                result
+                result,
+                template_name=self.templates[TemplateType.ORDER_CONFIRMATION]
             )
             
             return result
@@ -197,7 +206,8 @@ class WhatsAppTemplateManager:
                 phone_number,
                 TemplateType.WELCOME,
                 {"customer_name": customer_name},
-                result
+                result,
+                template_name=self.templates[TemplateType.WELCOME]
             )
             
             return result
@@ -511,7 +521,8 @@ class WhatsAppTemplateManager:
         return components
     
     async def _log_template_sent(self, phone_number: str, template_type: TemplateType,
-                                data: Dict[str, Any], result: Dict[str, Any]) -> None:
+                                data: Dict[str, Any], result: Dict[str, Any],
+                                template_name: Optional[str] = None) -> None:
         """
         Registra el envío de una plantilla
         
@@ -520,50 +531,131 @@ class WhatsAppTemplateManager:
             template_type: Tipo de plantilla
             data: Datos utilizados
             result: Resultado del envío
+            template_name: Nombre de la plantilla enviada
         """
         try:
-            log_entry = {
-                "timestamp": datetime.now(),
-                "phone_number": phone_number,
-                "template_type": template_type.value,
-                "template_data": data,
-                "message_id": result.get("messages", [{}])[0].get("id"),
-                "status": "sent",
-                "response": result
-            }
+            message_id = result.get("messages", [{}])[0].get("id")
             
-            # Aquí deberías guardar en la base de datos
+            # El estado de entrega se actualiza después con los webhooks de estado
+            await whatsapp_outbound_dispatcher.record_sent(
+                phone_number,
+                template_type.value,
+                template_name,
+                message_id,
+                data=data,
+                reference=str(data["id"]) if data.get("id") is not None else None
+            )
             logger.info(f"Template sent: {template_type.value} to {phone_number}")
             
         except Exception as e:
             logger.error(f"Error logging template: {str(e)}")
     
-    async def get_abandoned_carts(self, hours: int = 24) -> List[Dict[str, Any]]:
+    async def get_abandoned_carts(self, hours: int = 24, consume: bool = True) -> List[Dict[str, Any]]:
         """
-        Obtiene carritos abandonados para recuperación
+        Obtiene los carritos abandonados nuevos desde la base de datos de WordPress
+        (sesiones de WooCommerce y CartFlows). Cada carrito se devuelve una sola vez:
+        el escáner continúa desde el último escaneo de cualquier worker
         
         Args:
             hours: Horas de abandono para considerar
+            consume: Avanzar el escaneo (False devuelve los mismos carritos la próxima vez)
             
         Returns:
-            Lista de carritos abandonados
+            Lista de carritos con id, phone_number, whatsapp_optin, items y total
         """
         try:
-            # Aquí deberías implementar la lógica para obtener carritos abandonados
-            # desde WooCommerce o tu sistema de tracking
+            if not wordpress_db_service.pool:
+                logger.warning("⚠️ Base de datos de WordPress no configurada, sin carritos abandonados")
+                return []
+            
+            raw_carts = await wordpress_db_service.scan_new_abandoned_carts(hours, advance=consume)
+            if not raw_carts:
+                return []
+            
+            # Nombres y SKUs de todos los productos del lote en una sola consulta
+            product_ids = set()
+            for raw in raw_carts:
+                items = raw['cart_data']['items'] if 'session_key' in raw else raw['items']
+                for item in items:
+                    if isinstance(item, dict):
+                        product_ids.update(self._cart_item_product_ids(item))
+            labels = await self.db_service.get_product_labels([f"product_{pid}" for pid in product_ids])
             
-            # Por ahora, retornamos un ejemplo
             abandoned_carts = []
+            for raw in raw_carts:
+                if 'session_key' in raw:
+                    cart = raw['cart_data']
+                    cart_id = f"wc_session:{raw['session_key']}"
+                    optin = settings.WHATSAPP_CART_RECOVERY_WC_SESSIONS_OPTIN
+                    abandoned_at = raw['expiry']
+                else:
+                    cart = raw
+                    cart_id = f"cartflows:{raw['cart_id']}"
+                    optin = True  # CartFlows solo devuelve carritos no dados de baja
+                    abandoned_at = raw['abandoned_at']
+                
+                phone_number = self._cart_phone_number(cart.get('phone'))
+                abandoned_carts.append({
+                    "id": cart_id,
+                    "phone_number": phone_number,
+                    "whatsapp_optin": bool(optin and phone_number),
+                    "email": cart.get('email', ''),
+                    "customer_name": cart.get('customer_name', ''),
+                    "items": [
+                        self._cart_item_with_label(item, labels)
+                        for item in cart.get('items', []) if isinstance(item, dict)
+                    ],
+                    "total": float(cart.get('total') or 0),
+                    "abandoned_at": abandoned_at
+                })
             
-            # Esta es una implementación de ejemplo
-            # En producción, deberías consultar tu base de datos o WooCommerce
-            
+            logger.info(f"🛒 {len(abandoned_carts)} carritos abandonados nuevos")
             return abandoned_carts
         
         except Exception as e:
             logger.error(f"Error getting abandoned carts: {str(e)}")
             return []
     
+    def _cart_item_product_ids(self, item: Dict[str, Any]) -> List[int]:
+        """IDs con los que buscar el nombre de una línea: variación primero y luego producto"""
+        ids = []
+        for key in ('variation_id', 'product_id'):
+            try:
+                value = int(item.get(key) or 0)
+            except (TypeError, ValueError):
+                continue
+            if value:
+                ids.append(value)
+        return ids
+    
+    def _cart_item_with_label(self, item: Dict[str, Any], labels: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Línea del carrito con el nombre y SKU del catálogo"""
+        label = next(
+            (labels[f"product_{pid}"] for pid in self._cart_item_product_ids(item) if f"product_{pid}" in labels),
+            {}
+        )
+        try:
+            quantity = int(item.get('quantity') or 1)
+        except (TypeError, ValueError):
+            quantity = 1
+        return {
+            "name": label.get('name') or item.get('name') or 'Producto',
+            "sku": label.get('sku') or item.get('sku') or '',
+            "quantity": quantity,
+            "total": float(item.get('total') or item.get('line_total') or 0)
+        }
+    
+    def _cart_phone_number(self, phone: Optional[str]) -> Optional[str]:
+        """Teléfono en formato internacional (+34...) o None si no es válido"""
+        if not phone:
+            return None
+        digits = whatsapp_service.format_phone_number(str(phone))
+        if digits.startswith('00'):
+            digits = digits[2:]
+        if len(digits) < 11:
+            return None
+        return f"+{digits}"
+    
     async def process_cart_recovery_batch(self, dry_run: bool = False) -> Dict[str, Any]:
         """
         Procesa un lote de carritos abandonados para recuperación
@@ -575,8 +667,8 @@ class WhatsAppTemplateManager:
             Resumen del procesamiento
         """
         try:
-            # Obtener carritos abandonados
-            abandoned_carts = await self.get_abandoned_carts()
+            # Obtener carritos abandonados (una simulación no los consume)
+            abandoned_carts = await self.get_abandoned_carts(consume=not dry_run)
             
             results = {
                 "total_carts": len(abandoned_carts),
@@ -585,29 +677,45 @@ class WhatsAppTemplateManager:
                 "skipped": 0
             }
             
-            for cart in abandoned_carts:
-                try:
-                    # Verificar si el cliente tiene opt-in para WhatsApp
-                    if not cart.get("whatsapp_optin", False):
-                        results["skipped"] += 1
-                        continue
-                    
-                    # Verificar si ya se envió un mensaje recientemente
-                    if await self._already_sent_recently(cart["phone_number"], TemplateType.CART_RECOVERY):
-                        results["skipped"] += 1
-                        continue
-                    
-                    if not dry_run:
-                        # Enviar mensaje de recuperación
-                        await self.send_cart_recovery(cart["phone_number"], cart)
-                        results["messages_sent"] += 1
-                    else:
-                        logger.info(f"[DRY RUN] Would send cart recovery to {cart['phone_number']}")
-                        results["messages_sent"] += 1
+            # Solo clientes con opt-in para WhatsApp
+            candidates = [cart for cart in abandoned_carts if cart.get("whatsapp_optin", False)]
+            results["skipped"] += len(abandoned_carts) - len(candidates)
+            
+            # Una sola consulta para saber a quién ya se le envió recientemente
+            recently_sent = await whatsapp_outbound_dispatcher.get_recently_sent(
+                [cart["phone_number"] for cart in candidates],
+                TemplateType.CART_RECOVERY.value
+            )
+            
+            jobs = []
+            for cart in candidates:
+                phone_number = cart["phone_number"]
                 
-                except Exception as e:
-                    logger.error(f"Error processing cart {cart.get('id')}: {str(e)}")
-                    results["errors"] += 1
+                # Ya enviado recientemente o repetido en este lote
+                if phone_number in recently_sent:
+                    results["skipped"] += 1
+                    continue
+                recently_sent.add(phone_number)
+                
+                if dry_run:
+                    logger.info(f"[DRY RUN] Would send cart recovery to {phone_number}")
+                    results["messages_sent"] += 1
+                    continue
+                
+                jobs.append(OutboundJob(
+                    phone=phone_number,
+                    template_type=TemplateType.CART_RECOVERY.value,
+                    send=partial(self.send_cart_recovery, phone_number, cart),
+                    reference=str(cart.get("id")) if cart.get("id") is not None else None
+                ))
+            
+            # Envío con límite de ritmo y workers acotados
+            if jobs:
+                summary = await whatsapp_outbound_dispatcher.dispatch(jobs)
+                results["messages_sent"] += summary["sent"]
+                results["errors"] += summary["failed"]
+                results["rate_limited"] = summary["rate_limited"]
+                results["throttled_seconds"] = summary["throttled_seconds"]
             
             logger.info(f"Cart recovery batch completed: {results}")
             return results
@@ -616,6 +724,37 @@ class WhatsAppTemplateManager:
             logger.error(f"Error in cart recovery batch: {str(e)}")
             raise
     
+    def start_worker(self):
+        """Arrancar la campaña periódica de recuperación de carritos"""
+        if self._running or self.recovery_interval <= 0:
+            return
+        self._running = True
+        self._worker_task = asyncio.create_task(self._worker_loop())
+    
+    async def stop_worker(self):
+        """Detener la campaña periódica"""
+        self._running = False
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+    
+    async def _worker_loop(self):
+        # Todos los workers ejecutan el bucle: el advisory lock del escáner hace que
+        # cada carrito se procese una sola vez
+        while self._running:
+            await asyncio.sleep(self.recovery_interval)
+            try:
+                if wordpress_db_service.pool:
+                    await self.process_cart_recovery_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en la campaña de recuperación de carritos: {e}")
+    
     async def _already_sent_recently(self, phone_number: str, 
                                    template_type: TemplateType,
                                    hours: int = 48) -> bool:
@@ -630,9 +769,10 @@ class WhatsAppTemplateManager:
         Returns:
             True si ya se envió recientemente
         """
-        # Aquí deberías consultar tu base de datos
-        # Por ahora retornamos False
-        return False
+        recently_sent = await whatsapp_outbound_dispatcher.get_recently_sent(
+            [phone_number], template_type.value, hours
+        )
+        return phone_number in recently_sent
     
     async def register_template(self, template_name: str, 
                               template_content: str,
@@ -11,6 +11,8 @@ from dataclasses import dataclass
 from enum import Enum
 
 from services.whatsapp_360dialog_service import whatsapp_service
+from services.whatsapp_session_resolver import whatsapp_session_resolver
+from services.whatsapp_outbound_dispatcher import whatsapp_outbound_dispatcher
 from services.database import db_service
 from config.settings import settings
 
@@ -68,7 +70,8 @@ class WhatsAppWebhookHandler:
     
     def __init__(self):
         self.db_service = db_service
-        self.active_sessions = {}  # Sesiones activas por número de teléfono
+        self.session_resolver = whatsapp_session_resolver
+        self.active_sessions = whatsapp_session_resolver.sessions  # Sesiones activas por número de teléfono
         logger.info("WhatsApp Webhook Handler initialized")
     
     async def process_webhook(self, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -261,11 +264,17 @@ class WhatsAppWebhookHandler:
             timestamp = datetime.fromtimestamp(int(status_data.get("timestamp")))
             recipient = status_data.get("recipient_id")
             
-            # Actualizar estado en base de datos si es necesario
             logger.info(f"Status update: {message_id} - {status} for {recipient}")
             
-            # Aquí podrías actualizar el estado en la base de datos
-            # o emitir un evento para notificar al frontend
+            # Actualizar el estado de entrega de las plantillas enviadas
+            errors = status_data.get("errors") or [{}]
+            error = (errors[0].get("title") or errors[0].get("message")) if status == "failed" else None
+            await whatsapp_outbound_dispatcher.record_status(
+                message_id,
+                status,
+                timestamp=float(status_data.get("timestamp")),
+                error=error
+            )
             
         except Exception as e:
             logger.error(f"Error processing status update: {str(e)}")
@@ -302,22 +311,7 @@ class WhatsAppWebhookHandler:
         Returns:
             Datos de la sesión
         """
-        if phone_number not in self.active_sessions:
-            # Crear nueva sesión
-            session = {
-                "phone_number": phone_number,
-                "session_id": f"wa_{phone_number}_{datetime.now().timestamp()}",
-                "started_at": datetime.now(),
-                "last_activity": datetime.now(),
-                "platform": "whatsapp",
-                "context": {}
-            }
-            self.active_sessions[phone_number] = session
-        else:
-            # Actualizar última actividad
-            self.active_sessions[phone_number]["last_activity"] = datetime.now()
-        
-        return self.active_sessions[phone_number]
+        return await self.session_resolver.resolve(phone_number)
     
     async def _log_message(self, message: WhatsAppMessage, session: Dict[str, Any]) -> None:
         """
@@ -394,24 +388,15 @@ class WhatsAppWebhookHandler:
         """
         return whatsapp_service.verify_webhook(mode, token, challenge)
     
-    async def cleanup_inactive_sessions(self, timeout_minutes: int = 30) -> None:
+    async def cleanup_inactive_sessions(self, timeout_minutes: Optional[int] = None) -> None:
         """
         Limpia sesiones inactivas
         
         Args:
             timeout_minutes: Minutos de inactividad para considerar timeout
+                (por defecto WHATSAPP_SESSION_TIMEOUT_MINUTES)
         """
-        current_time = datetime.now()
-        sessions_to_remove = []
-        
-        for phone, session in self.active_sessions.items():
-            last_activity = session["last_activity"]
-            if (current_time - last_activity).total_seconds() > timeout_minutes * 60:
-                sessions_to_remove.append(phone)
-        
-        for phone in sessions_to_remove:
-            del self.active_sessions[phone]
-            logger.info(f"Session cleaned up for {phone}")
+        await self.session_resolver.cleanup_expired(timeout_minutes)
 
 
 # Instancia singleton del handler
@@ -4,8 +4,11 @@ Cliente API de WooCommerce para el servidor MCP de El Corte Eléctrico
 
 import httpx
 import asyncio
-from typing import List, Dict, Any, Optional
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from config.settings import settings
+from services.tracing_service import tracer
+from services.woocommerce_paginator import WooCommercePaginator
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,14 +27,16 @@ class WooCommerceService:
         
         async with httpx.AsyncClient(timeout=self.timeout) as client:
             try:
-                response = await client.request(
-                    method=method,
-                    url=url,
-                    auth=self.auth,
-                    **kwargs
-                )
-                response.raise_for_status()
-                return response.json()
+                with tracer.span("woocommerce.request", method=method, endpoint=endpoint) as span:
+                    response = await client.request(
+                        method=method,
+                        url=url,
+                        auth=self.auth,
+                        **kwargs
+                    )
+                    span.set_attribute("http.status", response.status_code)
+                    response.raise_for_status()
+                    return response.json()
             except httpx.HTTPError as e:
                 print(f"Error HTTP: {e}")
                 return None
@@ -39,6 +44,21 @@ class WooCommerceService:
                 print(f"Error: {e}")
                 return None
     
+    def iter_pages(
+        self,
+        endpoint: str,
+        params: Dict[str, Any] = None,
+        per_page: int = 100,
+        max_pages: int = None,
+        concurrency: int = None
+    ) -> AsyncIterator[Tuple[int, Optional[List[Dict]]]]:
+        """
+        Recorrer un endpoint paginado con descargas concurrentes y limitador adaptativo
+        Produce (página, elementos); elementos es None si la página no se pudo obtener
+        """
+        paginator = WooCommercePaginator(self, concurrency=concurrency)
+        return paginator.iter_pages(endpoint, params, per_page=per_page, max_pages=max_pages)
+    
     # Métodos de productos
     async def get_products(self, **params) -> Optional[List[Dict]]:
         """Obtener lista de productos"""
@@ -94,45 +114,34 @@ class WooCommerceService:
             
             # También buscar pedidos de invitados (guest checkout)
             # WooCommerce no permite buscar directamente por billing email, 
-            # así que obtenemos pedidos recientes y filtramos
-            # Intentar obtener más pedidos si es necesario
-            page = 1
-            max_pages = 3  # Buscar hasta 300 pedidos
-            
-            while page <= max_pages:
-                recent_orders = await self._make_request(
-                    "GET", 
-                    "orders", 
-                    params={
-                        "per_page": 100, 
-                        "page": page,
-                        "orderby": "date", 
-                        "order": "desc"
-                    }
-                )
-                
-                if recent_orders:
-                    # Filtrar pedidos por email de facturación
-                    found_in_page = False
-                    for order in recent_orders:
-                        billing = order.get('billing', {})
-                        if billing.get('email', '').lower() == customer_email.lower():
-                            # Evitar duplicados si ya se agregó desde cliente registrado
-                            if not any(o.get('id') == order.get('id') for o in matching_orders):
-                                matching_orders.append(order)
-                                found_in_page = True
+            # así que obtenemos pedidos recientes (hasta 300) y filtramos
+            recent_pages = self.iter_pages(
+                "orders",
+                {"orderby": "date", "order": "desc"},
+                per_page=100,
+                max_pages=3
+            )
+            # Las páginas llegan en orden de finalización: se procesan en orden de número
+            # (de más reciente a más antiguo) para que el corte no deje fuera pedidos nuevos
+            buffered_pages: Dict[int, List[Dict]] = {}
+            next_page = 1
+            async with aclosing(recent_pages) as pages:
+                async for page, recent_orders in pages:
+                    buffered_pages[page] = recent_orders or []
                     
-                    # Si encontramos al menos uno, podemos parar
-                    if found_in_page and len(matching_orders) >= 5:
-                        break
+                    while next_page in buffered_pages:
+                        # Filtrar pedidos por email de facturación
+                        for order in buffered_pages.pop(next_page):
+                            billing = order.get('billing', {})
+                            if billing.get('email', '').lower() == customer_email.lower():
+                                # Evitar duplicados si ya se agregó desde cliente registrado
+                                if not any(o.get('id') == order.get('id') for o in matching_orders):
+                                    matching_orders.append(order)
+                        next_page += 1
                     
-                    # Si no hay más pedidos, salir
-                    if len(recent_orders) < 100:
+                    # Con suficientes coincidencias se cancelan las páginas pendientes
+                    if len(matching_orders) >= 5:
                         break
-                else:
-                    break
-                
-                page += 1
             
             # Ordenar por fecha más reciente
             matching_orders.sort(key=lambda x: x.get('date_created', ''), reverse=True)
@@ -140,7 +149,7 @@ class WooCommerceService:
             return matching_orders
             
         except Exception as e:
-            self.logger.error(f"Error buscando pedidos del cliente: {e}")
+            logger.error(f"Error buscando pedidos del cliente: {e}")
             return []
     
     # Métodos de clientes
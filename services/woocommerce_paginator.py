@@ -0,0 +1,226 @@
+"""
+Paginación concurrente de la API REST de WooCommerce
+Lee X-WP-TotalPages de la primera respuesta, descarga el resto de páginas en paralelo
+bajo un limitador token bucket que se adapta a 429/5xx y a la latencia, y entrega
+las páginas como iterador asíncrono según van llegando
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from config.settings import WOOCOMMERCE_PAGINATION_CONFIG
+from services.tracing_service import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket con ritmo adaptativo (AIMD)
+    - Respuesta rápida: el ritmo sube de forma aditiva hasta max_rate
+    - Respuesta lenta: el ritmo baja un 20%
+    - 429/5xx o error de red: el ritmo se reduce multiplicativamente, se vacía el cubo
+      y se respeta Retry-After si el servidor lo envía
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        config = config or WOOCOMMERCE_PAGINATION_CONFIG
+        self.min_rate = config["min_rate"]
+        self.max_rate = config["max_rate"]
+        self.burst = config["burst"]
+        self.rate_increase = config["rate_increase"]
+        self.backoff_factor = config["backoff_factor"]
+        self.target_latency = config["target_latency"]
+
+        self.rate = config["initial_rate"]
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+        self._stats = {"requests": 0, "throttled": 0, "slow": 0}
+
+    def _refill(self, now: float):
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Esperar hasta disponer de un token (los que esperan se atienden en orden)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self._stats["requests"] += 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def record_success(self, latency: float):
+        """Ajustar el ritmo tras una respuesta correcta"""
+        if latency > self.target_latency:
+            self._stats["slow"] += 1
+            self.rate = max(self.min_rate, self.rate * 0.8)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.rate_increase)
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        """Frenar tras un 429/5xx o un error de red"""
+        self._stats["throttled"] += 1
+        self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+        self.tokens = 0.0
+        self.updated_at = time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, self.updated_at + retry_after)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado actual del limitador"""
+        return {
+            **self._stats,
+            "rate": round(self.rate, 2),
+            "tokens": round(self.tokens, 2)
+        }
+
+
+class WooCommercePaginator:
+    """Recorre un endpoint paginado de WooCommerce con descargas concurrentes"""
+
+    def __init__(self, wc_service, limiter: AdaptiveRateLimiter = None,
+                 concurrency: int = None, max_retries: int = None):
+        self.wc_service = wc_service
+        self.limiter = limiter or woocommerce_rate_limiter
+        self.concurrency = max(1, concurrency or WOOCOMMERCE_PAGINATION_CONFIG["concurrency"])
+        self.max_retries = max_retries or WOOCOMMERCE_PAGINATION_CONFIG["max_retries"]
+
+    async def iter_pages(
+        self,
+        endpoint: str,
+        params: Dict[str, Any] = None,
+        per_page: int = 100,
+        max_pages: int = None
+    ) -> AsyncIterator[Tuple[int, Optional[List[Dict]]]]:
+        """
+        Iterar las páginas de un endpoint
+        Produce tuplas (página, elementos). Tras la primera, las páginas llegan en orden
+        de finalización, no de número. Una página que no se pudo obtener tras los
+        reintentos se entrega como (página, None) para que el consumidor decida.
+        Si el consumidor sale antes (break), usar contextlib.aclosing para cancelar
+        las descargas en vuelo.
+        """
+        params = dict(params or {})
+
+        async with httpx.AsyncClient(timeout=self.wc_service.timeout) as client:
+            first, total_pages = await self._fetch_page(client, endpoint, params, 1, per_page)
+            yield 1, first
+            if first is None:
+                return
+
+            if total_pages is None:
+                # Sin cabecera X-WP-TotalPages: avanzar de forma secuencial hasta una página corta
+                page, items = 1, first
+                while len(items) >= per_page and (max_pages is None or page < max_pages):
+                    page += 1
+                    items, _ = await self._fetch_page(client, endpoint, params, page, per_page)
+                    yield page, items
+                    if items is None:
+                        return
+                return
+
+            last_page = min(total_pages, max_pages) if max_pages else total_pages
+            next_page = 2
+            in_flight: Dict[asyncio.Task, int] = {}
+            try:
+                while next_page <= last_page or in_flight:
+                    while next_page <= last_page and len(in_flight) < self.concurrency:
+                        task = asyncio.create_task(
+                            self._fetch_page(client, endpoint, params, next_page, per_page)
+                        )
+                        in_flight[task] = next_page
+                        next_page += 1
+
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        page = in_flight.pop(task)
+                        items, _ = task.result()
+                        yield page, items
+            finally:
+                for task in in_flight:
+                    task.cancel()
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def _fetch_page(
+        self,
+        client: httpx.AsyncClient,
+        endpoint: str,
+        params: Dict[str, Any],
+        page: int,
+        per_page: int
+    ) -> Tuple[Optional[List[Dict]], Optional[int]]:
+        """
+        Descargar una página respetando el limitador
+        Returns: (elementos o None si falla, total de páginas o None si no viene la cabecera)
+        """
+        url = f"{self.wc_service.base_url}/{endpoint}"
+        request_params = {**params, "page": page, "per_page": per_page}
+
+        for attempt in range(1, self.max_retries + 1):
+            await self.limiter.acquire()
+            started = time.monotonic()
+
+            try:
+                with tracer.span("woocommerce.page", endpoint=endpoint, page=page, attempt=attempt) as span:
+                    response = await client.get(url, params=request_params, auth=self.wc_service.auth)
+                    span.set_attribute("http.status", response.status_code)
+            except httpx.HTTPError as e:
+                self.limiter.record_throttle()
+                logger.warning(f"⚠️ Error de red en {endpoint} página {page} (intento {attempt}/{self.max_retries}): {e}")
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                self.limiter.record_throttle(self._parse_retry_after(response.headers.get("Retry-After")))
+                logger.warning(f"⚠️ WooCommerce respondió {response.status_code} en {endpoint} página {page} "
+                               f"(intento {attempt}/{self.max_retries}), ritmo: {self.limiter.rate:.2f} req/s")
+                continue
+
+            if response.status_code >= 400:
+                logger.error(f"❌ WooCommerce respondió {response.status_code} en {endpoint} página {page}")
+                return None, None
+
+            self.limiter.record_success(time.monotonic() - started)
+
+            try:
+                items = response.json()
+            except ValueError as e:
+                logger.error(f"❌ Respuesta no JSON en {endpoint} página {page}: {e}")
+                return None, None
+            if not isinstance(items, list):
+                logger.error(f"❌ Respuesta inesperada en {endpoint} página {page}: {type(items).__name__}")
+                return None, None
+
+            total_pages = response.headers.get("X-WP-TotalPages")
+            return items, int(total_pages) if total_pages and total_pages.isdigit() else None
+
+        logger.error(f"❌ No se pudo obtener {endpoint} página {page} tras {self.max_retries} intentos")
+        return None, None
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Retry-After en segundos (se ignora el formato de fecha HTTP)"""
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+
+# Limitador compartido por todas las instancias de WooCommerceService del proceso
+woocommerce_rate_limiter = AdaptiveRateLimiter()
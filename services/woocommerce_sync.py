@@ -5,13 +5,18 @@ Sincroniza productos, categorías y información de la tienda con la base de con
 
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime, timedelta, timezone
 import json
+import hashlib
+from contextlib import aclosing
 
 from services.woocommerce import WooCommerceService
 from services.database import db_service
 from services.embedding_service import embedding_service
+from services.product_attributes_service import product_attributes_service
+from services.product_card_cache import product_card_cache
+from services.cpu_offload import cpu_offload
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -23,10 +28,19 @@ class WooCommerceSyncService:
         self.wc_service = WooCommerceService()
         self.batch_size = 50  # Productos por lote
         self.max_retries = 3
+        self.fetch_concurrency = 3  # Páginas descargándose en paralelo (paginador con limitador adaptativo)
+        self.process_workers = 2  # Páginas procesándose (embeddings + upsert) en paralelo
+        self.page_queue_size = 4  # Páginas en espera entre descarga y procesado
         
     async def sync_all_products(self, force_update: bool = False) -> Dict[str, int]:
         """
         Sincronizar todos los productos de WooCommerce
+        
+        Pipeline productor/consumidor: el paginador descarga páginas en paralelo hacia una
+        cola acotada mientras otras tareas las transforman, generan embeddings por lote e insertan.
+        La descarga y los embeddings se solapan y la memoria queda limitada a las páginas
+        en cola; del catálogo completo solo se conservan los IDs vistos.
+        
         Args:
             force_update: Si True, actualiza todos los productos independientemente de la fecha
         Returns:
@@ -38,6 +52,8 @@ class WooCommerceSyncService:
             "total_fetched": 0,
             "new_products": 0,
             "updated_products": 0,
+            "commercial_updates": 0,  # Solo precio/stock: sin embedding
+            "skipped_products": 0,
             "errors": 0,
             "categories_synced": 0
         }
@@ -46,54 +62,79 @@ class WooCommerceSyncService:
             # 1. Sincronizar categorías primero
             await self._sync_categories(stats)
             
-            # 2. Obtener todos los productos de WooCommerce
-            page = 1
+            # 2. Pipeline de productos: descarga -> transformación -> embeddings -> upsert
             per_page = self.batch_size
-            all_products = []
+            page_queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_queue_size)
+            seen_ids: Set[str] = set()
+            state = {"fetch_failed": False}
             
-            while True:
-                logger.info(f"📥 Obteniendo página {page} de productos...")
-                
-                products = await self.wc_service.get_products(
-                    page=page,
+            async def fetch_pages():
+                pages = self.wc_service.iter_pages(
+                    "products",
+                    {"status": "publish"},  # Solo productos publicados
                     per_page=per_page,
-                    status='publish'  # Solo productos publicados
+                    concurrency=self.fetch_concurrency
                 )
-                
-                if not products or len(products) == 0:
-                    break
-                    
-                all_products.extend(products)
-                stats["total_fetched"] += len(products)
-                
-                # Si obtenemos menos productos que per_page, es la última página
-                if len(products) < per_page:
-                    break
-                    
-                page += 1
-                
-                # Pequeña pausa para no sobrecargar la API
-                await asyncio.sleep(0.5)
+                async with aclosing(pages):
+                    async for page, products in pages:
+                        if products is None:
+                            # Sin el catálogo completo no se puede desactivar nada con seguridad
+                            state["fetch_failed"] = True
+                            return
+                        
+                        logger.info(f"📥 Obtenida página {page} de productos ({len(products)})")
+                        if products:
+                            stats["total_fetched"] += len(products)
+                            seen_ids.update(f"product_{p['id']}" for p in products if isinstance(p, dict) and p.get('id'))
+                            await page_queue.put((page, products))
             
-            logger.info(f"📊 Total productos obtenidos: {len(all_products)}")
+            async def process_worker():
+                while True:
+                    item = await page_queue.get()
+                    try:
+                        if item is None:
+                            return
+                        page, products = item
+                        page_stats = await self._process_product_page(products, force_update)
+                        
+                        stats["new_products"] += page_stats["new"]
+                        stats["updated_products"] += page_stats["updated"]
+                        stats["commercial_updates"] += page_stats["commercial"]
+                        stats["skipped_products"] += page_stats["skipped"]
+                        stats["errors"] += page_stats["errors"]
+                        
+                        logger.info(f"✅ Procesada página {page}: "
+                                  f"{page_stats['new']} nuevos, {page_stats['updated']} actualizados, "
+                                  f"{page_stats['commercial']} solo precio/stock, "
+                                  f"{page_stats['skipped']} sin cambios")
+                    except Exception as e:
+                        logger.error(f"❌ Error procesando página de productos: {e}")
+                        stats["errors"] += 1
+                    finally:
+                        page_queue.task_done()
             
-            # 3. Procesar productos en lotes
-            for i in range(0, len(all_products), self.batch_size):
-                batch = all_products[i:i + self.batch_size]
-                batch_stats = await self._process_product_batch(batch, force_update)
-                
-                stats["new_products"] += batch_stats["new"]
-                stats["updated_products"] += batch_stats["updated"]
-                stats["errors"] += batch_stats["errors"]
-                
-                logger.info(f"✅ Procesado lote {i//self.batch_size + 1}: "
-                          f"{batch_stats['new']} nuevos, {batch_stats['updated']} actualizados")
-                
-                # Pausa entre lotes
-                await asyncio.sleep(1)
+            processors = [asyncio.create_task(process_worker()) for _ in range(self.process_workers)]
+            try:
+                await fetch_pages()
+            finally:
+                # Una señal de fin por consumidor, tras las páginas ya encoladas
+                for _ in processors:
+                    await page_queue.put(None)
+                await asyncio.gather(*processors, return_exceptions=True)
+            
+            logger.info(f"📊 Total productos obtenidos: {stats['total_fetched']}")
             
-            # 4. Limpiar productos inactivos (que ya no existen en WooCommerce)
-            await self._cleanup_inactive_products(all_products)
+            # 3. Limpiar productos inactivos (que ya no existen en WooCommerce)
+            if state["fetch_failed"]:
+                stats["errors"] += 1
+                logger.warning("⚠️ Descarga de productos incompleta, se omite la desactivación de productos")
+            else:
+                await self._cleanup_inactive_products(seen_ids)
+                # Los productos desactivados salen de los centroides
+                try:
+                    await db_service.refresh_category_centroids()
+                except Exception as e:
+                    logger.error(f"❌ Error recalculando centroides de categorías: {e}")
             
             logger.info(f"🎉 Sincronización completada: {stats}")
             return stats
@@ -103,6 +144,176 @@ class WooCommerceSyncService:
             stats["errors"] += 1
             return stats
     
+    async def _process_product_page(self, products: List[Dict], force_update: bool = False) -> Dict[str, int]:
+        """
+        Procesar una página de productos: una consulta para conocer su estado, un único
+        lote de embeddings para los que cambiaron de texto y upserts en paralelo.
+        Precio/stock se escriben en product_live_state; si solo cambian ellos no se toca
+        knowledge_base (ni embedding, ni search_vector, ni índices).
+        Returns: contadores y `failed_ids` con los external_id que no se pudieron guardar
+        """
+        page_stats = {"new": 0, "updated": 0, "commercial": 0, "skipped": 0, "errors": 0, "failed_ids": []}
+        
+        valid_products = [p for p in products if isinstance(p, dict) and p.get('id')]
+        page_stats["errors"] += len(products) - len(valid_products)
+        
+        external_ids = [f"product_{p['id']}" for p in valid_products]
+        sync_state = await db_service.get_product_sync_state(external_ids)
+        
+        candidates = []
+        for product, external_id in zip(valid_products, external_ids):
+            existing = sync_state.get(external_id)
+            if existing and not self._needs_update(product, existing['updated_at'], force_update):
+                page_stats["skipped"] += 1
+                continue
+            candidates.append((product, external_id, existing))
+        
+        # Limpieza de HTML y hashes de toda la página fuera del event loop
+        candidate_products = [product for product, _, _ in candidates]
+        formatted = await cpu_offload.run(
+            "sync.format_products", self._format_products, candidate_products,
+            size=sum(len(p.get('description') or '') + len(p.get('short_description') or '')
+                     for p in candidate_products)
+        )
+        
+        pending = []
+        metadata_updates = []
+        titles = {}
+        live_updates = []
+        for (product, external_id, existing), product_content in zip(candidates, formatted):
+            if isinstance(product_content, Exception):
+                logger.error(f"❌ Error formateando producto {product.get('id')}: {product_content}")
+                page_stats["errors"] += 1
+                page_stats["failed_ids"].append(external_id)
+                continue
+            
+            metadata = product_content["metadata"]
+            live_state = product_content["live_state"]
+            commercial_changed = not existing or existing['commercial_hash'] != live_state["commercial_hash"]
+            if commercial_changed:
+                live_updates.append(live_state)
+            
+            titles[external_id] = product_content["title"]
+            if existing and existing['text_hash'] == metadata["text_hash"]:
+                if existing['catalog_hash'] != metadata["catalog_hash"] or not existing['is_active']:
+                    metadata_updates.append((external_id, metadata))
+                elif commercial_changed:
+                    page_stats["commercial"] += 1
+                else:
+                    page_stats["skipped"] += 1
+                continue
+            pending.append((external_id, product_content, bool(existing)))
+        
+        # Las tarjetas renderizadas de los productos que cambian dejan de ser válidas
+        product_card_cache.invalidate(
+            [state["external_id"] for state in live_updates]
+            + [external_id for external_id, _ in metadata_updates]
+            + [external_id for external_id, _, _ in pending]
+        )
+        
+        if live_updates:
+            # Una sola sentencia sobre la tabla estrecha: no toca knowledge_base ni sus índices
+            try:
+                await db_service.upsert_product_live_state(live_updates)
+            except Exception as e:
+                logger.error(f"❌ Error actualizando precio/stock de {len(live_updates)} productos: {e}")
+                live_failed = {state["external_id"] for state in live_updates}
+                page_stats["errors"] += len(live_failed)
+                page_stats["failed_ids"].extend(live_failed)
+                # No contarlos como actualizados ni reescribir su fila ancha
+                pending = [item for item in pending if item[0] not in live_failed]
+                metadata_updates = [item for item in metadata_updates if item[0] not in live_failed]
+                page_stats["commercial"] = 0
+        
+        # Productos cuyo texto o catálogo se guardó: sus facetas se recalculan
+        stored = []
+        
+        if metadata_updates:
+            try:
+                page_stats["updated"] += await db_service.update_knowledge_metadata_batch(metadata_updates)
+                stored.extend(metadata_updates)
+            except Exception as e:
+                logger.error(f"❌ Error actualizando metadatos de {len(metadata_updates)} productos: {e}")
+                page_stats["errors"] += len(metadata_updates)
+                page_stats["failed_ids"].extend(external_id for external_id, _ in metadata_updates)
+        
+        if not pending:
+            await self._store_product_facets(stored, titles)
+            await self._store_category_membership(stored)
+            return page_stats
+        
+        # Embeddings de toda la página en una sola llamada
+        embeddings = await embedding_service.generate_embeddings_batch(
+            [content["content"] for _, content, _ in pending]
+        )
+        
+        semaphore = asyncio.Semaphore(5)  # Máximo 5 upserts en paralelo
+        
+        async def upsert(external_id, product_content, embedding):
+            async with semaphore:
+                return await db_service.upsert_knowledge(
+                    content_type="product",
+                    title=product_content["title"],
+                    content=product_content["content"],
+                    embedding=embedding,
+                    external_id=external_id,
+                    metadata=product_content["metadata"]
+                )
+        
+        tasks = []
+        outcomes = []
+        product_content_by_id = {external_id: content for external_id, content, _ in pending}
+        for (external_id, product_content, exists), embedding in zip(pending, embeddings):
+            # generate_embeddings_batch devuelve un vector de ceros si la API falla
+            if not embedding or not any(embedding):
+                logger.error(f"❌ Sin embedding para {external_id}, se reintentará en la próxima sincronización")
+                page_stats["errors"] += 1
+                page_stats["failed_ids"].append(external_id)
+                continue
+            tasks.append(upsert(external_id, product_content, embedding))
+            outcomes.append(("updated" if exists else "new", external_id))
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result, (outcome, external_id) in zip(results, outcomes):
+            if isinstance(result, Exception) or result is None:
+                page_stats["errors"] += 1
+                page_stats["failed_ids"].append(external_id)
+            else:
+                page_stats[outcome] += 1
+                stored.append((external_id, product_content_by_id[external_id]["metadata"]))
+        
+        await self._store_product_facets(stored, titles)
+        await self._store_category_membership(stored)
+        return page_stats
+    
+    async def _store_product_facets(self, stored: List[Tuple[str, Dict]], titles: Dict[str, str]):
+        """Extraer y guardar las facetas normalizadas de los productos guardados"""
+        if not stored:
+            return
+        try:
+            facets_by_id = {
+                external_id: product_attributes_service.extract_facets(titles.get(external_id, ''), metadata)
+                for external_id, metadata in stored
+            }
+            await db_service.replace_product_facets(facets_by_id)
+        except Exception as e:
+            # Las facetas solo afectan al refinamiento: no marcar el producto como fallido
+            logger.error(f"❌ Error guardando facetas de {len(stored)} productos: {e}")
+    
+    async def _store_category_membership(self, stored: List[Tuple[str, Dict]]):
+        """Actualizar la pertenencia a categorías y los centroides de las categorías afectadas"""
+        if not stored:
+            return
+        try:
+            members = {
+                external_id: metadata.get("category_ids", [])
+                for external_id, metadata in stored
+            }
+            await db_service.replace_category_membership(members)
+        except Exception as e:
+            # Solo afecta a la navegación por categorías: no marcar el producto como fallido
+            logger.error(f"❌ Error guardando categorías de {len(stored)} productos: {e}")
+    
     async def sync_single_product(self, product_id: int) -> bool:
         """
         Sincronizar un producto específico
@@ -166,35 +377,9 @@ class WooCommerceSyncService:
         except Exception as e:
             logger.error(f"❌ Error sincronizando categorías: {e}")
     
-    async def _process_product_batch(self, products: List[Dict], force_update: bool = False) -> Dict[str, int]:
-        """Procesar un lote de productos"""
-        batch_stats = {"new": 0, "updated": 0, "errors": 0}
-        
-        # Procesar productos en paralelo (pero limitado)
-        semaphore = asyncio.Semaphore(5)  # Máximo 5 productos en paralelo
-        
-        async def process_with_semaphore(product):
-            async with semaphore:
-                return await self._process_single_product(product, force_update)
-        
-        tasks = [process_with_semaphore(product) for product in products]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for result in results:
-            if isinstance(result, Exception):
-                batch_stats["errors"] += 1
-            elif result == "new":
-                batch_stats["new"] += 1
-            elif result == "updated":
-                batch_stats["updated"] += 1
-            elif result == "error":
-                batch_stats["errors"] += 1
-        
-        return batch_stats
-    
     async def _process_single_product(self, product: Dict, force_update: bool = False) -> str:
         """
-        Procesar un producto individual
+        Procesar un producto individual (misma lógica que una página de un solo producto)
         Returns: 'new', 'updated', 'skipped', or 'error'
         """
         try:
@@ -203,65 +388,19 @@ class WooCommerceSyncService:
                 logger.error(f"❌ Producto no es diccionario: {type(product)} - {product}")
                 return "error"
             
-            product_id = product.get('id')
-            if not product_id:
+            if not product.get('id'):
                 logger.error(f"❌ Producto sin ID: {product}")
                 return "error"
-                
-            external_id = f"product_{product_id}"
             
-            # Verificar si ya existe
-            existing = await db_service.get_knowledge_by_external_id(external_id)
+            page_stats = await self._process_product_page([product], force_update)
             
-            # Decidir si actualizar
-            should_update = force_update
-            if existing and not force_update:
-                # Comparar fecha de modificación
-                date_modified = product.get('date_modified', '')
-                if date_modified:
-                    try:
-                        # Convertir fecha de WooCommerce a datetime con zona horaria
-                        wc_modified = datetime.fromisoformat(date_modified.replace('Z', '+00:00'))
-                        db_modified = existing.get('updated_at')
-                        
-                        if db_modified:
-                            # Si db_modified es naive (sin timezone), hacerlo aware en UTC
-                            if db_modified.tzinfo is None:
-                                db_modified = db_modified.replace(tzinfo=timezone.utc)
-                            
-                            # Si wc_modified es naive, hacerlo aware en UTC
-                            if wc_modified.tzinfo is None:
-                                wc_modified = wc_modified.replace(tzinfo=timezone.utc)
-                                
-                            should_update = wc_modified > db_modified
-                    except (ValueError, AttributeError) as e:
-                        logger.warning(f"⚠️ Error procesando fecha {date_modified}: {e}")
-                        should_update = True  # Si hay error en fecha, actualizar
-            
-            if existing and not should_update:
-                return "skipped"
-            
-            # Formatear producto para base de conocimiento
-            product_content = self._format_product_for_knowledge(product)
-            
-            # Generar embedding
-            embedding = await embedding_service.generate_embedding(product_content["content"])
-            
-            # Insertar o actualizar
-            result_id = await db_service.upsert_knowledge(
-                content_type="product",
-                title=product_content["title"],
-                content=product_content["content"],
-                embedding=embedding,
-                external_id=external_id,
-                metadata=product_content["metadata"]
-            )
-            
-            # Log detallado para debugging
-            if existing and should_update:
-                logger.debug(f"Actualizando producto {product_id}: Precio={product_content['metadata'].get('price')}")
-            
-            return "new" if not existing else "updated"
+            if page_stats["errors"]:
+                return "error"
+            if page_stats["new"]:
+                return "new"
+            if page_stats["updated"] or page_stats["commercial"]:
+                return "updated"
+            return "skipped"
             
         except Exception as e:
             # Manejo de error más defensivo
@@ -271,6 +410,42 @@ class WooCommerceSyncService:
             logger.error(f"❌ Error procesando producto {product_id}: {e}")
             return "error"
     
+    def _needs_update(self, product: Dict, db_modified: Optional[datetime], force_update: bool = False) -> bool:
+        """Determinar si un producto existente cambió en WooCommerce desde la última sincronización"""
+        if force_update:
+            return True
+        
+        date_modified = product.get('date_modified', '')
+        if not date_modified or not db_modified:
+            return False
+        
+        try:
+            # Convertir fecha de WooCommerce a datetime con zona horaria
+            wc_modified = datetime.fromisoformat(date_modified.replace('Z', '+00:00'))
+            
+            # Si db_modified es naive (sin timezone), hacerlo aware en UTC
+            if db_modified.tzinfo is None:
+                db_modified = db_modified.replace(tzinfo=timezone.utc)
+            
+            # Si wc_modified es naive, hacerlo aware en UTC
+            if wc_modified.tzinfo is None:
+                wc_modified = wc_modified.replace(tzinfo=timezone.utc)
+            
+            return wc_modified > db_modified
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"⚠️ Error procesando fecha {date_modified}: {e}")
+            return True  # Si hay error en fecha, actualizar
+    
+    def _format_products(self, products: List[Dict]) -> List[Any]:
+        """Formatear una página de productos; un producto que falla devuelve su excepción en su posición"""
+        formatted = []
+        for product in products:
+            try:
+                formatted.append(self._format_product_for_knowledge(product))
+            except Exception as e:
+                formatted.append(e)
+        return formatted
+    
     def _format_product_for_knowledge(self, product: Dict) -> Dict[str, Any]:
         """Formatear producto de WooCommerce para base de conocimiento"""
         
@@ -287,9 +462,12 @@ class WooCommerceSyncService:
         
         # Categorías (con validación defensiva)
         categories = []
+        category_ids = []
         for cat in product.get('categories', []):
             if isinstance(cat, dict):
                 categories.append(cat.get('name', ''))
+                if cat.get('id'):
+                    category_ids.append(cat['id'])
             else:
                 logger.warning(f"⚠️ Categoría no es diccionario: {type(cat)} - {cat}")
         category_text = ', '.join(categories) if categories else ''
@@ -315,21 +493,12 @@ class WooCommerceSyncService:
         clean_description = self._clean_html(description)
         clean_short_description = self._clean_html(short_description)
         
-        # Construir contenido optimizado para búsqueda
-        # Aplicar IVA del 21% a los precios para el contenido
-        VAT_RATE = 1.21
-        price_with_vat = round(self._safe_float_conversion(price) * VAT_RATE, 2) if price else 0
-        regular_price_with_vat = round(self._safe_float_conversion(regular_price) * VAT_RATE, 2) if regular_price else 0
-        sale_price_with_vat = round(self._safe_float_conversion(sale_price) * VAT_RATE, 2) if sale_price else 0
-        
+        # Construir contenido optimizado para búsqueda (es el texto que se embebe).
+        # Precio y stock solo van en metadatos: así un cambio comercial no obliga a
+        # regenerar el embedding ni el search_vector
         content_parts = [
             f"Producto: {name}",
             f"SKU: {sku}" if sku else "",
-            f"Precio: {price_with_vat}€ (IVA incluido)" if price else "",
-            f"Precio regular: {regular_price_with_vat}€ (IVA incluido)" if regular_price and regular_price != price else "",
-            f"Precio oferta: {sale_price_with_vat}€ (IVA incluido)" if sale_price else "",
-            f"Stock: {stock_status}",
-            f"Cantidad disponible: {stock_quantity}" if stock_quantity else "",
             f"Categorías: {category_text}" if category_text else "",
             f"Características: {attributes_text}" if attributes_text else "",
             f"Descripción: {clean_short_description}" if clean_short_description else "",
@@ -359,26 +528,66 @@ class WooCommerceSyncService:
         # Aplicar IVA del 21% a los precios
         VAT_RATE = 1.21
         
-        metadata = {
-            "wc_id": product.get('id'),
-            "sku": sku,
+        # Precio y stock van a product_live_state; en lectura se unen a los metadatos
+        live_state = {
+            "external_id": f"product_{product.get('id')}",
             "price": round(self._safe_float_conversion(price) * VAT_RATE, 2),
             "regular_price": round(self._safe_float_conversion(regular_price) * VAT_RATE, 2),
             "sale_price": round(self._safe_float_conversion(sale_price) * VAT_RATE, 2) if sale_price else 0,
             "stock_status": stock_status,
-            "stock_quantity": stock_quantity if isinstance(stock_quantity, (int, float)) else 0,
+            "stock_qty": int(stock_quantity) if isinstance(stock_quantity, (int, float)) else 0
+        }
+        
+        metadata = {
+            "wc_id": product.get('id'),
+            "sku": sku,
             "categories": categories,
+            "category_ids": category_ids,
             "attributes": metadata_attributes,
             "permalink": product.get('permalink', ''),
             "date_created": product.get('date_created', ''),
             "date_modified": product.get('date_modified', ''),
             "images": metadata_images
         }
+        hashes = self._calculate_product_hashes(name, content, metadata, live_state)
+        metadata["text_hash"] = hashes["text_hash"]
+        metadata["catalog_hash"] = hashes["catalog_hash"]
+        live_state["commercial_hash"] = hashes["commercial_hash"]
         
         return {
             "title": name,
             "content": content,
-            "metadata": metadata
+            "metadata": metadata,
+            "live_state": live_state
+        }
+    
+    def _calculate_product_hashes(self, title: str, content: str, metadata: Dict[str, Any],
+                                  live_state: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Calcular las huellas de un producto formateado
+        Returns:
+            - text_hash: título y contenido, lo que alimenta el embedding y el search_vector
+            - catalog_hash: resto de metadatos de knowledge_base (imágenes, enlace, atributos)
+            - commercial_hash: precio, oferta y stock de product_live_state
+        """
+        def digest(data: Any) -> str:
+            return hashlib.sha256(
+                json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+            ).hexdigest()
+        
+        catalog_fields = {
+            key: value for key, value in metadata.items()
+            if key not in ("date_created", "date_modified", "text_hash", "catalog_hash")
+        }
+        commercial_fields = {
+            key: live_state.get(key)
+            for key in ("price", "regular_price", "sale_price", "stock_status", "stock_qty")
+        }
+        
+        return {
+            "text_hash": digest([title, content]),
+            "catalog_hash": digest(catalog_fields),
+            "commercial_hash": digest(commercial_fields)
         }
     
     def _format_category_for_knowledge(self, category: Dict) -> Dict[str, Any]:
@@ -467,17 +676,19 @@ class WooCommerceSyncService:
             
         return 0.0
     
-    async def _cleanup_inactive_products(self, active_products: List[Dict]):
+    async def _cleanup_inactive_products(self, active_ids: Set[str]):
         """Marcar como inactivos los productos que ya no existen en WooCommerce"""
         try:
-            # Obtener IDs de productos activos
-            active_ids = {f"product_{p['id']}" for p in active_products}
+            if not active_ids:
+                logger.warning("⚠️ Sin productos activos en WooCommerce, se omite la desactivación")
+                return
             
             # Marcar como inactivos los productos que no están en la lista
             deactivated = await db_service.deactivate_missing_products(active_ids)
             
             if deactivated > 0:
                 logger.info(f"🗑️ {deactivated} productos marcados como inactivos")
+                product_card_cache.clear()
                 
         except Exception as e:
             logger.error(f"❌ Error en limpieza de productos inactivos: {e}")
@@ -490,18 +701,22 @@ class WooCommerceSyncService:
             # Obtener última sincronización
             last_sync = await db_service.get_last_sync_time()
             
-            return {
-                "total_products": stats.get("products", 0),
-                "total_categories": stats.get("categories", 0),
-                "active_products": stats.get("active_products", 0),
-                "last_sync": last_sync.isoformat() if last_sync else None,
-                "sync_needed": self._is_sync_needed(last_sync)
-            }
+            return self.build_sync_status(stats, last_sync)
             
         except Exception as e:
             logger.error(f"❌ Error obteniendo estado de sincronización: {e}")
             return {"error": str(e)}
     
+    def build_sync_status(self, stats: Dict[str, Any], last_sync: Optional[datetime]) -> Dict[str, Any]:
+        """Estado de sincronización a partir de estadísticas ya calculadas (sin consultar de nuevo)"""
+        return {
+            "total_products": stats.get("products", 0),
+            "total_categories": stats.get("categories", 0),
+            "active_products": stats.get("active_products", 0),
+            "last_sync": last_sync.isoformat() if last_sync else None,
+            "sync_needed": self._is_sync_needed(last_sync)
+        }
+    
     def _is_sync_needed(self, last_sync: Optional[datetime]) -> bool:
         """Determinar si se necesita sincronización"""
         if not last_sync:
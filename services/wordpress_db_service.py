@@ -5,13 +5,26 @@ y obtener información de carritos abandonados
 
 import asyncio
 import aiomysql
+import json
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union
 from config.settings import settings
+from services.cpu_offload import cpu_offload
+from services.database import db_service
 
 logger = logging.getLogger(__name__)
 
+# Segundos que se reutiliza la comprobación de existencia de una tabla
+TABLE_PROBE_TTL = 3600
+
+# Minutos tras los que CartFlows ya ha marcado un carrito como abandonado
+CARTFLOWS_SETTLE_MINUTES = 30
+
+# Clave del advisory lock del escaneo (un solo worker escanea a la vez)
+SCAN_LOCK_NAME = "abandoned_cart_scan"
+
 
 class WordPressDBService:
     """
@@ -21,9 +34,32 @@ class WordPressDBService:
     def __init__(self):
         self.pool = None
         self.table_prefix = getattr(settings, 'WORDPRESS_TABLE_PREFIX', 'wp_')
+        self.scan_batch_size = 500
+        
+        # Marcas de agua de los escaneos incrementales (guardadas en PostgreSQL si está
+        # disponible, para que los workers de uvicorn continúen el mismo escaneo)
+        self._woocommerce_mark: Optional[Tuple[int, int]] = None  # (session_expiry, session_id)
+        self._cartflows_mark: Optional[Tuple[datetime, int]] = None  # (time, id)
+        self.shared_marks = False
+        self._table_probes: Dict[str, Tuple[bool, float]] = {}  # tabla -> (existe, cuándo)
         
     async def initialize(self):
-        """Inicializa el pool de conexiones"""
+        """Inicializa el pool de conexiones y la tabla de marcas de agua"""
+        try:
+            if db_service.initialized:
+                async with db_service.pool.acquire() as conn:
+                    await conn.execute("""
+                        CREATE TABLE IF NOT EXISTS abandoned_cart_scan_marks (
+                            source VARCHAR(50) PRIMARY KEY,
+                            mark JSONB NOT NULL,
+                            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                self.shared_marks = True
+        except Exception as e:
+            logger.error(f"Error creating abandoned cart scan marks table: {e}")
+            self.shared_marks = False
+        
         try:
             # Solo inicializar si hay configuración de WordPress
             if not hasattr(settings, 'WORDPRESS_DB_HOST'):
@@ -52,12 +88,122 @@ class WordPressDBService:
             self.pool.close()
             await self.pool.wait_closed()
     
-    async def get_abandoned_carts_from_woocommerce(self, hours_ago: int = 24) -> List[Dict[str, Any]]:
+    async def _table_exists(self, table_name: str) -> bool:
+        """
+        Comprueba si existe una tabla (resultado cacheado)
+        La consulta a information_schema se repite como mucho cada TABLE_PROBE_TTL segundos
+        para detectar plugins instalados más tarde
+        """
+        cached = self._table_probes.get(table_name)
+        if cached and time.monotonic() - cached[1] < TABLE_PROBE_TTL:
+            return cached[0]
+        
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute("""
+                    SELECT COUNT(*) as count 
+                    FROM information_schema.tables 
+                    WHERE table_schema = %s 
+                    AND table_name = %s
+                """, (settings.WORDPRESS_DB_NAME, table_name))
+                result = await cursor.fetchone()
+        
+        exists = result['count'] > 0
+        self._table_probes[table_name] = (exists, time.monotonic())
+        return exists
+    
+    async def reset_scan_state(self):
+        """Olvida las marcas de agua: el siguiente escaneo recorre de nuevo toda la ventana"""
+        self._woocommerce_mark = None
+        self._cartflows_mark = None
+        if self.shared_marks:
+            async with db_service.pool.acquire() as conn:
+                await conn.execute("DELETE FROM abandoned_cart_scan_marks")
+    
+    async def scan_new_abandoned_carts(self, hours_ago: int = 24,
+                                       advance: bool = True) -> List[Dict[str, Any]]:
+        """
+        Carritos abandonados desde el último escaneo (WooCommerce y CartFlows)
+        
+        Con marcas compartidas el escaneo se hace bajo un advisory lock y continúa desde
+        las marcas guardadas por cualquier worker: cada carrito se devuelve una sola vez
+        aunque varios procesos escaneen. Si otro worker está escaneando se devuelve []
+        
+        Args:
+            hours_ago: Horas sin actividad para considerar un carrito abandonado
+            advance: Guardar las marcas de agua (False para simulaciones: el siguiente
+                escaneo vuelve a devolver los mismos carritos)
+            
+        Returns:
+            Lista de carritos abandonados nuevos
+        """
+        if not self.shared_marks:
+            marks = (self._woocommerce_mark, self._cartflows_mark)
+            carts = await self._scan(hours_ago)
+            if not advance:
+                self._woocommerce_mark, self._cartflows_mark = marks
+            return carts
+        
+        async with db_service.pool.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", SCAN_LOCK_NAME)
+            if not locked:
+                logger.info("🛒 Otro worker está escaneando carritos abandonados")
+                return []
+            try:
+                await self._load_marks(conn)
+                carts = await self._scan(hours_ago)
+                if advance:
+                    await self._save_marks(conn)
+                return carts
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", SCAN_LOCK_NAME)
+    
+    async def _scan(self, hours_ago: int) -> List[Dict[str, Any]]:
+        woocommerce_carts = await self.get_abandoned_carts_from_woocommerce(hours_ago)
+        cartflows_carts = await self.get_abandoned_carts_from_cartflows(hours_ago)
+        return woocommerce_carts + cartflows_carts
+    
+    async def _load_marks(self, conn):
+        """Leer las marcas de agua guardadas por el último escaneo de cualquier worker"""
+        rows = await conn.fetch("SELECT source, mark FROM abandoned_cart_scan_marks")
+        marks = {row['source']: row['mark'] for row in rows}
+        
+        woocommerce = marks.get('woocommerce')
+        self._woocommerce_mark = (int(woocommerce[0]), int(woocommerce[1])) if woocommerce else None
+        cartflows = marks.get('cartflows')
+        self._cartflows_mark = (datetime.fromisoformat(cartflows[0]), int(cartflows[1])) if cartflows else None
+    
+    async def _save_marks(self, conn):
+        """Guardar las marcas de agua para el siguiente escaneo"""
+        marks = []
+        if self._woocommerce_mark:
+            marks.append(('woocommerce', list(self._woocommerce_mark)))
+        if self._cartflows_mark:
+            last_time, last_id = self._cartflows_mark
+            marks.append(('cartflows', [last_time.isoformat(), last_id]))
+        if not marks:
+            return
+        
+        await conn.executemany("""
+            INSERT INTO abandoned_cart_scan_marks (source, mark, updated_at)
+            VALUES ($1, $2, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET mark = EXCLUDED.mark, updated_at = EXCLUDED.updated_at
+        """, marks)
+    
+    async def get_abandoned_carts_from_woocommerce(self, hours_ago: int = 24,
+                                                   incremental: bool = True) -> List[Dict[str, Any]]:
         """
         Obtiene carritos abandonados de las sesiones de WooCommerce
         
+        Una sesión con carrito se considera abandonada cuando su session_expiry cae
+        dentro de las próximas `hours_ago` horas. Toda actividad nueva retrasa la
+        expiración más allá de ese corte, así que basta con una marca de agua
+        (session_expiry, session_id) y paginación por clave para leer solo las
+        sesiones que han pasado a estar abandonadas desde el escaneo anterior.
+        
         Args:
             hours_ago: Horas hacia atrás para buscar carritos abandonados
+            incremental: Continuar desde la marca de agua (False recorre toda la ventana)
             
         Returns:
             Lista de carritos abandonados
@@ -65,52 +211,76 @@ class WordPressDBService:
         if not self.pool:
             logger.warning("WordPress DB not initialized")
             return []
-            
+        
+        mark = self._woocommerce_mark if incremental else None
+        now = int(time.time())
+        cutoff = now + hours_ago * 3600
+        last_expiry, last_id = mark or (now, 0)
+        abandoned_carts = []
+        scanned = 0
+        
         try:
             async with self.pool.acquire() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
-                    # Query para obtener sesiones con carritos no vacíos
                     query = f"""
                     SELECT 
+                        session_id,
                         session_key,
                         session_value,
                         session_expiry
                     FROM {self.table_prefix}woocommerce_sessions
-                    WHERE session_expiry > UNIX_TIMESTAMP()
-                    AND session_expiry < UNIX_TIMESTAMP(DATE_ADD(NOW(), INTERVAL %s HOUR))
-                    AND session_value LIKE '%cart_contents%'
-                    AND session_value NOT LIKE '%cart_contents";a:0:%'
+                    WHERE (session_expiry > %s OR (session_expiry = %s AND session_id > %s))
+                    AND session_expiry > UNIX_TIMESTAMP()
+                    AND session_expiry < %s
+                    ORDER BY session_expiry, session_id
+                    LIMIT %s
                     """
                     
-                    await cursor.execute(query, (hours_ago,))
-                    sessions = await cursor.fetchall()
-                    
-                    abandoned_carts = []
-                    for session in sessions:
-                        try:
-                            # Parsear los datos de la sesión (PHP serialized)
-                            cart_data = self._parse_session_data(session['session_value'])
-                            if cart_data:
-                                abandoned_carts.append({
-                                    'session_key': session['session_key'],
-                                    'cart_data': cart_data,
-                                    'expiry': datetime.fromtimestamp(session['session_expiry'])
-                                })
-                        except Exception as e:
-                            logger.error(f"Error parsing session {session['session_key']}: {e}")
-                            
-                    return abandoned_carts
+                    while True:
+                        await cursor.execute(query, (last_expiry, last_expiry, last_id, cutoff, self.scan_batch_size))
+                        sessions = await cursor.fetchall()
+                        if not sessions:
+                            break
+                        
+                        scanned += len(sessions)
+                        last_expiry, last_id = sessions[-1]['session_expiry'], sessions[-1]['session_id']
+                        
+                        # Deserializar fuera del event loop
+                        abandoned_carts.extend(await cpu_offload.run(
+                            "wordpress.parse_sessions", self._parse_woocommerce_sessions, sessions,
+                            size=sum(len(session.get('session_value') or '') for session in sessions)
+                        ))
+                        
+                        if len(sessions) < self.scan_batch_size:
+                            break
+            
+            if incremental:
+                # Toda sesión por debajo del corte ya se ha leído y no puede reaparecer allí
+                # (la actividad nueva la expira más tarde): el siguiente escaneo empieza en él
+                self._woocommerce_mark = (cutoff, 0)
+            
+            if scanned:
+                logger.info(f"🛒 Sesiones de WooCommerce escaneadas: {scanned}, carritos abandonados: {len(abandoned_carts)}")
+            return abandoned_carts
                     
         except Exception as e:
             logger.error(f"Error getting abandoned carts from WooCommerce: {e}")
-            return []
+            return abandoned_carts
     
-    async def get_abandoned_carts_from_cartflows(self, hours_ago: int = 24) -> List[Dict[str, Any]]:
+    async def get_abandoned_carts_from_cartflows(self, hours_ago: int = 24,
+                                                 incremental: bool = True) -> List[Dict[str, Any]]:
         """
         Obtiene carritos abandonados de CartFlows si está instalado
         
+        Con incremental=True se continúa desde la marca de agua (time, id) del escaneo
+        anterior; el primer escaneo cubre las últimas `hours_ago` horas. Solo se leen
+        filas con más de CARTFLOWS_SETTLE_MINUTES de antigüedad, cuando CartFlows ya
+        ha decidido si el carrito está abandonado, para que la marca no salte filas
+        que cambian de estado después.
+        
         Args:
             hours_ago: Horas hacia atrás para buscar carritos abandonados
+            incremental: Continuar desde la marca de agua (False recorre toda la ventana)
             
         Returns:
             Lista de carritos abandonados
@@ -118,29 +288,25 @@ class WordPressDBService:
         if not self.pool:
             logger.warning("WordPress DB not initialized")
             return []
-            
+        
+        abandoned_carts = []
+        
         try:
+            # Verificar si existe la tabla de CartFlows
+            table_name = f"{self.table_prefix}cartflows_ca_cart_abandonment"
+            if not await self._table_exists(table_name):
+                logger.debug("CartFlows table not found")
+                return []
+            
+            mark = self._cartflows_mark if incremental else None
+            last_time, last_id = mark or (datetime.now() - timedelta(hours=hours_ago), 0)
+            
             async with self.pool.acquire() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
-                    # Verificar si existe la tabla de CartFlows
-                    table_name = f"{self.table_prefix}cartflows_ca_cart_abandonment"
-                    check_query = """
-                    SELECT COUNT(*) as count 
-                    FROM information_schema.tables 
-                    WHERE table_schema = %s 
-                    AND table_name = %s
-                    """
-                    
-                    await cursor.execute(check_query, (settings.WORDPRESS_DB_NAME, table_name))
-                    result = await cursor.fetchone()
-                    
-                    if result['count'] == 0:
-                        logger.info("CartFlows table not found")
-                        return []
-                    
                     # Query para obtener carritos abandonados de CartFlows
                     query = f"""
                     SELECT 
+                        id,
                         session_id,
                         email,
                         cart_contents,
@@ -149,60 +315,123 @@ class WordPressDBService:
                         other_fields,
                         checkout_id
                     FROM {table_name}
-                    WHERE order_status IN ('abandoned', 'processing')
-                    AND time >= DATE_SUB(NOW(), INTERVAL %s HOUR)
+                    WHERE (time > %s OR (time = %s AND id > %s))
+                    AND time < DATE_SUB(NOW(), INTERVAL %s MINUTE)
+                    AND order_status IN ('abandoned', 'processing')
                     AND unsubscribed = 0
-                    ORDER BY time DESC
+                    ORDER BY time, id
+                    LIMIT %s
                     """
                     
-                    await cursor.execute(query, (hours_ago,))
-                    carts = await cursor.fetchall()
-                    
-                    abandoned_carts = []
-                    for cart in carts:
-                        try:
-                            # Parsear cart_contents (PHP serialized o JSON)
-                            cart_items = self._parse_cart_contents(cart['cart_contents'])
-                            
-                            # Parsear other_fields para obtener teléfono
-                            other_fields = self._parse_other_fields(cart['other_fields'])
-                            
-                            if cart_items and cart['email']:
-                                abandoned_carts.append({
-                                    'cart_id': cart['session_id'],
-                                    'email': cart['email'],
-                                    'phone': other_fields.get('phone', ''),
-                                    'customer_name': other_fields.get('name', ''),
-                                    'items': cart_items,
-                                    'total': float(cart['cart_total']) if cart['cart_total'] else 0,
-                                    'abandoned_at': cart['abandoned_time'],
-                                    'checkout_id': cart['checkout_id']
-                                })
-                        except Exception as e:
-                            logger.error(f"Error parsing cart {cart['session_id']}: {e}")
-                            
-                    return abandoned_carts
+                    while True:
+                        await cursor.execute(query, (last_time, last_time, last_id, CARTFLOWS_SETTLE_MINUTES,
+                                                     self.scan_batch_size))
+                        carts = await cursor.fetchall()
+                        if not carts:
+                            break
+                        
+                        last_time, last_id = carts[-1]['abandoned_time'], carts[-1]['id']
+                        
+                        # Deserializar fuera del event loop
+                        abandoned_carts.extend(await cpu_offload.run(
+                            "wordpress.parse_cartflows", self._parse_cartflows_rows, carts,
+                            size=sum(len(cart.get('cart_contents') or '') + len(cart.get('other_fields') or '')
+                                     for cart in carts)
+                        ))
+                        
+                        if len(carts) < self.scan_batch_size:
+                            break
+            
+            if incremental:
+                self._cartflows_mark = (last_time, last_id)
+            
+            return abandoned_carts
                     
         except Exception as e:
             logger.error(f"Error getting abandoned carts from CartFlows: {e}")
-            return []
+            return abandoned_carts
+    
+    def _parse_woocommerce_sessions(self, sessions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convierte una página de sesiones en carritos (se ejecuta en un hilo)"""
+        abandoned_carts = []
+        for session in sessions:
+            try:
+                # Parsear los datos de la sesión (PHP serialized)
+                cart_data = self._parse_session_data(session['session_value'])
+                if cart_data:
+                    abandoned_carts.append({
+                        'session_key': session['session_key'],
+                        'cart_data': cart_data,
+                        'expiry': datetime.fromtimestamp(session['session_expiry'])
+                    })
+            except Exception as e:
+                logger.error(f"Error parsing session {session['session_key']}: {e}")
+        return abandoned_carts
+    
+    def _parse_cartflows_rows(self, carts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convierte una página de filas de CartFlows en carritos (se ejecuta en un hilo)"""
+        abandoned_carts = []
+        for cart in carts:
+            try:
+                # Parsear cart_contents (PHP serialized o JSON)
+                cart_items = self._parse_cart_contents(cart['cart_contents'])
+                
+                # Parsear other_fields para obtener teléfono
+                other_fields = self._parse_other_fields(cart['other_fields'])
+                
+                if cart_items and cart['email']:
+                    abandoned_carts.append({
+                        'cart_id': cart['session_id'],
+                        'email': cart['email'],
+                        'phone': other_fields.get('phone') or other_fields.get('wcf_phone_number', ''),
+                        'customer_name': other_fields.get('name') or other_fields.get('wcf_first_name', ''),
+                        'items': cart_items,
+                        'total': float(cart['cart_total']) if cart['cart_total'] else 0,
+                        'abandoned_at': cart['abandoned_time'],
+                        'checkout_id': cart['checkout_id']
+                    })
+            except Exception as e:
+                logger.error(f"Error parsing cart {cart['session_id']}: {e}")
+        return abandoned_carts
     
     def _parse_session_data(self, session_value: str) -> Optional[Dict[str, Any]]:
         """
         Parsea los datos de sesión de WooCommerce (PHP serialized)
         
+        Cada clave de la sesión ('cart', 'customer', 'cart_totals') es a su vez
+        un valor serializado
+        
         Args:
             session_value: Valor serializado de la sesión
             
         Returns:
-            Datos parseados o None
+            Datos parseados o None si no hay carrito
         """
-        # Esto es una simplificación - en producción necesitarías
-        # una librería para parsear PHP serialized data
         try:
-            # Por ahora retornamos None para indicar que necesita implementación
-            logger.debug("PHP serialized parsing not implemented")
-            return None
+            session = php_unserialize(session_value)
+            if not isinstance(session, dict):
+                return None
+            
+            cart = self._unserialize_field(session.get('cart'))
+            if not cart:
+                return None
+            
+            customer = self._unserialize_field(session.get('customer')) or {}
+            totals = self._unserialize_field(session.get('cart_totals')) or {}
+            
+            items = self._cart_items(cart)
+            if not items:
+                return None
+            
+            first_name = customer.get('first_name') or customer.get('billing_first_name') or ''
+            last_name = customer.get('last_name') or customer.get('billing_last_name') or ''
+            return {
+                'items': items,
+                'total': float(totals.get('total') or sum(item['total'] for item in items)),
+                'email': customer.get('email') or customer.get('billing_email') or '',
+                'phone': customer.get('phone') or customer.get('billing_phone') or '',
+                'customer_name': f"{first_name} {last_name}".strip()
+            }
         except Exception as e:
             logger.error(f"Error parsing session data: {e}")
             return None
@@ -218,14 +447,15 @@ class WordPressDBService:
             Lista de items del carrito
         """
         try:
+            if not cart_contents:
+                return []
+            
             # Intenta parsear como JSON primero
-            import json
             if cart_contents.startswith('{') or cart_contents.startswith('['):
                 return json.loads(cart_contents)
             
-            # Si no es JSON, probablemente es PHP serialized
-            # Por ahora retornamos lista vacía
-            return []
+            # Si no es JSON, es PHP serialized
+            return self._cart_items(php_unserialize(cart_contents))
         except Exception as e:
             logger.error(f"Error parsing cart contents: {e}")
             return []
@@ -241,13 +471,91 @@ class WordPressDBService:
             Diccionario con los campos
         """
         try:
-            import json
-            if other_fields and (other_fields.startswith('{') or other_fields.startswith('[')):
+            if not other_fields:
+                return {}
+            if other_fields.startswith('{') or other_fields.startswith('['):
                 return json.loads(other_fields)
-            return {}
+            fields = php_unserialize(other_fields)
+            return fields if isinstance(fields, dict) else {}
         except Exception as e:
             logger.error(f"Error parsing other fields: {e}")
             return {}
+    
+    def _unserialize_field(self, value: Any) -> Any:
+        """Los campos de la sesión de WooCommerce vienen serializados dos veces"""
+        if isinstance(value, str) and value:
+            return php_unserialize(value)
+        return value
+    
+    def _cart_items(self, cart: Any) -> List[Dict[str, Any]]:
+        """Normaliza las líneas de un carrito de WooCommerce"""
+        if not isinstance(cart, dict):
+            return []
+        
+        items = []
+        for line in cart.values():
+            if not isinstance(line, dict) or not line.get('product_id'):
+                continue
+            items.append({
+                'product_id': int(line['product_id']),
+                'variation_id': int(line.get('variation_id') or 0),
+                'quantity': int(line.get('quantity') or 1),
+                'total': float(line.get('line_total') or 0)
+            })
+        return items
+
+
+def php_unserialize(data: Union[str, bytes]) -> Any:
+    """
+    Deserializa un valor de PHP serialize() (s, i, d, b, N, a y O)
+    Los arrays se devuelven como dict; las longitudes de cadena son en bytes
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    value, _ = _php_unserialize_value(data, 0)
+    return value
+
+
+def _php_unserialize_value(data: bytes, pos: int) -> Tuple[Any, int]:
+    kind = data[pos:pos + 1]
+    
+    if kind == b'N':
+        return None, pos + 2
+    
+    if kind in (b'i', b'd', b'b'):
+        end = data.index(b';', pos)
+        raw = data[pos + 2:end].decode()
+        if kind == b'i':
+            return int(raw), end + 1
+        if kind == b'b':
+            return raw == '1', end + 1
+        return float(raw), end + 1
+    
+    if kind == b's':
+        colon = data.index(b':', pos + 2)
+        length = int(data[pos + 2:colon])
+        start = colon + 2  # :"
+        return data[start:start + length].decode('utf-8', errors='replace'), start + length + 2  # ";
+    
+    if kind in (b'a', b'O'):
+        if kind == b'O':
+            # O:<len>:"<clase>":<n>:{...}: se ignora la clase
+            colon = data.index(b':', pos + 2)
+            pos = colon + 2 + int(data[pos + 2:colon]) + 1  # tras el nombre de clase y ':'
+            colon = data.index(b':', pos + 1)
+            count = int(data[pos + 1:colon])
+        else:
+            colon = data.index(b':', pos + 2)
+            count = int(data[pos + 2:colon])
+        pos = colon + 2  # :{
+        result = {}
+        for _ in range(count):
+            key, pos = _php_unserialize_value(data, pos)
+            value, pos = _php_unserialize_value(data, pos)
+            result[key] = value
+        return result, pos + 1  # }
+    
+    raise ValueError(f"Tipo PHP serializado no soportado en posición {pos}: {kind!r}")
 
 
 # Instancia global del servicio
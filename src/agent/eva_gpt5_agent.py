@@ -8,7 +8,7 @@ import asyncio
 import json
 import os
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator, Awaitable, Callable
 from datetime import datetime
 from dataclasses import dataclass, field
 
@@ -34,6 +34,7 @@ from .gpt5_agents import (
 
 # Servicios del sistema
 from services.database import HybridDatabaseService
+from services.search_filters import ProductSearchFilters
 from services.embedding_service import EmbeddingService
 from services.conversation_logger import conversation_logger
 from services.woocommerce import WooCommerceService
@@ -41,6 +42,8 @@ from services.knowledge_base import knowledge_service
 from services.conversation_memory import memory_service
 from services.bot_config_service import bot_config_service
 from services.gpt5_client import GPT5Client, ReasoningEffort, Verbosity
+from services.tracing_service import tracer
+from services.runtime_metrics import runtime_metrics
 
 # Utilidades
 from src.utils.whatsapp_utils import format_escalation_message
@@ -195,7 +198,8 @@ debo consultar la base de conocimiento para darte información precisa y actuali
         message: str,
         user_id: str = "default",
         platform: str = "wordpress",
-        session_id: Optional[str] = None
+        session_id: Optional[str] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> str:
         """
         Procesa un mensaje del usuario usando el sistema multi-agente
@@ -205,16 +209,38 @@ debo consultar la base de conocimiento para darte información precisa y actuali
             user_id: ID del usuario
             platform: Plataforma de origen
             session_id: ID de sesión (opcional)
+            on_delta: Callback opcional que recibe los fragmentos de texto
+                      de la generación final a medida que llegan (streaming)
             
         Returns:
             Respuesta formateada para el usuario
         """
         
-        start_time = datetime.now()
-        
         # Generar session_id si no se proporciona
         if not session_id:
-            session_id = f"{user_id}_{int(start_time.timestamp())}"
+            session_id = f"{user_id}_{int(datetime.now().timestamp())}"
+        
+        # Span raíz del turno: todas las etapas (LLM, SQL, WooCommerce...) cuelgan de él
+        with runtime_metrics.in_flight("agent_turns"), tracer.span(
+            "agent.turn",
+            user_id=user_id,
+            platform=platform,
+            session_id=session_id,
+            streaming=on_delta is not None
+        ):
+            return await self._process_message(message, user_id, platform, session_id, on_delta)
+    
+    async def _process_message(
+        self,
+        message: str,
+        user_id: str,
+        platform: str,
+        session_id: str,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """Implementación de process_message dentro del span del turno"""
+        
+        start_time = datetime.now()
         
         # No hacer corrección manual - dejar que la IA maneje errores ortográficos
             
@@ -249,10 +275,17 @@ debo consultar la base de conocimiento para darte información precisa y actuali
             
             # PASO 1: Clasificar intención
             # SIEMPRE usar IA para clasificar - no usar lógica mecánica
-            intent_result = await self.intent_classifier.classify_intent(
-                message,
-                conversation.get_recent_messages()
-            )
+            with tracer.span("agent.intent_classification") as span:
+                intent_result = await self.intent_classifier.classify_intent(
+                    message,
+                    conversation.get_recent_messages()
+                )
+                span.set_attributes(
+                    intent=intent_result.intent.value,
+                    confidence=intent_result.confidence
+                )
+            
+            tracer.current_span().set_attribute("intent", intent_result.intent.value)
             
             conversation.current_intent = intent_result.intent
             conversation.intent_confidence = intent_result.confidence
@@ -263,28 +296,29 @@ debo consultar la base de conocimiento para darte información precisa y actuali
             )
             
             # PASO 2: Procesar según intención
-            if intent_result.intent == UserIntent.PRODUCT_SEARCH:
-                response = await self._handle_product_search(
-                    message, conversation, platform
-                )
+            with tracer.span("agent.handler", intent=intent_result.intent.value):
+                if intent_result.intent == UserIntent.PRODUCT_SEARCH:
+                    response = await self._handle_product_search(
+                        message, conversation, platform
+                    )
                 
-            elif intent_result.intent == UserIntent.TECHNICAL_INFO:
-                response = await self._handle_technical_info(
-                    message, conversation, platform
-                )
+                elif intent_result.intent == UserIntent.TECHNICAL_INFO:
+                    response = await self._handle_technical_info(
+                        message, conversation, platform, on_delta
+                    )
                 
-            elif intent_result.intent == UserIntent.ORDER_INQUIRY:
-                response = await self._handle_order_inquiry(
-                    message, conversation, intent_result.entities, platform
-                )
+                elif intent_result.intent == UserIntent.ORDER_INQUIRY:
+                    response = await self._handle_order_inquiry(
+                        message, conversation, intent_result.entities, platform
+                    )
                 
-            elif intent_result.intent == UserIntent.GREETING:
-                response = await self._handle_greeting(conversation, platform)
+                elif intent_result.intent == UserIntent.GREETING:
+                    response = await self._handle_greeting(conversation, platform)
                 
-            else:
-                response = await self._handle_general_question(
-                    message, conversation, platform
-                )
+                else:
+                    response = await self._handle_general_question(
+                        message, conversation, platform, on_delta
+                    )
             
             # Registrar respuesta
             conversation.add_message("assistant", response)
@@ -334,6 +368,97 @@ debo consultar la base de conocimiento para darte información precisa y actuali
             conversation.add_message("assistant", error_response, {"error": str(e)})
             return error_response
             
+    async def process_message_stream(
+        self,
+        message: str,
+        user_id: str = "default",
+        platform: str = "wordpress",
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Versión streaming de process_message
+        
+        Emite eventos ``{"type": "delta", "content": ...}`` mientras se genera la
+        respuesta final y termina con ``{"type": "final", "content": ...}`` con la
+        respuesta completa ya formateada. Las intenciones que no generan texto
+        con GPT-5 (búsqueda de productos, saludos, pedidos) solo emiten el final.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def _on_delta(text: str):
+            await queue.put({"type": "delta", "content": text})
+        
+        async def _run():
+            try:
+                response = await self.process_message(
+                    message=message,
+                    user_id=user_id,
+                    platform=platform,
+                    session_id=session_id,
+                    on_delta=_on_delta
+                )
+                await queue.put({"type": "final", "content": response})
+            except Exception as e:
+                await queue.put({"type": "error", "error": e})
+        
+        task = asyncio.create_task(_run())
+        
+        try:
+            while True:
+                event = await queue.get()
+                if event["type"] == "error":
+                    raise event["error"]
+                yield event
+                if event["type"] == "final":
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def release_session(self, session_id: str) -> bool:
+        """
+        Liberar el estado de una conversación terminada
+        Returns: True si la sesión existía
+        """
+        return self.conversations.pop(session_id, None) is not None
+
+    async def _generate_text(
+        self,
+        prompt: str,
+        model: str,
+        reasoning_effort: ReasoningEffort,
+        verbosity: Verbosity,
+        max_completion_tokens: Optional[int] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """
+        Genera el texto final con GPT-5, en streaming si se proporciona on_delta
+        """
+        if not on_delta:
+            response = await self.gpt5.create_response(
+                input_text=prompt,
+                model=model,
+                reasoning_effort=reasoning_effort,
+                verbosity=verbosity,
+                max_completion_tokens=max_completion_tokens
+            )
+            return response.content
+        
+        content = ""
+        async for event in self.gpt5.stream_response(
+            input_text=prompt,
+            model=model,
+            reasoning_effort=reasoning_effort,
+            verbosity=verbosity,
+            max_completion_tokens=max_completion_tokens
+        ):
+            if event["type"] == "delta":
+                await on_delta(event["text"])
+            elif event["type"] == "completed":
+                content = event["response"].content
+        
+        return content
+            
     async def _handle_product_search(
         self,
         message: str,
@@ -379,10 +504,11 @@ debo consultar la base de conocimiento para darte información precisa y actuali
         # PASO 1: Analizar la búsqueda (solo si no es respuesta a clarificación)
         if conversation.search_state != SearchState.SEARCHING:
             self.logger.info("🔍 Analizando búsqueda de productos...")
-            analysis = await self.search_analyzer.analyze_search(
-                search_context.original_query,  # Usar query combinada si es respuesta
-                conversation.get_recent_messages()
-            )
+            with tracer.span("agent.search_analysis"):
+                analysis = await self.search_analyzer.analyze_search(
+                    search_context.original_query,  # Usar query combinada si es respuesta
+                    conversation.get_recent_messages()
+                )
             
             # Guardar información extraída
             search_context.extracted_info = {
@@ -437,11 +563,12 @@ debo consultar la base de conocimiento para darte información precisa y actuali
                 # Usar la query combinada si es una respuesta a clarificación
                 query_to_use = search_context.original_query if search_context.has_clarified else message
                 self.logger.info(f"🔎 Generando queries para: '{query_to_use}'")
-                queries = await self.query_generator.generate_queries(
-                    query_to_use,
-                    search_context.extracted_info,
-                    analysis.product_type
-                )
+                with tracer.span("agent.query_generation"):
+                    queries = await self.query_generator.generate_queries(
+                        query_to_use,
+                        search_context.extracted_info,
+                        analysis.product_type
+                    )
                 self.logger.info(f"📝 Query principal generada: '{queries.primary_query}'")
             else:
                 # Búsquedas refinadas
@@ -452,7 +579,12 @@ debo consultar la base de conocimiento para darte información precisa y actuali
                 )
             
             # Ejecutar búsqueda
-            search_results = await self._execute_product_search(queries)
+            with tracer.span("agent.product_search") as span:
+                search_results = await self._execute_product_search(
+                    queries,
+                    search_context.original_query if search_context.has_clarified else message
+                )
+                span.set_attribute("results", len(search_results))
             
             # PASO 3: Validar resultados
             conversation.update_search_state(SearchState.VALIDATING)
@@ -469,16 +601,32 @@ debo consultar la base de conocimiento para darte información precisa y actuali
             # 3. Detectar si hay categorías con muchos productos
             has_large_categories = False
             for r in category_results:
-                content = str(r.get('content', '')).lower()
-                # Buscar patrones como "número de productos: X" o "X productos"
-                import re
-                match = re.search(r'(\d+)\s*producto', content)
-                if match:
-                    num_products = int(match.group(1))
-                    if num_products >= 50:
-                        has_large_categories = True
-                        self.logger.info(f"📊 Categoría con {num_products} productos detectada")
-                        break
+                # Número de productos guardado en los metadatos de la categoría (el contenido
+                # llega recortado y la cifra va al final de la descripción)
+                try:
+                    num_products = int((r.get('metadata') or {}).get('count') or 0)
+                except (TypeError, ValueError):
+                    num_products = 0
+                if num_products >= 50:
+                    has_large_categories = True
+                    self.logger.info(f"📊 Categoría con {num_products} productos detectada")
+                    break
+            
+            # Las búsquedas MCP solo devuelven productos: detectar la categoría por la
+            # cercanía de la consulta al centroide de sus productos (solo si parece general)
+            if not has_large_categories and all_same_score and len(message.split()) <= 5:
+                try:
+                    query_embedding = await self.embedding_service.generate_embedding(message)
+                    for category in await self.db_service.search_categories_by_centroid(query_embedding, limit=3):
+                        if (category.get('product_count') or 0) >= 50:
+                            has_large_categories = True
+                            category_results.append({**category, 'content_type': 'category'})
+                            self.logger.info(
+                                f"📊 Categoría '{category.get('title')}' con {category['product_count']} productos "
+                                f"detectada por centroide (similitud {category.get('similarity', 0):.2f})"
+                            )
+                except Exception as e:
+                    self.logger.error(f"Error detectando categorías por centroide: {e}")
             
             # SI: hay categorías grandes, todos tienen mismo score, y no especificó detalles
             # ENTONCES: es una búsqueda muy general
@@ -528,11 +676,12 @@ debo consultar la base de conocimiento para darte información precisa y actuali
                 self.logger.info(f"✅ Búsqueda específica con {len(search_results)} resultados")
             else:
                 # Validación completa solo si es necesario
-                validation = await self.results_validator.validate_results(
-                    message,
-                    search_results,
-                    search_context.extracted_info
-                )
+                with tracer.span("agent.results_validation", candidates=len(search_results)):
+                    validation = await self.results_validator.validate_results(
+                        message,
+                        search_results,
+                        search_context.extracted_info
+                    )
             
             # Registrar intento
             search_context.add_attempt(
@@ -644,8 +793,29 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
             platform
         )
         
-    async def _execute_product_search(self, queries) -> List[Dict[str, Any]]:
-        """Ejecuta búsqueda de productos usando las queries generadas"""
+    async def _execute_product_search(self, queries, user_query: str = "") -> List[Dict[str, Any]]:
+        """
+        Ejecuta búsqueda de productos usando las queries generadas
+        Las restricciones exactas del mensaje del usuario (marca, amperaje, precio, stock...)
+        se aplican como filtros SQL antes del ranking; si ningún producto las cumple
+        (facetas incompletas en el catálogo) se repite la búsqueda sin filtros
+        """
+        
+        search_filters, _ = ProductSearchFilters.from_query(user_query or queries.primary_query or "")
+        if not search_filters.is_empty():
+            all_results = await self._collect_search_results(queries, search_filters)
+            if all_results:
+                return all_results
+            self.logger.info("⚠️ Ningún producto cumple los filtros exactos, búsqueda sin filtros")
+        
+        return await self._collect_search_results(queries)
+    
+    async def _collect_search_results(
+        self,
+        queries,
+        search_filters: Optional[ProductSearchFilters] = None
+    ) -> List[Dict[str, Any]]:
+        """Reúne los resultados de la query principal y, si faltan, de las alternativas"""
         
         all_results = []
         seen_ids = set()
@@ -654,7 +824,7 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
         # El QueryGenerator ya debería haber limpiado la query apropiadamente
         if queries.primary_query:
             self.logger.info(f"🔍 Búsqueda principal: '{queries.primary_query}'")
-            results = await self._search_products(queries.primary_query)
+            results = await self._search_products(queries.primary_query, search_filters)
             for r in results:
                 if r.get('id') not in seen_ids:
                     all_results.append(r)
@@ -664,7 +834,7 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
         if len(all_results) < 5:
             for alt_query in queries.alternative_queries[:2]:
                 if alt_query:
-                    results = await self._search_products(alt_query)
+                    results = await self._search_products(alt_query, search_filters)
                     for r in results:
                         if r.get('id') not in seen_ids:
                             all_results.append(r)
@@ -674,11 +844,38 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
                         break
         
         return all_results[:20]  # Máximo 20 resultados
+    
+    async def _search_products_filtered(
+        self,
+        query: str,
+        search_filters: ProductSearchFilters
+    ) -> List[Dict[str, Any]]:
+        """Búsqueda híbrida con los filtros exactos compilados a SQL"""
+        
+        # Precio y stock ya van como filtro: fuera del texto que se embebe y se busca
+        _, cleaned_query = ProductSearchFilters.from_query(query)
+        self.logger.info(f"🧩 Búsqueda filtrada: '{cleaned_query}' ({search_filters.cache_key()})")
+        
+        embedding = await self.embedding_service.generate_embedding(cleaned_query)
+        return await self.db_service.hybrid_search(
+            query_text=cleaned_query,
+            query_embedding=embedding,
+            content_types=['product'],
+            limit=15,
+            filters=search_filters
+        )
         
-    async def _search_products(self, query: str) -> List[Dict[str, Any]]:
-        """Ejecuta búsqueda usando las herramientas MCP"""
+    async def _search_products(
+        self,
+        query: str,
+        search_filters: Optional[ProductSearchFilters] = None
+    ) -> List[Dict[str, Any]]:
+        """Ejecuta búsqueda usando las herramientas MCP (o la base de datos si hay filtros exactos)"""
         
         try:
+            if search_filters and not search_filters.is_empty():
+                return await self._search_products_filtered(query, search_filters)
+            
             if self.mcp_tools and 'search_products' in self.mcp_tools:
                 # Usar herramienta MCP
                 result = await self.mcp_tools['search_products'](
@@ -734,46 +931,27 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
     ) -> str:
         """Formatea los resultados de productos para el usuario"""
         
+        with tracer.span("agent.format_results", platform=platform, products=len(products)):
+            return self._render_product_results(products, platform, search_context)
+    
+    def _render_product_results(
+        self,
+        products: List[Dict[str, Any]],
+        platform: str,
+        search_context: Any
+    ) -> str:
+        """Renderiza los productos en el formato de la plataforma"""
+        
+        query = search_context.original_query if hasattr(search_context, 'original_query') else "tu búsqueda"
+        
         if platform == "whatsapp":
-            return format_products_for_whatsapp(products)
+            return format_products_for_whatsapp(products, query)
         else:
-            # Formato HTML para web/wordpress
+            # Formato HTML para web/wordpress: las tarjetas leen title + metadata directamente
+            # y se sirven desde la cache de fragmentos
             from src.utils.wordpress_utils import format_product_search_response
             
-            # Convertir productos al formato esperado por wordpress_utils
-            wp_products = []
-            for product in products:
-                metadata = product.get('metadata', {})
-                
-                # Asegurar que las imágenes estén en el formato correcto
-                images = metadata.get('images', [])
-                if images and isinstance(images[0], str):
-                    # Convertir URLs simples a formato dict
-                    images = [{'src': img} for img in images if img]
-                elif not images:
-                    images = []
-                    
-                wp_product = {
-                    'name': product.get('title', 'Producto'),
-                    'price': str(metadata.get('price', 0)),
-                    'regular_price': str(metadata.get('regular_price', metadata.get('price', 0))),
-                    'sale_price': str(metadata.get('sale_price', '')),
-                    'stock_status': metadata.get('stock_status', 'unknown'),
-                    'permalink': metadata.get('permalink', ''),
-                    'sku': metadata.get('sku', ''),
-                    'images': images,
-                    'relevance_score': product.get('rrf_score', product.get('score', 0))  # Para ordenar por relevancia
-                }
-                wp_products.append(wp_product)
-                
-            if wp_products:
-                # Usar el formato HTML bonito
-                return format_product_search_response(
-                    wp_products, 
-                    search_context.original_query if hasattr(search_context, 'original_query') else "tu búsqueda"
-                )
-            else:
-                return "<p>Lo siento, encontré productos pero hubo un error al procesarlos.</p>"
+            return format_product_search_response(products, query)
             
     async def _handle_no_results(
         self,
@@ -815,7 +993,8 @@ Genera una pregunta breve y natural para ayudar a especificar qué tipo/caracter
         self,
         message: str,
         conversation: ConversationState,
-        platform: str
+        platform: str,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> str:
         """Maneja consultas técnicas sobre productos"""
         
@@ -878,15 +1057,14 @@ Genera una respuesta útil y práctica que:
 
 Responde de forma clara y concisa."""
 
-                response = await self.gpt5.create_response(
-                    input_text=prompt,
+                return await self._generate_text(
+                    prompt,
                     model="gpt-5-mini",
                     reasoning_effort=ReasoningEffort.LOW,
                     verbosity=Verbosity.MEDIUM,
-                    max_completion_tokens=600
+                    max_completion_tokens=600,
+                    on_delta=on_delta
                 )
-                
-                return response.content
             
             # Si no es sobre productos mostrados, buscar en knowledge base
             # Buscar información técnica
@@ -915,16 +1093,15 @@ IMPORTANTE - NUNCA INVENTES PRODUCTOS:
 Genera una respuesta clara, concisa y técnicamente correcta.
 Si la información no es suficiente, indícalo honestamente."""
 
-                response = await self.gpt5.create_response(
-                    input_text=prompt,
+                return await self._generate_text(
+                    prompt,
                     model=self.model,
                     reasoning_effort=ReasoningEffort.LOW,
                     verbosity=Verbosity.MEDIUM,
-                    max_completion_tokens=500
+                    max_completion_tokens=500,
+                    on_delta=on_delta
                 )
                 
-                return response.content
-                
             else:
                 return (
                     "No encontré información técnica específica sobre eso en nuestra base de conocimiento. "
@@ -1021,7 +1198,8 @@ Si la información no es suficiente, indícalo honestamente."""
         self,
         message: str,
         conversation: ConversationState,
-        platform: str
+        platform: str,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> str:
         """Maneja preguntas generales usando GPT-5"""
         
@@ -1037,16 +1215,15 @@ IMPORTANTE: Si preguntan por contacto, ubicación, teléfono, email, redes socia
 usa la información proporcionada arriba. NO inventes información."""
 
         try:
-            response = await self.gpt5.create_response(
-                input_text=context,
+            return await self._generate_text(
+                context,
                 model=self.model,
                 reasoning_effort=ReasoningEffort.MEDIUM,
                 verbosity=Verbosity.MEDIUM,
-                max_completion_tokens=300
+                max_completion_tokens=300,
+                on_delta=on_delta
             )
             
-            return response.content
-            
         except:
             return (
                 "Gracias por tu pregunta. Para información específica sobre horarios, "
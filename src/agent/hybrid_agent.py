@@ -19,12 +19,14 @@ from langchain_openai import ChatOpenAI
 
 # Importar servicios del sistema existente (FASE 3 INTEGRATION)
 from services.database import db_service
+from services.search_filters import ProductSearchFilters
 from services.embedding_service import embedding_service
 from services.conversation_logger import conversation_logger
 from services.woocommerce import WooCommerceService
 from services.knowledge_base import knowledge_service
 from services.conversation_memory import memory_service
 from services.bot_config_service import bot_config_service
+from services.cpu_offload import cpu_offload
 
 # Importar el sistema multi-agente y el refinador de búsqueda
 from .multi_agent_system import CustomerServiceMultiAgent, ConversationContext
@@ -238,8 +240,11 @@ class HybridCustomerAgent:
         
         self.logger.info(f"🤖 {self.bot_name} ({strategy}): {response[:100]}...")
         
-        # Aplicar formateo final según la plataforma
-        formatted_response = self._format_for_platform(response, platform)
+        # Aplicar formateo final según la plataforma (regex sobre toda la respuesta: fuera del loop si es larga)
+        formatted_response = await cpu_offload.run(
+            "agent.format_for_platform", self._format_for_platform, response, platform,
+            size=len(response or "")
+        )
         
         return formatted_response
     
@@ -517,14 +522,31 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                 else:
                     return "No entendí qué producto buscas. ¿Podrías ser más específico?"
             
+            # Filtros exactos del mensaje (marca, amperaje, polos, precio, stock...) aplicados en SQL
+            search_filters, _ = ProductSearchFilters.from_query(message)
+            # Precio y stock van como filtro: se quitan de la consulta que se embebe y se busca
+            _, query_to_use = ProductSearchFilters.from_query(query_to_use)
+            
             # Generar embedding y buscar (incluir categorías para detectar matches de categorías)
             embedding = await self.embedding_service.generate_embedding(query_to_use)
-            results = await self.db_service.hybrid_search(
-                query_text=query_to_use,
-                query_embedding=embedding,
-                content_types=["product", "category"],  # Incluir categorías para detectar matches
-                limit=30  # Buscar más para poder evaluar si hay demasiados
-            )
+            results = []
+            if not search_filters.is_empty():
+                results = await self.db_service.hybrid_search(
+                    query_text=query_to_use,
+                    query_embedding=embedding,
+                    content_types=["product"],
+                    limit=30,
+                    filters=search_filters
+                )
+                if not results:
+                    self.logger.info("⚠️ Ningún producto cumple los filtros exactos, búsqueda sin filtros")
+            if not results:
+                results = await self.db_service.hybrid_search(
+                    query_text=query_to_use,
+                    query_embedding=embedding,
+                    content_types=["product", "category"],  # Incluir categorías para detectar matches
+                    limit=30  # Buscar más para poder evaluar si hay demasiados
+                )
             
             self.logger.info(f"📦 Encontrados {len(results)} productos")
             
@@ -534,7 +556,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                 self.logger.info(f"✅ Marca detectada, mostrando {min(5, len(results))} productos directamente")
                 # Tomar solo los primeros 5 resultados (ya vienen ordenados por score)
                 top_results = results[:5]
-                return self._format_product_results(top_results, message, platform)
+                return await self._format_product_results(top_results, message, platform)
             
             # PASO 4: Usar IA para decidir si refinar o mostrar productos
             # No más lógica rígida, la IA decide basándose en el contexto
@@ -566,7 +588,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
             if len(validated_products) <= 5:
                 # Pocos resultados relevantes, mostrar directamente
                 self.logger.info(f"✅ Mostrando {len(validated_products)} productos directamente")
-                return self._format_product_results(validated_products, message, platform)
+                return await self._format_product_results(validated_products, message, platform)
             
             if len(validated_products) > 5:
                 # Muchos resultados validados - dejar que la IA decida si refinar
@@ -591,7 +613,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                 else:
                     # La IA decidió mostrar productos directamente
                     self.logger.info(f"✅ Mostrando los 5 mejores de {len(validated_products)} productos validados")
-                    return self._format_product_results(validated_products[:5], message, platform)
+                    return await self._format_product_results(validated_products[:5], message, platform)
             
             # PASO 4: No necesita refinamiento o hay pocos resultados
             if not results:
@@ -622,19 +644,36 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                         self.logger.info(f"✅ Encontrada categoría con alta puntuación ({score}): {cat.get('title')}")
                         break
                 
+                if not high_score_category:
+                    # Sin coincidencia por nombre: la categoría cuyos productos más se parecen a la consulta
+                    centroid_categories = await self.db_service.search_categories_by_centroid(embedding, limit=1)
+                    if centroid_categories:
+                        high_score_category = centroid_categories[0]
+                        self.logger.info(
+                            f"✅ Categoría detectada por centroide ({high_score_category.get('similarity', 0):.2f}): "
+                            f"{high_score_category.get('title')}"
+                        )
+                
                 # Si encontramos una categoría relevante, buscar productos de esa categoría
                 if high_score_category:
                     category_title = high_score_category.get('title', '')
                     self.logger.info(f"🔍 Buscando productos de la categoría: {category_title}")
                     
-                    # Buscar productos de esta categoría específica
-                    category_embedding = await self.embedding_service.generate_embedding(category_title)
-                    category_products = await self.db_service.hybrid_search(
-                        query_text=category_title,
-                        query_embedding=category_embedding,
-                        content_types=["product"],
-                        limit=10
-                    )
+                    # Productos de la categoría desde la pertenencia materializada (una consulta indexada)
+                    category_products = []
+                    category_id = (high_score_category.get('metadata') or {}).get('wc_id')
+                    if category_id:
+                        category_products = await self.db_service.get_category_products(int(category_id), limit=10)
+                    
+                    if not category_products:
+                        # Sin pertenencia sincronizada: buscar por el título de la categoría
+                        category_embedding = await self.embedding_service.generate_embedding(category_title)
+                        category_products = await self.db_service.hybrid_search(
+                            query_text=category_title,
+                            query_embedding=category_embedding,
+                            content_types=["product"],
+                            limit=10
+                        )
                     
                     if category_products:
                         self.logger.info(f"✅ Encontrados {len(category_products)} productos en la categoría {category_title}")
@@ -664,6 +703,8 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                         if term in synonym_map:
                             expanded_terms.extend(synonym_map[term])
                     
+                    # Los términos se buscan en la descripción completa, no en el extracto
+                    await self.db_service.hydrate_content(product_results, limit=20)
                     for result in product_results[:20]:
                         title_lower = result.get('title', '').lower()
                         content_lower = result.get('content', '').lower()
@@ -688,7 +729,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
             if len(results) > 5:
                 results = await search_optimizer.optimize_search_results(message, results, limit=5)
             
-            return self._format_product_results(results, message, platform)
+            return await self._format_product_results(results, message, platform)
             
         except Exception as e:
             self.logger.error(f"⚠️ Error en búsqueda con refinamiento: {e}")
@@ -771,6 +812,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                     filtered_results = []
                     original_term = refiner_context.original_query.lower()
                     
+                    await self.db_service.hydrate_content(refiner_context.last_search_results)
                     for result in refiner_context.last_search_results:
                         title_lower = result.get('title', '').lower()
                         content_lower = result.get('content', '').lower()
@@ -835,20 +877,35 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                     combined_query = f"{refiner_context.original_query} {refined_query}"
                     self.logger.info(f"🎯 Estrategia 1: Query combinada: '{combined_query}'")
                     
+                    # Las especificaciones de ambas consultas se aplican como filtros SQL
+                    search_filters, cleaned_query = ProductSearchFilters.from_query(combined_query)
+                    
                     from services.search_optimizer import search_optimizer
-                    search_analysis = await search_optimizer.analyze_product_query(combined_query)
-                    optimized_query = search_analysis.get('search_query', combined_query)
+                    search_analysis = await search_optimizer.analyze_product_query(cleaned_query)
+                    optimized_query = search_analysis.get('search_query', cleaned_query)
                     
                     embedding = await self.embedding_service.generate_embedding(optimized_query)
-                    results = await self.db_service.hybrid_search(
-                        query_text=optimized_query,
-                        query_embedding=embedding,
-                        content_types=["product"],
-                        limit=20
-                    )
+                    if not search_filters.is_empty():
+                        results = await self.db_service.hybrid_search(
+                            query_text=optimized_query,
+                            query_embedding=embedding,
+                            content_types=["product"],
+                            limit=20,
+                            filters=search_filters
+                        )
+                        if results:
+                            self.logger.info(f"   ✅ {len(results)} productos cumplen los filtros exactos")
+                    if not results:
+                        results = await self.db_service.hybrid_search(
+                            query_text=optimized_query,
+                            query_embedding=embedding,
+                            content_types=["product"],
+                            limit=20
+                        )
                     
                     # Filtrar por marca si se detectó una
                     if detected_brand and results:
+                        await self.db_service.hydrate_content(results)
                         brand_filtered = [r for r in results if detected_brand in r.get('title', '').lower() or detected_brand in r.get('content', '').lower()]
                         if brand_filtered:
                             results = brand_filtered
@@ -905,6 +962,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                         
                         # Filtrar por marca si es necesario
                         if detected_brand and results:
+                            await self.db_service.hydrate_content(results)
                             brand_filtered = [r for r in results if detected_brand in r.get('title', '').lower() or detected_brand in r.get('content', '').lower()]
                             if brand_filtered:
                                 results = brand_filtered
@@ -924,6 +982,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                     # Si hay números, buscar en los resultados originales
                     if numbers and refiner_context.last_search_results:
                         filtered_results = []
+                        await self.db_service.hydrate_content(refiner_context.last_search_results)
                         for result in refiner_context.last_search_results:
                             title = result.get('title', '').lower()
                             content = result.get('content', '').lower()
@@ -996,7 +1055,7 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
                         return f"No encontré productos exactos con esas especificaciones. ¿Te puedo ayudar con otra búsqueda o prefieres que te muestre opciones similares?"
             
             # Formatear y devolver resultados
-            return self._format_product_results(results, refined_query, platform)
+            return await self._format_product_results(results, refined_query, platform)
             
         except Exception as e:
             self.logger.error(f"Error en búsqueda refinada: {e}")
@@ -1005,14 +1064,20 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
     async def _generate_intelligent_not_found_response(self, query: str, platform: str) -> str:
         """Genera una respuesta inteligente cuando no se encuentran productos usando IA"""
         try:
-            # Buscar categorías similares para sugerir
+            # Buscar categorías similares para sugerir: primero las cuyos productos se parecen
+            # a la consulta (centroide), después las que coinciden por nombre/descripción
             embedding = await self.embedding_service.generate_embedding(query)
-            similar_categories = await self.db_service.hybrid_search(
-                query_text=query,
-                query_embedding=embedding,
-                content_types=["category"],
-                limit=5
-            )
+            similar_categories = await self.db_service.search_categories_by_centroid(embedding, limit=3)
+            seen_titles = {cat.get('title') for cat in similar_categories}
+            similar_categories += [
+                cat for cat in await self.db_service.hybrid_search(
+                    query_text=query,
+                    query_embedding=embedding,
+                    content_types=["category"],
+                    limit=5
+                )
+                if cat.get('title') not in seen_titles
+            ]
             
             # Preparar contexto para el LLM
             categories_context = ""
@@ -1109,8 +1174,11 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
         
         return min(score, 1.0)  # Limitar a máximo 1.0
     
-    def _format_product_results(self, results: list, query: str, platform: str) -> str:
+    async def _format_product_results(self, results: list, query: str, platform: str) -> str:
         """Formatea los resultados de productos según la plataforma"""
+        # La relevancia mira términos de toda la descripción: la búsqueda solo trae un extracto
+        await self.db_service.hydrate_content(results)
+        
         # Reordenar resultados por relevancia mejorada
         for result in results:
             result['improved_relevance'] = self._calculate_relevance_score(query, result)
@@ -1124,30 +1192,8 @@ RESPONDE SOLO con el nombre de la estrategia: quick_response, tool_assisted, mul
         if platform == "wordpress":
             from src.utils.wordpress_utils import format_product_search_response
             
-            products = []
-            for result in results[:5]:
-                if isinstance(result, dict):
-                    metadata = result.get('metadata', {})
-                    # Asegurar que las imágenes estén en el formato correcto
-                    images = metadata.get('images', [])
-                    if images and isinstance(images[0], dict):
-                        # Ya está en el formato correcto
-                        pass
-                    elif images and isinstance(images[0], str):
-                        # Convertir URLs simples a formato dict
-                        images = [{'src': img} for img in images if img]
-                    
-                    product = {
-                        'name': result.get('title', 'Producto'),
-                        'price': str(metadata.get('price', 0)),
-                        'regular_price': str(metadata.get('regular_price', 0)),
-                        'sale_price': str(metadata.get('sale_price', 0)),
-                        'stock_status': metadata.get('stock_status', 'unknown'),
-                        'permalink': metadata.get('permalink', ''),
-                        'sku': metadata.get('sku', ''),
-                        'images': images
-                    }
-                    products.append(product)
+            # Las tarjetas leen title + metadata directamente y se sirven desde la cache de fragmentos
+            products = [result for result in results[:5] if isinstance(result, dict)]
             
             if products:
                 # Usar el formato HTML bonito de wordpress_utils
@@ -1251,11 +1297,14 @@ Responde SOLO con la categoría: order_inquiry, stock_check, faq_inquiry, produc
         try:
             self.logger.info(f"🔍 BÚSQUEDA DE PRODUCTOS: '{message}'")
             
+            # Filtros exactos en SQL; la consulta sin precio/stock es la que se optimiza y embebe
+            search_filters, cleaned_query = ProductSearchFilters.from_query(message)
+            
             # Usar el optimizador de búsqueda para analizar la consulta
             from services.search_optimizer import search_optimizer
             
-            search_analysis = await search_optimizer.analyze_product_query(message)
-            optimized_query = search_analysis.get('search_query', message)
+            search_analysis = await search_optimizer.analyze_product_query(cleaned_query)
+            optimized_query = search_analysis.get('search_query', cleaned_query)
             
             self.logger.info(f"🤖 Consulta optimizada: '{optimized_query}' (Original: '{message}')")
             self.logger.info(f"📊 Análisis: {search_analysis}")
@@ -1270,8 +1319,19 @@ Responde SOLO con la categoría: order_inquiry, stock_check, faq_inquiry, produc
                 content_types=["product"],
                 limit=20,  # Buscar más para luego filtrar con IA
                 wc_service=self.wc_service,
-                search_analysis=search_analysis  # Pasar el análisis completo que incluye detected_sku
+                search_analysis=search_analysis,  # Pasar el análisis completo que incluye detected_sku
+                filters=search_filters
             )
+            if not results and not search_filters.is_empty():
+                self.logger.info("⚠️ Ningún producto cumple los filtros exactos, búsqueda sin filtros")
+                results = await self.db_service.intelligent_product_search(
+                    query_text=optimized_query,
+                    query_embedding=embedding,
+                    content_types=["product"],
+                    limit=20,
+                    wc_service=self.wc_service,
+                    search_analysis=search_analysis
+                )
             
             # Si hay resultados, optimizarlos con IA
             if results and len(results) > 5:
@@ -1307,7 +1367,7 @@ Responde SOLO con la categoría: order_inquiry, stock_check, faq_inquiry, produc
                         break
             
             # Formatear respuesta usando el método unificado
-            response = self._format_product_results(results, message, platform)
+            response = await self._format_product_results(results, message, platform)
             
             # Agregar información adicional de knowledge base si existe (solo para WhatsApp)
             if platform == "whatsapp" and additional_info:
@@ -1683,7 +1743,8 @@ Cliente: {self.conversation_state.context.customer_name or 'Cliente'}
                     content_types=["product"],
                     limit=2
                 )
-                return product_results
+                # Van al prompt como contexto: traer el texto completo
+                return await self.db_service.hydrate_content(product_results)
             
             return knowledge_results
             
@@ -10,6 +10,8 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 
+from services.tracing_service import tracer
+
 logger = logging.getLogger(__name__)
 
 class PipelineStage(Enum):
@@ -73,6 +75,13 @@ class PipelineContext:
     def add_processing_time(self, stage: str, time_ms: int):
         """Registra el tiempo de procesamiento de una etapa"""
         self.processing_time_ms[stage] = time_ms
+        # Exponer también la etapa en el trazador (ring buffer / exportación OTLP)
+        tracer.record_span(
+            f"pipeline.{stage}",
+            time_ms,
+            session_id=self.session_id,
+            iteration=self.iteration_count
+        )
     
     def add_error(self, error: str):
         """Registra un error durante el procesamiento"""
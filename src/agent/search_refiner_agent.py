@@ -10,6 +10,9 @@ from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
+from services.database import db_service
+from services.product_attributes_service import product_attributes_service
+
 logger = logging.getLogger(__name__)
 
 class RefinementState(Enum):
@@ -39,6 +42,8 @@ class SearchContext:
     last_search_results: List[Dict] = field(default_factory=list)
     available_brands: List[str] = field(default_factory=list)
     available_attributes: Dict[str, List[str]] = field(default_factory=dict)
+    facet_distribution: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # product_facets de los resultados
+    asking_facet: Optional[str] = None  # Faceta por la que se preguntó al usuario
     
     # Umbrales
     too_many_threshold: int = 10  # Más de 10 resultados es demasiado
@@ -297,6 +302,49 @@ class SearchRefinerAgent:
             k: sorted(list(v)) for k, v in attributes.items() if v
         }
     
+    async def get_attributes_for_results(
+        self,
+        context: SearchContext,
+        search_results: List[Dict]
+    ) -> Dict[str, List[str]]:
+        """
+        Atributos disponibles en los resultados a partir de la tabla de facetas
+        (una consulta GROUP BY); si no hay facetas se extraen de los resultados
+        """
+        external_ids = []
+        for result in search_results:
+            external_id = result.get('external_id')
+            if not external_id and result.get('id') and result.get('name'):
+                external_id = f"product_{result['id']}"  # Producto directo de WooCommerce
+            if external_id and external_id.startswith('product_'):
+                external_ids.append(external_id)
+        
+        distribution = {}
+        if external_ids and db_service.initialized:
+            distribution = await product_attributes_service.get_result_facets(db_service, external_ids)
+        
+        context.facet_distribution = distribution
+        if not distribution:
+            return self.extract_attributes_from_results(search_results)
+        
+        # Mismas claves que extract_attributes_from_results, valores más frecuentes primero
+        facet_keys = {
+            'marca': 'brands',
+            'amperaje': 'amperajes',
+            'curva': 'curvas',
+            'polos': 'polos',
+            'sensibilidad': 'sensibilidades',
+            'seccion': 'secciones',
+            'ip': 'ips'
+        }
+        attributes = {}
+        for facet, key in facet_keys.items():
+            values = distribution.get(facet, {}).get("values", {})
+            if values:
+                attributes[key] = sorted(values, key=lambda v: (-values[v], v))
+        
+        return attributes
+    
     async def should_refine_search(
         self, 
         session_id: str,
@@ -317,7 +365,7 @@ class SearchRefinerAgent:
             return False, None
         
         # Extraer atributos disponibles de los resultados PRIMERO
-        available_attrs = self.extract_attributes_from_results(search_results)
+        available_attrs = await self.get_attributes_for_results(context, search_results)
         
         # Calcular la diversidad de los resultados
         num_brands = len(available_attrs.get('brands', []))
@@ -387,6 +435,8 @@ class SearchRefinerAgent:
     ) -> Optional[str]:
         """Genera la pregunta de refinamiento apropiada para el usuario"""
         
+        context.asking_facet = None
+        
         # Asegurar que siempre tengamos un tipo de producto válido
         product_type = query_details.get('product_type')
         if not product_type or product_type == 'None':
@@ -409,6 +459,18 @@ class SearchRefinerAgent:
                 )
         
         # Segunda iteración: preguntar por atributo técnico basado en lo disponible
+        if context.iterations <= 1 and context.facet_distribution:
+            # La faceta que mejor divide los resultados (marca y tipo se tratan aparte)
+            exclude = {'marca', 'tipo'} | set(context.selected_attributes)
+            facet = product_attributes_service.choose_split_facet(
+                context.facet_distribution, result_count, exclude=exclude
+            )
+            if facet:
+                context.current_state = RefinementState.ASKING_ATTRIBUTE
+                context.asking_facet = facet
+                question = product_attributes_service.build_facet_question(facet, context.facet_distribution)
+                return f"Perfecto. {question['question']}"
+        
         if context.iterations <= 1:
             # Preguntar por atributos disponibles en los resultados
             if available_attrs.get('amperajes') and len(available_attrs['amperajes']) >= 2:
@@ -517,42 +579,50 @@ class SearchRefinerAgent:
             elif context.selected_brand and context.selected_brand not in refined_parts:
                 refined_parts.append(context.selected_brand)
             
-            # Extraer valores numéricos y unidades
-            import re
+            # Si se preguntó por una faceta, buscar directamente sus valores en la respuesta
+            facet_value = self._match_facet_value(context, user_response)
+            if facet_value:
+                context.selected_attributes[context.asking_facet] = facet_value
+                if facet_value not in refined_parts:
+                    refined_parts.append(facet_value)
             
-            # Amperaje
-            amp_match = re.search(r'(\d+)\s*[Aa]?', response_lower)
-            if amp_match:
-                amp_value = f"{amp_match.group(1)}A"
-                context.selected_attributes['amperaje'] = amp_value
-                if amp_value not in refined_parts:
-                    refined_parts.append(amp_value)
+            if not facet_value:
+                # Extraer valores numéricos y unidades
+                import re
             
-            # Curva
-            curve_match = re.search(r'[Cc]urva\s*([A-Za-z])|^([A-Za-z])$', user_response)
-            if curve_match:
-                curve = (curve_match.group(1) or curve_match.group(2)).upper()
-                if curve in ['A', 'B', 'C', 'D', 'K', 'Z']:
-                    curve_str = f"curva {curve}"
-                    context.selected_attributes['curva'] = curve_str
-                    if curve_str not in refined_parts:
-                        refined_parts.append(curve_str)
+                # Amperaje
+                amp_match = re.search(r'(\d+)\s*[Aa]?', response_lower)
+                if amp_match:
+                    amp_value = f"{amp_match.group(1)}A"
+                    context.selected_attributes['amperaje'] = amp_value
+                    if amp_value not in refined_parts:
+                        refined_parts.append(amp_value)
             
-            # Polos
-            pole_match = re.search(r'(\d)\s*[Pp]?', response_lower)
-            if pole_match and 'polo' in response_lower:
-                poles = f"{pole_match.group(1)}P"
-                context.selected_attributes['polos'] = poles
-                if poles not in refined_parts:
-                    refined_parts.append(poles)
+                # Curva
+                curve_match = re.search(r'[Cc]urva\s*([A-Za-z])|^([A-Za-z])$', user_response)
+                if curve_match:
+                    curve = (curve_match.group(1) or curve_match.group(2)).upper()
+                    if curve in ['A', 'B', 'C', 'D', 'K', 'Z']:
+                        curve_str = f"curva {curve}"
+                        context.selected_attributes['curva'] = curve_str
+                        if curve_str not in refined_parts:
+                            refined_parts.append(curve_str)
+            
+                # Polos
+                pole_match = re.search(r'(\d)\s*[Pp]?', response_lower)
+                if pole_match and 'polo' in response_lower:
+                    poles = f"{pole_match.group(1)}P"
+                    context.selected_attributes['polos'] = poles
+                    if poles not in refined_parts:
+                        refined_parts.append(poles)
             
-            # Sensibilidad
-            sens_match = re.search(r'(\d+)\s*m[Aa]', response_lower)
-            if sens_match:
-                sensitivity = f"{sens_match.group(1)}mA"
-                context.selected_attributes['sensibilidad'] = sensitivity
-                if sensitivity not in refined_parts:
-                    refined_parts.append(sensitivity)
+                # Sensibilidad
+                sens_match = re.search(r'(\d+)\s*m[Aa]', response_lower)
+                if sens_match:
+                    sensitivity = f"{sens_match.group(1)}mA"
+                    context.selected_attributes['sensibilidad'] = sensitivity
+                    if sensitivity not in refined_parts:
+                        refined_parts.append(sensitivity)
         
         # Construir consulta refinada
         context.refined_query = ' '.join(refined_parts)
@@ -561,6 +631,19 @@ class SearchRefinerAgent:
         logger.info(f"Consulta refinada: '{context.refined_query}'")
         return context.refined_query
     
+    def _match_facet_value(self, context: SearchContext, user_response: str) -> Optional[str]:
+        """Valor de la faceta preguntada que aparece en la respuesta del usuario"""
+        if not context.asking_facet:
+            return None
+        
+        values = context.facet_distribution.get(context.asking_facet, {}).get("values", {})
+        response = user_response.lower().replace(' ', '')
+        # Los valores más largos primero para que '16A' no coincida dentro de '160A'
+        for value in sorted(values, key=len, reverse=True):
+            if value.lower().replace(' ', '') in response:
+                return value
+        return None
+    
     def get_search_summary(self, session_id: str) -> str:
         """Obtiene un resumen del proceso de refinamiento"""
         context = self.contexts.get(session_id)
@@ -5,6 +5,8 @@ Formateador especializado de productos para WhatsApp
 from typing import List, Dict, Any, Optional
 import re
 
+from services.product_card_cache import product_card_cache
+
 
 def format_products_for_whatsapp(products: List[Dict[str, Any]], query: str) -> str:
     """
@@ -34,13 +36,10 @@ def format_products_for_whatsapp(products: List[Dict[str, Any]], query: str) ->
     response = header
     response += "━━━━━━━━━━━━━━━━━━━━\n\n"
     
-    # Formatear cada producto
-    for i, product in enumerate(products[:5], 1):
-        response += format_single_product(product, i)
-        
-        # Separador entre productos (excepto el último)
-        if i < min(len(products), 5):
-            response += "┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈\n\n"
+    # Formatear cada producto (fragmentos cacheados) con separador entre ellos
+    response += "┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈┈\n\n".join(
+        format_single_product(product, i) for i, product in enumerate(products[:5], 1)
+    )
     
     # Pie del mensaje más natural
     response += "\n━━━━━━━━━━━━━━━━━━━━\n"
@@ -70,6 +69,7 @@ def format_products_for_whatsapp(products: List[Dict[str, Any]], query: str) ->
 def format_single_product(product: Dict[str, Any], index: int) -> str:
     """
     Formatea un producto individual para WhatsApp
+    El texto se cachea por producto y versión de precio/stock en product_card_cache
     
     Args:
         product: Diccionario con datos del producto
@@ -79,15 +79,27 @@ def format_single_product(product: Dict[str, Any], index: int) -> str:
         Producto formateado
     """
     # Extraer datos con valores por defecto
-    title = product.get('title', product.get('name', 'Producto'))
     metadata = product.get('metadata', {})
-    price = float(metadata.get('price', 0))
-    regular_price = float(metadata.get('regular_price', price))
-    sale_price = float(metadata.get('sale_price', 0))
-    stock_status = metadata.get('stock_status', 'unknown')
-    permalink = metadata.get('permalink', '')
-    sku = metadata.get('sku', '')
-    
+    fields = (
+        product.get('title', product.get('name', 'Producto')),
+        float(metadata.get('price', 0)),
+        float(metadata.get('regular_price', metadata.get('price', 0))),
+        float(metadata.get('sale_price', 0)),
+        metadata.get('stock_status', 'unknown'),
+        metadata.get('permalink', ''),
+        metadata.get('sku', '')
+    )
+    return product_card_cache.get_or_render(
+        product.get('external_id'),
+        'whatsapp',
+        "|".join(str(field) for field in fields),
+        lambda: _render_single_product(*fields)
+    )
+
+
+def _render_single_product(title: str, price: float, regular_price: float, sale_price: float,
+                           stock_status: str, permalink: str, sku: str) -> str:
+    """Construye el texto de un producto para WhatsApp"""
     # Limpiar título si es muy largo
     if len(title) > 60:
         title = title[:57] + "..."
@@ -5,23 +5,59 @@ import json
 from typing import List, Dict, Any, Optional
 from html import escape
 
+from services.product_card_cache import product_card_cache
+
+
+# Campos que determinan el HTML de la tarjeta: forman la versión del fragmento cacheado
+_CARD_VERSION_FIELDS = ('name', 'price', 'regular_price', 'sale_price', 'permalink', 'image_url', 'image_alt')
+
 
 def format_product_card(product: Dict[str, Any]) -> str:
     """
     Format a single product as an HTML card for WordPress display.
     
+    Accepts WooCommerce-style dicts (name, price, images, permalink) or search
+    results (title + metadata). Rendered cards are cached per product and
+    price/stock version in product_card_cache.
+    
     Args:
         product: Product dictionary with fields like name, price, images, permalink
         
     Returns:
         HTML string for the product card
     """
-    name = escape(product.get('name', 'Producto'))
-    price = product.get('price', '0')
-    permalink = product.get('permalink', '#')
+    fields = _product_card_fields(product)
+    version = "|".join(str(fields[field]) for field in _CARD_VERSION_FIELDS)
+    return product_card_cache.get_or_render(
+        product.get('external_id'),
+        'wordpress',
+        version,
+        lambda: _render_product_card(fields)
+    )
+
+
+def _product_card_fields(product: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract the fields used by the card from either product shape.
+    """
+    if 'name' not in product and ('title' in product or 'metadata' in product):
+        # Search result: price/stock live in metadata (merged from product_live_state)
+        metadata = product.get('metadata') or {}
+        name = product.get('title', 'Producto')
+        price = str(metadata.get('price', 0))
+        regular_price = str(metadata.get('regular_price', metadata.get('price', 0)))
+        sale_price = str(metadata.get('sale_price', ''))
+        permalink = metadata.get('permalink', '')
+        images = metadata.get('images', [])
+    else:
+        name = product.get('name', 'Producto')
+        price = product.get('price', '0')
+        regular_price = product.get('regular_price', '0')
+        sale_price = product.get('sale_price', '0')
+        permalink = product.get('permalink', '#')
+        images = product.get('images', [])
     
     # Extract first image if available
-    images = product.get('images', [])
     image_url = ''
     image_alt = name
     
@@ -33,9 +69,30 @@ def format_product_card(product: Dict[str, Any]) -> str:
             image_url = images[0].get('src', '')
             image_alt = images[0].get('alt', name)
     
+    return {
+        'name': name,
+        'price': price,
+        'regular_price': regular_price,
+        'sale_price': sale_price,
+        'permalink': permalink,
+        'image_url': image_url,
+        'image_alt': image_alt
+    }
+
+
+def _render_product_card(fields: Dict[str, Any]) -> str:
+    """
+    Build the HTML card from the extracted fields.
+    """
+    name = escape(fields['name'])
+    price = fields['price']
+    permalink = fields['permalink']
+    image_url = fields['image_url']
+    image_alt = fields['image_alt']
+    
     # Extract price information
-    regular_price = product.get('regular_price', '0')
-    sale_price = product.get('sale_price', '0')
+    regular_price = fields['regular_price']
+    sale_price = fields['sale_price']
     
     # Determine if product is on sale
     is_on_sale = False
@@ -113,8 +170,7 @@ def format_product_search_response(products: List[Dict[str, Any]], search_query:
     
     response += '<div class="eva-products-list" style="max-height: 400px; overflow-y: auto; padding-right: 4px;">'
     
-    for product in products:
-        response += format_product_card(product)
+    response += "".join(format_product_card(product) for product in products)
     
     response += '</div>'
     
@@ -0,0 +1,49 @@
+"""
+Fixtures compartidas de las pruebas unitarias
+Las pruebas del SQL de las colas necesitan PostgreSQL: se ejecutan contra
+TEST_DATABASE_URL, cada una en un esquema temporal, y se saltan si no está definida
+"""
+
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+import pytest
+
+from services import json_codec
+from services.database import db_service
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """
+    Factoría de un pool asyncpg sobre un esquema vacío que sustituye al de db_service
+    Uso: `async with postgres() as pool:` dentro de la corrutina de la prueba
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL no definida")
+
+    import asyncpg
+
+    @asynccontextmanager
+    async def connect():
+        schema = f"test_{uuid.uuid4().hex[:12]}"
+        admin = await asyncpg.connect(url)
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        pool = await asyncpg.create_pool(
+            url,
+            min_size=1,
+            max_size=4,
+            server_settings={"search_path": f"{schema},public"},  # public: extensiones (pgvector)
+            init=json_codec.register_json_codecs
+        )
+        monkeypatch.setattr(db_service, "pool", pool)
+        try:
+            yield pool
+        finally:
+            await pool.close()
+            await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+            await admin.close()
+
+    return connect
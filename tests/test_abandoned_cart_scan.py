@@ -0,0 +1,171 @@
+"""
+Pruebas del escaneo de carritos abandonados: marcas de agua compartidas entre workers
+(contra PostgreSQL, TEST_DATABASE_URL) y formato de los carritos para la recuperación
+"""
+
+import asyncio
+from datetime import datetime
+
+from services.database import db_service
+from services.whatsapp_templates import WhatsAppTemplateManager
+from services import whatsapp_templates
+from services.wordpress_db_service import WordPressDBService, SCAN_LOCK_NAME
+
+# Sesiones de WooCommerce ordenadas por (session_expiry, session_id)
+SESSIONS = [(100, 1), (100, 2), (200, 3)]
+
+
+class FakeWordPress(WordPressDBService):
+    """Escáner cuyas tablas de WordPress son listas en memoria"""
+
+    def __init__(self, sessions):
+        super().__init__()
+        self.sessions = sessions
+
+    async def get_abandoned_carts_from_woocommerce(self, hours_ago=24, batch_size=500):
+        new = [s for s in self.sessions if self._woocommerce_mark is None or s > self._woocommerce_mark]
+        if new:
+            self._woocommerce_mark = new[-1]
+        return [{"session_key": f"s{session_id}", "cart_data": {}, "expiry": None} for _, session_id in new]
+
+    async def get_abandoned_carts_from_cartflows(self, hours_ago=24, batch_size=500):
+        self._cartflows_mark = (datetime(2026, 1, 1, 12, 0), 7)
+        return []
+
+
+def run(postgres, monkeypatch, scenario):
+    monkeypatch.setattr(db_service, "initialized", True)
+
+    async def main():
+        async with postgres() as pool:
+            return await scenario(pool)
+    return asyncio.run(main())
+
+
+def test_marks_are_shared_between_workers(postgres, monkeypatch):
+    sessions = list(SESSIONS)
+
+    async def scenario(pool):
+        first, second = FakeWordPress(sessions), FakeWordPress(sessions)
+        await first.initialize()
+        await second.initialize()
+        assert first.shared_marks and second.shared_marks
+
+        found_first = await first.scan_new_abandoned_carts()
+        sessions.append((300, 4))
+        found_second = await second.scan_new_abandoned_carts()
+        marks = {row["source"]: row["mark"] for row in await pool.fetch(
+            "SELECT source, mark FROM abandoned_cart_scan_marks"
+        )}
+        return found_first, found_second, marks, second._cartflows_mark
+
+    found_first, found_second, marks, cartflows_mark = run(postgres, monkeypatch, scenario)
+
+    assert [cart["session_key"] for cart in found_first] == ["s1", "s2", "s3"]
+    # El segundo worker continúa donde lo dejó el primero
+    assert [cart["session_key"] for cart in found_second] == ["s4"]
+    assert marks == {"woocommerce": [300, 4], "cartflows": ["2026-01-01T12:00:00", 7]}
+    assert cartflows_mark == (datetime(2026, 1, 1, 12, 0), 7)
+
+
+def test_scan_is_skipped_while_another_worker_scans(postgres, monkeypatch):
+    async def scenario(pool):
+        scanner = FakeWordPress(list(SESSIONS))
+        await scanner.initialize()
+        async with pool.acquire() as conn:
+            await conn.execute("SELECT pg_advisory_lock(hashtext($1))", SCAN_LOCK_NAME)
+            busy = await scanner.scan_new_abandoned_carts()
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", SCAN_LOCK_NAME)
+        free = await scanner.scan_new_abandoned_carts()
+        return busy, free
+
+    busy, free = run(postgres, monkeypatch, scenario)
+
+    assert busy == []
+    assert len(free) == 3
+
+
+def test_simulated_scan_does_not_advance_marks(postgres, monkeypatch):
+    async def scenario(pool):
+        scanner = FakeWordPress(list(SESSIONS))
+        await scanner.initialize()
+        simulated = await scanner.scan_new_abandoned_carts(advance=False)
+        real = await scanner.scan_new_abandoned_carts()
+        after = await scanner.scan_new_abandoned_carts()
+        return simulated, real, after
+
+    simulated, real, after = run(postgres, monkeypatch, scenario)
+
+    assert len(simulated) == len(real) == 3
+    assert after == []
+
+
+def test_abandoned_carts_have_recovery_shape(monkeypatch):
+    raw_carts = [
+        {
+            "session_key": "abc",
+            "cart_data": {
+                "items": [{"product_id": 10, "variation_id": 11, "quantity": 2, "total": 20.0}],
+                "total": 20.0,
+                "email": "ana@example.com",
+                "phone": "600 111 222",
+                "customer_name": "Ana"
+            },
+            "expiry": datetime(2026, 1, 1)
+        },
+        {
+            "cart_id": "cf1",
+            "email": "luis@example.com",
+            "phone": "0034 611 222 333",
+            "customer_name": "Luis",
+            "items": [{"product_id": 12, "quantity": 1, "line_total": 5.5}],
+            "total": 5.5,
+            "abandoned_at": datetime(2026, 1, 2),
+            "checkout_id": 3
+        },
+        {
+            "cart_id": "cf2",
+            "email": "sin@example.com",
+            "phone": "123",
+            "customer_name": "",
+            "items": [{"product_id": 99, "quantity": 1}],
+            "total": 1,
+            "abandoned_at": datetime(2026, 1, 3),
+            "checkout_id": 3
+        },
+    ]
+
+    class Scanner:
+        pool = object()
+
+        async def scan_new_abandoned_carts(self, hours_ago=24, advance=True):
+            return raw_carts
+
+    async def get_product_labels(external_ids):
+        assert sorted(external_ids) == ["product_10", "product_11", "product_12", "product_99"]
+        return {
+            "product_11": {"external_id": "product_11", "name": "Magnetotérmico 2P", "sku": "MT2"},
+            "product_12": {"external_id": "product_12", "name": "Diferencial", "sku": None},
+        }
+
+    monkeypatch.setattr(whatsapp_templates, "wordpress_db_service", Scanner())
+    monkeypatch.setattr(db_service, "get_product_labels", get_product_labels)
+
+    manager = WhatsAppTemplateManager()
+    carts = asyncio.run(manager.get_abandoned_carts())
+
+    woocommerce, cartflows, invalid = carts
+    assert woocommerce["id"] == "wc_session:abc"
+    assert woocommerce["phone_number"] == "+34600111222"
+    assert woocommerce["whatsapp_optin"] is False  # Sin consentimiento en las sesiones
+    assert woocommerce["items"] == [{"name": "Magnetotérmico 2P", "sku": "MT2", "quantity": 2, "total": 20.0}]
+
+    assert cartflows["id"] == "cartflows:cf1"
+    assert cartflows["phone_number"] == "+34611222333"
+    assert cartflows["whatsapp_optin"] is True
+    assert cartflows["items"] == [{"name": "Diferencial", "sku": "", "quantity": 1, "total": 5.5}]
+    assert cartflows["abandoned_at"] == datetime(2026, 1, 2)
+
+    assert invalid["phone_number"] is None
+    assert invalid["whatsapp_optin"] is False
+    assert invalid["items"][0]["name"] == "Producto"
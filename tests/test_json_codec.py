@@ -0,0 +1,71 @@
+"""
+Pruebas unitarias del codec JSON (parámetros y columnas JSON/JSONB de PostgreSQL)
+"""
+
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from services import json_codec
+
+
+def test_encode_db_encodes_strings_as_json_strings():
+    # Los parámetros son objetos Python: una cadena es un valor JSON, no JSON ya serializado
+    assert json_codec.loads(json_codec._encode_db('{"a": 1}')) == '{"a": 1}'
+    assert json_codec.loads(json_codec._encode_db("hola")) == "hola"
+
+
+def test_encode_db_serializes_objects():
+    encoded = json_codec._encode_db({"precio": Decimal("19.90"), "tags": {"led"}, "n": None})
+    assert json_codec.loads(encoded) == {"precio": 19.9, "tags": ["led"], "n": None}
+
+
+def test_encode_db_serializes_datetimes_and_unicode():
+    encoded = json_codec._encode_db({"fecha": datetime(2024, 5, 1, 12, 30), "título": "Iluminación"})
+    decoded = json_codec.loads(encoded)
+    assert decoded["fecha"].startswith("2024-05-01T12:30")
+    assert decoded["título"] == "Iluminación"
+
+
+def test_encode_db_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        json_codec._encode_db({"valor": object()})
+
+
+def test_from_db_decodes_text_and_bytes():
+    assert json_codec.from_db('{"a": [1, 2]}') == {"a": [1, 2]}
+    assert json_codec.from_db(b'[1, "dos"]') == [1, "dos"]
+
+
+def test_from_db_passes_decoded_values_through():
+    value = {"ya": "decodificado"}
+    assert json_codec.from_db(value) is value
+    assert json_codec.from_db([1]) == [1]
+
+
+def test_from_db_defaults():
+    assert json_codec.from_db(None) is None
+    assert json_codec.from_db(None, {}) == {}
+    assert json_codec.from_db("", []) == []
+
+
+def test_round_trip_through_db_codec():
+    value = {"metadata": {"categories": ["Diferenciales"], "price": 12.5}, "ids": [1, 2, 3]}
+    assert json_codec.loads(json_codec._encode_db(value)) == value
+
+
+def test_codecs_round_trip_jsonb_and_jsonb_arrays(postgres):
+    async def main():
+        async with postgres() as pool:
+            return await pool.fetchrow(
+                "SELECT $1::jsonb AS obj, $2::jsonb AS text_value, $3::jsonb[] AS items",
+                {"fecha": datetime(2024, 5, 1), "n": 1}, "hola", [{"id": 1}, {"id": 2}]
+            )
+
+    row = asyncio.run(main())
+
+    assert row["obj"] == {"fecha": "2024-05-01T00:00:00", "n": 1}
+    assert row["text_value"] == "hola"
+    assert row["items"] == [{"id": 1}, {"id": 2}]
@@ -0,0 +1,142 @@
+"""
+Pruebas de la carga incremental de documentos markdown por chunks contra PostgreSQL
+(TEST_DATABASE_URL): solo se embeben los chunks nuevos o modificados
+"""
+
+import asyncio
+
+import pytest
+
+from services.knowledge_base import KnowledgeBaseService
+
+DOCUMENT = """# Preguntas frecuentes
+
+## Envíos
+
+Enviamos a toda la península en 24-48 horas.
+
+## Devoluciones
+
+Tienes 14 días para devolver cualquier producto.
+
+## Pagos
+
+Aceptamos tarjeta, transferencia y Bizum.
+"""
+
+
+class FakeEmbeddings:
+    """Servicio de embeddings que cuenta los textos embebidos"""
+
+    initialized = True
+
+    def __init__(self):
+        self.calls = []
+
+    async def generate_embeddings_batch(self, texts):
+        self.calls.append(list(texts))
+        return [[1.0, float(len(text)), 0.5] for text in texts]
+
+
+@pytest.fixture
+def service():
+    kb = KnowledgeBaseService()
+    kb.embedding_service = FakeEmbeddings()
+    return kb
+
+
+def run(postgres, scenario):
+    async def main():
+        async with postgres() as pool:
+            await pool.execute("""
+                CREATE TABLE knowledge_base (
+                    id SERIAL PRIMARY KEY,
+                    content_type VARCHAR(50),
+                    title TEXT,
+                    content TEXT,
+                    external_id VARCHAR(255),
+                    embedding vector(3),
+                    metadata JSONB,
+                    search_vector tsvector,
+                    is_active BOOLEAN,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            return await scenario(pool)
+    return asyncio.run(main())
+
+
+async def chunks(pool):
+    rows = await pool.fetch("""
+        SELECT id, content, metadata FROM knowledge_base
+        WHERE metadata->>'original_doc_id' = 'faq_faq'
+        ORDER BY (metadata->>'chunk_index')::int
+    """)
+    return [(row["id"], row["content"], row["metadata"]) for row in rows]
+
+
+def test_unchanged_document_is_not_embedded_again(postgres, service, tmp_path):
+    path = tmp_path / "faq.md"
+    path.write_text(DOCUMENT, encoding="utf-8")
+
+    async def scenario(pool):
+        assert await service.load_markdown_file(path, "faq")
+        first = await chunks(pool)
+        assert await service.load_markdown_file(path, "faq")
+        return first, await chunks(pool)
+
+    first, second = run(postgres, scenario)
+
+    assert len(service.embedding_service.calls) == 1  # Una sola llamada por lotes
+    assert len(service.embedding_service.calls[0]) == 3
+    assert [m["total_chunks"] for _, _, m in first] == [3, 3, 3]
+    assert second == first
+
+
+def test_edit_embeds_only_changed_chunk(postgres, service, tmp_path):
+    path = tmp_path / "faq.md"
+    path.write_text(DOCUMENT, encoding="utf-8")
+
+    async def scenario(pool):
+        await service.load_markdown_file(path, "faq")
+        before = await chunks(pool)
+        edited = DOCUMENT.replace("14 días", "30 días")
+        path.write_text(edited, encoding="utf-8")
+        assert await service.load_markdown_file(path, "faq")
+        return before, await chunks(pool)
+
+    before, after = run(postgres, scenario)
+
+    assert len(service.embedding_service.calls) == 2
+    assert len(service.embedding_service.calls[1]) == 1
+    assert "30 días" in service.embedding_service.calls[1][0]
+    # Los chunks sin cambios conservan su fila; el modificado se sustituye
+    assert after[0][0] == before[0][0] and after[2][0] == before[2][0]
+    assert after[1][0] != before[1][0]
+    assert "30 días" in after[1][1]
+    assert len(after) == 3
+
+
+def test_removed_section_reindexes_and_legacy_rows_are_deleted(postgres, service, tmp_path):
+    path = tmp_path / "faq.md"
+    path.write_text(DOCUMENT, encoding="utf-8")
+
+    async def scenario(pool):
+        await service.load_markdown_file(path, "faq")
+        # Fila de una versión anterior del cargador, sin chunk_hash
+        await pool.execute("""
+            INSERT INTO knowledge_base (content_type, title, content, metadata, is_active)
+            VALUES ('faq', 'Preguntas frecuentes', 'antiguo', '{"original_doc_id": "faq_faq"}', true)
+        """)
+        without_returns = DOCUMENT.replace(
+            "## Devoluciones\n\nTienes 14 días para devolver cualquier producto.\n\n", ""
+        )
+        path.write_text(without_returns, encoding="utf-8")
+        assert await service.load_markdown_file(path, "faq")
+        return await chunks(pool)
+
+    after = run(postgres, scenario)
+
+    assert len(service.embedding_service.calls) == 1  # Quitar una sección no embebe nada
+    assert [content for _, content, _ in after][1] == "## Pagos\n\nAceptamos tarjeta, transferencia y Bizum."
+    assert [(m["chunk_index"], m["total_chunks"]) for _, _, m in after] == [(0, 2), (1, 2)]
@@ -0,0 +1,71 @@
+"""
+Pruebas unitarias de php_unserialize (sesiones y carritos de WooCommerce)
+"""
+
+import pytest
+
+from services.wordpress_db_service import php_unserialize
+
+
+def test_scalars():
+    assert php_unserialize('i:42;') == 42
+    assert php_unserialize('i:-7;') == -7
+    assert php_unserialize('d:3.5;') == 3.5
+    assert php_unserialize('b:1;') is True
+    assert php_unserialize('b:0;') is False
+    assert php_unserialize('N;') is None
+    assert php_unserialize('s:4:"hola";') == "hola"
+
+
+def test_string_length_is_in_bytes():
+    # 'Schuko ñ€' ocupa 12 bytes en UTF-8 aunque tenga 8 caracteres
+    value = "Schuko ñ€"
+    serialized = f's:{len(value.encode("utf-8"))}:"{value}";'
+    assert php_unserialize(serialized) == value
+    assert php_unserialize(serialized.encode("utf-8")) == value
+
+
+def test_string_with_delimiters_inside():
+    # Las comillas y los ';' dentro de la cadena no cortan el valor
+    value = 'a";b:{c}'
+    assert php_unserialize(f's:{len(value)}:"{value}";') == value
+
+
+def test_array_becomes_dict():
+    data = 'a:2:{i:0;s:3:"uno";s:3:"dos";i:2;}'
+    assert php_unserialize(data) == {0: "uno", "dos": 2}
+
+
+def test_nested_cart():
+    line = (
+        'a:4:{s:10:"product_id";i:123;s:12:"variation_id";i:0;'
+        's:8:"quantity";i:2;s:10:"line_total";d:19.9;}'
+    )
+    data = f'a:1:{{s:32:"0123456789abcdef0123456789abcdef";{line}}}'
+    cart = php_unserialize(data)
+    assert cart == {
+        "0123456789abcdef0123456789abcdef": {
+            "product_id": 123, "variation_id": 0, "quantity": 2, "line_total": 19.9
+        }
+    }
+
+
+def test_object_ignores_class_name():
+    data = 'O:8:"stdClass":2:{s:4:"name";s:5:"Pérez";s:3:"ids";a:1:{i:0;i:5;}}'
+    data = data.replace('s:5:"Pérez"', f's:{len("Pérez".encode("utf-8"))}:"Pérez"')
+    assert php_unserialize(data) == {"name": "Pérez", "ids": {0: 5}}
+
+
+def test_multibyte_value_followed_by_more_keys():
+    # Si la longitud se contara en caracteres, la clave siguiente quedaría desalineada
+    value = "Iluminación LED"
+    data = (
+        f'a:2:{{s:6:"nombre";s:{len(value.encode("utf-8"))}:"{value}";'
+        's:5:"total";d:12.5;}'
+    )
+    assert php_unserialize(data) == {"nombre": value, "total": 12.5}
+
+
+def test_unsupported_type():
+    with pytest.raises(ValueError):
+        php_unserialize('C:3:"Foo":0:{}')
@@ -0,0 +1,95 @@
+"""
+Pruebas unitarias de ProductAttributesService.extract_facets
+"""
+
+import pytest
+
+from services.product_attributes_service import ProductAttributesService
+
+
+@pytest.fixture
+def service():
+    return ProductAttributesService()
+
+
+def test_breaker_title(service):
+    facets = service.extract_facets("Diferencial ABB 2P 40A 30mA clase AC", {})
+
+    assert facets == {
+        "marca": ["ABB"],
+        "tipo": ["diferencial"],
+        "amperaje": ["40A"],
+        "polos": ["2P"],
+        "sensibilidad": ["30mA"]
+    }
+
+
+def test_ip_code_is_not_an_amperage(service):
+    facets = service.extract_facets("Foco LED IP65 Aluminio 50W", {})
+
+    assert facets["ip"] == ["IP65"]
+    assert "amperaje" not in facets
+
+
+def test_ik_code_and_spaced_ip(service):
+    facets = service.extract_facets("Luminaria estanca IK08 IP 44", {})
+
+    assert facets["ip"] == ["IP44"]
+    assert "amperaje" not in facets
+    assert "polos" not in facets
+
+
+def test_section_with_decimal_comma(service):
+    facets = service.extract_facets("Cable RV-K 3x2,5mm2 negro", {})
+
+    assert facets["seccion"] == ["2.5mm²"]
+
+
+def test_decimal_amperage_and_curve(service):
+    facets = service.extract_facets("Automático Schneider 1P+N 6,5 amperios Curva C", {})
+
+    assert facets["amperaje"] == ["6.5A"]
+    assert facets["polos"] == ["1P"]
+    assert facets["curva"] == ["C"]
+
+
+def test_woocommerce_attributes(service):
+    metadata = {
+        "categories": ["Enchufes"],
+        "attributes": {
+            "Tipo": ["Schuko"],
+            "Grado de protección": ["44"],
+            "Intensidad nominal": ["16 A"],
+            "Número de polos": ["2"]
+        }
+    }
+
+    facets = service.extract_facets("Base Simon blanca", metadata)
+
+    assert facets["amperaje"] == ["16A"]
+    assert facets["polos"] == ["2P"]
+    assert facets["ip"] == ["IP44"]  # 'Tipo' no alimenta la faceta 'ip'
+    assert facets["marca"] == ["Simon"]
+
+
+def test_brand_is_matched_as_whole_word(service):
+    assert service.extract_facets("Interruptor Schneider Electric", {})["marca"] == ["Schneider Electric"]
+
+
+def test_no_facets(service):
+    # 'genérico' contiene 'ge', pero no es la marca GE
+    assert service.extract_facets("Producto genérico", None) == {}
+
+
+@pytest.mark.parametrize("facet, value, expected", [
+    ("amperaje", "40", "40A"),
+    ("amperaje", "6,5 A", "6.5A"),
+    ("polos", "4p+n", "4P+N"),
+    ("polos", "3", "3P"),
+    ("sensibilidad", "30", "30mA"),
+    ("curva", "curva c", "C"),
+    ("ip", "ip65", "IP65"),
+    ("marca", " ABB ", "ABB")
+])
+def test_normalize_facet_value(service, facet, value, expected):
+    assert service.normalize_facet_value(facet, value) == expected
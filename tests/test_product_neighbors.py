@@ -0,0 +1,135 @@
+"""
+Pruebas unitarias del refresco de vecinos de productos con una base de datos falsa:
+el refresco incremental (solo filas cambiadas en memoria, resto en streaming) debe dar
+las mismas listas que un cálculo completo por fuerza bruta
+"""
+
+import asyncio
+import struct
+
+import numpy as np
+import pytest
+
+import services.product_neighbors as product_neighbors
+from services.database import _decode_vectors
+
+TOP_K = 5
+MIN_SIMILARITY = 0.1
+
+
+def vector_send(vector):
+    """Formato binario de pgvector: dimensión, reservado y float32 big-endian"""
+    return struct.pack(">hh", len(vector), 0) + vector.astype(">f4").tobytes()
+
+
+class FakeNeighborsDB:
+    """Catálogo en memoria con la interfaz de HybridDatabaseService que usa el refresco"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.hashes = {external_id: "v0" for external_id in embeddings}
+        self.stored = {}
+        self.loaded_rows = 0
+
+    def update(self, external_id, vector, version):
+        self.embeddings[external_id] = vector
+        self.hashes[external_id] = version
+
+    def remove(self, external_id):
+        del self.embeddings[external_id]
+        del self.hashes[external_id]
+
+    async def count_neighbor_changes(self):
+        return 1, 0
+
+    async def get_neighbor_catalog(self):
+        ids = sorted(self.embeddings)
+        return [(i, self.hashes[i]) for i in ids], {k: dict(v) for k, v in self.stored.items()}
+
+    async def iter_neighbor_embeddings(self, external_ids=None, batch_size=512):
+        ids = sorted(self.embeddings if external_ids is None else set(external_ids) & set(self.embeddings))
+        for start in range(0, len(ids), 37):
+            chunk = ids[start:start + 37]
+            self.loaded_rows += len(chunk)
+            yield chunk, _decode_vectors([vector_send(self.embeddings[i]) for i in chunk])
+
+    async def upsert_product_neighbors(self, rows, remove_ids):
+        for external_id in remove_ids:
+            self.stored.pop(external_id, None)
+        for external_id, source_hash, neighbor_ids, scores in rows:
+            self.stored[external_id] = {
+                "source_hash": source_hash, "neighbor_ids": neighbor_ids, "scores": scores
+            }
+
+
+def brute_force(embeddings):
+    ids = sorted(embeddings)
+    matrix = np.stack([embeddings[i] for i in ids])
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    sims = matrix @ matrix.T
+    np.fill_diagonal(sims, -np.inf)
+    return {
+        external_id: [ids[j] for j in np.argsort(-sims[row])[:TOP_K] if sims[row, j] >= MIN_SIMILARITY]
+        for row, external_id in enumerate(ids)
+    }
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(7)
+
+
+@pytest.fixture
+def db(rng, monkeypatch):
+    fake = FakeNeighborsDB({f"product_{i:03d}": rng.normal(size=16).astype(np.float32) for i in range(200)})
+    monkeypatch.setattr(product_neighbors, "db_service", fake)
+    return fake
+
+
+@pytest.fixture
+def service():
+    return product_neighbors.ProductNeighborsService({
+        "top_k": TOP_K, "min_similarity": MIN_SIMILARITY, "batch_size": 50, "refresh_interval": 60
+    })
+
+
+def neighbor_lists(db):
+    return {external_id: entry["neighbor_ids"] for external_id, entry in db.stored.items()}
+
+
+def test_full_refresh_matches_brute_force(db, service):
+    result = asyncio.run(service._refresh_locked(True))
+
+    assert result == {"products": 200, "recomputed": 200, "removed": 0}
+    assert neighbor_lists(db) == brute_force(db.embeddings)
+
+
+def test_incremental_refresh_matches_brute_force(db, service, rng):
+    asyncio.run(service._refresh_locked(True))
+
+    for round_number in range(1, 6):
+        for i in rng.choice(200, size=3, replace=False):
+            external_id = f"product_{i:03d}"
+            if external_id in db.embeddings:
+                db.update(external_id, rng.normal(size=16).astype(np.float32), f"v{round_number}")
+        db.remove(sorted(db.embeddings)[round_number * 7])
+        db.update(f"product_new_{round_number}", rng.normal(size=16).astype(np.float32), "v0")
+
+        db.loaded_rows = 0
+        result = asyncio.run(service._refresh_locked(False))
+
+        assert result["removed"] == 1
+        assert neighbor_lists(db) == brute_force(db.embeddings)
+        # Dos pasadas en streaming más las filas cambiadas y recalculadas, nunca un refresco completo
+        assert result["recomputed"] < len(db.embeddings) // 2
+        assert db.loaded_rows <= 2 * len(db.embeddings) + 4 + result["recomputed"]
+
+
+def test_incremental_refresh_without_changes_loads_nothing(db, service):
+    asyncio.run(service._refresh_locked(True))
+    db.loaded_rows = 0
+
+    result = asyncio.run(service._refresh_locked(False))
+
+    assert result["recomputed"] == 0
+    assert db.loaded_rows == 0
@@ -0,0 +1,125 @@
+"""
+Pruebas unitarias de las métricas de runtime: LatencyHistogram y la exposición Prometheus
+"""
+
+import os
+import time
+
+import pytest
+
+from services.runtime_metrics import LatencyHistogram, RuntimeMetrics
+
+
+def test_histogram_buckets_count_and_sum():
+    histogram = LatencyHistogram(buckets=(0.1, 1.0), window_seconds=60)
+
+    for seconds in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(seconds)
+    histogram.observe(0.2, error=True)
+
+    # Un valor igual al límite cuenta en ese bucket (le = "menor o igual")
+    assert histogram.bucket_counts == [2, 2]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(2.85)
+    assert histogram.errors == 1
+
+
+def test_histogram_quantiles_use_recent_window():
+    histogram = LatencyHistogram(buckets=(1.0,), window_seconds=60)
+    assert histogram.quantile(0.5) is None
+
+    for seconds in (0.4, 0.1, 0.3, 0.2, 0.5):
+        histogram.observe(seconds)
+
+    assert histogram.quantile(0.0) == 0.1
+    assert histogram.quantile(0.5) == 0.3
+    assert histogram.quantile(1.0) == 0.5
+
+
+def test_histogram_window_expires_old_observations(monkeypatch):
+    histogram = LatencyHistogram(buckets=(1.0,), window_seconds=60)
+    histogram.observe(0.3)
+    assert histogram.recent() == [0.3]
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 120)
+
+    assert histogram.recent() == []
+    assert histogram.quantile(0.5) is None
+    assert histogram.count == 1  # El acumulado de Prometheus no caduca
+
+
+@pytest.fixture
+def metrics():
+    runtime = RuntimeMetrics()
+    runtime.worker = "101"
+    return runtime
+
+
+def test_render_prometheus_histogram_series(metrics):
+    metrics.observe("eva_search_latency_seconds", 0.02, mode="vector")
+    metrics.observe("eva_search_latency_seconds", 3.0, error=True, mode="vector")
+
+    lines = metrics.render_prometheus().splitlines()
+
+    assert "# TYPE eva_search_latency_seconds histogram" in lines
+    assert 'eva_search_latency_seconds_bucket{worker="101",mode="vector",le="0.025"} 1' in lines
+    assert 'eva_search_latency_seconds_bucket{worker="101",mode="vector",le="5"} 2' in lines
+    assert 'eva_search_latency_seconds_bucket{worker="101",mode="vector",le="+Inf"} 2' in lines
+    assert 'eva_search_latency_seconds_sum{worker="101",mode="vector"} 3.020000' in lines
+    assert 'eva_search_latency_seconds_count{worker="101",mode="vector"} 2' in lines
+    assert "# TYPE eva_search_errors_total counter" in lines
+    assert 'eva_search_errors_total{worker="101",mode="vector"} 1' in lines
+
+
+def test_render_prometheus_buckets_are_cumulative(metrics):
+    for seconds in (0.001, 0.02, 0.3, 100.0):
+        metrics.observe("eva_agent_turn_latency_seconds", seconds)
+
+    values = [
+        int(line.rsplit(" ", 1)[1])
+        for line in metrics.render_prometheus().splitlines()
+        if line.startswith("eva_agent_turn_latency_seconds_bucket")
+    ]
+
+    assert values == sorted(values)
+    assert values[-1] == 4  # +Inf incluye el valor fuera de todos los buckets
+    assert values[-2] == 3
+
+
+def test_render_prometheus_escapes_label_values(metrics):
+    metrics.observe("eva_upstream_latency_seconds", 0.1, upstream="openai", operation='llm."chat"\\x')
+
+    output = metrics.render_prometheus()
+
+    assert 'operation="llm.\\"chat\\"\\\\x"' in output
+
+
+def test_render_prometheus_gauges_in_flight_and_queues(metrics):
+    metrics.register_gauge("eva_whatsapp_sessions", "Sesiones activas", lambda: 3)
+    metrics.register_gauge("eva_broken", "Falla al leerse", lambda: 1 / 0)
+    metrics._queue_depth["webhooks"] = 7
+
+    with metrics.in_flight("agent_turns"):
+        output = metrics.render_prometheus()
+
+    lines = output.splitlines()
+    assert output.endswith("\n")
+    assert 'eva_whatsapp_sessions{worker="101"} 3' in lines
+    assert not any(line.startswith("eva_broken") for line in lines)
+    assert 'eva_in_flight{worker="101",operation="agent_turns"} 1' in lines
+    assert 'eva_queue_depth{worker="101",queue="webhooks"} 7' in lines
+
+
+def test_render_prometheus_labels_every_series_with_worker(metrics):
+    metrics.observe("eva_search_latency_seconds", 0.02, mode="text")
+    metrics.register_gauge("eva_whatsapp_sessions", "Sesiones activas", lambda: 1)
+
+    series = [line for line in metrics.render_prometheus().splitlines() if not line.startswith("#")]
+
+    assert series
+    assert all('{worker="101"' in line for line in series)
+
+
+def test_worker_defaults_to_process_id():
+    assert RuntimeMetrics().worker == str(os.getpid())
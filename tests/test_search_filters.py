@@ -0,0 +1,80 @@
+"""
+Pruebas unitarias de ProductSearchFilters (extracción de la consulta y compilación a SQL)
+"""
+
+from services.search_filters import ProductSearchFilters
+
+
+def test_from_query_extracts_facets_brand_price_and_stock():
+    filters, cleaned = ProductSearchFilters.from_query(
+        "diferencial ABB 40A 2 polos 30mA por menos de 50 euros en stock"
+    )
+
+    assert filters.brands == ["ABB"]
+    assert filters.amperaje == ["40A"]
+    assert filters.polos == ["2P"]
+    assert filters.sensibilidad == ["30mA"]
+    assert filters.max_price == 50.0
+    assert filters.min_price is None
+    assert filters.in_stock is True
+    # Precio y stock salen del texto; las especificaciones se quedan para el ranking
+    assert cleaned == "diferencial ABB 40A 2 polos 30mA"
+
+
+def test_from_query_price_range_and_decimal_comma():
+    filters, cleaned = ProductSearchFilters.from_query("cable 2,5mm2 entre 30 y 10,5 euros")
+
+    assert filters.seccion == ["2.5mm²"]
+    assert (filters.min_price, filters.max_price) == (10.5, 30.0)
+    assert cleaned == "cable 2,5mm2"
+
+
+def test_from_query_poles_with_neutral_accepts_both():
+    filters, _ = ProductSearchFilters.from_query("automático 4P+N curva C IP65")
+
+    assert filters.polos == ["4P+N", "4P"]
+    assert filters.curva == ["C"]
+    assert filters.ip == ["IP65"]
+
+
+def test_from_query_without_filters():
+    filters, cleaned = ProductSearchFilters.from_query("  lámpara para el jardín ")
+
+    assert filters.is_empty()
+    assert filters.cache_key() == ""
+    assert cleaned == "lámpara para el jardín"
+
+
+def test_cache_key_is_stable():
+    a = ProductSearchFilters(brands=["Hager", "ABB"], amperaje=["40A"], in_stock=True)
+    b = ProductSearchFilters(brands=["ABB", "Hager"], amperaje=["40A"], in_stock=True)
+    assert a.cache_key() == b.cache_key() == "brands=abb,hager|amperaje=40a|in_stock=True"
+
+
+def test_to_sql_empty():
+    params = ["embedding"]
+    assert ProductSearchFilters().to_sql(params) == ""
+    assert params == ["embedding"]
+
+
+def test_to_sql_numbers_parameters_after_existing_ones():
+    filters = ProductSearchFilters(brands=["Schneider"], amperaje=["40"], max_price=100, in_stock=True)
+    params = ["embedding", 10]
+
+    sql = filters.to_sql(params, id_column="kb.external_id")
+
+    assert params == ["embedding", 10, "marca", ["Schneider%"], "amperaje", ["40A"], 100.0]
+    assert "kb.external_id IN (SELECT f.external_id FROM product_facets f WHERE f.facet = $3 AND f.value ILIKE ANY($4))" in sql
+    assert "WHERE f.facet = $5 AND f.value = ANY($6))" in sql
+    assert "ls.price <= $7 AND ls.stock_status = 'instock'" in sql
+    assert sql.count("AND kb.external_id IN") == 3
+
+
+def test_to_sql_product_type_constraint():
+    filters = ProductSearchFilters(product_type="diferencial")
+    params = []
+
+    sql = filters.to_sql(params)
+
+    assert params == ["tipo", ["diferencial"]]
+    assert sql.startswith("AND external_id IN (SELECT f.external_id FROM product_facets f")
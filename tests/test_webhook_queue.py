@@ -0,0 +1,157 @@
+"""
+Pruebas de la cola de webhooks de WooCommerce contra PostgreSQL (TEST_DATABASE_URL):
+reclamo por producto con debounce, un solo lote en proceso por producto y coalescencia
+"""
+
+import asyncio
+
+import pytest
+
+from services.webhook_queue import WebhookQueueService
+
+
+def product(product_id, name):
+    return {"id": product_id, "name": name, "status": "publish", "price": "10", "date_modified": "2024-05-01"}
+
+
+@pytest.fixture
+def queue():
+    service = WebhookQueueService()
+    service.debounce_seconds = 0
+    service.max_wait_seconds = 3600
+    service.batch_size = 50
+    return service
+
+
+def run(postgres, queue, scenario):
+    async def main():
+        async with postgres() as pool:
+            await queue.initialize()
+            assert queue.initialized
+            return await scenario(pool)
+    return asyncio.run(main())
+
+
+def claimed_products(events):
+    return sorted({event["resource_id"] for event in events})
+
+
+def test_coalesces_events_to_latest_per_product(postgres, queue, monkeypatch):
+    applied = {}
+
+    async def apply(latest):
+        applied.update(latest)
+        return {}
+
+    monkeypatch.setattr(queue, "_apply_product_events", apply)
+
+    async def scenario(pool):
+        await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        await queue.enqueue("product.updated", product(1, "v2"), "d2", verified=True)
+        await queue.enqueue("product.updated", product(1, "v3"), "d3", verified=True)
+        await queue.enqueue("product.updated", product(2, "otro"), "d4", verified=True)
+
+        processed = await queue.process_due_events()
+        statuses = await pool.fetch("SELECT status, COUNT(*) AS n FROM webhook_events GROUP BY status")
+        return processed, {row["status"]: row["n"] for row in statuses}
+
+    processed, statuses = run(postgres, queue, scenario)
+
+    assert processed == 4
+    assert statuses == {"done": 4}
+    assert applied[1]["payload"]["name"] == "v3"
+    assert applied[2]["payload"]["name"] == "otro"
+    assert queue._stats["events_coalesced"] == 2
+
+
+def test_duplicate_delivery_is_ignored(postgres, queue):
+    async def scenario(pool):
+        first = await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        again = await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        return first, again
+
+    first, again = run(postgres, queue, scenario)
+
+    assert first is not None
+    assert again is None
+    assert queue._stats["duplicates_ignored"] == 1
+
+
+def test_debounce_window_delays_claim(postgres, queue):
+    queue.debounce_seconds = 60
+
+    async def scenario(pool):
+        await queue.enqueue("product.updated", product(1, "v1"), "d1")
+        waiting = await queue._claim_product_events()
+
+        # Pasada la espera máxima desde el primer evento se reclama aunque sigan llegando
+        await pool.execute("UPDATE webhook_events SET received_at = NOW() - INTERVAL '2 hours'")
+        await queue.enqueue("product.updated", product(1, "v2"), "d2")
+        due = await queue._claim_product_events()
+        return waiting, due
+
+    waiting, due = run(postgres, queue, scenario)
+
+    assert waiting == []
+    assert [event["payload"]["name"] for event in sorted(due, key=lambda e: e["id"])] == ["v1", "v2"]
+
+
+def test_product_with_batch_in_progress_is_not_claimed(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        first = await queue._claim_product_events()
+
+        # Otro worker tiene el lote de v1 en proceso: v2 espera, el producto 2 no
+        await queue.enqueue("product.updated", product(1, "v2"), "d2", verified=True)
+        await queue.enqueue("product.updated", product(2, "otro"), "d3", verified=True)
+        second = await queue._claim_product_events()
+
+        await queue._mark_done([event["id"] for event in first])
+        third = await queue._claim_product_events()
+        return first, second, third
+
+    first, second, third = run(postgres, queue, scenario)
+
+    assert claimed_products(first) == [1]
+    assert claimed_products(second) == [2]
+    assert [event["payload"]["name"] for event in third] == ["v2"]
+
+
+def test_failed_product_is_retried_with_backoff(postgres, queue, monkeypatch):
+    async def apply(latest):
+        return {1: "WooCommerce no responde"}
+
+    monkeypatch.setattr(queue, "_apply_product_events", apply)
+
+    async def scenario(pool):
+        await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        await queue.enqueue("product.updated", product(2, "otro"), "d2", verified=True)
+        await queue.process_due_events()
+        return await pool.fetch("""
+            SELECT resource_id, status, attempts, last_error, available_at > NOW() AS delayed
+            FROM webhook_events ORDER BY resource_id
+        """)
+
+    rows = [dict(row) for row in run(postgres, queue, scenario)]
+
+    assert rows[0] == {
+        "resource_id": 1, "status": "pending", "attempts": 1,
+        "last_error": "WooCommerce no responde", "delayed": True
+    }
+    assert rows[1]["status"] == "done"
+
+
+def test_stale_processing_events_are_recovered(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue("product.updated", product(1, "v1"), "d1", verified=True)
+        await queue._claim_product_events()
+        fresh = await queue.recover_stale_events()
+
+        await pool.execute("UPDATE webhook_events SET locked_at = NOW() - INTERVAL '1 hour'")
+        stale = await queue.recover_stale_events()
+        return fresh, stale, await queue._claim_product_events()
+
+    fresh, stale, claimed = run(postgres, queue, scenario)
+
+    assert (fresh, stale) == (0, 1)
+    assert claimed_products(claimed) == [1]
@@ -0,0 +1,173 @@
+"""
+Pruebas de la cola de mensajes entrantes de WhatsApp contra PostgreSQL (TEST_DATABASE_URL):
+un mensaje a la vez por número, en orden, con reintentos que bloquean a los siguientes
+"""
+
+import asyncio
+
+import pytest
+
+from services.whatsapp_inbound_queue import WhatsAppInboundQueue
+from services.whatsapp_session_resolver import whatsapp_session_resolver
+
+
+def webhook(*messages):
+    """Webhook de 360Dialog con mensajes (id, número)"""
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "123"},
+        "messages": [
+            {"id": message_id, "from": phone, "type": "text", "text": {"body": message_id}}
+            for message_id, phone in messages
+        ]
+    }}]}]}
+
+
+@pytest.fixture
+def queue():
+    return WhatsAppInboundQueue()
+
+
+def run(postgres, queue, scenario):
+    async def main():
+        async with postgres() as pool:
+            await queue.initialize()
+            assert queue.initialized
+            return await scenario(pool)
+    return asyncio.run(main())
+
+
+def message_ids(rows):
+    return sorted(row["message_id"] for row in rows)
+
+
+def test_redelivered_messages_are_ignored(postgres, queue):
+    async def scenario(pool):
+        first = await queue.enqueue_webhook(webhook(("m1", "34600"), ("m2", "34600")))
+        again = await queue.enqueue_webhook(webhook(("m2", "34600"), ("m3", "34611")))
+        stored = await pool.fetch("SELECT message, value FROM whatsapp_inbound_messages ORDER BY id")
+        return first, again, stored
+
+    first, again, stored = run(postgres, queue, scenario)
+
+    assert (first, again) == (2, 1)
+    assert queue._stats["duplicates_ignored"] == 1
+    assert stored[0]["message"]["text"] == {"body": "m1"}
+    assert stored[0]["value"] == {"metadata": {"phone_number_id": "123"}}
+
+
+def test_claims_one_message_per_phone_in_order(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue_webhook(webhook(("a1", "34600"), ("a2", "34600"), ("b1", "34611")))
+        first = await queue._claim_messages(10)
+        blocked = await queue._claim_messages(10)
+
+        await queue._mark_done(next(row["id"] for row in first if row["message_id"] == "a1"))
+        after_done = await queue._claim_messages(10)
+        return first, blocked, after_done
+
+    first, blocked, after_done = run(postgres, queue, scenario)
+
+    assert message_ids(first) == ["a1", "b1"]
+    assert first[0]["message"]["type"] == "text"
+    assert blocked == []
+    assert message_ids(after_done) == ["a2"]
+
+
+def test_limit_and_in_flight_phones(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue_webhook(webhook(("a1", "34600"), ("b1", "34611"), ("c1", "34622")))
+        queue._in_flight["34611"] = None  # Número con un mensaje en curso en este proceso
+        limited = await queue._claim_messages(1)
+        rest = await queue._claim_messages(10)
+        return limited, rest
+
+    limited, rest = run(postgres, queue, scenario)
+
+    assert message_ids(limited) == ["a1"]
+    assert message_ids(rest) == ["c1"]
+
+
+def test_retry_wait_blocks_later_messages_of_the_phone(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue_webhook(webhook(("a1", "34600"), ("a2", "34600"), ("b1", "34611")))
+        claimed = await queue._claim_messages(10)
+        failed = next(row for row in claimed if row["message_id"] == "a1")
+        await queue._mark_failed(failed, "Agente no disponible")
+        await queue._mark_done(next(row["id"] for row in claimed if row["message_id"] == "b1"))
+
+        waiting = await queue._claim_messages(10)
+
+        await pool.execute("UPDATE whatsapp_inbound_messages SET available_at = NOW() WHERE message_id = 'a1'")
+        retried = await queue._claim_messages(10)
+        return waiting, retried
+
+    waiting, retried = run(postgres, queue, scenario)
+
+    assert waiting == []  # a2 no adelanta a a1
+    assert message_ids(retried) == ["a1"]
+    assert retried[0]["attempts"] == 2
+
+
+def test_interrupted_message_is_released_without_counting_attempt(postgres, queue):
+    started = asyncio.Event()
+
+    async def handler(message, value):
+        started.set()
+        await asyncio.sleep(60)
+
+    queue.set_handler(handler)
+
+    async def scenario(pool):
+        await queue.enqueue_webhook(webhook(("a1", "34600")))
+        row = (await queue._claim_messages(1))[0]
+        task = asyncio.create_task(queue._run_message(row))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await pool.fetchrow("SELECT status, attempts FROM whatsapp_inbound_messages")
+
+    assert dict(run(postgres, queue, scenario)) == {"status": "pending", "attempts": 0}
+
+
+def test_stale_and_expired_messages(postgres, queue):
+    async def scenario(pool):
+        await queue.enqueue_webhook(webhook(("a1", "34600"), ("b1", "34611")))
+        await queue._claim_messages(10)
+        await pool.execute("""
+            UPDATE whatsapp_inbound_messages SET locked_at = NOW() - INTERVAL '1 hour'
+            WHERE message_id = 'a1'
+        """)
+        recovered = await queue.recover_stale_messages()
+
+        await pool.execute("""
+            UPDATE whatsapp_inbound_messages SET received_at = NOW() - INTERVAL '1 day'
+            WHERE message_id = 'a1'
+        """)
+        claimed = await queue._claim_messages(10)
+        return recovered, claimed
+
+    recovered, claimed = run(postgres, queue, scenario)
+
+    assert recovered == 1
+    assert claimed == []  # a1 caducó; b1 sigue en proceso
+    assert queue._stats["expired"] == 1
+
+
+def test_phone_owned_by_another_live_worker_is_skipped(postgres, queue, monkeypatch):
+    monkeypatch.setattr(whatsapp_session_resolver, "initialized", False)
+
+    async def scenario(pool):
+        await whatsapp_session_resolver.initialize()
+        await pool.execute("""
+            INSERT INTO whatsapp_sessions (phone, session_id, owner, heartbeat_at)
+            VALUES ('34600', 'wa_34600', 'otro-host:1:abcd', NOW()),
+                   ('34611', 'wa_34611', 'caido:2:ef01', NOW() - INTERVAL '1 hour')
+        """)
+        await queue.enqueue_webhook(webhook(("a1", "34600"), ("b1", "34611"), ("c1", "34622")))
+        return await queue._claim_messages(10)
+
+    claimed = run(postgres, queue, scenario)
+
+    # 34600 es de un worker vivo; el dueño de 34611 dejó de latir
+    assert message_ids(claimed) == ["b1", "c1"]
@@ -0,0 +1,48 @@
+"""
+Pruebas unitarias del cubo de tokens que limita el ritmo de envíos salientes de WhatsApp
+"""
+
+import asyncio
+
+from services.whatsapp_outbound_dispatcher import TokenBucket
+
+
+def test_bucket_burst_is_immediate():
+    bucket = TokenBucket(rate=10, capacity=3)
+
+    async def run():
+        return [await bucket.acquire() for _ in range(3)]
+
+    waits = asyncio.run(run())
+
+    assert all(wait < 0.02 for wait in waits)
+
+
+def test_bucket_waits_for_next_token():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def run():
+        await bucket.acquire()
+        return await bucket.acquire()
+
+    waited = asyncio.run(run())
+
+    assert waited >= 0.04  # 1/20 s
+    assert bucket.throttled_seconds >= waited
+
+
+def test_bucket_pause_blocks_and_empties():
+    bucket = TokenBucket(rate=100, capacity=5)
+
+    async def run():
+        bucket.pause(0.1)
+        return await bucket.acquire()
+
+    waited = asyncio.run(run())
+
+    assert waited >= 0.09
+    assert bucket._tokens < 1
+
+
+def test_bucket_capacity_is_at_least_one():
+    assert TokenBucket(rate=1, capacity=0).capacity == 1
@@ -0,0 +1,131 @@
+"""
+Pruebas del resolvedor de sesiones de WhatsApp compartido entre workers, contra
+PostgreSQL (TEST_DATABASE_URL): dos instancias hacen de dos procesos de uvicorn
+"""
+
+import asyncio
+
+import pytest
+
+from services.whatsapp_session_resolver import WhatsAppSessionResolver
+
+
+class Recorder:
+    """Listener que guarda los session_id recibidos"""
+
+    def __init__(self):
+        self.session_ids = []
+
+    def __call__(self, session):
+        self.session_ids.append(session["session_id"])
+
+
+@pytest.fixture
+def workers():
+    resolvers = []
+    for _ in range(2):
+        resolver = WhatsAppSessionResolver(timeout_minutes=30)
+        resolver.expired, resolver.released = Recorder(), Recorder()
+        resolver.add_expiry_listener(resolver.expired)
+        resolver.add_release_listener(resolver.released)
+        resolvers.append(resolver)
+    return resolvers
+
+
+def run(postgres, workers, scenario):
+    async def main():
+        async with postgres() as pool:
+            for resolver in workers:
+                await resolver.initialize()
+                assert resolver.initialized
+            return await scenario(pool)
+    return asyncio.run(main())
+
+
+def test_session_is_shared_and_context_kept(postgres, workers):
+    first, second = workers
+
+    async def scenario(pool):
+        session = await first.resolve("34600")
+        session["context"]["step"] = 1
+        again = await first.resolve("34600")
+        other = await second.resolve("34600")
+        return session, again, other
+
+    session, again, other = run(postgres, workers, scenario)
+
+    assert again["session_id"] == other["session_id"] == session["session_id"]
+    assert again["context"] == {"step": 1}
+    assert other["context"] == {}  # El contexto en memoria no viaja entre procesos
+
+
+def test_takeover_releases_state_in_previous_owner(postgres, workers):
+    first, second = workers
+
+    async def scenario(pool):
+        session = await first.resolve("34600")
+        await second.resolve("34600")
+        released = await first.heartbeat()
+        kept = await second.heartbeat()
+        return session, released, kept
+
+    session, released, kept = run(postgres, workers, scenario)
+
+    assert (released, kept) == (1, 0)
+    assert first.released.session_ids == [session["session_id"]]
+    assert "34600" not in first.sessions and "34600" in second.sessions
+    assert first.expired.session_ids == second.expired.session_ids == []
+
+
+def test_expired_takeover_ends_once_and_releases_previous_owner(postgres, workers):
+    first, second = workers
+
+    async def scenario(pool):
+        old = await first.resolve("34600")
+        await first.set_conversation(old, "conv-1")
+        await pool.execute("UPDATE whatsapp_sessions SET last_activity = NOW() - INTERVAL '2 hours'")
+
+        new = await second.resolve("34600")
+        await first.heartbeat()
+        removed = await first.cleanup_expired() + await second.cleanup_expired()
+        return old, new, removed
+
+    old, new, removed = run(postgres, workers, scenario)
+
+    assert new["conversation_id"] is None  # Sesión nueva, sin la conversación de métricas anterior
+    assert second.expired.session_ids == [old["session_id"]]
+    assert first.expired.session_ids == []
+    assert first.released.session_ids == [old["session_id"]]
+    assert removed == 0
+
+
+def test_cleanup_expires_own_and_dead_owner_sessions(postgres, workers):
+    first, second = workers
+
+    async def scenario(pool):
+        await first.resolve("34600")
+        await second.resolve("34611")
+        await pool.execute("UPDATE whatsapp_sessions SET last_activity = NOW() - INTERVAL '2 hours'")
+
+        # 34611 pertenece a un worker vivo: first no la toca
+        removed_by_first = await first.cleanup_expired()
+        await pool.execute("UPDATE whatsapp_sessions SET heartbeat_at = NOW() - INTERVAL '1 hour'")
+        removed_dead = await first.cleanup_expired()
+        return removed_by_first, removed_dead
+
+    removed_by_first, removed_dead = run(postgres, workers, scenario)
+
+    assert (removed_by_first, removed_dead) == (1, 1)
+    assert len(first.expired.session_ids) == 2
+    assert "34600" not in first.sessions
+
+
+def test_release_ownership_on_shutdown(postgres, workers):
+    first, _ = workers
+
+    async def scenario(pool):
+        await first.resolve("34600")
+        await first.release_ownership()
+        return await pool.fetchrow("SELECT owner, heartbeat_at FROM whatsapp_sessions")
+
+    assert dict(run(postgres, workers, scenario)) == {"owner": None, "heartbeat_at": None}
@@ -0,0 +1,86 @@
+"""
+Pruebas unitarias del limitador de ritmo adaptativo de la paginación de WooCommerce
+"""
+
+import asyncio
+import time
+
+from services.woocommerce_paginator import AdaptiveRateLimiter
+
+CONFIG = {
+    "initial_rate": 4.0,
+    "min_rate": 0.5,
+    "max_rate": 6.0,
+    "burst": 3,
+    "rate_increase": 1.0,
+    "backoff_factor": 0.5,
+    "target_latency": 2.0
+}
+
+
+def test_limiter_additive_increase_until_max():
+    limiter = AdaptiveRateLimiter(CONFIG)
+
+    limiter.record_success(0.1)
+    assert limiter.rate == 5.0
+    for _ in range(5):
+        limiter.record_success(0.1)
+    assert limiter.rate == CONFIG["max_rate"]
+
+
+def test_limiter_slow_response_reduces_rate():
+    limiter = AdaptiveRateLimiter(CONFIG)
+
+    limiter.record_success(5.0)
+
+    assert limiter.rate == 4.0 * 0.8
+    assert limiter.get_stats()["slow"] == 1
+
+
+def test_limiter_throttle_backs_off_and_empties_bucket():
+    limiter = AdaptiveRateLimiter(CONFIG)
+
+    for _ in range(10):
+        limiter.record_throttle()
+
+    assert limiter.rate == CONFIG["min_rate"]
+    assert limiter.tokens == 0.0
+    assert limiter.get_stats()["throttled"] == 10
+
+
+def test_limiter_respects_retry_after():
+    limiter = AdaptiveRateLimiter(CONFIG)
+    before = time.monotonic()
+
+    limiter.record_throttle(retry_after=30)
+
+    assert limiter.blocked_until >= before + 30
+
+
+def test_limiter_refill_is_capped_at_burst():
+    limiter = AdaptiveRateLimiter(CONFIG)
+    limiter.tokens = 0.0
+
+    limiter._refill(limiter.updated_at + 0.5)
+    assert limiter.tokens == 2.0  # 0,5 s a 4 peticiones/s
+
+    limiter._refill(limiter.updated_at + 100)
+    assert limiter.tokens == float(CONFIG["burst"])
+
+
+def test_limiter_acquire_uses_burst_then_waits():
+    limiter = AdaptiveRateLimiter({**CONFIG, "initial_rate": 20.0})
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(CONFIG["burst"]):
+            await limiter.acquire()
+        burst_elapsed = time.monotonic() - started
+        await limiter.acquire()  # Sin tokens: espera ~1/20 s
+        return burst_elapsed, time.monotonic() - started
+
+    burst_elapsed, total_elapsed = asyncio.run(run())
+
+    assert burst_elapsed < 0.04
+    assert total_elapsed >= 0.04
+    assert limiter.get_stats()["requests"] == CONFIG["burst"] + 1
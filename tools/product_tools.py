@@ -3,9 +3,12 @@ Herramientas MCP para gestión de productos de WooCommerce
 Integra búsqueda híbrida (semántica + texto) con base de conocimiento
 """
 
+import asyncio
 from typing import List, Dict, Any
 from services.woocommerce import WooCommerceService
 from services.database import HybridDatabaseService
+from services.search_filters import ProductSearchFilters
+from services.product_neighbors import product_neighbors_service
 from services.embedding_service import EmbeddingService
 
 # NO usar instancias globales - crear nuevas instancias en cada llamada
@@ -178,7 +181,31 @@ def register_product_tools(mcp):
     @mcp.tool()
     async def get_products_by_category(category_name: str, limit: int = 10) -> str:
         """Obtener productos de una categoría específica"""
+        db_service = None
         try:
+            # Primero la pertenencia materializada en la sincronización (sin llamadas a la API)
+            db_service = await _open_db_service()
+            if db_service:
+                category = await db_service.find_category(category_name)
+                if category and category.get('category_id'):
+                    products = await db_service.get_category_products(category['category_id'], limit=limit)
+                    if products:
+                        category_title = category['title'].replace('Categoría: ', '', 1)
+                        response = f"🏷️ **Productos en '{category_title}'** ({category.get('product_count', len(products))} en total)\n\n"
+                        for i, product in enumerate(products, 1):
+                            metadata = product.get('metadata', {})
+                            price = metadata.get('price', 0)
+                            stock_icon = "✅" if metadata.get('stock_status') == 'instock' else "❌"
+                            response += f"{i}. {stock_icon} **{product.get('title', 'Producto')}**\n"
+                            if price:
+                                response += f"   💰 Precio: {price}€\n"
+                            if metadata.get('permalink'):
+                                response += f"   🔗 {metadata['permalink']}\n"
+                            response += "\n"
+                        return response
+                    return f"❌ No hay productos en la categoría: '{category_name}'"
+            
+            # Sin base de datos o categoría aún no sincronizada: consultar WooCommerce
             wc_service = WooCommerceService()
             
             # Buscar la categoría primero
@@ -197,6 +224,8 @@ def register_product_tools(mcp):
             
         except Exception as e:
             return f"❌ Error al obtener productos por categoría: {str(e)}"
+        finally:
+            await _close_db_service(db_service)
     
     @mcp.tool()
     async def get_featured_products(limit: int = 10) -> str:
@@ -276,9 +305,11 @@ def register_product_tools(mcp):
     
     @mcp.tool()
     async def find_similar_products(product_id: int, limit: int = 5) -> str:
-        """Encontrar productos similares usando búsqueda vectorial"""
+        """Encontrar productos similares (listas de vecinos precalculadas)"""
+        db_service = None
         try:
-            if not db_service.initialized:
+            db_service = await _open_db_service()
+            if not db_service:
                 return "❌ Base de conocimiento no disponible"
             
             # Obtener el producto base
@@ -288,21 +319,8 @@ def register_product_tools(mcp):
             if not base_product:
                 return f"❌ Producto {product_id} no encontrado en base de conocimiento"
             
-            # Usar el embedding del producto base para buscar similares
-            base_embedding = eval(base_product.get('embedding', '[]'))
-            
-            if not base_embedding:
-                return f"❌ No hay embedding disponible para el producto {product_id}"
-            
-            # Búsqueda vectorial de productos similares
-            similar_results = await db_service.vector_search(
-                query_embedding=base_embedding,
-                content_types=["product"],
-                limit=limit + 1  # +1 porque incluirá el producto base
-            )
-            
-            # Filtrar el producto base de los resultados
-            similar_products = [r for r in similar_results if r.get('external_id') != external_id][:limit]
+            # Lectura por clave de los vecinos precalculados (búsqueda en vivo si aún no existen)
+            similar_products = await product_neighbors_service.get_similar_products(external_id, limit, db=db_service)
             
             if not similar_products:
                 return f"❌ No se encontraron productos similares a {base_product.get('title', 'este producto')}"
@@ -327,8 +345,36 @@ def register_product_tools(mcp):
             
         except Exception as e:
             return f"❌ Error buscando productos similares: {str(e)}"
+        finally:
+            await _close_db_service(db_service)
 
 # Funciones auxiliares
+async def _open_db_service() -> HybridDatabaseService:
+    """
+    Servicio de base de datos propio de la llamada (el proceso MCP no inicializa el global)
+    Returns: servicio inicializado, o None si la base de datos no está disponible
+    """
+    db_service = HybridDatabaseService()
+    try:
+        await asyncio.wait_for(db_service.initialize(), timeout=5.0)
+    except Exception as e:
+        print(f"   ⚠️ Base de datos no disponible: {e}")
+        await _close_db_service(db_service)
+        return None
+    
+    if not db_service.initialized:
+        await _close_db_service(db_service)
+        return None
+    return db_service
+
+async def _close_db_service(db_service: HybridDatabaseService):
+    """Cerrar el pool de un servicio creado con _open_db_service"""
+    try:
+        if db_service and db_service.pool:
+            await db_service.close()
+    except Exception as e:
+        print(f"   ⚠️ Error cerrando conexión: {e}")
+
 async def _hybrid_product_search(query: str, limit: int, db_service: HybridDatabaseService, embedding_service: EmbeddingService, wc_service: WooCommerceService = None) -> str:
     """Realizar búsqueda inteligente combinando WooCommerce y búsqueda híbrida"""
     try:
@@ -338,11 +384,14 @@ async def _hybrid_product_search(query: str, limit: int, db_service: HybridDatab
         if not embedding_service.initialized:
             return "❌ Error: Servicio de embeddings no inicializado"
             
+        # Filtros exactos en SQL; la consulta sin precio/stock es la que se optimiza y embebe
+        search_filters, cleaned_query = ProductSearchFilters.from_query(query)
+        
         # Usar el optimizador de búsqueda para analizar la consulta
         from services.search_optimizer import search_optimizer
         
-        search_analysis = await search_optimizer.analyze_product_query(query)
-        optimized_query = search_analysis.get('search_query', query)
+        search_analysis = await search_optimizer.analyze_product_query(cleaned_query)
+        optimized_query = search_analysis.get('search_query', cleaned_query)
         
         # Generar embedding para la consulta OPTIMIZADA
         embedding = await embedding_service.generate_embedding(optimized_query)
@@ -354,8 +403,19 @@ async def _hybrid_product_search(query: str, limit: int, db_service: HybridDatab
             content_types=["product"],
             limit=limit,
             wc_service=wc_service,
-            search_analysis=search_analysis  # Incluye detected_sku si existe
+            search_analysis=search_analysis,  # Incluye detected_sku si existe
+            filters=search_filters
         )
+        if not results and not search_filters.is_empty():
+            # Facetas incompletas en el catálogo: repetir sin filtros exactos
+            results = await db_service.intelligent_product_search(
+                query_text=optimized_query,
+                query_embedding=embedding,
+                content_types=["product"],
+                limit=limit,
+                wc_service=wc_service,
+                search_analysis=search_analysis
+            )
         
         if not results:
             return f"<!-- PRODUCTS_COUNT:0 -->❌ No se encontraron productos para: '{query}'"